@@ -10,6 +10,7 @@ from scipy.optimize import curve_fit,minimize,lsq_linear
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/FF_functions')
 from monitor_jobs import *
+from job_tracker import detect_backend,LocalBackend
 from copy import deepcopy
 
 def main(argv):
@@ -1269,96 +1270,21 @@ def monitor_jobs(jobids):
     return
 """
 
-# Returns the pending and running jobids for the user as a list
+# Returns the pending and running jobids for the user as a list (one query through the job_tracker backend)
 def check_queue():
 
     # The first time this function is executed, find the user name and scheduler being used. 
-    if not hasattr(check_queue, "user"):
-
-        # Get user name
+    if not hasattr(check_queue, "backend"):
         check_queue.user = subprocess.check_output("echo ${USER}", shell=True, encoding='utf8').strip("\r\n")
-
-        # Get batch system being used
-
-        squeue_tmp = subprocess.Popen(['which', 'squeue'], stdout=subprocess.PIPE,stderr=subprocess.STDOUT, encoding='utf8').communicate()[0].strip("\r\n")
-        qstat_tmp = subprocess.Popen(['which', 'qstat'], stdout=subprocess.PIPE,stderr=subprocess.STDOUT, encoding='utf8').communicate()[0].strip("\r\n")
-        check_queue.sched =  None
-        if "no squeue in" not in squeue_tmp:
-            check_queue.sched = "slurm"
-        elif "no qstat in" not in qstat_tmp:
-            check_queue.sched = "pbs"
-        else:
+        check_queue.backend = detect_backend(check_queue.user)
+        if isinstance(check_queue.backend,LocalBackend):
             print("ERROR in check_queue: neither slurm or pbs schedulers are being used.")
             quit()
 
-    # Get running and pending jobs using the slurm scheduler
-    if check_queue.sched == "slurm":
-
-        # redirect a squeue call into output
-        output = subprocess.check_output("squeue -l", shell=True, encoding='utf8')
-
-        # Initialize job information dictionary
-        jobs = []
-        id_ind = None
-        for count_i,i in enumerate(output.split('\n')):            
-            fields = i.split()
-            if len(fields) == 0: continue                
-            if id_ind is None and "JOBID" in fields:
-                id_ind = fields.index("JOBID")
-                if "STATE" not in fields:
-                    print("ERROR in check_queue: Could not identify STATE column in squeue -l output.")
-                    quit()
-                else:
-                    state_ind = fields.index("STATE")
-                if "USER" not in fields:
-                    print("ERROR in check_queue: Could not identify USER column in squeue -l output.")
-                    quit()
-                else:
-                    user_ind = fields.index("USER")
-                continue
-
-            # If this job belongs to the user and it is pending or running, then add it to the list of active jobs
-            if id_ind is not None and fields[user_ind] == check_queue.user and fields[state_ind] in ["PENDING","RUNNING"]:
-                jobs += [fields[id_ind]]
-
-    # Get running and pending jobs using the pbs scheduler
-    elif check_queue.sched == "pbs":
-
-        # redirect a qstat call into output
-        output = subprocess.check_output("qstat -f", shell=True, encoding='utf8')
-
-        # Initialize job information dictionary
-        jobs = []
-        job_dict = {}
-        current_key = None
-        for count_i,i in enumerate(output.split('\n')):
-            fields = i.split()
-            if len(fields) == 0: continue
-            if "Job Id" in i:
-
-                # Check if the previous job belongs to the user and needs to be added to the pending or running list. 
-                if current_key is not None:
-                    if job_dict[current_key]["State"] in ["R","Q"] and job_dict[current_key]["User"] == check_queue.user:
-                        jobs += [current_key]
-                current_key = i.split()[2]
-                job_dict[current_key] = { "State":"NA" , "Name":"NA", "Walltime":"NA", "Queue":"NA", "User":"NA"}
-                continue
-            if "Job_Name" == fields[0]:
-                job_dict[current_key]["Name"] = fields[2]
-            if "job_state" == fields[0]:
-                job_dict[current_key]["State"] = fields[2]
-            if "queue" == fields[0]:
-                job_dict[current_key]["Queue"] = fields[2]
-            if "Resource_List.walltime" == fields[0]:
-                job_dict[current_key]["Walltime"] = fields[2]        
-            if "Job_Owner" == fields[0]:
-                job_dict[current_key]["User"] = fields[2].split("@")[0]
-
-        # Check if the last job belongs to the user and needs to be added to the pending or running list. 
-        if current_key is not None:
-            if job_dict[current_key]["State"] in ["R","Q"] and job_dict[current_key]["User"] == check_queue.user:
-                jobs += [current_key]
-
+    jobs = check_queue.backend.queued()
+    if jobs is None:
+        print("ERROR in check_queue: the scheduler query failed.")
+        quit()
     return jobs
 
 # Plotting script
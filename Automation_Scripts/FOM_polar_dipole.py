@@ -15,6 +15,7 @@ import db_to_charmm,xyz_to_pdb,density_converter,add_time_pdb,read_charmm_energy
 import add_drude_pdb
 from file_parsers import *
 from monitor_jobs import *
+from orca_parser import parse_orca
 
 def main(argv):
 
@@ -346,25 +347,9 @@ def crd_num(x):
     return(int(x.split('.')[0]))
 
 def read_polarout(filename):
-    with open(filename,'r') as f:
-        flag = 0
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-            if len(fields) < 2 and flag == 0: continue
-          
-            if flag == 0  and fields[0] == "Isotropic" and fields[1] == "polarizability" :
-               polar = float(fields[3])*0.529177210**3 # A.U to A^3
-               continue
-            
-            if flag == 0  and fields[0] == 'DIPOLE' and fields[1] == 'MOMENT' :
-               flag = 1
-               continue
-
-
-            if flag == 1 and len(fields) == 4 and fields[0] == 'Magnitude' and fields[1] == '(Debye)':
-               dipole = float(fields[3])
-               flag = 0 
-               continue
+    data   = parse_orca(filename)
+    dipole = float(data["dipole_debye"][-1])
+    polar  = float(data["polarizability"][-1])*0.529177210**3 # A.U to A^3
     return dipole,polar
 
 def read_polarlog(filename):
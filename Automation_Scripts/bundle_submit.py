@@ -2,6 +2,9 @@
 import sys,argparse,os,ast,re,fnmatch,matplotlib,subprocess,shutil
 from numpy import *
 from pylab import *
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from work_queue import submit_pull
+from local_pool import run_local
 
 def main(argv):
 
@@ -69,11 +72,18 @@ def main(argv):
                         help = 'specifies the openmpi path containing the bin and lib folders. Each sched option has a default value that can be replaced if this is assigned. (defualt: None)')
 
     parser.add_argument('-sched',dest='scheduler', default="slurm-halstead",
-                        help = 'specifies the scheduler for the cluster ("torque" "slurm") (default: "slurm")')
+                        help = 'specifies the scheduler for the cluster ("torque" "slurm"). "local" runs the jobs on this machine, -p cores per job on a pool '+\
+                               'sized to the host\'s cores, and returns once they have finished. (default: "slurm")')
 
     parser.add_argument('--silent',dest='silent', default=False, const=True, action='store_const',
                         help = 'Shortcircuits all script related print statements (scheduler will probably still echo the job id)')
 
+    parser.add_argument('--pull',dest='pull', default=False, const=True, action='store_const',
+                        help = 'When set, the calculations are written to a shared queue (<-o>.queue.db) instead of being statically bundled, and single-node worker jobs are '+\
+                               'submitted that each run -ppn/-p calculations at a time, pulling the next calculation from the queue as soon as a slot frees up, until the queue is empty. '+\
+                               'Scans are run before optimizations before single points, and larger molecules first. The same number of nodes is requested as in the bundled mode. '+\
+                               'Only the -sched family (slurm or torque) is used for the worker scripts. (default: off)')
+
     args=parser.parse_args()
     if type(args.walltime) == str and "min" in args.walltime: args.walltime = int(args.walltime.split('min')[0]); min_flag = 1
     else: args.walltime = int(args.walltime); min_flag = 0
@@ -218,6 +228,18 @@ def main(argv):
             print("No jobs in need of running, exiting...")
         quit()
 
+    # Pull-based bundling: queue the calculations and submit worker jobs that pull from the queue
+    if args.pull is True:
+        N_queued,N_workers = submit_pull([ (input_paths[count_i],'sh "{}"'.format(i),i) for count_i,i in enumerate(input_files) ],args,min_flag,working_dir)
+        if args.silent is False:
+            print("Queued {} jobs and submitted {} worker jobs".format(N_queued,N_workers))
+        quit()
+
+    # Local execution: run the jobs on this machine and return once they finish (no jobids are printed)
+    if args.scheduler == "local":
+        run_local([ ('sh "{}"'.format(i),input_paths[count_i],args.procs) for count_i,i in enumerate(input_files) ])
+        quit()
+
     # Insert escape characters for ( and )
     for i in [ "(", ")" ]:
         input_files = [ _.replace(i,"\{}".format(i)) for _ in input_files ]
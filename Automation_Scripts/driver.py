@@ -11,6 +11,11 @@ from copy import deepcopy
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/FF_functions')
 from monitor_jobs import *
+from job_tracker import JobTracker,LocalBackend
+from dag_scheduler import DAGScheduler
+from local_pool import shell_submit_args
+from orca_index import OrcaIndex
+from qc_cache import use_cache,store_results
 from parse_all import *
 import frag_gen_inter,frag_gen,xyz_to_orca,paramgen,merge_FF,extract_intramolecular_params,gen_md_for_sampling,gen_jobs_for_charges 
 import restart_scans,dihedral_restart
@@ -26,6 +31,10 @@ def main(argv):
                         help = 'The program expects a configuration file from which to assign various run conditions. (default: config.txt in the current working directory)')
     parser.add_argument('-o',dest='output',default='taffi.log',
                         help = 'log name for stdout')
+    parser.add_argument('--dag',dest='dag',default=False,action='store_const',const=True,
+                        help = 'When present, the geometry optimizations, mode scans, charges, and vdw fits of each model compound are launched as soon as their own '+\
+                               'prerequisites are done instead of running each stage as a batch-wide barrier. Concurrency is capped by the PARAM_MAX_JOBS, CHARGES_MAX_JOBS, '+\
+                               'and VDW_MAX_JOBS config keywords (default: off)')
 
     args=parser.parse_args()    
     
@@ -42,6 +51,9 @@ def main(argv):
     c["c_path"] =args.config
     sys.stdout = Logger(c["run_dir"]+'/'+args.output)
 
+    # Calculations already in the QC cache (QC_CACHE) are restored by orca_submit.py instead of being rerun
+    c["qc_cache"] = use_cache(c["qc_cache"])
+
     # Initialize Params_for_Batch.db, the local set of
     # fixed parameters for use in the fitting procedure.
     if not os.path.isfile('Params_for_Batch.db'):
@@ -55,6 +67,13 @@ def main(argv):
     # Read all.json (contains model compound and dependency information for the batch 
     status = read_alljson('{}/all.json'.format(c["run_dir"]))
 
+    # Run the whole parameterization as a dependency graph (model compounds advance independently, the geometry
+    # optimizations and mode scans are scheduled per compound)
+    if args.dag is True:
+        run_dag(c,status)
+        store_results(c["qc_cache"],c["run_dir"])
+        return
+
     # Run geometry optimizations
     if not status["geoopt"]:
         geometry_optimizations(c,status)
@@ -88,14 +107,233 @@ def main(argv):
         if not status["gens"][g]["final_fit"]:
             fit_params(g,c,status)
 
+    # Add the batch's calculations to the QC cache
+    store_results(c["qc_cache"],c["run_dir"])
+    return
+
+# Runs the parameterization as a dependency graph instead of batch-wide stages (--dag). Each model compound
+# advances through geoopt -> modescan -> charges -> vdw as soon as its own prerequisites are done. The
+# generation-level fits are single tasks that wait on the model compounds of their generation:
+#   initial_fit:g  <- modescan of the gen's keys, final_fit of the previous gen (its params are merged into Params_for_Batch.db)
+#   charges:key    <- initial_fit of the key's first gen (the charges folder is shared by all of the key's gens)
+#   after_charge:g <- initial_fit:g and charges of the gen's keys
+#   vdw:key        <- after_charge of the key's first gen
+#   final_fit:g    <- after_charge:g and vdw of the gen's keys
+# PARAM_MAX_JOBS, CHARGES_MAX_JOBS and VDW_MAX_JOBS in the config cap the number of running tasks in each
+# class. Completed tasks are recorded in all.json ("dag") so that interrupted runs resume where they left off.
+def run_dag(c,status):
+
+    gens = sorted(status["gens"].keys())
+    keys = list(status["mc"].keys())
+    first_gen = { k:str(min(status["mc"][k]["gen"])) for k in keys }
+    mc_keys = { g:[ _ for _ in keys if int(g) in status["mc"][_]["gen"] ] for g in gens }
+    limits = { "param":c["param_max_jobs"], "charges":c["charges_max_jobs"], "vdw":c["vdw_max_jobs"] }
+
+    # Record each completed task in all.json
+    if "dag" not in status:
+        status["dag"] = []
+    def save_progress(task):
+        print("COMPLETE: {}".format(task.name))
+        if task.name not in status["dag"]:
+            status["dag"] += [task.name]
+        json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
+
+    dag = DAGScheduler(limits=limits,user=c["user"],on_done=save_progress)
+
+    # Per model compound geometry optimizations and mode scans
+    for k in keys:
+        dag.add("geoopt:{}".format(k),run=lambda t,k=k: dag_geoopt(c,k,t),check=lambda t,k=k: dag_geoopt(c,k,t),resource="param")
+    for k in keys:
+        dag.add("modescan:{}".format(k),run=lambda t,k=k: dag_mode_scans(c,status,k,t),check=lambda t,k=k: dag_mode_scans(c,status,k,t),\
+                deps=["geoopt:{}".format(k)],resource="param")
+    dag.add("geoopt",run=lambda t: dag_flag(c,status,"geoopt"),deps=[ "geoopt:{}".format(k) for k in keys ])
+    dag.add("modescan",run=lambda t: dag_flag(c,status,"modescan"),deps=[ "modescan:{}".format(k) for k in keys ])
+
+    # Generation fits and the per model compound charge and vdw fits
+    for count_g,g in enumerate(gens):
+        deps = [ "modescan:{}".format(k) for k in mc_keys[g] ]
+        if count_g > 0:
+            deps += [ "final_fit:{}".format(gens[count_g-1]) ]
+        dag.add("initial_fit:{}".format(g),run=lambda t,g=g: submit_fit(g,c,mc_keys[g],"initial_fit"),\
+                check=lambda t,g=g: check_fit(g,c,status,mc_keys[g],"initial_fit"),deps=deps,resource="param")
+        for k in [ _ for _ in mc_keys[g] if first_gen[_] == g ]:
+            dag.add("charges:{}".format(k),run=lambda t,g=g,k=k: dag_charges(g,c,status,k,t),check=lambda t,g=g,k=k: dag_charges(g,c,status,k,t),\
+                    deps=["initial_fit:{}".format(g)],resource="charges")
+        dag.add("after_charge:{}".format(g),run=lambda t,g=g: dag_flag(c,status,"charges",g) or submit_fit(g,c,mc_keys[g],"after_charge"),\
+                check=lambda t,g=g: check_fit(g,c,status,mc_keys[g],"after_charge"),\
+                deps=["initial_fit:{}".format(g)]+[ "charges:{}".format(k) for k in mc_keys[g] ],resource="param")
+        for k in [ _ for _ in mc_keys[g] if first_gen[_] == g ]:
+            dag.add("vdw:{}".format(k),run=lambda t,g=g,k=k: dag_vdw(g,c,k,dag),check=lambda t,k=k: check_vdw(k,final_db=True),\
+                    deps=["after_charge:{}".format(g)],resource="vdw")
+        dag.add("final_fit:{}".format(g),run=lambda t,g=g: dag_flag(c,status,"vdw",g) or submit_fit(g,c,mc_keys[g],"final_fit"),\
+                check=lambda t,g=g: check_fit(g,c,status,mc_keys[g],"final_fit"),\
+                deps=["after_charge:{}".format(g)]+[ "vdw:{}".format(k) for k in mc_keys[g] ],resource="param")
+
+    # Skip the work completed by previous runs (either mode)
+    done = list(status["dag"])
+    if status["geoopt"]:
+        done += [ "geoopt" ] + [ "geoopt:{}".format(k) for k in keys ]
+    if status["modescan"]:
+        done += [ "modescan" ] + [ "modescan:{}".format(k) for k in keys ]
+    for g in gens:
+        for s in [ "initial_fit","after_charge","final_fit" ]:
+            if status["gens"][g][s]:
+                done += [ "{}:{}".format(s,g) ]
+        if status["gens"][g]["charges"]:
+            done += [ "charges:{}".format(k) for k in mc_keys[g] ]
+        if status["gens"][g]["vdw"]:
+            done += [ "vdw:{}".format(k) for k in mc_keys[g] ]
+    dag.mark_done(done)
+
+    print("Running the parameterization as a dependency graph ({} tasks)...".format(len(dag)))
+    dag.run()
     return
 
+# Sets a batch-wide (or generation) flag in status/all.json once the tasks it summarizes are done. Returns no jobs.
+def dag_flag(c,status,flag,g=None):
+    if g is None:
+        status[flag] = True
+    else:
+        status["gens"][g][flag] = True
+    json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
+    return []
+
+# run/check function of the geoopt:key task. Submits the optimization from the inchi folder (so that orca_submit
+# only collects this model compound's inputs) and resubmits up to five times until it converges.
+def dag_geoopt(c,key,task):
+
+    substring = "{}/Automation_Scripts/orca_submit.py -d geoopt -p {} -t {} -ppn {} -q {} -sched {} -size {} -o optimizations -path_to_exe {}  --silent"
+    substring = substring.format(c["taffi_path"],c["param_geoopt_procs"],c["param_geoopt_wt"],c["param_geoopt_ppn"],c["param_geoopt_q"],c["param_geoopt_sched"],c["param_geoopt_size"],c["orca_exe"])
+
+    # Initial submission
+    if task.stage is None:
+        task.stage = "opt"
+        write_geoopt(c,key)
+
+    # Check for convergence, resubmit if needed
+    else:
+        os.chdir(key)
+        delete_wildcard('optimizations')
+        os.chdir(c['run_dir'])
+        if geoopt_converged(c,key) is True:
+            return []
+        task.attempts += 1
+        if task.attempts > 5:
+            print("ERROR: five restarts have been attempted and the geoopt jobs for {} still haven't converged. Something bad is happening.".format(key))
+            quit()
+        print("resub of {} geoopt has been triggered".format(key))
+        substring += " --resubmit"
+
+    os.chdir(key)
+    output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
+    os.chdir(c['run_dir'])
+    output = str(output,'utf-8')
+    return [ m.split()[-1] for m in output.split("\n")[:-1]]
+
+# run/check function of the modescan:key task. Same checks as mode_scans, restricted to one model compound:
+#   stage "scans":    (after the scans finish) look for bond/angle reoptimizations and incomplete flexible dihedrals
+#   stage "redo":     bond/angle reoptimizations finished, regenerate and submit their scans
+#   stage "restart":  restarted dihedral scans finished, post-process them
+# Each round of resubmissions counts as an attempt (five at most).
+def dag_mode_scans(c,status,key,task):
+
+    # Initial submission
+    if task.stage is None:
+        task.stage = "scans"
+        write_mode_scans(c,status,key)
+        jobids = []
+        for d,procs,wt,q,sched,ppn,size in [ ("bonds_angles","param_ba_procs","param_ba_wt","param_ba_q","param_ba_sched","param_ba_ppn","param_ba_size"),\
+                                             ("dihedrals","param_d_procs","param_d_wt","param_d_q","param_d_sched","param_d_ppn","param_d_size") ]:
+            substring = "python3 {}/Automation_Scripts/orca_submit.py -f *in -d {} -p {} -t {}  -q {} -sched {} -ppn {} -size {} -path_to_exe {} --silent -o {}"
+            substring = substring.format(c["taffi_path"],d,c[procs],c[wt],c[q],c[sched],c[ppn],c[size],c["orca_exe"],d)
+            jobids += dag_submit(c,key,substring)
+        return jobids
+
+    # Bond/angle reoptimizations finished: generate and submit the new mode scans
+    if task.stage == "redo":
+        task.stage = "scans"
+        restart_scans.main(("{}/Intra -f {} -b {} -gens {} {}".format(key,c['basis'],c['functional'],c['gens'],c['nod3'])).split())
+        substring = "python3 {}/Automation_Scripts/orca_submit.py -f *in  -p {} -t {}  -q {} -sched {} -ppn {} -size {} -o ba_scan_resub -path_to_exe {} --silent"
+        substring = substring.format(c["taffi_path"],c["param_geoopt_procs"],c["param_geoopt_wt"],c["param_geoopt_q"],c["param_geoopt_sched"],c["param_geoopt_ppn"],c["param_geoopt_size"],c["orca_exe"])
+        return dag_submit(c,key,substring)
+
+    # Restarted dihedral scans finished: post-process them, then recheck
+    if task.stage == "restart":
+        dihedral_restart.main("{} --post".format(key).split())
+        task.stage = "scans"
+
+    # Check the scans
+    os.chdir(key)
+    for i in [ "bonds_angles","dihedrals","ba_geo_resub","ba_scan_resub","dihedrals_restart" ]:
+        delete_wildcard(i)
+    os.chdir(c['run_dir'])
+    if task.attempts >= 5:
+        print("\tERROR: five restarts have been attempted and the mode scans of {} still haven't converged. Something bad is happening.".format(key))
+        quit()
+
+    # Remove old test, REDO, and RESTART folders (sometimes the result of an interuption mid-cycle)
+    for i in [ "{}/{}".format(dp,d0) for dp,d,f in os.walk(key) for d0 in d if fnmatch.fnmatch(d0,"RESTART") or fnmatch.fnmatch(d0,"REDO") ]:
+        shutil.rmtree(i)
+    if os.path.isdir("test-{}".format(key)):
+        shutil.rmtree("test-{}".format(key))
+
+    # check bond angle submissions with extract_intramolecular_paraams.py
+    flag = find_restarts(c,[key],"test-{}".format(key))
+
+    # Bond/angle reoptimizations take precedence, incomplete dihedrals are picked up on the next check
+    if flag is True:
+        task.attempts += 1
+        task.stage = "redo"
+        print("Some bond/angle jobs of {} failed to converge. Resubmitting (attempt {})...".format(key,task.attempts))
+        substring = "python3 {}/Automation_Scripts/orca_submit.py -f *in -d REDO -p {} -t {}  -q {} -sched {} -ppn {} -size {} -o ba_geo_resub -path_to_exe {} --silent"
+        substring = substring.format(c["taffi_path"],c["param_geoopt_procs"],c["param_geoopt_wt"],c["param_geoopt_q"],c["param_geoopt_sched"],c["param_geoopt_ppn"],c["param_geoopt_size"],c["orca_exe"])
+        return dag_submit(c,key,substring)
+
+    # Handle flexible dihedral resubmission
+    if dihedral_restarts(c,key) != 0:
+        task.attempts += 1
+        task.stage = "restart"
+        print("\tSome flexible dihedral scans of {} did not complete. Resuming (attempt {})...".format(key,task.attempts))
+        substring = "python3 {}/Automation_Scripts/orca_submit.py -f *in -d RESTART -p {} -t {}  -q {} -sched {} -ppn {} -size {} -path_to_exe {} --silent -o dihedrals_restart"
+        substring = substring.format(c["taffi_path"],c["param_d_procs"],c["param_d_wt"],c["param_d_q"],c["param_d_sched"],c["param_d_ppn"],c["param_d_size"],c["orca_exe"])
+        return dag_submit(c,key,substring)
+
+    return []
+
+# run/check function of the charges:key task (MD sampling -> QC -> charge fit)
+def dag_charges(g,c,status,key,task):
+    if task.stage is None:
+        task.stage = "md"
+        return charges_md(g,c,status,key) or dag_charges(g,c,status,key,task)
+    elif task.stage == "md":
+        task.stage = "qc"
+        return charges_qc(g,c,status,key) or dag_charges(g,c,status,key,task)
+    elif task.stage == "qc":
+        task.stage = "fit"
+        return charges_fit(g,c,status,key) or dag_charges(g,c,status,key,task)
+    check_charges(g,key)
+    return []
+
+# run function of the vdw:key task. vdw_loop.py runs as a local subprocess that is tracked by the scheduler.
+def dag_vdw(g,c,key,dag):
+    proc = launch_vdw(g,c,key)
+    if proc is None:
+        return []
+    return [ dag.register(proc,jobid="vdw-{}".format(key)) ]
+
+# Runs an orca_submit/lammps_submit command string from within the inchi folder and returns the submitted jobids
+def dag_submit(c,key,substring):
+    os.chdir(key)
+    output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE, encoding='utf-8').communicate()[0]
+    os.chdir(c['run_dir'])
+    return [ m.split()[-1] for m in output.split("\n")[:-1]]
+
 # Submits and monitors the frag_gen_all.py job
 def gen_models(c):
     jobids = []
     sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
     sublist.append('python3 {}/FF_functions/frag_gen_all.py \'*.xyz\' -FF \'{}\' -gens {}'.format(c["taffi_path"],c["ff"],c['gens']))
-    sublist= sublist + ('frag_gen_all -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split()
+    sublist= sublist + ('frag_gen_all -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split() + shell_submit_args(c["param_fit_sched"])
     output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
     output = str(output,'utf-8')
     jobids += [ output.split("\n")[-2].split()[-1]]
@@ -109,17 +347,7 @@ def geometry_optimizations(c,status):
     # Loop over inchi keys and generate run folders and input files
     print( "\trunning geometry optimizations...")    
     for key in status["mc"].keys():
-        other_opt = {}
-        other_opt['no_freq'] = 1
-        other_opt['proc_num'] = c['param_geoopt_procs']
-        other_opt['random_factor'] = 0.0
-        other_opt['charge'] = c['charge']
-        other_opt['functional'] = c['functional']
-        other_opt['basis'] = c['basis']
-        if c['functional'] == 'wB97X-D3':
-            other_opt['D3_option'] = ""
-        e,g = xyz_parse('{}/{}.xyz'.format(key,key))
-        xyz_to_orca.fun(c,key,{"elements":e,"geo":g},other_opt)
+        write_geoopt(c,key)
 
     # Submit the geometry optimizations
     jobids = []
@@ -147,17 +375,7 @@ def geometry_optimizations(c,status):
 
         # Check status of jobs
         for key in status["mc"].keys():
-            geofolders = [ key+'/Intra/'+i for i in os.listdir(key+'/Intra') if os.path.isdir(key+'/Intra/'+i) == True and fnmatch.fnmatch(i,"*geoopt*")] 
-            geoopt_output = [ os.path.isfile(i+'/geoopt.out') for i in geofolders ]
-            if geofolders == []:
-                print("ERROR: {}/Intra/*_geoopt* folder wasn't found".format(key))
-                quit()
-            if False in geoopt_output:
-                print("WARNING: {}/Intra/*_geoopt*/geoopt.out wasn't found".format(key))
-                resub_flag = 1
-            flag = [ find_string(i+'/geoopt.out',b'THE OPTIMIZATION HAS CONVERGED') for i in geofolders]
-            if False in flag:
-                print("WARNING: {}/Intra/*_geoopt* didn't run to completion...".format(key))
+            if geoopt_converged(c,key) is False:
                 resub_flag = 1
 
         # Attempt resubmission if the resub_flag has been triggered
@@ -179,6 +397,77 @@ def geometry_optimizations(c,status):
     json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
     return
 
+# Writes the orca geometry optimization input for a model compound
+def write_geoopt(c,key):
+    other_opt = {}
+    other_opt['no_freq'] = 1
+    other_opt['proc_num'] = c['param_geoopt_procs']
+    other_opt['random_factor'] = 0.0
+    other_opt['charge'] = c['charge']
+    other_opt['functional'] = c['functional']
+    other_opt['basis'] = c['basis']
+    if c['functional'] == 'wB97X-D3':
+        other_opt['D3_option'] = ""
+    e,g = xyz_parse('{}/{}.xyz'.format(key,key))
+    xyz_to_orca.fun(c,key,{"elements":e,"geo":g},other_opt)
+    return
+
+# Returns True if the geometry optimizations of a model compound have converged (prints the reason otherwise)
+def geoopt_converged(c,key):
+    geofolders = [ key+'/Intra/'+i for i in os.listdir(key+'/Intra') if os.path.isdir(key+'/Intra/'+i) == True and fnmatch.fnmatch(i,"*geoopt*")] 
+    geoopt_output = [ os.path.isfile(i+'/geoopt.out') for i in geofolders ]
+    if geofolders == []:
+        print("ERROR: {}/Intra/*_geoopt* folder wasn't found".format(key))
+        quit()
+    if False in geoopt_output:
+        print("WARNING: {}/Intra/*_geoopt*/geoopt.out wasn't found".format(key))
+        return False
+    index = orca_status(c)
+    flag = [ index.status(i+'/geoopt.out')["converged"] for i in geofolders ]
+    index.save()
+    if False in flag:
+        print("WARNING: {}/Intra/*_geoopt* didn't run to completion...".format(key))
+        return False
+    return True
+
+# Returns the ORCA status index (orca_index.json) of the run directory
+def orca_status(c):
+    if not hasattr(orca_status,"index"):
+        orca_status.index = OrcaIndex(c["run_dir"])
+    return orca_status.index
+
+# Returns True if bond/angle scans of the model compounds need to be reoptimized. extract_intramolecular_params.py --find_restarts is run
+# into the output folder (which is removed afterwards) and its log is checked. The extraction is skipped when none of the bond/angle
+# outputs (or the FF) have changed since it last found nothing to restart.
+def find_restarts(c,keys,output):
+    index = orca_status(c)
+    name = "find_restarts:{}".format(output)
+    fingerprint = index.fingerprint([c['ff']]+[ j for i in keys for j in index.outputs(i+'/Intra',exclude=["scan-forward","scan-reverse","RESTART"]) ])
+    if index.check(name,fingerprint) is False:
+        return False
+
+    substring = "python {}/FF_functions/extract_intramolecular_params.py -f {} -gens {} --find_restarts -lammps_exe {} -FF {} -o {} -modes bonds^angles^harm_dihedrals".format(c["taffi_path"],"^".join(keys),c['gens'],c['lammps_exe'],c['ff'],output)
+    subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE, encoding='utf8').communicate()
+    flag = find_string("{}/extract_intramolecular.log".format(output),b"Generating the input files for a reoptimization based on the lowest energy")   #search string must be byte object, hence the "b"
+    shutil.rmtree(output)
+
+    # Only the negative result is reused (a positive result also writes the REDO inputs)
+    if flag is False:
+        index.record_check(name,fingerprint,False)
+        index.save()
+    return flag
+
+# Returns the number of incomplete flexible dihedral scans below folder (from the status index). If there are any,
+# dihedral_restart.py is run to generate their RESTART inputs.
+def dihedral_restarts(c,folder):
+    index = orca_status(c)
+    incomplete = index.incomplete_scans(folder)
+    index.save()
+    if len(incomplete) > 0:
+        substring = "python {}/FF_functions/dihedral_restart.py {}".format(c["taffi_path"],folder)
+        subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE, encoding='utf8').communicate()
+    return len(incomplete)
+
 # Wrapper for performing the quantum chemistry scans for the intramolecular modes. 
 # This function handles generation of the mode scans, QC job submission, completion checks, restart and resubmission conditions associated with the intramolecular modes. 
 def mode_scans(c,status):
@@ -186,18 +475,7 @@ def mode_scans(c,status):
     # Loop over inchi keys and generate run folders and input files
     print( "\trunning mode scans...")    
     for key in status["mc"].keys():
-
-        # Generate bond/angle mode scan job if needed
-        if not os.path.isdir(key+'/Intra/bonds_angles'):            
-            command_list = ('-p {} -q {} -gens {} -theory dft -f {} -b {} {} -inchi {} -modes'.format(c['param_ba_procs'],status["mc"][key]["q"],c['gens'],c['functional'],c['basis'],c['nod3'],key)).split()
-            command_list.append("bonds angles")
-            paramgen.main(command_list)
-
-        # Generate dihedral mode scan job if needed
-        if not os.path.isdir(key+'/Intra/dihedrals'):
-            command_list = ('-p {} -q {} -gens {} -theory dft -f {} -b {} -d_step 10.0 {} -inchi {} --scan -modes'.format(c['param_d_procs'],status["mc"][key]["q"],c['gens'],c['functional'],c['basis'],c['nod3'],key)).split() 
-            command_list.append("dihedrals")
-            paramgen.main(command_list)
+        write_mode_scans(c,status,key)
 
     # Submit scans
     print("submitting mode scans...")
@@ -237,18 +515,10 @@ def mode_scans(c,status):
             shutil.rmtree(i)
 
         # check bond angle submissions with extract_intramolecular_paraams.py
-        substring = "python {}/FF_functions/extract_intramolecular_params.py -gens {} --find_restarts -lammps_exe {} -FF {} -o test -modes bonds^angles^harm_dihedrals".format(c["taffi_path"],c['gens'],c['lammps_exe'],c['ff'])
-        output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE, encoding='utf8').communicate()
-        flag = find_string("test/extract_intramolecular.log",b"Generating the input files for a reoptimization based on the lowest energy")   #search string must be byte object, hence the "b"
-        shutil.rmtree('test')
+        flag = find_restarts(c,list(status["mc"].keys()),"test")
 
         # Handle flexible dihedral resubmission
-        substring = "python {}/FF_functions/dihedral_restart.py . --verbose".format(c["taffi_path"])
-        output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE, encoding='utf8').communicate()[0]
-        if (output.split("\n")[0]) != '':
-            D_flag = len(output.split("\n"))
-        else:
-            D_flag = 0
+        D_flag = dihedral_restarts(c,'.')
                      
         # Handles dihedral resubmission for incomplete scans
         if (D_flag != 0):
@@ -300,6 +570,22 @@ def mode_scans(c,status):
     json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
     return
 
+# Generates the bond/angle and dihedral mode scan jobs of a model compound (if they haven't been generated already)
+def write_mode_scans(c,status,key):
+
+    # Generate bond/angle mode scan job if needed
+    if not os.path.isdir(key+'/Intra/bonds_angles'):            
+        command_list = ('-p {} -q {} -gens {} -theory dft -f {} -b {} {} -inchi {} -modes'.format(c['param_ba_procs'],status["mc"][key]["q"],c['gens'],c['functional'],c['basis'],c['nod3'],key)).split()
+        command_list.append("bonds angles")
+        paramgen.main(command_list)
+
+    # Generate dihedral mode scan job if needed
+    if not os.path.isdir(key+'/Intra/dihedrals'):
+        command_list = ('-p {} -q {} -gens {} -theory dft -f {} -b {} -d_step 10.0 {} -inchi {} --scan -modes'.format(c['param_d_procs'],status["mc"][key]["q"],c['gens'],c['functional'],c['basis'],c['nod3'],key)).split() 
+        command_list.append("dihedrals")
+        paramgen.main(command_list)
+    return
+
 # Wrapper for fitting the intramolecular parameters for the generation.
 # This function handles the three cases for which parameterizations occur each generation (initial_fit, after_charge, final_fit)
 def fit_params(g,c,status):
@@ -310,77 +596,68 @@ def fit_params(g,c,status):
     # Find inchi keys for this generation
     mc_keys = [ _ for _ in status["mc"].keys() if int(g) in status["mc"][_]["gen"] ]
 
+    # Submit the fit
+    jobids = submit_fit(g,c,mc_keys,stage)
+
+    # Wait until jobs complete
+    monitor_jobs(jobids,c['user'])
+
+    # Check completion and update status/all.json
+    check_fit(g,c,status,mc_keys,stage)
+
+    return
+
+# Submits the intramolecular parameter fit of the generation for the requested stage (initial_fit, after_charge, final_fit) and returns the jobids
+def submit_fit(g,c,mc_keys,stage):
+
     # case: initial fit
     # No charges or VDW parameters for the gen are available, so the fit is performed based on charges from the equilibrium geometry and UFF params
     if stage == "initial_fit":
 
         sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
-        sublist.append('{}python {}/FF_functions/extract_intramolecular_params.py -f \'{}\' -o gen-{}_initial_params -FF \'{}\' -min_cycles 5 -gens {} -max_cycles 10 -N_sc 1 -lammps_exe {} --mixing_rule lb -batch {}'.format(\
-        c["module_string"],c["taffi_path"]," ".join(mc_keys),g,c["ff"],c['gens'],c["lammps_exe"],g))
-        sublist= sublist + ('initial_params  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split()
-        output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
-        output = str(output,'utf-8')
-        jobids = [ output.split("\n")[-2].split()[-1]]
-
-        # Wait until jobs complete
-        monitor_jobs(jobids,c['user'])
-        # Check completion and update status/all.json
-        if os.path.isdir("gen-{}_initial_params".format(g)) is False or os.path.isfile("gen-{}_initial_params/params-DFT.db".format(g)) is False:
-            print("An error occured during the gen {} initial parameter fit.".format(g))
-            quit()
-        else:
-            status["gens"][g]["initial_fit"] = True
-            json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
+        sublist.append('{}python {}/FF_functions/extract_intramolecular_params.py -f \'{}\' -o gen-{}_initial_params -FF \'{}\' -min_cycles 5 -gens {} -max_cycles 10 -N_sc 1 -lammps_exe {} --mixing_rule lb -batch {} -procs {}'.format(\
+        c["module_string"],c["taffi_path"]," ".join(mc_keys),g,c["ff"],c['gens'],c["lammps_exe"],g,c["param_fit_ppn"]))
+        sublist= sublist + ('initial_params  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split() + shell_submit_args(c["param_fit_sched"])
 
     # case: after_charge
     # Charge force field files are read. No VDW parameters for the gen are available, so the fit is performed based on the UFF params
-    if stage == "after_charge":
+    elif stage == "after_charge":
 
         sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
         sublist.append('{}python {}/FF_functions/extract_intramolecular_params.py -f \'{}\' -o gen-{}_after_charges'.format(c["module_string"],c["taffi_path"]," ".join(mc_keys),g)+\
                        ' -FF \'{} {}\''.format(c["ff"]," ".join(["{}/charges/CHELPG_calcs/charges/fit_charges.db".format(_) for _ in mc_keys ]))+\
-                       ' -min_cycles 5 -max_cycles 10 -N_sc 1 -gens {} -lammps_exe {} --mixing_rule lb -batch {}'.format(c['gens'],c["lammps_exe"],g))
-        sublist= sublist + ('after_charges  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split()
-        output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
-        output = str(output,'utf-8')
-        jobids = [ output.split("\n")[-2].split()[-1]]
-
-        # Wait until jobs complete
-        monitor_jobs(jobids,c['user'])
-
-        # Check completion and update status/all.json        
-        if os.path.isdir("gen-{}_after_charges".format(g)) is False or os.path.isfile("gen-{}_after_charges/params-DFT.db".format(g)) is False:
-            print("An error occured during the gen {} after charges parameter fit.".format(g))
-            quit()
-        else:
-            status["gens"][g]["after_charge"] = True
-            json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
+                       ' -min_cycles 5 -max_cycles 10 -N_sc 1 -gens {} -lammps_exe {} --mixing_rule lb -batch {} -procs {}'.format(c['gens'],c["lammps_exe"],g,c["param_fit_ppn"]))
+        sublist= sublist + ('after_charges  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split() + shell_submit_args(c["param_fit_sched"])
 
     # case: final_fit
     # Charge and VDW force field files are read. Everything is available to perform the fit, mixing rule is changed. 
-    if stage == "final_fit":
+    elif stage == "final_fit":
 
         sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
         sublist.append('{}python {}/FF_functions/extract_intramolecular_params.py -f \'{}\' -o gen-{}_final_params'.format(c["module_string"],c["taffi_path"]," ".join(mc_keys),g)+\
                        ' -FF \'{} {}\''.format(c["ff"]," ".join(["{}/charges/CHELPG_calcs/charges/fit_charges.db {}/final_vdw.db".format(_,_) for _ in mc_keys ]))+\
-                       ' -min_cycles 5 -max_cycles 10 -N_sc 3 -lammps_exe {} -gens {} --mixing_rule wh -batch {}'.format(c["lammps_exe"],c['gens'],g))
-        sublist= sublist + ('final_params  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split()
-        output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
-        output = str(output,'utf-8')
-        jobids = [ output.split("\n")[-2].split()[-1]]
-
-        # Wait until jobs complete
-        monitor_jobs(jobids,c['user'])
-
-        # Check completion and update status/all.json        
-        if os.path.isdir("gen-{}_final_params".format(g)) is False or os.path.isfile("gen-{}_final_params/params-DFT.db".format(g)) is False:
-            print("An error occured during the gen {} final parameter fit.".format(g))
-            quit()
-        else:
-            status["gens"][g]["final_fit"] = True
-            json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
+                       ' -min_cycles 5 -max_cycles 10 -N_sc 3 -lammps_exe {} -gens {} --mixing_rule wh -batch {} -procs {}'.format(c["lammps_exe"],c['gens'],g,c["param_fit_ppn"]))
+        sublist= sublist + ('final_params  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split() + shell_submit_args(c["param_fit_sched"])
 
-        # Merge final params for this generation with Params_for_Batch.db
+    output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
+    output = str(output,'utf-8')
+    return [ output.split("\n")[-2].split()[-1]]
+
+# Checks the completion of the intramolecular parameter fit for the requested stage and updates status/all.json.
+# After the final_fit, the generation's parameters are merged with Params_for_Batch.db
+def check_fit(g,c,status,mc_keys,stage):
+
+    folder = { "initial_fit":"initial_params", "after_charge":"after_charges", "final_fit":"final_params" }[stage]
+    label  = { "initial_fit":"initial", "after_charge":"after charges", "final_fit":"final" }[stage]
+    if os.path.isdir("gen-{}_{}".format(g,folder)) is False or os.path.isfile("gen-{}_{}/params-DFT.db".format(g,folder)) is False:
+        print("An error occured during the gen {} {} parameter fit.".format(g,label))
+        quit()
+    else:
+        status["gens"][g][stage] = True
+        json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
+
+    # Merge final params for this generation with Params_for_Batch.db
+    if stage == "final_fit":
         option = {}
         option['master'] = '{}/Params_for_Batch.db'.format(c['run_dir'])
         option['new_params'] = '{}/gen-{}_final_params/params-DFT.db'.format(c['run_dir'],g)
@@ -393,9 +670,7 @@ def fit_params(g,c,status):
 # This function performs (1) MD sampling, (2) QC job submission, (3) charge fitting to the output files. 
 def fit_charges(g,c,status):
 
-    # Absolute paths of FF are needed for the subdirectory calls
     print("fitting gen-{} charges".format(g))
-    init_FF = os.path.abspath("gen-{}_initial_params/params-DFT.db".format(g))
 
     # Find inchi keys for this generation
     mc_keys = [ _ for _ in status["mc"].keys() if int(g) in status["mc"][_]["gen"] ]
@@ -405,27 +680,7 @@ def fit_charges(g,c,status):
     #####################################################
     jobids = []
     for inchi in mc_keys:
-
-        # Get number of atoms in the molecule and number of molecules required for the simulation
-        N_atoms = len(status["mc"][inchi]["atom_types"])
-        N_mol = int(1000/N_atoms) + 1
-
-        # Move into inchi folder and generate MD inputs within charges folder 
-        os.chdir(inchi) # ***for gen_md.py has to go into the folder
-        if not os.path.isdir('charges'):
-            sublist = ('{}.xyz -N {} -T 298  -T_A 400 -t 1E5 -t_A 1E5 -charge_scale 1.0 -o charges -q {} -gens {} --molecule -FF '.format(inchi,N_mol,status["mc"][inchi]["q"],c['gens'])).split()
-            sublist.append('{} {}'.format(c['ff'],init_FF))
-            gen_md_for_sampling.main(sublist)
-
-        # Move into charges folder and submit the MD job to the compute nodes (overwrites old job if equil.lammpstrj is missing)
-        os.chdir('charges')
-        if not os.path.isfile("equil.lammpstrj"):
-            substring = "python3 {}/Automation_Scripts/lammps_submit.py -f charges.in.init -p {} -t {} -ppn {} -q {} -sched {} -size {} -o charges -path_to_exe {} -npp {} --silent --overwrite"
-            substring = substring.format(c["taffi_path"],c["charges_md_procs"],c["charges_md_wt"],c["charges_md_ppn"],c["charges_md_q"],c["charges_md_sched"],c["charges_md_size"],c["lammps_exe"],c['charges_md_npp'])
-            output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
-            output = str(output,'utf-8')
-            jobids += [ m.split()[-1] for m in output.split("\n")[:-1]]
-        os.chdir(c['run_dir'])
+        jobids += charges_md(g,c,status,inchi)
 
     # Wait until jobs complete 
     monitor_jobs(jobids,c["user"])
@@ -436,27 +691,7 @@ def fit_charges(g,c,status):
     ##########################################
     jobids = []
     for inchi in mc_keys:
-
-        # Generate QC jobs for this model compound
-        if not os.path.isfile("{}/charges/equil.lammpstrj".format(inchi)):
-            print("ERROR: MD-sampliing for partial charges did not complete for {}".format(inchi))
-            quit()
-        
-        # Generate QC jobs for this model compound
-        if not os.path.isdir("{}/charges/CHELPG_calcs".format(inchi)):
-            os.chdir("{}/charges".format(inchi))
-            substring = 'equil.lammpstrj charges.map -every 10 -N 200 -mol_list 0 -p 8 -QC_types dft -o CHELPG_calcs -q {} -f {} {}'
-            substring = substring.format(status["mc"][inchi]["q"],c['functional'],c['nod3'])
-            gen_jobs_for_charges.main(substring.split())
-
-            os.chdir('CHELPG_calcs')
-            substring = "python3 {}/Automation_Scripts/orca_submit.py -p {} -t {} -ppn {} -q {} -sched {} -size {} -o charges -path_to_exe {}  --silent"
-            substring = substring.format(c["taffi_path"],c["charges_qc_procs"],c["charges_qc_wt"],c["charges_qc_ppn"],c["charges_qc_q"],c["charges_qc_sched"],c["charges_qc_size"],c["orca_exe"])
-            output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
-            output = str(output,'utf-8')
-            jobids += [ m.split()[-1] for m in output.split("\n")[:-1]]
-
-        os.chdir(c['run_dir'])
+        jobids += charges_qc(g,c,status,inchi)
 
     # Wait until jobs complete 
     monitor_jobs(jobids,c["user"])
@@ -467,41 +702,107 @@ def fit_charges(g,c,status):
     ####################################      
     jobids = []
     for inchi in mc_keys:
-
-        if os.path.isdir("{}/charges/CHELPG_calcs".format(inchi)) is False or os.path.isfile("{}/charges/CHELPG_calcs/configs/0/0_charges.vpot".format(inchi)) is False:
-            print("ERROR: QC for partial chages did not complete for {}".format(inchi))
-            quit()
-            
-        # If the fit_charges.db file does not exist, then remove the fit directory and attempt to refit the charges 
-        os.chdir(inchi+'/charges') 
-        if(os.path.isdir('CHELPG_calcs/charges')) and ((os.path.isfile('CHELPG_calcs/charges/fit_charges.db')) is False) :
-            shutil.rmtree('CHELPG_calcs/charges')
-
-        # Fit the charges
-        if not os.path.isdir('CHELPG_calcs/charges'):
-
-            # Have to use sublist or the split method would split the python function call to two
-            sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
-            sublist.append('{}/FF_functions/extract_charges.py CHELPG_calcs -FF \'{}\' -o charges -w_hyper 0.0 -w_dipole 0.1 --two_step -w_qtot 1.0 -q {} -gens {} --keep_min'.format(c["taffi_path"],c["ff"],c["charge"],c["gens"]))
-            sublist= sublist + ('charge_parse  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split()
-            output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
-            output = str(output,'utf-8')
-            jobids += [ output.split("\n")[-2].split()[-1]]
-        os.chdir(c['run_dir'])
+        jobids += charges_fit(g,c,status,inchi)
 
     # Wait until jobs complete 
     monitor_jobs(jobids,c["user"])
 
     # Check completion
     for inchi in mc_keys:
-        if os.path.isfile("{}/charges/CHELPG_calcs/charges/fit_charges.db".format(inchi)) is False: 
-            print("An error occured during the gen {} after charge fitting of {}.".format(g,inchi))
-            quit()
+        check_charges(g,inchi)
 
     # Update all.json
     status["gens"][g]["charges"] = True
     json.dump(status,codecs.open(c["run_dir"]+'/all.json', 'w', encoding='utf-8'),indent=10)
     print("COMPLETE: Fitting partial charges for gen-{} partial-charges".format(g))
+
+# Charges step 1: generates and submits the MD sampling for a model compound (skipped if equil.lammpstrj exists). Returns the jobids.
+def charges_md(g,c,status,inchi):
+
+    # Absolute paths of FF are needed for the subdirectory calls
+    init_FF = os.path.abspath("gen-{}_initial_params/params-DFT.db".format(g))
+
+    # Get number of atoms in the molecule and number of molecules required for the simulation
+    jobids = []
+    N_atoms = len(status["mc"][inchi]["atom_types"])
+    N_mol = int(1000/N_atoms) + 1
+
+    # Move into inchi folder and generate MD inputs within charges folder 
+    os.chdir(inchi) # ***for gen_md.py has to go into the folder
+    if not os.path.isdir('charges'):
+        sublist = ('{}.xyz -N {} -T 298  -T_A 400 -t 1E5 -t_A 1E5 -charge_scale 1.0 -o charges -q {} -gens {} --molecule -FF '.format(inchi,N_mol,status["mc"][inchi]["q"],c['gens'])).split()
+        sublist.append('{} {}'.format(c['ff'],init_FF))
+        gen_md_for_sampling.main(sublist)
+
+    # Move into charges folder and submit the MD job to the compute nodes (overwrites old job if equil.lammpstrj is missing)
+    os.chdir('charges')
+    if not os.path.isfile("equil.lammpstrj"):
+        substring = "python3 {}/Automation_Scripts/lammps_submit.py -f charges.in.init -p {} -t {} -ppn {} -q {} -sched {} -size {} -o charges -path_to_exe {} -npp {} --silent --overwrite"
+        substring = substring.format(c["taffi_path"],c["charges_md_procs"],c["charges_md_wt"],c["charges_md_ppn"],c["charges_md_q"],c["charges_md_sched"],c["charges_md_size"],c["lammps_exe"],c['charges_md_npp'])
+        output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
+        output = str(output,'utf-8')
+        jobids += [ m.split()[-1] for m in output.split("\n")[:-1]]
+    os.chdir(c['run_dir'])
+    return jobids
+
+# Charges step 2: generates and submits the QC jobs for a model compound (skipped if CHELPG_calcs exists). Returns the jobids.
+def charges_qc(g,c,status,inchi):
+
+    # Generate QC jobs for this model compound
+    jobids = []
+    if not os.path.isfile("{}/charges/equil.lammpstrj".format(inchi)):
+        print("ERROR: MD-sampliing for partial charges did not complete for {}".format(inchi))
+        quit()
+    
+    # Generate QC jobs for this model compound
+    if not os.path.isdir("{}/charges/CHELPG_calcs".format(inchi)):
+        os.chdir("{}/charges".format(inchi))
+        substring = 'equil.lammpstrj charges.map -every 10 -N 200 -mol_list 0 -p 8 -QC_types dft -o CHELPG_calcs -q {} -f {} {}'
+        substring = substring.format(status["mc"][inchi]["q"],c['functional'],c['nod3'])
+        gen_jobs_for_charges.main(substring.split())
+
+        os.chdir('CHELPG_calcs')
+        substring = "python3 {}/Automation_Scripts/orca_submit.py -p {} -t {} -ppn {} -q {} -sched {} -size {} -o charges -path_to_exe {}  --silent"
+        substring = substring.format(c["taffi_path"],c["charges_qc_procs"],c["charges_qc_wt"],c["charges_qc_ppn"],c["charges_qc_q"],c["charges_qc_sched"],c["charges_qc_size"],c["orca_exe"])
+        output = subprocess.Popen(subproc_string(substring),stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
+        output = str(output,'utf-8')
+        jobids += [ m.split()[-1] for m in output.split("\n")[:-1]]
+
+    os.chdir(c['run_dir'])
+    return jobids
+
+# Charges step 3: submits the charge fit for a model compound (skipped if a completed fit exists). Returns the jobids.
+def charges_fit(g,c,status,inchi):
+
+    jobids = []
+    if os.path.isdir("{}/charges/CHELPG_calcs".format(inchi)) is False or os.path.isfile("{}/charges/CHELPG_calcs/configs/0/0_charges.vpot".format(inchi)) is False:
+        print("ERROR: QC for partial chages did not complete for {}".format(inchi))
+        quit()
+        
+    # If the fit_charges.db file does not exist, then remove the fit directory and attempt to refit the charges 
+    os.chdir(inchi+'/charges') 
+    if(os.path.isdir('CHELPG_calcs/charges')) and ((os.path.isfile('CHELPG_calcs/charges/fit_charges.db')) is False) :
+        shutil.rmtree('CHELPG_calcs/charges')
+
+    # Fit the charges
+    if not os.path.isdir('CHELPG_calcs/charges'):
+
+        # Have to use sublist or the split method would split the python function call to two
+        sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
+        sublist.append('{}/FF_functions/extract_charges.py CHELPG_calcs -FF \'{}\' -o charges -w_hyper 0.0 -w_dipole 0.1 --two_step -w_qtot 1.0 -q {} -gens {} --keep_min -procs {}'.format(c["taffi_path"],c["ff"],c["charge"],c["gens"],c["param_fit_ppn"])+\
+                       (' -batch {}'.format(c["charges_fit_batch"]) if c["charges_fit_batch"] is not None else ''))
+        sublist= sublist + ('charge_parse  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split() + shell_submit_args(c["param_fit_sched"])
+        output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
+        output = str(output,'utf-8')
+        jobids += [ output.split("\n")[-2].split()[-1]]
+    os.chdir(c['run_dir'])
+    return jobids
+
+# Checks that the charge fit of a model compound produced fit_charges.db
+def check_charges(g,inchi):
+    if os.path.isfile("{}/charges/CHELPG_calcs/charges/fit_charges.db".format(inchi)) is False: 
+        print("An error occured during the gen {} after charge fitting of {}.".format(g,inchi))
+        quit()
     return
 
 # Submits the vdw script for each inchi key in the generation
@@ -513,48 +814,20 @@ def fit_vdw(g,c,status):
     mc_keys = [ _ for _ in status["mc"].keys() if int(g) in status["mc"][_]["gen"] ]
 
     process = {}
-    jobids = []
     for inchi in mc_keys:
+        proc = launch_vdw(g,c,inchi)
+        if proc is not None:
+            process[inchi] = proc
 
-        # Skip complete jobs. Encountered because model compounds can be in multiple generations. 
-        if(os.path.isfile(inchi+'/final_vdw.db')):
-            continue
-
-        # prepare subdirectory and intermediate_params.db with params from after charges.
-        if not os.path.isdir('{}/vdw'.format(inchi)):
-            os.mkdir('{}/vdw'.format(inchi))
-        if not os.path.isfile('{}/vdw/intermediate_params.db'.format(inchi)):
-            sublist = "{}/vdw/intermediate_params.db gen-{}_after_charges/params-DFT.db -only".format(inchi,g).split()
-            sublist.append("atom bond angle torsion charge")
-            merge_FF.main(sublist)
-
-        # Launch the subprocess for parameterizing the vdw params
-        os.chdir(inchi) ## vdw_loop has to be run in inchikey folder 
-        command = ('{}/Automation_Scripts/vdw_loop.py -c {} -FF'.format(c["taffi_path"],c["c_path"])).split()
-        command.append(c['ff'])
-        process[inchi] = subprocess.Popen(command)
-        os.chdir(c['run_dir']) # Back to run dir
-
-    # Wait until all process complete
-    running = {}
+    # Wait until all process complete (reporting each inchi key as its vdw_loop.py exits)
+    tracker = JobTracker(LocalBackend(),interval=2.0,max_interval=20.0)
     for key in process:
-        running[key] = process[key].poll() 
-    while ( None in  list(running.values())):
-        for key in process:
-            running[key] = process[key].poll()
-        time.sleep(20)
+        tracker.add(tracker.backend.register(process[key],jobid=key),callback=lambda x: print("\tvdw fitting for {} has finished (exit code {})".format(x,process[x].returncode)))
+    tracker.wait()
 
     # Check completion
     for inchi in mc_keys:
-        if os.path.isdir(inchi+'/vdw') is False:
-            print("An error occured duing the VDW fitting: folder i\"{}/vdw\" does not exist.".format(inchi))
-            quit()
-        elif os.path.isfile(inchi+'/vdw/status.txt') is False:
-            print("An error occured duing the VDW fitting: file \"{}/vdw/status.txt\" does not exist, cannot determine convergence status.".format(inchi)) 
-            quit()
-        elif (find_string(inchi+'/vdw/status.txt',b'complete')) is False:
-            print("An error occured duing the VDW fitting: \"{}/vdw\" is incomplete.".format(inchi))
-            quit()
+        check_vdw(inchi)
 
     # remove *.gbw files (take up a LOT of memory)
     delete_gbw()  
@@ -571,6 +844,46 @@ def fit_vdw(g,c,status):
     print("COMPLETE: VDW fitting for gen: {}".format(g))
     return
 
+# Prepares the vdw folder of a model compound and launches vdw_loop.py as a subprocess. Returns the
+# Popen object (None if the model compound already has a final_vdw.db)
+def launch_vdw(g,c,inchi):
+
+    # Skip complete jobs. Encountered because model compounds can be in multiple generations. 
+    if(os.path.isfile(inchi+'/final_vdw.db')):
+        return None
+
+    # prepare subdirectory and intermediate_params.db with params from after charges.
+    if not os.path.isdir('{}/vdw'.format(inchi)):
+        os.mkdir('{}/vdw'.format(inchi))
+    if not os.path.isfile('{}/vdw/intermediate_params.db'.format(inchi)):
+        sublist = "{}/vdw/intermediate_params.db gen-{}_after_charges/params-DFT.db -only".format(inchi,g).split()
+        sublist.append("atom bond angle torsion charge")
+        merge_FF.main(sublist)
+
+    # Launch the subprocess for parameterizing the vdw params
+    os.chdir(inchi) ## vdw_loop has to be run in inchikey folder 
+    command = ('{}/Automation_Scripts/vdw_loop.py -c {} -FF'.format(c["taffi_path"],c["c_path"])).split()
+    command.append(c['ff'])
+    proc = subprocess.Popen(command)
+    os.chdir(c['run_dir']) # Back to run dir
+    return proc
+
+# Checks the convergence status written by vdw_loop.py for a model compound (and that final_vdw.db was created if final_db is True)
+def check_vdw(inchi,final_db=False):
+    if os.path.isdir(inchi+'/vdw') is False:
+        print("An error occured duing the VDW fitting: folder i\"{}/vdw\" does not exist.".format(inchi))
+        quit()
+    elif os.path.isfile(inchi+'/vdw/status.txt') is False:
+        print("An error occured duing the VDW fitting: file \"{}/vdw/status.txt\" does not exist, cannot determine convergence status.".format(inchi)) 
+        quit()
+    elif (find_string(inchi+'/vdw/status.txt',b'complete')) is False:
+        print("An error occured duing the VDW fitting: \"{}/vdw\" is incomplete.".format(inchi))
+        quit()
+    elif final_db is True and os.path.isfile(inchi+'/final_vdw.db') is False:
+        print("An error occured after the vdw parameterizations, {}/final_vdw.db was not found.".format(inchi))
+        quit()
+    return
+
 # XXX ADD FUNCTION DESCRIPTIONS. 7/14/20
 def delete_gbw():
     fileList = glob.glob('./*.gbw')
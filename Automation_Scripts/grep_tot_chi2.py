@@ -12,6 +12,8 @@ sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/FF_functions')
 import log_to_db,merge_FF_drude,db_to_charmm,relax_drude_loop
 from monitor_jobs import *
+from orca_parser import parse_orca
+from vpot_loader import write_cache
 from parse_all import *
 from file_parsers import *
 import place_charge,generate_connolly,generate_connolly_new,gen_md_for_CHARMM_new
@@ -283,25 +285,9 @@ def read_db(dbfile):
     return (charge_dict,polar_dict)
 
 def read_polarout(filename):
-    with open(filename,'r') as f:
-        flag = 0
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-            if len(fields) < 2 and flag == 0: continue
-          
-            if flag == 0  and fields[0] == "Isotropic" and fields[1] == "polarizability" :
-               polar = float(fields[3])*0.529177210**3 # A.U to A^3
-               continue
-            
-            if flag == 0  and fields[0] == 'DIPOLE' and fields[1] == 'MOMENT' :
-               flag = 1
-               continue
-
-
-            if flag == 1 and len(fields) == 4 and fields[0] == 'Magnitude' and fields[1] == '(Debye)':
-               dipole = float(fields[3])
-               flag = 0 
-               continue
+    data   = parse_orca(filename)
+    dipole = float(data["dipole_debye"][-1])
+    polar  = float(data["polarizability"][-1])*0.529177210**3 # A.U to A^3
     return dipole,polar
 
 def write_chi(title,q,xyz,total_pc,atomtypes,f,charge_dict,polar_dict):
@@ -1038,6 +1024,7 @@ def Get_Inchi_xyz(xyz):
 #    pot  gridx gridy gridz
 #         ....
 def rewrite_potential(oldpot,newpot,connolly_grid):
+   elements,geo,pot = [],[],[]
    with open(oldpot,'r') as f:
       with open(newpot,'w') as g:
         atom_count = 0
@@ -1057,6 +1044,8 @@ def rewrite_potential(oldpot,newpot,connolly_grid):
             if flag == 1:
                 if len(fields) == 0: continue
                 g.write(lines)
+                elements += [fields[0]]
+                geo      += [[ float(i) for i in fields[1:4] ]]
                 atom_count += 1
                 if atom_count == n_atom:
                     flag = 2
@@ -1074,7 +1063,13 @@ def rewrite_potential(oldpot,newpot,connolly_grid):
                    flag = 1
                    continue
                if flag == 1 :
-                  g.write("{:< 10.7e}     {:< 10.7e}  {:< 10.7e}  {:< 10.7e}\n".format(float(fields[3]),float(fields[0]),float(fields[1]),float(fields[2])))
+                  lines = "{:< 10.7e}     {:< 10.7e}  {:< 10.7e}  {:< 10.7e}\n".format(float(fields[3]),float(fields[0]),float(fields[1]),float(fields[2]))
+                  g.write(lines)
+                  pot += [ float(i) for i in lines.split() ]
+
+   # Write the binary sidecar of the new potential (the values as written) so the fits don't parse it again
+   pot = np.array(pot).reshape(-1,4)
+   write_cache(newpot,elements,np.array(geo).reshape(-1,3),pot[:,1:4],pot[:,0])
    return
 
 def clean_pcsubmit(run_dir,nconf):
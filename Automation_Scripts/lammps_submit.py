@@ -1,6 +1,8 @@
 #!/bin/env python                                                                                                                                                              
 import sys,argparse,os,ast,re,fnmatch,subprocess
 from numpy import *
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from local_pool import run_local
 
 def main(argv):
 
@@ -45,7 +47,8 @@ def main(argv):
                         help = 'Specifies the number of calculations to bundle per submitted job (default: 100000)')
 
     parser.add_argument('-sched', dest='sched', default='torque-halstead',
-                        help = 'Specifies the scheduler protocol to use (torque-halstead and torque-titan are implemented)')
+                        help = 'Specifies the scheduler protocol to use (torque-halstead and torque-titan are implemented). "local" runs the jobs on this machine, '+\
+                               '-p cores per job (mpirun) on a pool sized to the host\'s cores, and returns once they have finished; partitions and gpus are ignored.')
 
     parser.add_argument('-a', dest='account', default=None,
                         help = 'Account to charge the job to. Usually only necessary on government machines. (default: None)')
@@ -165,6 +168,20 @@ def main(argv):
         print("No jobs in need of running, exiting...")
         quit()
 
+    # Local execution: run the jobs on this machine and return once they finish (no jobids are printed)
+    if args.sched == "local":
+        jobs = []
+        for count_i,i in enumerate(input_files):
+            if args.procs > 1:
+                command = 'mpirun -np {} {} -in "{}" > "{}"'.format(args.procs,args.path_to_exe,i,'.'.join(i.split('.')[:-1])+'.out')
+            else:
+                command = '{} -in "{}" > "{}"'.format(args.path_to_exe,i,'.'.join(i.split('.')[:-1])+'.out')
+            if args.shell != "":
+                command = "{}\n{}".format(args.shell,command)
+            jobs += [(command,os.path.abspath(input_paths[count_i]) if input_paths[count_i] != '' else working_dir,args.procs)]
+        run_local(jobs)
+        quit()
+
     # Insert escape characters for ( and )
     for i in [ "(", ")" ]:
         input_files = [ _.replace(i,"\{}".format(i)) for _ in input_files ]
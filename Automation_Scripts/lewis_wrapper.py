@@ -30,7 +30,8 @@ def doLewis(filename):
     
     # Canonicalize by sorting the elements based on hashing (NOTE: range(len(N_atom_types)) is used here rather than "atoms" as in the keep_terminal is True option. 
     Masses = [ mass_dict[elements[i]] for i in range(len(atom_types)) ]
-    hash_list,atoms = [ list(j) for j in zip(*sorted([ (atom_hash(count_i,adj_matrix,Masses),i) for count_i,i in enumerate(range(len(atom_types))) ],reverse=True)) ]
+    hashes = atom_hashes(adj_matrix,Masses)
+    hash_list,atoms = [ list(j) for j in zip(*sorted([ (hashes[count_i],i) for count_i,i in enumerate(range(len(atom_types))) ],reverse=True)) ]
 
     bonding_pref = []
 
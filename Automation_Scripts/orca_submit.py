@@ -2,6 +2,11 @@
 import sys,argparse,os,ast,re,fnmatch,matplotlib,subprocess,shutil
 from numpy import *
 from pylab import *
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from work_queue import submit_pull
+from local_pool import run_local
+from qc_cache import QCCache
+from orca_parser import terminated
 
 def main(argv):
 
@@ -72,11 +77,22 @@ def main(argv):
                         help = 'specifies the openmpi path containing the bin and lib folders. Each sched option has a default value that can be replaced if this is assigned. (defualt: None)')
 
     parser.add_argument('-sched',dest='scheduler', default="slurm-halstead",
-                        help = 'specifies the scheduler for the cluster ("torque" "slurm") (default: "slurm")')
+                        help = 'specifies the scheduler for the cluster ("torque" "slurm"). "local" runs the jobs on this machine, -p cores per job on a pool '+\
+                               'sized to the host\'s cores, and returns once they have finished. (default: "slurm")')
 
     parser.add_argument('--silent',dest='silent', default=False, const=True, action='store_const',
                         help = 'Shortcircuits all script related print statements (scheduler will probably still echo the job id)')
 
+    parser.add_argument('--pull',dest='pull', default=False, const=True, action='store_const',
+                        help = 'When set, the calculations are written to a shared queue (<-o>.queue.db) instead of being statically bundled, and single-node worker jobs are '+\
+                               'submitted that each run -ppn/-p calculations at a time, pulling the next calculation from the queue as soon as a slot frees up, until the queue is empty. '+\
+                               'Scans are run before optimizations before single points, and larger molecules first. The same number of nodes is requested as in the bundled mode. '+\
+                               'Only the -sched family (slurm or torque) is used for the worker scripts. (default: off)')
+
+    parser.add_argument('-cache',dest='cache', default=os.environ.get("TAFFI_QC_CACHE"),
+                        help = 'QC result cache (see Lib/qc_cache.py). Inputs whose calculation is already in the cache get the cached output instead of being submitted, '+\
+                               'and completed outputs that are found are added to the cache. (default: the TAFFI_QC_CACHE environment variable, or none)')
+
     args=parser.parse_args()
     if type(args.walltime) == str and "min" in args.walltime: args.walltime = int(args.walltime.split('min')[0]); min_flag = 1
     else: args.walltime = int(args.walltime); min_flag = 0
@@ -86,6 +102,7 @@ def main(argv):
     args.scheduler = args.scheduler.lower()
     Filename = args.Filename
     working_dir = os.getcwd()
+    cache = QCCache(args.cache) if args.cache is not None else None
 
     # Check that the number of processors per job divides into the number of processors per node.
     if args.ppn % args.procs != 0:
@@ -135,16 +152,21 @@ def main(argv):
             # Save the submission input files and paths to lists
             current_name = j.split('/')[-1]
             if current_name.split('.')[0]+".out" not in os.listdir('.'):
+
+                # Calculations that are already in the QC cache get the cached output instead of being submitted
+                if cache is not None and cache.restore(current_name):
+                    if args.silent is False:
+                        print("Restored the output of {} from the QC cache".format(current_name))
+                    os.chdir(working_dir)
+                    continue
                 input_files += [current_name]
                 input_paths += [path_to_file]
 
             # Check for job completion if resubmit option is toggled
             elif args.resubmit == 1:
-                completed_flag = 0
-                with open(current_name.split('.')[0]+".out",'r') as f:
-                    for lines in f:
-                        if "****ORCA TERMINATED NORMALLY****" in lines:
-                            completed_flag = 1
+                completed_flag = int(terminated(current_name.split('.')[0]+".out"))
+                if completed_flag == 1 and cache is not None:
+                    cache.store(current_name)
 
                 # Add incompleted files to the submission lists and clean up previous run files
                 if completed_flag == 0:
@@ -211,6 +233,8 @@ def main(argv):
                                     
             # Skip any that already have output files present
             else:
+                if cache is not None:
+                    cache.store(current_name)
                 if args.silent is False:
                     print("Skipped file {} because output was already found".format(current_name))
             os.chdir(working_dir)
@@ -221,6 +245,18 @@ def main(argv):
             print("No jobs in need of running, exiting...")
         quit()
 
+    # Pull-based bundling: queue the calculations and submit worker jobs that pull from the queue
+    if args.pull is True:
+        N_queued,N_workers = submit_pull([ (input_paths[count_i],'{} "{}" > "{}"'.format(args.path_to_exe,i,'.'.join(i.split('.')[:-1])+'.out'),i) for count_i,i in enumerate(input_files) ],args,min_flag,working_dir)
+        if args.silent is False:
+            print("Queued {} jobs and submitted {} worker jobs".format(N_queued,N_workers))
+        quit()
+
+    # Local execution: run the jobs on this machine and return once they finish (no jobids are printed)
+    if args.scheduler == "local":
+        run_local([ ('{} "{}" > "{}"'.format(args.path_to_exe,i,'.'.join(i.split('.')[:-1])+'.out'),input_paths[count_i],args.procs) for count_i,i in enumerate(input_files) ])
+        quit()
+
     # Insert escape characters for ( and )
     for i in [ "(", ")" ]:
         input_files = [ _.replace(i,"\{}".format(i)) for _ in input_files ]
@@ -22,6 +22,7 @@ if [ $# -lt 2 -o "$1" == "?" ]; then
     echo -e "\t-h\t: submit job in hold state (no argument)"
     echo -e "\t-shell\t: any arguments sandwiched between -shell flags (e.g., -shell mv foo folder/foo -shell) "
     echo -e "\t\t  will be added to submission script and executed in the run before the python call."
+    echo -e "\t-w\t: where the job is run (local: run the command on this machine and return once it finishes)"
     echo -e ""
     exit
 fi
@@ -96,6 +97,13 @@ if [ ! -z $( echo ${walltime} | grep "min" ) ]; then
     min_flag=1
 fi
 
+# Run the job on this machine (no scheduler). The last line echoes the job name in place of a jobid.
+if [ "${where_is_this_being_run}" == "local" ]; then
+    ( eval "${shell_command}"; eval "${command}" ) > ${name_sub}.out 2> ${name_sub}.err
+    echo -e "Completed local job ${name_sub}"
+    exit
+fi
+
 # Remove old submission scripts
 if [ -f ${outputname}.submit ]; then
     echo ${outputname}
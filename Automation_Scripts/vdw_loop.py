@@ -12,6 +12,8 @@ sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/FF_functio
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Parsers')
 from monitor_jobs import *
 from parse_all import *
+from local_pool import shell_submit_args
+from qc_cache import use_cache,store_results
 import frag_gen_inter,frag_gen,xyz_to_orca,paramgen,merge_FF,extract_intramolecular_params,gen_md_for_sampling,gen_jobs_for_charges 
 import plot_vdw_convergence,check_density,rescale_data,gen_jobs_for_vdw
 import codecs,json
@@ -42,6 +44,7 @@ def main(argv):
     c['run_dir'] = os.getcwd()
     if(args.FF_db != ''):
       c['ff'] = (args.FF_db)
+    c['qc_cache'] = use_cache(c['qc_cache'])
 
     # Make config file absolute
     args.config = os.path.abspath(args.config)
@@ -341,6 +344,9 @@ def main(argv):
         # Wait until jobs complete
         monitor_jobs(jobids,c['user'])
 
+        # Add the configurations to the QC cache
+        store_results(c['qc_cache'],c['run_dir']+'/vdw')
+
         # remove *.gbw files (take up a LOT of memory)
         os.chdir('vdw')
         delete_gbw()
@@ -352,8 +358,8 @@ def main(argv):
         # STEP 3: FIT VDW PARAMETERS
         jobids = []
         sublist = ['{}/Automation_Scripts/shell_submit.sh'.format(c['taffi_path'])]
-        sublist.append('{}/FF_functions/extract_vdw.py -f vdw -FF_DFT \'intermediate_params.db {}\' -o cycle-{} -E_max 0.0 -xhi2_thresh 1E-8 -q_a 0.0 -q_b 0.0 -mixing_rule wh -L2_sigma {} -L2_eps {} -fun {} -gens {}'.format(c['taffi_path'],c['ff'],cycle,L2_s,L2_e,c['functional'],c['gens']))
-        sublist= sublist + ('vdw_parse  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split()
+        sublist.append('{}/FF_functions/extract_vdw.py -f vdw -FF_DFT \'intermediate_params.db {}\' -o cycle-{} -E_max 0.0 -xhi2_thresh 1E-8 -q_a 0.0 -q_b 0.0 -mixing_rule wh -L2_sigma {} -L2_eps {} -fun {} -gens {} -procs {}'.format(c['taffi_path'],c['ff'],cycle,L2_s,L2_e,c['functional'],c['gens'],c["param_fit_ppn"]))
+        sublist= sublist + ('vdw_parse  -p 1 -t {} -q {} -ppn {}'.format(c["param_fit_wt"],c["param_fit_q"],c["param_fit_ppn"])).split() + shell_submit_args(c["param_fit_sched"])
         output = subprocess.Popen(sublist,stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()[0]
         output = str(output,'utf-8')
         jobids += [ output.split("\n")[-2].split()[-1]]
@@ -4,7 +4,7 @@ import numpy as np
 # Add TAFFY Lib to path
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 from file_parsers import xyz_parse
-from adjacency import Table_generator, find_lewis, canon_bond, canon_angle, canon_dihedral, canon_improper
+from adjacency import Table_generator, find_lewis, canon_bond, canon_angle, canon_dihedral, canon_improper, enumerate_modes, canon_modes, type_ids, mode_lists
 from id_types import Hybridization_finder,id_types
 
 def main(argv):
@@ -291,46 +291,17 @@ def get_data(FF_all,coord_files,q_list,gens,Improper_flag=False,force_read_opt=F
 #            diehdral instances, charges, and VDW parameters.
 def Find_parameters(Adj_mat,Bond_mats,Geometry,Atom_types,FF_db="FF_file",Improper_flag = False, force_read=False,remove_multi=False):
 
-    # List comprehension to determine bonds from a loop over the adjacency matrix. Iterates over rows (i) and individual elements
-    # ( elements A[count_i,count_j] = j ) and stores the bond if the element is "1". The count_i < count_j condition avoids
-    # redudant bonds (e.g., (i,j) vs (j,i) ). By convention only the i < j definition is stored.
-    print("Parsing bonds...")
-    Bonds          = [ (count_i,count_j) for count_i,i in enumerate(Adj_mat) for count_j,j in enumerate(i) if j == 1 ]
-    Bond_types     = [ (Atom_types[i[0]],Atom_types[i[1]]) for i in Bonds ]
-
-    # List comprehension to determine angles from a loop over the bonds. Note, since there are two bonds in every angle, there will be
-    # redundant angles stored (e.g., (i,j,k) vs (k,j,i) ). By convention only the i < k definition is stored.
-    print("Parsing angles...")
-    Angles          = [ (count_j,i[0],i[1]) for i in Bonds for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in i ]
-    Angle_types     = [ (Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]]) for i in Angles ]
-
-    # List comprehension to determine dihedrals from a loop over the angles. Note, since there are two angles in every dihedral, there will be
-    # redundant dihedrals stored (e.g., (i,j,k,m) vs (m,k,j,i) ). By convention only the i < m definition is stored.
-    print("Parsing dihedrals...")
-    Dihedrals      = [ (count_j,i[0],i[1],i[2]) for i in Angles for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in i ]
-    Dihedral_types = [ (Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[i[3]]) for i in Dihedrals ]
-
-    # List comprehension to determine dihedrals from a loop over the angles. Note, since there are two angles in every dihedral, there will be
-    # redundant dihedrals stored (e.g., (i,j,k,m) vs (m,k,j,i) ). By convention only the i < m definition is stored.
+    # The modes are enumerated from the neighbor lists of the adjacency matrix (see enumerate_modes in adjacency.py). Each 
+    # bond, angle, dihedral, and improper is generated once, so no redundancy removal is needed. The modes are canonicalized 
+    # with integer type ids whose ordering matches the type strings (i.e., same result as canon_bond, canon_angle, etc).
+    print("Parsing bonds, angles, and dihedrals...")
+    labels,(type_id,) = type_ids(Atom_types)
+    Bonds,Angles,Dihedrals,_,Impropers = enumerate_modes(Adj_mat)
+    Bonds,Bond_types         = mode_lists(*canon_modes(Bonds,type_id[Bonds]),labels=labels)
+    Angles,Angle_types       = mode_lists(*canon_modes(Angles,type_id[Angles]),labels=labels)
+    Dihedrals,Dihedral_types = mode_lists(*canon_modes(Dihedrals,type_id[Dihedrals]),labels=labels)
     if Improper_flag:    print("Parsing impropers...")
-    Impropers      = [ (i[1],i[0],i[2],count_j) for i in Angles for count_j,j in enumerate(Adj_mat[i[1]]) if j == 1 and count_j not in i ]
-    Improper_types = [ (Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[i[3]]) for i in Impropers ]
-
-    # Canonicalize the modes
-    for i in range(len(Bonds)):
-        Bond_types[i],Bonds[i] = canon_bond(Bond_types[i],ind=Bonds[i])
-    for i in range(len(Angles)):
-        Angle_types[i],Angles[i] = canon_angle(Angle_types[i],ind=Angles[i])
-    for i in range(len(Dihedrals)):
-        Dihedral_types[i],Dihedrals[i] = canon_dihedral(Dihedral_types[i],ind=Dihedrals[i])
-    for i in range(len(Impropers)):
-        Improper_types[i],Impropers[i] = canon_improper(Improper_types[i],ind=Impropers[i])        
-
-    # Remove redundancies    
-    if len(Bonds) > 0: Bonds,Bond_types = list(map(list, list(zip(*[ (i,Bond_types[count_i]) for count_i,i in enumerate(Bonds) if count_i == [ count_j for count_j,j in enumerate(Bonds) if j == i or j[::-1] == i ][0]  ]))))
-    if len(Angles) > 0: Angles,Angle_types = list(map(list, list(zip(*[ (i,Angle_types[count_i]) for count_i,i in enumerate(Angles) if count_i == [ count_j for count_j,j in enumerate(Angles) if j == i or j[::-1] == i ][0]  ]))))
-    if len(Dihedrals) > 0: Dihedrals,Dihedral_types = list(map(list, list(zip(*[ (i,Dihedral_types[count_i]) for count_i,i in enumerate(Dihedrals) if count_i == [ count_j for count_j,j in enumerate(Dihedrals) if j == i or j[::-1] == i ][0]  ]))))
-    if len(Impropers) > 0: Impropers,Improper_types = list(map(list, list(zip(*[ (i,Improper_types[count_i]) for count_i,i in enumerate(Impropers) if count_i == [ count_j for count_j,j in enumerate(Impropers) if j[0] == i[0] and len(set(i[1:]).intersection(set(j[1:]))) ][0] ]))))
+    Impropers,Improper_types = mode_lists(*canon_modes(Impropers,type_id[Impropers],improper=True),labels=labels)
 
     # Remove bimodal angles (e.g., if the same angle is present in
     # more than one configuration, then only the most abundant is kept)
@@ -362,8 +333,12 @@ def Find_parameters(Adj_mat,Bond_mats,Geometry,Atom_types,FF_db="FF_file",Improp
             Angles = [ j for count_j,j in enumerate(Angles) if count_j not in del_inds ]
 
     # Add the opls/harmonic type as a fifth element in the Dihedral_types tuples
+    # (the central bond orders are looked up in each bond matrix at once)
+    harmonic = np.zeros(len(Dihedrals),dtype=bool)
+    for j in Bond_mats:
+        harmonic |= np.asarray(j)[[ k[1] for k in Dihedrals ],[ k[2] for k in Dihedrals ]] == 2
     for count_i,i in enumerate(Dihedrals):
-        if 2 in [ j[i[1],i[2]] for j in Bond_mats ]:
+        if harmonic[count_i]:
             Dihedral_types[count_i] = tuple(list(Dihedral_types[count_i]) + ["harmonic"])        
         # elif ( "R" in Dihedral_types[count_i][1] or "E" in Dihedral_types[count_i][1] or "Z" in Dihedral_types[count_i][1] ) and \
         #      ( "R" in Dihedral_types[count_i][2] or "E" in Dihedral_types[count_i][2] or "Z" in Dihedral_types[count_i][2] ):
@@ -476,23 +451,28 @@ def Find_parameters(Adj_mat,Bond_mats,Geometry,Atom_types,FF_db="FF_file",Improp
     with open(FF_db,'r') as f:
         content=f.readlines()
 
-    Charges = zeros(len(Atom_types))
-    for i in range(len(Atom_types)):
-        for lines in content:
-            fields=lines.split()
+    # (the charge lines are parsed once, the last definition of each type is used)
+    charge_dict = {}
+    for lines in content:
+        fields=lines.split()
 
-            # Skip empty lines
-            if len(fields) == 0:
-                continue
-                    
-            if fields[0].lower() in ['charge'] and Atom_types[i] == fields[1]:
-                Charges[i] = float(fields[2])
+        # Skip empty lines
+        if len(fields) == 0:
+            continue
+
+        if fields[0].lower() in ['charge']:
+            charge_dict[fields[1]] = float(fields[2])
+
+    Charges = np.zeros(len(Atom_types))
+    for i in range(len(Atom_types)):
+        if Atom_types[i] in charge_dict:
+            Charges[i] = charge_dict[Atom_types[i]]
 
     # Search for polarizability based on atom type
     with open(FF_db,'r') as f:
         content=f.readlines()
 
-    alphas = zeros(len(Atom_types))
+    alphas = np.zeros(len(Atom_types))
     for count_i,i in enumerate(alphas):
         alphas[count_i] = -1
     for i in range(len(Atom_types)):
@@ -547,13 +527,13 @@ def Find_parameters(Adj_mat,Bond_mats,Geometry,Atom_types,FF_db="FF_file",Improp
                         VDW_params[(fields[2],fields[1])] = [fields[3],float(fields[4]),float(fields[5]),float(fields[6])]
 
     # Check for missing parameters
-    Missing_masses = [ i for i in Atom_types if str(i) not in list(Masses.keys()) ] 
+    Missing_masses = [ i for i in Atom_types if str(i) not in Masses ] 
     Missing_charges = [ count_i for count_i,i in enumerate(Charges) if i == -100.0 ]; Missing_charges = [ Atom_types[i] for i in Missing_charges ]
-    Missing_bonds = [ i for i in Bond_types if (i[0],i[1]) not in list(Bond_params.keys()) ]
-    Missing_angles = [ i for i in Angle_types if (i[0],i[1],i[2]) not in list(Angle_params.keys()) ]
-    Missing_dihedrals = [ i for i in Dihedral_types if (i[0],i[1],i[2],i[3],i[4]) not in list(Dihedral_params.keys()) ]
+    Missing_bonds = [ i for i in Bond_types if (i[0],i[1]) not in Bond_params ]
+    Missing_angles = [ i for i in Angle_types if (i[0],i[1],i[2]) not in Angle_params ]
+    Missing_dihedrals = [ i for i in Dihedral_types if (i[0],i[1],i[2],i[3],i[4]) not in Dihedral_params ]
     Missing_impropers = []
-    if Improper_flag is True: Missing_impropers = [ i for i in Improper_types if (i[0],i[1],i[2],i[3]) not in list(Improper_params.keys()) ]
+    if Improper_flag is True: Missing_impropers = [ i for i in Improper_types if (i[0],i[1],i[2],i[3]) not in Improper_params ]
 
     # When the force_read option is set to True, the script will attempt to replace the missing dihedral types with whatever (matching)
     # parameters are in the force-field file. For example, if an opls type is expected but a harmonic type is supplied, the harmonic type
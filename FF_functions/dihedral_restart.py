@@ -2,6 +2,8 @@
 import sys,os,argparse
 import shutil
 from numpy import *
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from orca_index import OrcaIndex
 
 
 def main(argv):
@@ -21,21 +23,11 @@ def main(argv):
     # Make relevant inputs lowercase
     args=parser.parse_args(argv)    
 
-    # Find the dihedral folders
-    dihedral_folders = [ dp+'/'+dirs for dp,dn,fn in os.walk(args.folder) for dirs in dn if dirs in ["scan-forward","scan-reverse"] ] 
-    
-    # Check for job completion
-    incomplete_list = []
-    for i in dihedral_folders:
-        output_name = next( j for j in os.listdir(i) if j.split('.')[-1] == "out" )
-        base_name   = '.'.join(output_name.split('.')[:-1])
-        completed_flag = False
-        with open("{}/{}".format(i,output_name),'r') as f:
-            for lines in f:
-                if "****ORCA TERMINATED NORMALLY****" in lines:
-                    completed_flag = True
-        if completed_flag is False:
-            incomplete_list += [(i,base_name)]
+    # Find the dihedral folders whose scans didn't complete (outputs are read through the status index
+    # of the current directory, so unchanged outputs aren't reread)
+    index = OrcaIndex('.')
+    incomplete_list = index.incomplete_scans(args.folder)
+    index.save()
 
     # Print the files being restarted if the flag is present.
     if args.verbose is True:
@@ -8,7 +8,7 @@ from scipy.spatial.distance import cdist
 import numpy as np #from numpy import *
 from numpy.linalg import norm
 from copy import deepcopy
-import time
+import time,resource
 from itertools import combinations
 
 # Add TAFFY Lib to path
@@ -18,6 +18,9 @@ from adjacency import *
 from file_parsers import *
 from id_types import *
 from kekule import *
+from orca_parser import parse_orca
+from ingest_pool import pool_map,get_procs
+from vpot_loader import load_vpot
 import random
 
 def main(argv):
@@ -75,6 +78,12 @@ def main(argv):
     parser.add_argument('-N', dest='N_configs', default=None,
                         help = 'Expects an integer. When supplied, only this number of configurations will be used for the fit (default: None)') 
 
+    parser.add_argument('-procs', dest='procs', default=1,
+                        help = 'Number of processes used to parse the configurations (0 uses all cores). (default: 1)')
+
+    parser.add_argument('-batch', dest='batch', default=None,
+                        help = 'When supplied, the configurations are fit in the batched mode, this number of configurations at a time (see fit_configs_batched). (default: None, one configuration at a time)')
+
     parser.add_argument('--symmetrize', dest='symmetrize', default=False, action='store_const', const=True,
                         help = 'When this flag is supplied, the partial charges on identical atom types are constrained to be equal during the fitting. (default: off)')
 
@@ -101,6 +110,8 @@ def main(argv):
     args.output_folder = str(args.output_folder)
     args.FF_db = args.FF_db.split()
     args.gens = int(args.gens)
+    args.procs = int(args.procs)
+    if args.batch is not None: args.batch = int(args.batch)
     if args.N_configs is not None: args.N_configs = int(args.N_configs); 
     if args.N_configs is not None and args.N_configs < 0: print("ERROR: -N option must be an integer greater than 0. Exiting..."); quit()
 
@@ -235,208 +246,10 @@ def main(argv):
     # Print diagnostic
     print(("Number of Configurations Being Parsed: {}\n".format(len(potfiles))))    
 
-    ################
-    # All-Atom Fit # 
-    ################
-
-    for z in [ 'AA', 'UA' ]:
-
-        # Initialize arrays
-        lstsq_D_errs = []
-        lstsq_errs   = []
-        lstsq_qtot   = []
-        fit_D_errs   = []
-        fit_errs     = []
-        fit_qtot     = []
-        avoid_list   = []
-
-        if z == "AA":
-            lstsq_dict   = {}
-            fit_dict     = {}
-
-        # Iterate over the files being fit
-        for count_f,f in enumerate(potfiles):
-            
-            # Parse dipole and quadrupole
-            # Parse the geometry, grid locations, and potential from the orca *.vpot file
-            # NOTE: the geo,grid are returned in bohr
-            elements,geo,grid,potential = parse_vpot(f,xyzs[count_f])
-
-            # Generate the adjacency matrix
-            # NOTE: the units are converted back angstroms
-            adj_mat = Table_generator(elements,geo*0.52917721067,File=xyzs[count_f])
-
-            # Generate the atomtypes
-            #atomtypes = id_types(elements,adj_mat,args.gens,Hybridization_finder(elements,adj_mat),geo*0.52917721067)
-            atomtypes = id_types(elements,adj_mat,args.gens) # id_types v.062520
-
-            # Calculate the center of mass
-            cm = calc_cm(elements,geo)    
-
-            # Parse dipole/quadrupole
-            if outputs[count_f] is not None:
-                dipole_0,quadrupole_0 = parse_orca_out(outputs[count_f])
-            else:
-                w_dipole = 0.0
-                w_quadrupole = 0.0
-                dipole_0 = np.array([0.0,0.0,0.0])
-                quadrupole_0 = np.array([0.0,0.0,0.0])
-
-            # If no dipole or quadrupole are found then zero out the weight of that component and continue
-            if dipole_0 is None:
-                w_dipole = 0.0
-                dipole_0 = np.array([0.0,0.0,0.0])
-            if quadrupole_0 is None:
-                w_quadrupole = 0.0
-                quadrupole_0 = np.array([0.0,0.0,0.0])
-
-            # Prune united-atom hydrogens if the option is enabled
-            if z == "UA":
-                del_ind=[ count_i for count_i,i in enumerate(adj_mat) if elements[count_i] == "H" and len([ j for count_j,j in enumerate(adj_mat[count_i]) if j == 1 and elements[count_j] == "C" and np.sum(adj_mat[count_j]) == 4 ]) > 0 ]
-                keep_ind = [ i for i in range(len(adj_mat)) if i not in del_ind ]
-                # keep_ind = [ count_i for count_i,i in enumerate(adj_mat) if elements[count_i] != "H" or "C" not in [ elements[count_j] for count_j,j in enumerate(i) if j == 1 ] ]
-                geo = geo[keep_ind]
-                elements = [ elements[i] for i in keep_ind ]
-                adj_mat = adj_mat[keep_ind,:][:,keep_ind]
-                atomtypes = [ atomtypes[i]+'-UA' for i in keep_ind ]
-
-            # Calculate the inverse displacements of each grid point from the charge centers being fit. 
-            seps = 1.0/cdist(grid,geo)
-
-            # Calculate lstsq fit with qtot charge constraint as a reference
-            lstsq_charges = lstsq_potfit(geo,grid,args.qtot,seps,potential)
-
-            # Initialize initial guess (charges) and a list of holding the index in charges that each atomic charges corresponds to
-            # In the case of no symmetry constraints, charge_mapping simply maps one-to-one to the charges list. When there are symmetry 
-            # constraints the charge_mapping elements of like atomtypes will commonly reference some common index in charges array. 
-            # NOTE: initial guess is made to satisfy q_tot but distributing the necessary amount to the atoms being fit
-            # NOTE: fix_ind and the initial guess are populated with charges from the supplied FF files  
-            charge_mapping = list(range(len(geo)))
-            fix_ind        = [ count_i for count_i,i in enumerate(atomtypes) if i in list(fixed_dict.keys()) ]
-            fit_ind        = [ count_i for count_i,i in enumerate(atomtypes) if i not in list(fixed_dict.keys()) ]
-            charges_0      = np.array([ 0.0 if count_i in fit_ind else fixed_dict[atomtypes[count_i]] for count_i,i in enumerate(atomtypes) ])
-            if len(fit_ind) == 0:
-                offset = 0.0
-            else:
-                offset         = (args.qtot-np.sum(charges_0))/float(len(fit_ind))
-            for i in fit_ind: charges_0[i] = offset
-
-            ###################
-            # Fit the charges #
-            ###################
-
-            # two-step algorithm: first fits the polar atoms with symmetry constraints, then holds the polar atoms fixed and fits the non-polar atoms with symmetry constraints.
-            if args.two_step == True:
-
-                # Find non-carbon atoms and hydrogens that aren't attached to carbon
-                polar_ind = [ count_i for count_i,i in enumerate(adj_mat) if \
-                              ( elements[count_i] != 'C' and elements[count_i] != "H" ) or ( elements[count_i] == "H" and np.sum([ 1 for count_j,j in enumerate(adj_mat[count_i]) if ( j == 1 and elements[count_j] == "C" ) ]) == 0 ) ]
-
-                # Find non-carbon atoms and hydrogens that aren't attached to carbon
-                nonpolar_ind = [ i for i in range(len(geo)) if i not in polar_ind ]
-
-                # Remove fixed atoms from fit consideration
-                polar_ind    = [ i for i in polar_ind if i not in fix_ind ]
-                nonpolar_ind = [ i for i in nonpolar_ind if i not in fix_ind ]
-
-                # During the first step (i) no charges are fixed and (ii) symmetry is only forced on the polar atoms.
-                # The polar atomtypes are looped over (outer loop), the indices of all like atomtypes are found (idx), all charge_mapping elements at indices idx are set to point at the first instance of that atom type.
-                charge_mapping = list(range(len(geo)))
-                for i in set([ atomtypes[j] for j in polar_ind ]):
-                    idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
-                    for j in idx: charge_mapping[j] = idx[0]
-
-                # Fit the polar atoms                    imposes_symmetry fits_all
-                fit_charges = flex_fit(geo,potential,seps,charge_mapping,fit_ind,\
-                                       args.qtot,dipole_0,quadrupole_0,cm,args.w_pot,args.w_qtot,args.w_hyper,args.b_hyper,args.w_dipole,args.w_quadrupole,charges_0=charges_0,traceless_opt=False)
-
-                # During the second step (i) the charges on the polar_ind atoms are fixed and (ii) symmetry is forced on the non_polar atoms.
-                for i in set([ atomtypes[j] for j in nonpolar_ind ]):
-                    idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
-                    for j in idx: charge_mapping[j] = idx[0]
-
-                # Check to ensure that there is something to fit in this second step
-                if len(nonpolar_ind) > 0:
-
-                    # Fit the non-polar atoms                imposes_symmetry fits_only_nonpolar
-                    fit_charges = flex_fit(geo,potential,seps,charge_mapping,nonpolar_ind,\
-                                           args.qtot,dipole_0,quadrupole_0,cm,args.w_pot,args.w_qtot,args.w_hyper,args.b_hyper,args.w_dipole,args.w_quadrupole,charges_0=fit_charges,traceless_opt=False)
-                
-            # symmetrize algorithm: fits all atoms at once with symmetry constraints.
-            elif args.symmetrize == True:
-
-                # The atomtypes are looped over (outer loop), the indices of all like atomtypes are found (idx), all charge_mapping elements at indices idx are set to point at the first instance of that atom type.
-                for i in set(atomtypes):
-                    idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
-                    for j in idx: charge_mapping[j] = idx[0]
-
-                # Fit the charges                        imposes_symmetry  fits_all_atoms
-                fit_charges = flex_fit(geo,potential,seps,charge_mapping,fit_ind,\
-                                       args.qtot,dipole_0,quadrupole_0,cm,args.w_pot,args.w_qtot,args.w_hyper,args.b_hyper,args.w_dipole,args.w_quadrupole,charges_0=charges_0,traceless_opt=False)
-
-            # default: perform the fit to all atoms at once without symmetry constraints
-            else:
-
-                # Fit the charges
-                fit_charges = flex_fit(geo,potential,seps,list(range(len(geo))),fit_ind,\
-                                       args.qtot,dipole_0,quadrupole_0,cm,args.w_pot,args.w_qtot,args.w_hyper,args.b_hyper,args.w_dipole,args.w_quadrupole,charges_0=charges_0,traceless_opt=False)
-
-            # Update the charges in the dictionaries
-            for i in set(atomtypes):
-
-                # When keep_min option is enabled, the program avoids saving any charges for whom this geometry is not a minimal structure
-                if args.keep_min is True and minimal_structure(i,geo,elements,adj_mat=adj_mat,atomtypes=atomtypes) is False :                    
-                    avoid_list += [i]
-                    continue
-
-                if i not in lstsq_dict:
-                    lstsq_dict[i] = []
-                if i not in fit_dict:
-                    fit_dict[i] = []
-                for count_j,j in enumerate(atomtypes):
-                    if i == j:
-                        lstsq_dict[i] += [lstsq_charges[count_j]]
-                        fit_dict[i] += [fit_charges[count_j]]
-
-            # Update error dictionaries
-            lstsq_errs += [np.mean((Calc_Pot(seps,lstsq_charges)-potential)**(2.0))]
-            fit_errs += [np.mean((Calc_Pot(seps,fit_charges)-potential)**(2.0))]
-            if dipole_0 is not None:
-                lstsq_D_errs += [ (norm(dipole_0) - calc_dipole(geo,lstsq_charges)[1])**(2.0) ]
-                fit_D_errs += [ (norm(dipole_0) - calc_dipole(geo,fit_charges)[1])**(2.0) ]
-
-            # Update qtot lists           
-            lstsq_qtot += [np.sum(lstsq_charges)] 
-            fit_qtot += [np.sum(fit_charges)]
-
-        # Print Charge summary
-        print(("{}".format("*"*140)))
-        print(("* {:^136s} *".format("Final {}-Charges".format(z))))
-        print(("*{:^138s}*".format("-"*138)))
-        print(("* {:<60s}         {:<30s}        {:<19s} {:<10s}*".format("Atomtype","CHELPG","Fit","Status")))
-        print(("{}".format("*"*140)))
-        for i in lstsq_dict:
-            if z == "UA" and "-UA" not in i: continue
-            if i in list(fixed_dict.keys()): origin="fixed"
-            else: origin="fit"
-            print(("  {:<60s} {:35s} {:30s} {}".format(i,"{:< 8.6f} +/- {:<12.6f}".format(np.mean(lstsq_dict[i]),np.std(lstsq_dict[i])),"{:< 8.6f} +/- {:<12.6f}".format(np.mean(fit_dict[i]),np.std(fit_dict[i])),origin)))
-
-        # Print error summary
-        print(("\n  {:<60s} {:< 35.6g} {:< 35.6g} ".format("<xhi_pot^2> (A.U.^2):",np.mean(lstsq_errs),np.mean(fit_errs))))
-        if len(lstsq_D_errs) > 0:
-            print(("  {:<60s} {:< 35.6g} {:< 35.6g} ".format("<xhi_D^2> (A.U.^2):",np.mean(lstsq_D_errs),np.mean(fit_D_errs))))
-        print(("  {:<60s} {:< 35.6f} {:< 35.6f} \n".format("total charge (A.U.):",np.mean(lstsq_qtot),np.mean(fit_qtot))))    
-
-        # Print summary of charges not saved due to the --keep_min option
-        if len(avoid_list) > 0:
-            avoid_list = set(avoid_list)
-            print(("{}".format("*"*140)))
-            print(("* {:^136s} *".format("Atomtypes that weren't Saved Because this isn't a Minimal Geometry")))
-            print(("{}".format("*"*140)))
-            print("\nList of atomtypes that weren't saved:\n")
-            for i in sorted(avoid_list):
-                print(("\t{}".format(i)))
-            print(" ")
+    # Fit the charges of every configuration with the AA and UA models (see fit_charge_configs)
+    lstsq_dict,fit_dict,errs,model = fit_charge_configs(potfiles,xyzs,outputs,args.gens,fixed_dict,args.qtot,args.w_pot,args.w_qtot,args.w_hyper,args.b_hyper,args.w_dipole,args.w_quadrupole,\
+                                                        symmetrize=args.symmetrize,two_step=args.two_step,keep_min=args.keep_min,verbose=True,procs=args.procs,batch=args.batch)
+    elements,geo,atomtypes = model
 
     # Write the charge database file(s)
     write_params(args.output_folder+'/chelpg.db',lstsq_dict)
@@ -553,12 +366,20 @@ def minimal_structure(atomtype,geo,elements,adj_mat=None,atomtypes=None,gens=2):
 #
 #                keep_min:      When this bool is set to True, the charges are fit as usual but only the atomtypes for whom the supplied geometry is a minimal structure will be returned. 
 #
+#                procs:         Number of processes used to parse the configurations (default: 1)
+#
+#                batch:         When set to an integer, the configurations are fit in the batched mode, batch configurations at a time (see fit_configs_batched).
+#                               Larger values share more work between fits at the cost of memory. (default: None, one configuration at a time)
+#
 # Returns:       AA_charges:    A dictionary of all-atom charges with atom types as the keys and the charges as the elements
 #
 #                UA_charges:    A dictionary of united-atom charges with the atom types as the keys and the charges as the elements
 #
+#                errs:          A dictionary with the mean potential (xhi_pot) and dipole (xhi_D) errors, the wall time of the fit (wall_time, s),
+#                               the peak memory of the whole process (peak_memory, MB) and its increase during the fit (peak_memory_delta, MB)
+#
 def fit_charges(filename,xyz_file=None,path=None,out_file=None,qtot=0.0,gens=2,w_pot=1.0,w_qtot=1.0,w_hyper=0.0,b_hyper=0.1,w_dipole=0.1,w_quadrupole=0.0,FF_db='',N_configs=None,seed=444,\
-                UA_opt=False,symmetrize=False,two_step=False,keep_min=False,verbose=False):
+                UA_opt=False,symmetrize=False,two_step=False,keep_min=False,verbose=False,procs=1,batch=None):
 
     # Consistency checks
     if UA_opt not in [ True, False ]: 
@@ -695,6 +516,79 @@ def fit_charges(filename,xyz_file=None,path=None,out_file=None,qtot=0.0,gens=2,w
             outputs  = [ outputs[i] for i in keep_ind ]
             xyzs     = [ xyzs[i] for i in keep_ind ]
 
+    # Fit the charges of every configuration with the AA and UA models (see fit_charge_configs)
+    lstsq_dict,fit_dict,errs,model = fit_charge_configs(potfiles,xyzs,outputs,gens,fixed_dict,qtot,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,\
+                                                        symmetrize=symmetrize,two_step=two_step,keep_min=keep_min,verbose=verbose,procs=procs,batch=batch)
+    charges = { i:(np.mean(fit_dict[i]),np.std(fit_dict[i])) for i in fit_dict }
+
+    return charges, errs
+
+# Description: Fits the charges of a set of configurations with the AA and UA models and reduces the results by atomtype. This
+#              is the fitting stage shared by main (the extract_charges.py command line) and fit_charges.
+#
+# Inputs:      potfiles, xyzs, outputs: the *.vpot file of each configuration and its xyz and output files (None if missing)
+#              fixed_dict:    atomtypes whose charges are held fixed (atomtype:charge)
+#              verbose:       prints the charge, error and performance summaries
+#              procs, batch:  see fit_charges. The remaining arguments are the fit_charges arguments of the same name.
+#
+# Returns:     lstsq_dict:    the reference lstsq charges of each atomtype (one entry per atom and configuration)
+#              fit_dict:      the fit charges of each atomtype (one entry per atom and configuration)
+#              errs:          see fit_charges
+#              model:         elements, geo and atomtypes of the last fit
+def fit_charge_configs(potfiles,xyzs,outputs,gens,fixed_dict,qtot,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,symmetrize=False,two_step=False,keep_min=False,verbose=False,procs=1,batch=None):
+
+    # Wall time and process peak memory at the start of the fit
+    start_time = time.time()
+    peak_0     = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    # The configurations are parsed (distributed over procs processes) and fit in chunks, batch configurations at a time
+    # in the batched mode and a few per process otherwise. Only the fit results are kept, so the grids and potentials of
+    # one chunk are held in memory at a time.
+    if batch is not None:
+        chunk = int(batch)
+        if chunk < 1:
+            print("ERROR in fit_charge_configs: batch must be an integer greater than 0. Exiting...")
+            quit()
+    else:
+        chunk = 4*get_procs(procs)
+    fits    = {}
+    moments = {}
+    for start in range(0,len(potfiles),chunk):
+        ind     = list(range(start,min(start+chunk,len(potfiles))))
+        configs = pool_map(parse_config,[ (potfiles[i],xyzs[i],outputs[i],gens) for i in ind ],procs=procs)
+        configs = { i:configs[count_i] for count_i,i in enumerate(ind) }
+
+        # Dipole/quadrupole targets and weights of each fit
+        for i in ind:
+            dipole_0,quadrupole_0 = configs[i][7:9]
+            w_D,w_Q = w_dipole,w_quadrupole
+
+            # Zero the dipole/quadrupole if no output was found
+            if outputs[i] is None:
+                w_D = 0.0
+                w_Q = 0.0
+                dipole_0 = np.array([0.0,0.0,0.0])
+                quadrupole_0 = np.array([0.0,0.0,0.0])
+
+            # If no dipole or quadrupole are found then zero out the weight of that component and continue
+            if dipole_0 is None:
+                w_D = 0.0
+                dipole_0 = np.array([0.0,0.0,0.0])
+            if quadrupole_0 is None:
+                w_Q = 0.0
+                quadrupole_0 = np.array([0.0,0.0,0.0])
+            for z in [ 'AA', 'UA' ]:
+                moments[(z,i)] = (dipole_0,quadrupole_0,w_D,w_Q)
+
+        # Fit model (geometry in bohr, UA hydrogens pruned for the UA fit), reference lstsq charges and fit charges (see fit_config)
+        if batch is None:
+            for z in [ 'AA', 'UA' ]:
+                for i in ind:
+                    fits[(z,i)] = fit_config(configs[i],z,moments[(z,i)],fixed_dict,qtot,w_pot,w_qtot,w_hyper,b_hyper,symmetrize,two_step)
+        else:
+            fits.update(fit_configs_batched(configs,moments,fixed_dict,qtot,w_pot,w_qtot,w_hyper,b_hyper,symmetrize,two_step,batch))
+        configs = None
+
     ################
     # All-Atom Fit # 
     ################
@@ -717,129 +611,11 @@ def fit_charges(filename,xyz_file=None,path=None,out_file=None,qtot=0.0,gens=2,w
         # Iterate over the files being fit
         for count_f,f in enumerate(potfiles):
 
-            # Parse dipole and quadrupole
-            # Parse the geometry, grid locations, and potential from the orca *.vpot file
-            # NOTE: the geo is returned in bohr
-            elements,geo,grid,potential = parse_vpot(f,xyzs[count_f])
-
-            # Generate the adjacency matrix
-            # NOTE: the units are converted back angstroms
-            adj_mat = Table_generator(elements,geo*0.52917721067,File=xyzs[count_f])
-
-            # Generate the atomtypes
-            #atomtypes = id_types(elements,adj_mat,gens,Hybridization_finder(elements,adj_mat),geo*0.52917721067) ### OLD ID_TYPES CALL, HYBRID AND GEO AREN'T USED ANYMORE
-            atomtypes = id_types(elements,adj_mat,gens)
-
-            # Calculate the center of mass
-            cm = calc_cm(elements,geo)    
-
-            # Parse dipole/quadrupole
-            if outputs[count_f] is not None:
-                dipole_0,quadrupole_0 = parse_orca_out(outputs[count_f])
-            else:
-                w_dipole = 0.0
-                w_quadrupole = 0.0
-                dipole_0 = np.array([0.0,0.0,0.0])
-                quadrupole_0 = np.array([0.0,0.0,0.0])
-
-            # If no dipole or quadrupole are found then zero out the weight of that component and continue
-            if dipole_0 is None:
-                w_dipole = 0.0
-                dipole_0 = np.array([0.0,0.0,0.0])
-            if quadrupole_0 is None:
-                w_quadrupole = 0.0
-                quadrupole_0 = np.array([0.0,0.0,0.0])
-
-            # Prune united-atom hydrogens if the option is enabled
-            if z == "UA":
-                del_ind=[ count_i for count_i,i in enumerate(adj_mat) if elements[count_i] == "H" and len([ j for count_j,j in enumerate(adj_mat[count_i]) if j == 1 and elements[count_j] == "C" and np.sum(adj_mat[count_j]) == 4 ]) > 0 ]
-                keep_ind = [ i for i in range(len(adj_mat)) if i not in del_ind ]
-                #keep_ind = [ count_i for count_i,i in enumerate(adj_mat) if elements[count_i] != "H" or "C" not in [ elements[count_j] for count_j,j in enumerate(i) if j == 1 ] ]
-                geo = geo[keep_ind]
-                elements = [ elements[i] for i in keep_ind ]
-                adj_mat = adj_mat[keep_ind,:][:,keep_ind]
-                atomtypes = [ atomtypes[i]+'-UA' for i in keep_ind ]
-
-            # Calculate the inverse displacements of each grid point from the charge centers being fit. 
-            seps = 1.0/cdist(grid,geo)
-
-            # Calculate lstsq fit with qtot charge constraint as a reference
-            lstsq_charges = lstsq_potfit(geo,grid,qtot,seps,potential)
-
-            # Initialize initial guess (charges) and a list of holding the index in charges that each atomic charges corresponds to
-            # In the case of no symmetry constraints, charge_mapping simply maps one-to-one to the charges list. When there are symmetry 
-            # constraints the charge_mapping elements of like atomtypes will commonly reference some common index in charges array. 
-            # NOTE: initial guess is made to satisfy q_tot but distributing the necessary amount to the atoms being fit
-            # NOTE: fix_ind and the initial guess are populated with charges from the supplied FF files  
-            charge_mapping = list(range(len(geo)))
-            fix_ind        = [ count_i for count_i,i in enumerate(atomtypes) if i in list(fixed_dict.keys()) ]
-            fit_ind        = [ count_i for count_i,i in enumerate(atomtypes) if i not in list(fixed_dict.keys()) ]
-            charges_0      = np.array([ 0.0 if count_i in fit_ind else fixed_dict[atomtypes[count_i]] for count_i,i in enumerate(atomtypes) ])
-            if len(fit_ind) == 0:
-                offset = 0.0
-            else:
-                offset         = (qtot-np.sum(charges_0))/float(len(fit_ind))
-            for i in fit_ind: charges_0[i] = offset
-
-            ###################
-            # Fit the charges #
-            ###################
-
-            # two-step algorithm: first fits the polar atoms with symmetry constraints, then holds the polar atoms fixed and fits the non-polar atoms with symmetry constraints.
-            if two_step == True:
-
-                # Find non-carbon atoms and hydrogens that aren't attached to carbon
-                polar_ind = [ count_i for count_i,i in enumerate(adj_mat) \
-                              if ( elements[count_i] != 'C' and elements[count_i] != "H" ) or ( elements[count_i] == "H" and np.sum([ 1 for count_j,j in enumerate(adj_mat[count_i]) if ( j == 1 and elements[count_j] == "C" ) ]) == 0 ) ]
-
-                # Find non-carbon atoms and hydrogens that aren't attached to carbon
-                nonpolar_ind = [ i for i in range(len(geo)) if i not in polar_ind ]
-
-                # Remove fixed atoms from fit consideration
-                polar_ind    = [ i for i in polar_ind if i not in fix_ind ]
-                nonpolar_ind = [ i for i in nonpolar_ind if i not in fix_ind ]
-
-                # During the first step (i) no charges are fixed and (ii) symmetry is only forced on the polar atoms.
-                # The polar atomtypes are looped over (outer loop), the indices of all like atomtypes are found (idx), all charge_mapping elements at indices idx are set to point at the first instance of that atom type.
-                charge_mapping = list(range(len(geo)))
-                for i in set([ atomtypes[j] for j in polar_ind ]):
-                    idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
-                    for j in idx: charge_mapping[j] = idx[0]
-
-                # Fit the polar atoms                    imposes_symmetry fits_only_polar
-                fit_charges = flex_fit(geo,potential,seps,charge_mapping,fit_ind,\
-                                       qtot,dipole_0,quadrupole_0,cm,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,charges_0=charges_0,traceless_opt=False)
-
-                # During the second step (i) the charges on the polar_ind atoms are fixed and (ii) symmetry is forced on the non_polar atoms.
-                for i in set([ atomtypes[j] for j in nonpolar_ind ]):
-                    idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
-                    for j in idx: charge_mapping[j] = idx[0]
-
-                # Check to ensure that there is something to fit in this second step
-                if len(nonpolar_ind) > 0:
-
-                    # Fit the non-polar atoms                imposes_symmetry fits_only_nonpolar
-                    fit_charges = flex_fit(geo,potential,seps,charge_mapping,nonpolar_ind,\
-                                           qtot,dipole_0,quadrupole_0,cm,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,charges_0=fit_charges,traceless_opt=False)
-
-            # symmetrize algorithm: fits all atoms at once with symmetry constraints.
-            elif symmetrize == True:
-
-                # The atomtypes are looped over (outer loop), the indices of all like atomtypes are found (idx), all charge_mapping elements at indices idx are set to point at the first instance of that atom type.
-                for i in set(atomtypes):
-                    idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
-                    for j in idx: charge_mapping[j] = idx[0]
-
-                # Fit the charges                        imposes_symmetry  fits_all_atoms
-                fit_charges = flex_fit(geo,potential,seps,charge_mapping,fit_ind,\
-                                       qtot,dipole_0,quadrupole_0,cm,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,charges_0=charges_0,traceless_opt=False)
-
-            # default: perform the fit to all atoms at once without symmetry constraints
-            else:
-
-                # Fit the charges
-                fit_charges = flex_fit(geo,potential,seps,list(range(len(geo))),fit_ind,\
-                                       qtot,dipole_0,quadrupole_0,cm,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,charges_0=charges_0,traceless_opt=False)
+            # Fit results of the configuration
+            fit = fits[(z,count_f)]
+            elements,geo,adj_mat,atomtypes = fit["elements"],fit["geo"],fit["adj_mat"],fit["atomtypes"]
+            lstsq_charges,fit_charges = fit["lstsq_charges"],fit["fit_charges"]
+            dipole_0 = moments[(z,count_f)][0]
 
             # Update the charges in the dictionary
             for i in set(atomtypes):
@@ -859,8 +635,8 @@ def fit_charges(filename,xyz_file=None,path=None,out_file=None,qtot=0.0,gens=2,w
                         fit_dict[i] += [fit_charges[count_j]]
 
             # Update error dictionaries
-            lstsq_errs += [np.mean((Calc_Pot(seps,lstsq_charges)-potential)**(2.0))]
-            fit_errs += [np.mean((Calc_Pot(seps,fit_charges)-potential)**(2.0))]
+            lstsq_errs += [fit["lstsq_err"]]
+            fit_errs += [fit["fit_err"]]
             if dipole_0 is not None:
                 lstsq_D_errs += [ (norm(dipole_0) - calc_dipole(geo,lstsq_charges)[1])**(2.0) ]
                 fit_D_errs += [ (norm(dipole_0) - calc_dipole(geo,fit_charges)[1])**(2.0) ]
@@ -899,12 +675,210 @@ def fit_charges(filename,xyz_file=None,path=None,out_file=None,qtot=0.0,gens=2,w
                     print(("\t{}".format(i)))
                 print(" ")
 
-    charges = { i:(np.mean(fit_dict[i]),np.std(fit_dict[i])) for i in fit_dict }
     errs    = { "xhi_pot":np.mean(fit_errs) }
     if len(fit_D_errs) > 0:
         errs["xhi_D"] = np.mean(fit_D_errs)
 
-    return charges, errs
+    # Wall time and memory. ru_maxrss (kB on linux) is the peak of the whole process, which only grows between calls, so the
+    # increase of the peak over the fit is reported with it (zero when the fit stayed below an earlier peak).
+    errs["wall_time"]         = time.time() - start_time
+    errs["peak_memory"]       = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    errs["peak_memory_delta"] = errs["peak_memory"] - peak_0
+    if verbose is True:
+        print(("  {:<60s} {:<35s} {:<35s} \n".format("fit performance ({} configurations, batch = {}):".format(len(potfiles),batch),\
+                                                     "wall time: {:<.3f} s".format(errs["wall_time"]),\
+                                                     "process peak memory: {:<.1f} MB (+{:<.1f} MB)".format(errs["peak_memory"],errs["peak_memory_delta"]))))
+
+    return lstsq_dict,fit_dict,errs,(elements,geo,atomtypes)
+
+
+
+# Description: Fits the charges of one configuration (config is a parse_config result) for the AA or UA model (z) with the
+#              protocol selected by symmetrize/two_step. moments holds the dipole/quadrupole targets and weights of the fit.
+#              Returns a dictionary with the fit model (elements, geo, adj_mat and atomtypes, UA hydrogens pruned for the UA
+#              model), the reference lstsq and fit charges, and the mean squared potential errors of both.
+def fit_config(config,z,moments,fixed_dict,qtot,w_pot,w_qtot,w_hyper,b_hyper,symmetrize,two_step):
+
+    elements,geo,grid,potential,adj_mat,atomtypes,cm = config[:7]
+    dipole_0,quadrupole_0,w_dipole,w_quadrupole = moments
+
+    # Prune united-atom hydrogens for the UA fit
+    if z == "UA":
+        elements,geo,adj_mat,atomtypes,keep_ind = UA_model(elements,geo,adj_mat,atomtypes)
+
+    # Calculate the inverse displacements of each grid point from the charge centers being fit. 
+    seps = 1.0/cdist(grid,geo)
+
+    # Calculate lstsq fit with qtot charge constraint as a reference
+    lstsq_charges = lstsq_potfit(geo,grid,qtot,seps,potential)
+
+    # Fit the charges
+    fit_charges,steps = charge_fit_steps(elements,adj_mat,atomtypes,fixed_dict,qtot,symmetrize,two_step)
+    for charge_mapping,fit_ind in steps:
+        fit_charges = flex_fit(geo,potential,seps,charge_mapping,fit_ind,\
+                               qtot,dipole_0,quadrupole_0,cm,w_pot,w_qtot,w_hyper,b_hyper,w_dipole,w_quadrupole,charges_0=fit_charges,traceless_opt=False)
+
+    return { "elements":elements, "geo":geo, "adj_mat":adj_mat, "atomtypes":atomtypes, "lstsq_charges":lstsq_charges, "fit_charges":fit_charges,\
+             "lstsq_err":np.mean((Calc_Pot(seps,lstsq_charges)-potential)**(2.0)), "fit_err":np.mean((Calc_Pot(seps,fit_charges)-potential)**(2.0)) }
+
+# Description: Batched fit_config over a set of configurations (parse_config results keyed by configuration index). The
+#              configurations are processed in chunks of batch configurations.
+#              The inverse separations and potential gram matrices (see potential_gram) of a chunk are assembled once and
+#              shared by the AA and UA fits, the UA model using the rows/columns of the retained atoms. The configurations of
+#              a chunk that share the same fit model (atomtypes and adjacency matrix) are fit together, one flex_fit_batch
+#              call per fitting step (the hyperbolic restraint, w_hyper != 0, falls back to flex_fit on the shared matrices).
+#              Only the matrices of one chunk are held in memory at a time. Returns the fit_config results keyed by
+#              (z,configuration index).
+def fit_configs_batched(configs,moments,fixed_dict,qtot,w_pot,w_qtot,w_hyper,b_hyper,symmetrize,two_step,batch):
+
+    batch = int(batch)
+    if batch < 1:
+        print("ERROR in fit_configs_batched: batch must be an integer greater than 0. Exiting...")
+        quit()
+
+    fits = {}
+    keys = list(configs)
+    for start in range(0,len(keys),batch):
+        chunk = keys[start:start+batch]
+
+        # Inverse separations and gram matrices of the all-atom model
+        seps  = { i:1.0/cdist(configs[i][2],configs[i][1]) for i in chunk }
+        grams = { i:potential_gram(seps[i],configs[i][3]) for i in chunk }
+
+        for z in [ 'AA', 'UA' ]:
+
+            # Group the configurations by fit model
+            models = {}
+            groups = {}
+            for i in chunk:
+                elements,geo,grid,potential,adj_mat,atomtypes = configs[i][:6]
+                keep_ind = list(range(len(geo)))
+                if z == "UA":
+                    elements,geo,adj_mat,atomtypes,keep_ind = UA_model(elements,geo,adj_mat,atomtypes)
+                models[i] = (elements,geo,adj_mat,atomtypes,keep_ind)
+                key = (tuple(atomtypes),adj_mat.tobytes())
+                if key not in groups:
+                    groups[key] = []
+                groups[key] += [i]
+
+            for key in groups:
+                idx = groups[key]
+                elements,geo,adj_mat,atomtypes,keep_ind = models[idx[0]]
+                z_seps = { i:seps[i] if z == "AA" else seps[i][:,keep_ind] for i in idx }
+
+                # Fit the charges
+                charges_0,steps = charge_fit_steps(elements,adj_mat,atomtypes,fixed_dict,qtot,symmetrize,two_step)
+                fit_charges = [ charges_0 for i in idx ]
+                for charge_mapping,fit_ind in steps:
+                    if w_hyper == 0.0:
+                        z_grams = [ grams[i] if z == "AA" else (grams[i][0][keep_ind,:][:,keep_ind],grams[i][1][keep_ind],grams[i][2]) for i in idx ]
+                        fit_charges = flex_fit_batch([ models[i][1] for i in idx ],z_grams,charge_mapping,fit_ind,qtot,\
+                                                     [ moments[(z,i)][0] for i in idx ],[ moments[(z,i)][1] for i in idx ],[ configs[i][6] for i in idx ],w_pot,w_qtot,\
+                                                     [ moments[(z,i)][2] for i in idx ],[ moments[(z,i)][3] for i in idx ],fit_charges,traceless_opt=False)
+                    else:
+                        fit_charges = [ flex_fit(models[i][1],configs[i][3],z_seps[i],charge_mapping,fit_ind,qtot,moments[(z,i)][0],moments[(z,i)][1],configs[i][6],\
+                                                 w_pot,w_qtot,w_hyper,b_hyper,moments[(z,i)][2],moments[(z,i)][3],charges_0=fit_charges[count_i],traceless_opt=False) for count_i,i in enumerate(idx) ]
+
+                # Reference lstsq fit and errors
+                for count_i,i in enumerate(idx):
+                    elements,geo,adj_mat,atomtypes,keep_ind = models[i]
+                    grid,potential = configs[i][2:4]
+                    lstsq_charges = lstsq_potfit(geo,grid,qtot,z_seps[i],potential)
+                    fits[(z,i)] = { "elements":elements, "geo":geo, "adj_mat":adj_mat, "atomtypes":atomtypes, "lstsq_charges":lstsq_charges, "fit_charges":fit_charges[count_i],\
+                                    "lstsq_err":np.mean((Calc_Pot(z_seps[i],lstsq_charges)-potential)**(2.0)), "fit_err":np.mean((Calc_Pot(z_seps[i],fit_charges[count_i])-potential)**(2.0)) }
+
+        # Release the matrices of the chunk
+        seps,grams = None,None
+
+    return fits
+
+# Description: Returns the united-atom model of a configuration: hydrogens bonded to sp3 carbons are removed and the atomtypes
+#              carry the -UA suffix. Returns elements, geo, adj_mat, atomtypes and the indices of the retained atoms.
+def UA_model(elements,geo,adj_mat,atomtypes):
+    del_ind=[ count_i for count_i,i in enumerate(adj_mat) if elements[count_i] == "H" and len([ j for count_j,j in enumerate(adj_mat[count_i]) if j == 1 and elements[count_j] == "C" and np.sum(adj_mat[count_j]) == 4 ]) > 0 ]
+    keep_ind = [ i for i in range(len(adj_mat)) if i not in del_ind ]
+    return [ elements[i] for i in keep_ind ],geo[keep_ind],adj_mat[keep_ind,:][:,keep_ind],[ atomtypes[i]+'-UA' for i in keep_ind ],keep_ind
+
+# Description: Returns the initial guess and the steps of the charge fitting protocol as a list of (charge_mapping,fit_indices)
+#              pairs that are fit in order, each step starting from the charges of the previous one. Atoms with atomtypes in
+#              fixed_dict are held at those charges and the initial guess distributes the remainder of qtot over the fit atoms.
+#
+#              default:    one step, all atoms fit without symmetry constraints
+#              symmetrize: one step, all atoms fit with symmetry forced on like atomtypes
+#              two_step:   the TAFFI two step protocol. The first step fits all atoms with symmetry forced on the polar atoms (atoms
+#                          that aren't carbon or hydrogens attached to carbon), the second holds the polar atoms fixed and fits the
+#                          non-polar atoms with symmetry constraints.
+def charge_fit_steps(elements,adj_mat,atomtypes,fixed_dict,qtot,symmetrize=False,two_step=False):
+
+    # Initialize initial guess (charges) and a list of holding the index in charges that each atomic charges corresponds to
+    # In the case of no symmetry constraints, charge_mapping simply maps one-to-one to the charges list. When there are symmetry 
+    # constraints the charge_mapping elements of like atomtypes will commonly reference some common index in charges array. 
+    # NOTE: initial guess is made to satisfy q_tot but distributing the necessary amount to the atoms being fit
+    # NOTE: fix_ind and the initial guess are populated with charges from the supplied FF files  
+    charge_mapping = list(range(len(atomtypes)))
+    fix_ind        = [ count_i for count_i,i in enumerate(atomtypes) if i in list(fixed_dict.keys()) ]
+    fit_ind        = [ count_i for count_i,i in enumerate(atomtypes) if i not in list(fixed_dict.keys()) ]
+    charges_0      = np.array([ 0.0 if count_i in fit_ind else fixed_dict[atomtypes[count_i]] for count_i,i in enumerate(atomtypes) ])
+    if len(fit_ind) == 0:
+        offset = 0.0
+    else:
+        offset         = (qtot-np.sum(charges_0))/float(len(fit_ind))
+    for i in fit_ind: charges_0[i] = offset
+
+    # two-step algorithm: first fits the polar atoms with symmetry constraints, then holds the polar atoms fixed and fits the non-polar atoms with symmetry constraints.
+    if two_step == True:
+
+        # Find non-carbon atoms and hydrogens that aren't attached to carbon
+        polar_ind = [ count_i for count_i,i in enumerate(adj_mat) \
+                      if ( elements[count_i] != 'C' and elements[count_i] != "H" ) or ( elements[count_i] == "H" and np.sum([ 1 for count_j,j in enumerate(adj_mat[count_i]) if ( j == 1 and elements[count_j] == "C" ) ]) == 0 ) ]
+        nonpolar_ind = [ i for i in range(len(atomtypes)) if i not in polar_ind ]
+
+        # Remove fixed atoms from fit consideration
+        polar_ind    = [ i for i in polar_ind if i not in fix_ind ]
+        nonpolar_ind = [ i for i in nonpolar_ind if i not in fix_ind ]
+
+        # During the first step (i) no charges are fixed and (ii) symmetry is only forced on the polar atoms.
+        for i in set([ atomtypes[j] for j in polar_ind ]):
+            idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
+            for j in idx: charge_mapping[j] = idx[0]
+        steps = [ (charge_mapping,fit_ind) ]
+
+        # During the second step (i) the charges on the polar_ind atoms are fixed and (ii) symmetry is forced on the non_polar atoms.
+        if len(nonpolar_ind) > 0:
+            charge_mapping = list(charge_mapping)
+            for i in set([ atomtypes[j] for j in nonpolar_ind ]):
+                idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
+                for j in idx: charge_mapping[j] = idx[0]
+            steps += [ (charge_mapping,nonpolar_ind) ]
+
+    # symmetrize algorithm: fits all atoms at once with symmetry constraints.
+    elif symmetrize == True:
+        for i in set(atomtypes):
+            idx = [ count_k for count_k,k in enumerate(atomtypes) if k == i ]
+            for j in idx: charge_mapping[j] = idx[0]
+        steps = [ (charge_mapping,fit_ind) ]
+
+    # default: perform the fit to all atoms at once without symmetry constraints
+    else:
+        steps = [ (charge_mapping,fit_ind) ]
+
+    return charges_0,steps
+
+# Description: Parses one configuration of the charge fit: the nuclei, grid and potential of the *.vpot file (geo and
+#              grid in bohr), the adjacency matrix, atomtypes, center of mass and the dipole/quadrupole moments of the
+#              output file (None if output_file is None or the moments are missing). Worker of the -procs parse.
+def parse_config(potfile,xyz_file,output_file,gens):
+
+    # NOTE: the units are converted back to angstroms for the adjacency matrix
+    elements,geo,grid,potential = parse_vpot(potfile,xyz_file)
+    adj_mat   = Table_generator(elements,geo*0.52917721067,File=xyz_file)
+    atomtypes = id_types(elements,adj_mat,gens) # id_types v.062520
+    cm        = calc_cm(elements,geo)
+    if output_file is not None:
+        dipole_0,quadrupole_0 = parse_orca_out(output_file)
+    else:
+        dipole_0,quadrupole_0 = None,None
+    return elements,geo,grid,potential,adj_mat,atomtypes,cm,dipole_0,quadrupole_0
 
 # Least-squares fit to the potential with a constraint on the total charge
 #
@@ -921,8 +895,11 @@ def fit_charges(filename,xyz_file=None,path=None,out_file=None,qtot=0.0,gens=2,w
 # w_quadrupole:  the weighting value in the cost function for deviations from the quadrupole moment.
 # charges_0:     the initial guess for the partial charge distribution
 # traceless_opt: when calculating the quadrupole, this flag controls whether the calculation produces a traceless quadrupole.
+# method:        "lstsq" solves the normal equations directly (the objective is quadratic in the charges when w_hyper is zero),
+#                "minimize" uses scipy's minimize on flex_fit_func. Defaults to "lstsq" when w_hyper is zero and "minimize" otherwise.
+# gram:          precomputed potential_gram(seps,potential) used by the lstsq method (optional)
 def flex_fit(geo,potential,seps,charge_mapping=None,fit_indices=None,\
-             qtot=0.0,dipole_0=None,quadrupole_0=None,r_0=None,w_pot=1.0,w_qtot=1.0,w_hyper=0.01,b_hyper=0.1,w_dipole=0.1,w_quadrupole=0.05,charges_0=None,traceless_opt=False):
+             qtot=0.0,dipole_0=None,quadrupole_0=None,r_0=None,w_pot=1.0,w_qtot=1.0,w_hyper=0.01,b_hyper=0.1,w_dipole=0.1,w_quadrupole=0.05,charges_0=None,traceless_opt=False,method=None,gram=None):
 
     # Initialize global objects utilized during the fit
     if charges_0 is None:
@@ -938,12 +915,121 @@ def flex_fit(geo,potential,seps,charge_mapping=None,fit_indices=None,\
     if len(fit_indices) == 0:
         return charges
 
-    # Create anonymous function for use in the fitting
-    fit_func = lambda x: flex_fit_func(*x,potential=potential,seps=seps,geo=geo,charges=charges,charge_mapping=charge_mapping,charge_indices=fit_indices,qtot=qtot,dipole_0=dipole_0,quadrupole_0=quadrupole_0,r_0=r_0,\
-                                          w_pot=w_pot,w_qtot=w_qtot,w_hyper=w_hyper,b_hyper=b_hyper,w_dipole=w_dipole,w_quadrupole=w_quadrupole,traceless_opt=traceless_opt)
+    if method is None:
+        method = "lstsq" if w_hyper == 0.0 else "minimize"
+    if method not in ["lstsq","minimize"]:
+        print("ERROR in flex_fit: method must be either lstsq or minimize. Exiting...")
+        quit()
+    if method == "lstsq" and w_hyper != 0.0:
+        print("ERROR in flex_fit: the lstsq method requires w_hyper = 0 (the hyperbolic restraint isn't quadratic in the charges). Exiting...")
+        quit()
 
     # Fit the charges
-    charges[fit_indices] = minimize(fit_func,charges[fit_indices],tol=1E-12).x
+    if method == "lstsq":
+        charges[fit_indices] = flex_fit_lstsq(geo,potential,seps,charges,charge_mapping,fit_indices,qtot,dipole_0,quadrupole_0,r_0,\
+                                              w_pot,w_qtot,w_dipole,w_quadrupole,traceless_opt,gram)
+    else:
+
+        # Create anonymous function for use in the fitting
+        fit_func = lambda x: flex_fit_func(*x,potential=potential,seps=seps,geo=geo,charges=charges,charge_mapping=charge_mapping,charge_indices=fit_indices,qtot=qtot,dipole_0=dipole_0,quadrupole_0=quadrupole_0,r_0=r_0,\
+                                              w_pot=w_pot,w_qtot=w_qtot,w_hyper=w_hyper,b_hyper=b_hyper,w_dipole=w_dipole,w_quadrupole=w_quadrupole,traceless_opt=traceless_opt)
+        charges[fit_indices] = minimize(fit_func,charges[fit_indices],tol=1E-12).x
+
+    # Apply charge_mapping and subtract off unwanted residual charge
+    return map_charges(charges,charge_mapping,fit_indices,qtot)
+
+# Direct solution of the flex_fit objective without the hyperbolic term. The charges are linear in the fit variables (x) through
+# the fit_indices/charge_mapping assignment (charges = A*x + b, where b holds the charges that are held fixed), and the potential,
+# dipole and quadrupole terms are linear in the charges, so the cost function is a linear least-squares problem in x. The normal
+# equations are built once and solved with a Lagrange multiplier that enforces the total charge exactly (the w_qtot penalty is
+# then zero at the solution). There is no limit on the number of fit variables. Returns the values of the fit variables (indexed
+# to fit_indices), the same as the minimize path in flex_fit.
+def flex_fit_lstsq(geo,potential,seps,charges,charge_mapping,fit_indices,qtot=0.0,dipole_0=None,quadrupole_0=None,r_0=None,\
+                   w_pot=1.0,w_qtot=1.0,w_dipole=0.1,w_quadrupole=0.05,traceless_opt=False,gram=None):
+
+    KKT,rhs = flex_fit_system(geo,potential,seps,charges,charge_mapping,fit_indices,qtot,dipole_0,quadrupole_0,r_0,\
+                              w_pot,w_qtot,w_dipole,w_quadrupole,traceless_opt,gram)
+    return solve_kkt(KKT[None,:,:],rhs[None,:])[0][:len(fit_indices)]
+
+# Returns the gram matrix of seps (seps^T*seps), its product with the potential and the number of grid points. These are the only
+# parts of the normal equations that scale with the grid, so they are computed once per configuration and shared between fits
+# (for the UA model the rows/columns of the retained atoms are used).
+def potential_gram(seps,potential):
+    return np.dot(seps.T,seps),np.dot(seps.T,potential),len(potential)
+
+# Returns the bordered normal equations (KKT matrix and right hand side) of flex_fit_lstsq
+def flex_fit_system(geo,potential,seps,charges,charge_mapping,fit_indices,qtot=0.0,dipole_0=None,quadrupole_0=None,r_0=None,\
+                    w_pot=1.0,w_qtot=1.0,w_dipole=0.1,w_quadrupole=0.05,traceless_opt=False,gram=None):
+
+    # Build A and b by carrying out the same assignment and mapping passes as flex_fit_func on labels (fit variable or fixed center)
+    labels = [ ("fixed",i) for i in range(len(charges)) ]
+    for count_i,i in enumerate(fit_indices):
+        labels[i] = ("fit",count_i)
+    for count_i,i in enumerate(charge_mapping):
+        labels[count_i] = labels[i]
+    A = np.zeros([len(charges),len(fit_indices)])
+    b = np.zeros(len(charges))
+    for count_i,i in enumerate(labels):
+        if i[0] == "fit":
+            A[count_i,i[1]] = 1.0
+        else:
+            b[count_i] = charges[i[1]]
+
+    # Quadratic (H) and linear (f) terms of the cost function in the charges. The means in flex_fit_func become the 1/n prefactors.
+    if gram is None:
+        gram = potential_gram(seps,potential)
+    H = w_pot/float(gram[2]) * gram[0] + w_qtot * np.ones([len(charges),len(charges)])
+    f = w_pot/float(gram[2]) * gram[1] + w_qtot * qtot * np.ones(len(charges))
+    if w_dipole != 0.0 or w_quadrupole != 0.0:
+        centered = geo - (r_0 if r_0 is not None else np.mean(geo,axis=0))
+    if w_dipole != 0.0:
+        H += w_dipole/3.0 * np.dot(centered,centered.T)
+        f += w_dipole/3.0 * np.dot(centered,np.array(dipole_0))
+    if w_quadrupole != 0.0:
+        Q = centered[:,:,None] * centered[:,None,:]
+        if traceless_opt == True:
+            Q = 3.0 * Q - np.eye(3)[None,:,:] * (norm(centered,axis=1)**(2.0))[:,None,None]
+        Q = Q.reshape(len(charges),9)
+        H += w_quadrupole/9.0 * np.dot(Q,Q.T)
+        f += w_quadrupole/9.0 * np.dot(Q,np.array(quadrupole_0).flatten())
+
+    # Normal equations in x bordered by the total charge constraint: sum(A*x + b) = qtot
+    a   = np.sum(A,axis=0)
+    N   = len(fit_indices)
+    KKT = np.zeros([N+1,N+1])
+    KKT[:N,:N] = np.dot(A.T,np.dot(H,A))
+    KKT[:N,N]  = a
+    KKT[N,:N]  = a
+    rhs = np.concatenate([np.dot(A.T,f-np.dot(H,b)),[qtot-np.sum(b)]])
+    return KKT,rhs
+
+# Solves a stack of KKT systems (M x (N+1) x (N+1) and M x (N+1) arrays). Fit variables that are overwritten by the mapping
+# (or a constraint that can't be met) make a system singular, in which case the minimum norm solution is used for it.
+def solve_kkt(KKT,rhs):
+    try:
+        return np.linalg.solve(KKT,rhs[:,:,None])[:,:,0]
+    except np.linalg.LinAlgError:
+        return np.array([ np.linalg.lstsq(KKT[i],rhs[i],rcond=None)[0] for i in range(len(KKT)) ])
+
+# Batched flex_fit (lstsq method) for several configurations that share the same charge_mapping and fit_indices (e.g., the
+# configurations of one molecule). The KKT systems of the configurations are the diagonal blocks of the system for the stacked
+# configurations and are solved together. The per-configuration arguments are lists (grams holds potential_gram of each
+# configuration). Returns a list with the charges of each configuration.
+def flex_fit_batch(geos,grams,charge_mapping,fit_indices,qtot,dipoles_0,quadrupoles_0,r_0s,w_pot,w_qtot,w_dipoles,w_quadrupoles,charges_0,traceless_opt=False):
+
+    charges = [ deepcopy(i) for i in charges_0 ]
+    if len(fit_indices) == 0:
+        return charges
+    systems = [ flex_fit_system(geos[i],None,None,charges[i],charge_mapping,fit_indices,qtot,dipoles_0[i],quadrupoles_0[i],r_0s[i],\
+                                w_pot,w_qtot,w_dipoles[i],w_quadrupoles[i],traceless_opt,grams[i]) for i in range(len(charges)) ]
+    x = solve_kkt(np.array([ i[0] for i in systems ]),np.array([ i[1] for i in systems ]))
+    for count_i,i in enumerate(charges):
+        i[fit_indices] = x[count_i][:len(fit_indices)]
+        map_charges(i,charge_mapping,fit_indices,qtot)
+    return charges
+
+# Applies charge_mapping to the fit charges and subtracts the residual total charge from the fit_indices (in place)
+def map_charges(charges,charge_mapping,fit_indices,qtot):
 
     # Generate final list of charges based on charge_mapping
     for count_i,i in enumerate(charge_mapping):
@@ -1131,88 +1217,9 @@ def Calc_Pot(seps,charges_0):
     return np.dot(seps,charges_0.T)
 
 # Read in the nuclear coordinates, electric  potential, and grid coordinates from the *.vpot file
+# The text is only parsed on the first read, later reads load the binary sidecar (see vpot_loader.load_vpot)
 def parse_vpot(filename,xyz_file=None):
-
-    # Toggle the xyz flag 
-    if xyz_file != None:
-        xyz_flag = 1
-    else:
-        xyz_flag = 0
-
-    # Loop over the lines in the file
-    with open(filename,'r') as f:
-        atom_count = 0
-        pot_count = 0
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-
-            # Initialize lists/arrays
-            if lc == 0: 
-                n_atom    = int(fields[0])
-                n_grid    = int(fields[1])
-                elements  = ["X"]*n_atom
-                geo       = np.zeros([n_atom,3])
-                grid      = np.zeros([n_grid,3])
-                potential = np.zeros([n_grid])
-                flag = 1
-                continue
-
-            # Parse the grid and potential
-            if flag == 2:
-                grid[pot_count] = np.array([ float(i) for i in fields[1:4] ])
-                potential[pot_count] = float(fields[0])
-                pot_count += 1
-                if pot_count == n_grid:
-                    break
-
-            # Parse the molecule
-            if flag == 1:
-                if len(fields) == 0: continue
-                # The parse is avoided if the xyz_flag is 1
-                if xyz_flag == 0:
-                    elements[atom_count] = fields[0]
-                    geo[atom_count]      = np.array([ float(i) for i in fields[1:4] ])
-                atom_count += 1
-                if atom_count == n_atom:
-                    flag = 2
-                    continue
-
-    # If an xyz file is supplied parse the nuclear centers under the assumption that the units are in angstroms
-    # Basic checks are in place for the proper number of atoms and a complete xyz file. 
-    if xyz_flag == 1:
-        atom_count = 0
-        with open(xyz_file,'r') as f:
-            for lc,lines in enumerate(f):
-
-                # Initialize elements and geometry lists/arrays
-                if lc == 0:
-                    fields = lines.split()
-                    N_elements = ["X"]*int(fields[0])
-                    N_geo      = np.zeros([int(fields[0]),3])
-                    continue
-
-                # Parse the nuclei
-                # With a conversion from angstroms to bohr
-                if lc > 1:
-                    fields = lines.split()
-                    if len(fields) == 0: 
-                        continue
-                    else:
-                        N_elements[atom_count] = fields[0]
-                        N_geo[atom_count] = np.array([ float(i)/0.52917721067 for i in fields[1:4] ])
-                        atom_count += 1
-
-        # Perform basic checks on the number of nuclei being parsed
-        if len(N_elements) != len(elements):
-            print("ERROR in parse_vpot: the number of atoms in the supplied xyz file does not match the number of atoms specified in the vpot file. Exiting...")
-            quit()
-        if atom_count != len(N_elements):
-            print("ERROR in parse_vpot: parsing of the xyz file terminated before finding all nuclear centers. Exiting...")
-            quit()
-        geo = N_geo
-        elements = N_elements
-
-    return elements,geo,grid,potential
+    return load_vpot(filename,xyz_file)
 
 def natural_sort(l): 
     convert = lambda text: int(text) if text.isdigit() else text.lower() 
@@ -1222,39 +1229,13 @@ def natural_sort(l):
 # A function for extracting the dipole and quadrupole from orca files. 
 def parse_orca_out(output_file):
 
-    # Initialize the dipole and quadrupole to None 
-    dipole_0 = None
-    quadrupole_0 = None
-    complete_flag = 0
-
-    # open file and parse dipole/quadrupole if available
-    with open(output_file,'r') as f:
-        quad_flag = 0
-        for lines in f:
-            fields = lines.split()
-            
-            # dipole parsing commands
-            if len(fields) == 7 and fields[0] == "Total" and fields[1] == "Dipole" and fields[2] == "Moment":
-                dipole_0 = np.array([ float(i) for i in fields[4:7] ])
-
-            # quadrupole parsing commands
-            if quad_flag == 6:
-                quadrupole_0      = np.zeros([3,3])
-                quadrupole_0[0,:] = [float(fields[1]),float(fields[4]),float(fields[5])]
-                quadrupole_0[1,:] = [float(fields[4]),float(fields[2]),float(fields[6])]
-                quadrupole_0[2,:] = [float(fields[5]),float(fields[6]),float(fields[3])]
-                quad_flag = 0
-            elif quad_flag > 0:
-                quad_flag += 1
-            elif len(fields) == 3 and fields[0] == "QUADRUPOLE" and fields[1] == "MOMENT" and fields[2] == "(A.U.)":
-                quad_flag = 1
-            
-            # check for job completion
-            if "****ORCA TERMINATED NORMALLY****" in lines:
-                complete_flag = 1
+    # Parse the last dipole and quadrupole if available (None otherwise)
+    data = parse_orca(output_file)
+    dipole_0 = np.array(data["dipole"][-1]) if len(data["dipole"]) > 0 else None
+    quadrupole_0 = np.array(data["quadrupole"][-1]) if len(data["quadrupole"]) > 0 else None
 
     # Print a warning if the output file is incomplete
-    if complete_flag == 0:
+    if data["terminated"] is False:
         print(("WARNING in parse_orca_out: The file {} is incomplete.".format(output_file)))
             
     return dipole_0,quadrupole_0
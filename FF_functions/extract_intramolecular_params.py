@@ -28,6 +28,8 @@ from adjacency import *
 from file_parsers import *
 from id_types import *
 from kekule import *
+from orca_parser import parse_orca,relaxed_scan,terminated
+from ingest_pool import pool_map
 import random
 
 def main(argv):
@@ -133,6 +135,9 @@ def main(argv):
     parser.add_argument('-batch', dest='batch', default="",
                         help = 'This variable can be used to only parse the modes corresponding to a given batch/gen number. By default all modes within the modes file are processed.')
 
+    parser.add_argument('-procs', dest='procs', default=1,
+                        help = 'Number of processes used to walk the run folders and check the scans for completeness (0 uses all cores). (default: 1)')
+
     parser.add_argument('--all_bonds_angles', dest='all_bonds_angles', default=0, action='store_const', const = 1,
                         help = 'This flag toggles iterative fitting of all bond and angle terms to acheive self-consistency. Generally improves results. After further testing will become default. (default: off)')
 
@@ -183,6 +188,7 @@ def main(argv):
     args.mixing_rule = str(args.mixing_rule).lower()
     args.gens = int(args.gens)
     args.batch = [ int(_) for _ in args.batch.split() ]
+    args.procs = int(args.procs)
     working_dir = os.getcwd()
     Htokcalmol = 627.509
     Ecoul_Const = 332.0702108431797 # Converts elementary_charge^2/ang to kcal/mol 
@@ -262,7 +268,7 @@ def main(argv):
     dihedral_types,dihedral_folders,dihedral_atomtypes,\
     harm_dihedral_types,harm_dihedral_folders,harm_dihedral_atomtypes,\
     bond_folders_frag,angle_folders_frag,dihedral_folders_frag,harm_dihedral_folders_frag = \
-        parse_run_dirs(args.folders,parse_modes=args.parse_modes,modes_from_FF=modes_from_FF,xyz_fit=args.xyz_fit,undefined_modes=undefined_modes,gens=args.gens,batch=args.batch)
+        parse_run_dirs(args.folders,parse_modes=args.parse_modes,modes_from_FF=modes_from_FF,xyz_fit=args.xyz_fit,undefined_modes=undefined_modes,gens=args.gens,batch=args.batch,procs=args.procs)
 
     # Avoid overwriting data and create necessary output folders
     os.chdir(working_dir)
@@ -489,15 +495,14 @@ def main(argv):
 
 # This function collects the modes being parsed, the location of the relvant scan data for each mode, and the relvant atom labeling for each scan geometry.
 # The function also performs some basic checks to ensure that everything is in place for the parse. 
-def parse_run_dirs(folders=None,parse_modes=[],FF_dict=[],modes_from_FF=[],xyz_fit=[],undefined_modes=[],gens=2,batch=[]):    
+def parse_run_dirs(folders=None,parse_modes=[],FF_dict=[],modes_from_FF=[],xyz_fit=[],undefined_modes=[],gens=2,batch=[],procs=1):    
 
     # save current dir
     current_dir = os.getcwd()        
 
-    # Grab the mode files from the directories
-    mode_files = []
-    for i in folders:
-        mode_files += [ "{}/{}/{}".format(current_dir,dp,f0) for dp,d,f in os.walk(i) for f0 in f if fnmatch.fnmatch(f0,"*.modes") ]
+    # Grab the mode files and geoopt folders from the directories (one walk per folder, distributed over procs processes)
+    walks = pool_map(walk_run_dir,[ (i,current_dir) for i in folders ],procs=procs)
+    mode_files = [ j for i in walks for j in i[0] ]
 
     # Print warning if the number of mode files is less than the number of folders
     if len(mode_files) < len(folders):
@@ -537,10 +542,8 @@ def parse_run_dirs(folders=None,parse_modes=[],FF_dict=[],modes_from_FF=[],xyz_f
         geo_folders = natural_sort(set([ '/'.join(i.split('/')[:-3])+'/geoopt' for i in summed_folders ]))
 
 
-        # Grab the mode files from the directories
-        geo_folders = []
-        for i in folders:            
-            geo_folders += [ "{}/{}/{}".format(current_dir,dp,d0) for dp,d,f in os.walk(i) for d0 in d if fnmatch.fnmatch(d0,"geoopt_{}".format(i)) ]
+        # Grab the geoopt folders from the directories
+        geo_folders = [ j for i in walks for j in i[1] ]
 
         # Grab geo_atomtypes (in the *master.xyz file)
         geo_atomtypes = [ get_scan_atomtypes("{}/{}.xyz".format(i,i)) for i in folders ]
@@ -630,31 +633,21 @@ def parse_run_dirs(folders=None,parse_modes=[],FF_dict=[],modes_from_FF=[],xyz_f
         # Change to work directory
         os.chdir(current_dir)
 
-        # Loop over the supplied xyz_fit molecules and parse the modes
+        # Find the number of gens based on the atomtypes being parsed. A generation test is run on a set of all atomtypes involved
+        # in the mode scans that were discovered (probably not optimal but it is safe and doesn't cost much)
+        unique_types = set([ k for j in (bond_types+angle_types+dihedral_types+harm_dihedral_types) for k in j ])
+        gens = 0
+        for j in unique_types:
+            tmp_gen = [ count_k for count_k,k in enumerate(j.split("[")) if "]" in k ]
+            if tmp_gen[0] > gens:
+                gens = tmp_gen[0]
+        gens = gens - 1
+
+        # Parse the modes in the supplied xyz_fit molecules (distributed over procs processes)
         fit_bondtypes = []
         fit_angletypes = []
         fit_dihedraltypes = []    
-        for count_i,i in enumerate(xyz_fit):
-
-            # On the first iteration, find the number of gens based on the atomtypes being parsed
-            if count_i == 0:
-
-                # Run a generation test on a set of all atomtypes involved in the mode scans that were discovered (probably not optimal but it is safe and doesn't cost much)
-                unique_types = set([ k for j in (bond_types+angle_types+dihedral_types+harm_dihedral_types) for k in j ])
-                gens = 0
-                for j in unique_types:
-                    tmp_gen = [ count_k for count_k,k in enumerate(j.split("[")) if "]" in k ]
-                    if tmp_gen[0] > gens:
-                        gens = tmp_gen[0]
-                gens = gens - 1
-
-            # Parse the modes in the current xyz_fit file
-            fit_elements,fit_geo  = xyz_parse(i)
-            fit_adj_mat  = Table_generator(fit_elements,fit_geo,File=i)
-            fit_atomtypes = id_types(fit_elements,fit_adj_mat,gens=gens,geo=fit_geo)
-
-            # Find the mode types in this fragment and update the fit lists
-            tmp_Bonds,tmp_Angles,tmp_Dihedrals,tmp_One_fives,tmp_Bond_types,tmp_Angle_types,tmp_Dihedral_types,tmp_One_five_types = Find_modes(fit_adj_mat,fit_atomtypes,return_all=1)
+        for tmp_Bond_types,tmp_Angle_types,tmp_Dihedral_types in pool_map(xyz_fit_modes,[ (i,gens) for i in xyz_fit ],procs=procs):
             fit_bondtypes     += tmp_Bond_types
             fit_angletypes    += tmp_Angle_types
             fit_dihedraltypes += tmp_Dihedral_types            
@@ -775,12 +768,14 @@ def parse_run_dirs(folders=None,parse_modes=[],FF_dict=[],modes_from_FF=[],xyz_f
         print("")
         quit()
 
-    # Check that all *_folders contain complete run data
-    incomplete  = [ i for i in geo_folders if i not in missing and check_scan_completeness(i) == False ]
-    if "bonds" in parse_modes: incomplete += [ i for i in bond_folders if i not in missing and check_scan_completeness(i) == False ]
-    if "angles" in parse_modes: incomplete += [ i for i in angle_folders if i not in missing and check_scan_completeness(i) == False ]
-    if "harm_dihedrals" in parse_modes: incomplete += [ i for i in harm_dihedral_folders if i not in missing and check_scan_completeness(i) == False ]
-    if "dihedrals" in parse_modes: incomplete += [ i for i in dihedral_folders if i not in missing and check_scan_completeness(i) == False ]
+    # Check that all *_folders contain complete run data (the checks are distributed over procs processes)
+    checked  = [ i for i in geo_folders if i not in missing ]
+    if "bonds" in parse_modes: checked += [ i for i in bond_folders if i not in missing ]
+    if "angles" in parse_modes: checked += [ i for i in angle_folders if i not in missing ]
+    if "harm_dihedrals" in parse_modes: checked += [ i for i in harm_dihedral_folders if i not in missing ]
+    if "dihedrals" in parse_modes: checked += [ i for i in dihedral_folders if i not in missing ]
+    complete   = pool_map(check_scan_completeness,[ (i,) for i in checked ],procs=procs)
+    incomplete = [ i for count_i,i in enumerate(checked) if complete[count_i] == False ]
     if len(incomplete) > 0:
         print("\nERROR in parse_run_dirs: The following scan folders are incomplete. Exiting...\n")
         for i in incomplete:
@@ -803,6 +798,27 @@ def parse_run_dirs(folders=None,parse_modes=[],FF_dict=[],modes_from_FF=[],xyz_f
     #        dihedral_types,dihedral_folders,dihedral_atomtypes,\
     #        harm_dihedral_types,harm_dihedral_folders,harm_dihedral_atomtypes
 
+# Description: Helper function for parse_run_dirs that walks a run folder and returns the *.modes files and 
+#              geoopt_<folder> directories that it contains (paths are prefixed by current_dir). Worker of the -procs parse.
+def walk_run_dir(folder,current_dir):
+
+    mode_files  = []
+    geo_folders = []
+    for dp,d,f in os.walk(folder):
+        mode_files  += [ "{}/{}/{}".format(current_dir,dp,f0) for f0 in f if fnmatch.fnmatch(f0,"*.modes") ]
+        geo_folders += [ "{}/{}/{}".format(current_dir,dp,d0) for d0 in d if fnmatch.fnmatch(d0,"geoopt_{}".format(folder)) ]
+    return mode_files,geo_folders
+
+# Description: Helper function for parse_run_dirs that returns the bond, angle and dihedral types of an xyz_fit
+#              molecule. Worker of the -procs parse.
+def xyz_fit_modes(xyz_file,gens):
+
+    fit_elements,fit_geo  = xyz_parse(xyz_file)
+    fit_adj_mat  = Table_generator(fit_elements,fit_geo,File=xyz_file)
+    fit_atomtypes = id_types(fit_elements,fit_adj_mat,gens=gens,geo=fit_geo)
+    Bonds,Angles,Dihedrals,One_fives,Bond_types,Angle_types,Dihedral_types,One_five_types = Find_modes(fit_adj_mat,fit_atomtypes,return_all=1)
+    return Bond_types,Angle_types,Dihedral_types
+
 # Description: Helper function for parse_run_dirs that returns the mode folders only
 #              associated with the specified batch.
 #
@@ -2341,68 +2357,18 @@ def get_bond_angle_data(xyz_name):
         # Find the output file for this scan
         output_file = [ os.path.join(dp,f) for dp, dn, filenames in os.walk('.') for f in filenames if fnmatch.fnmatch(f,"*.out") ][0]
 
-        # Find the mode being scanned and the number of atoms in the geometry
-        con_flag = 0
-        geo_flag = 0
-        N_atoms  = 0
-        N_jobs   = 1
-        with open(output_file,'r') as f:
-            for lines in f:
-                if "%geom scan" in lines.lower(): con_flag = 1;continue
-                if con_flag == 1: bond_atoms = [ int(i) for i in lines.split("=")[0].split(">")[1].split()[1:] ]; con_flag = 0
-                if "CARTESIAN COORDINATES (ANGSTROEM)" in lines: geo_flag = 1; continue
-                if geo_flag == 1:
-                    fields = lines.split()
-                    if len(fields) == 1: continue
-                    if len(fields) == 0: break
-                    N_atoms += 1
-                if "JOBS TO BE PROCESSED THIS RUN" in lines: N_jobs = int(lines.split()[3])
-
-        # If there are multiple jobs, then that means a preliminary relaxation and/or mode scan is performed prior to the run data
-        # so the first job is skipped
-        if N_jobs == 1:
-            parse_job = 1
-        else: 
-            parse_job = 0
-
-        # Find the optimized geometries and single point energies
-        parse_flag      = -1
-        job_count       = 0
-        geo_flag        = 0
-        completion_flag = 0
-        atom_count      = 0
-        Geo_dict        = {}        
-        with open(output_file,'r') as f:
-            for lines in f:
-
-                # Only the last job is parsed, the parse_job flag and job_count flags control appropriate parsing
-                if parse_job == 1:
-                    if "RELAXED SURFACE SCAN STEP" in lines: 
-                        parse_flag += 1
-                        Geo_dict[str(parse_flag)] = {}
-                        Geo_dict[str(parse_flag)]["geo"] = np.zeros([N_atoms,3])
-                        Geo_dict[str(parse_flag)]["elements"] = ["X"]*N_atoms
-                    if "CARTESIAN COORDINATES (ANGSTROEM)" in lines: geo_flag = 1; continue
-                    if geo_flag == 1:
-                        fields = lines.split()
-                        if len(fields) == 1: continue
-                        Geo_dict[str(parse_flag)]["geo"][atom_count,:] = np.array([float(fields[1]),float(fields[2]),float(fields[3])])
-                        Geo_dict[str(parse_flag)]["elements"][atom_count] = fields[0]
-                        atom_count += 1
-                        if atom_count == N_atoms: 
-                            atom_count = 0 
-                            geo_flag = 0
-
-                    if "FINAL SINGLE POINT ENERGY" in lines: Geo_dict[str(parse_flag)]["DFT"] = float(lines.split()[4])*Htokcalmol
-                    if "MP2 TOTAL ENERGY" in lines: Geo_dict[str(parse_flag)]["MP2"] = float(lines.split()[3])*Htokcalmol
-
-                    if "****ORCA TERMINATED NORMALLY****" in lines: completion_flag = 1
-
-                # Only parse the last job
-                elif "JOB NUMBER" in lines: 
-                    job_count += 1
-                    if job_count == 2:
-                        parse_job = 1
+        # Parse the output in a single pass. The mode being scanned is read from the echoed %geom scan block. If there
+        # are multiple jobs, then that means a preliminary relaxation and/or mode scan is performed prior to the run data
+        # so only the steps from the second job onward are kept (see orca_parser.relaxed_scan).
+        data            = parse_orca(output_file)
+        bond_atoms      = data["scan_atoms"]
+        completion_flag = int(data["terminated"])
+        Geo_dict        = {}
+        for count_i,i in enumerate(relaxed_scan(data)):
+            Geo_dict[str(count_i)] = i
+            for j in ["DFT","MP2"]:
+                if j in i:
+                    Geo_dict[str(count_i)][j] = i[j]*Htokcalmol
 
         # Proceed to catenation of the optimized geometries if all are completed. While the catenated xyz file is
         # produced, all geometries are also saved to a dictionary called Geo_dict, keyed to their number in the sequence.
@@ -2484,11 +2450,7 @@ def get_bond_angle_data(xyz_name):
         sort_nicely(outputs)
 
         # Check for the completion of all output files
-        flag = [0]*len(outputs)
-        for count_o,o in enumerate(outputs):
-            with open(o,'r') as f:
-                for lines in f: 
-                    if "****ORCA TERMINATED NORMALLY****" in lines: flag[count_o] = 1
+        flag = [ int(terminated(o)) for o in outputs ]
         if 0 in flag: completion_flag = 0
         else: completion_flag = 1
 
@@ -3321,8 +3283,10 @@ def parse_bonds_sc(folders,bond_types,bond_folders,bond_folders_frag,bond_atomty
                             initial_guess += [5.0,0.0]
 
                 # Perform a fit of only the scanned mode while keeping all others constant (mutually adjusts the force constant and equilibrium position)
-                fit_func = lambda x: fit_bonds_angles_sc_single(x,*initial_guess[3:],modes=modes,fit_modes=mode_types,E_0=DFT_E)            
-                params = minimize(fit_func,initial_guess[:3],method='L-BFGS-B',bounds=[(None,None),bounds[1],bounds[2]],options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
+                # The objective functions return their analytic gradients (see sc_fit_objective)
+                sc_setup = sc_fit_setup(modes,fit_modes=mode_types)
+                fit_func = lambda x: sc_fit_objective(x,sc_setup,DFT_E,fixed=initial_guess[3:])
+                params = minimize(fit_func,initial_guess[:3],jac=True,method='L-BFGS-B',bounds=[(None,None),bounds[1],bounds[2]],options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
                 initial_guess[:3] = params
 
                 # Perform a 2-D optimization to find the best force constant for this mode while holding the other parameters constant
@@ -3330,14 +3294,14 @@ def parse_bonds_sc(folders,bond_types,bond_folders,bond_folders_frag,bond_atomty
                     xhi2_min = None
                     for i in np.arange(initial_guess[1]*min_scale,initial_guess[1]+1.0):
                         initial_guess[1] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
                     xhi2_min = None
                     for i in np.linspace(best_guess-1.0,best_guess+1.0,10):
                         initial_guess[1] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
@@ -3345,14 +3309,14 @@ def parse_bonds_sc(folders,bond_types,bond_folders,bond_folders_frag,bond_atomty
                     xhi2_min = None
                     for i in np.arange(initial_guess[2]-0.01,initial_guess[2]+0.01,0.001):
                         initial_guess[2] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
                     xhi2_min = None
                     for i in np.linspace(best_guess-0.001,best_guess+0.001,300):
                         initial_guess[2] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
@@ -3368,20 +3332,21 @@ def parse_bonds_sc(folders,bond_types,bond_folders,bond_folders_frag,bond_atomty
                     if 'dft' in qc_types:
 
                         # Perform the fit for the current initial guess
-                        fit_func = lambda x: fit_bonds_angles_sc_2(*x,modes=modes,fit_modes=mode_types,E_0=DFT_E)
-                        params = minimize(fit_func,initial_guess,method='L-BFGS-B',bounds=bounds,options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
-                        xhi2_current = fit_bonds_angles_sc_2(*params,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        fit_func = lambda x: sc_fit_objective(x,sc_setup,DFT_E)
+                        params = minimize(fit_func,initial_guess,jac=True,method='L-BFGS-B',bounds=bounds,options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
+                        xhi2_current = sc_fit_objective(params,sc_setup,DFT_E,jac=False)
 
                         # Update the fit parameters if a lower energy was obtained
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             DFT_params = deepcopy(params[1:3])                        
                             params[1] = 0.0
-                            E_corr = fit_bonds_angles_sc_2(*params,modes=modes,fit_modes=mode_types,penalty=False,E_0=DFT_E)
+                            E_corr = sc_fit_objective(params,sc_setup,DFT_E,penalty=False)
                             xhi2_min = xhi2_current
 
                     if 'mp2' in qc_types:
-                        fit_func = lambda x: fit_bonds_angles_sc(*x,modes=modes,E_0=MP2_E)
-                        params = minimize(fit_func,initial_guess,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
+                        mp2_setup = sc_fit_setup(modes)
+                        fit_func = lambda x: sc_fit_objective(x,mp2_setup,MP2_E)
+                        params = minimize(fit_func,initial_guess,jac=True,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
 
                 # Fall back on the least-squares guess if the fit was bad
                 if xhi2_min > 1E-7:
@@ -4040,8 +4005,10 @@ def parse_angles_sc(folders,angle_types,angle_folders,angle_folders_frag,angle_a
                     #         initial_guess += [5.0,0.0]
 
                 # Perform a fit of only the scanned mode while keeping all others constant 
-                fit_func = lambda x: fit_bonds_angles_sc_single(x,*initial_guess[3:],modes=modes,fit_modes=mode_types,E_0=DFT_E)
-                params = minimize(fit_func,initial_guess[:3],method='L-BFGS-B',bounds=[(None,None),bounds[1],bounds[2]],options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
+                # The objective functions return their analytic gradients (see sc_fit_objective)
+                sc_setup = sc_fit_setup(modes,fit_modes=mode_types)
+                fit_func = lambda x: sc_fit_objective(x,sc_setup,DFT_E,fixed=initial_guess[3:])
+                params = minimize(fit_func,initial_guess[:3],jac=True,method='L-BFGS-B',bounds=[(None,None),bounds[1],bounds[2]],options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
                 initial_guess[:3] = params
 
                 # Perform a 1-D optimization to find the best force constant for this mode while holding the other parameters constant
@@ -4049,14 +4016,14 @@ def parse_angles_sc(folders,angle_types,angle_folders,angle_folders_frag,angle_a
                     xhi2_min = None
                     for i in np.arange(initial_guess[1]*min_scale,initial_guess[1]+1.0):
                         initial_guess[1] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
                     xhi2_min = None
                     for i in np.linspace(best_guess-1.0,best_guess+1.0,300):
                         initial_guess[1] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
@@ -4064,14 +4031,14 @@ def parse_angles_sc(folders,angle_types,angle_folders,angle_folders_frag,angle_a
                     xhi2_min = None
                     for i in np.arange(initial_guess[2]-1.0*np.pi/180.0,initial_guess[2]+1.0*np.pi/180.0,0.01*np.pi/180.0):
                         initial_guess[2] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
                     xhi2_min = None
                     for i in np.linspace(best_guess-0.01*np.pi/180.0,best_guess+0.01*np.pi/180.0,300):
                         initial_guess[2] = i
-                        xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             best_guess = i
                             xhi2_min = xhi2_current
@@ -4087,20 +4054,21 @@ def parse_angles_sc(folders,angle_types,angle_folders,angle_folders_frag,angle_a
                     if 'dft' in qc_types:
 
                         # Perform the fit for the current initial guess
-                        fit_func = lambda x: fit_bonds_angles_sc_2(*x,modes=modes,fit_modes=mode_types,E_0=DFT_E)
-                        params = minimize(fit_func,initial_guess,method='L-BFGS-B',bounds=bounds,options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
-                        xhi2_current = fit_bonds_angles_sc_2(*params,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                        fit_func = lambda x: sc_fit_objective(x,sc_setup,DFT_E)
+                        params = minimize(fit_func,initial_guess,jac=True,method='L-BFGS-B',bounds=bounds,options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
+                        xhi2_current = sc_fit_objective(params,sc_setup,DFT_E,jac=False)
 
                         # Update the fit parameters if a lower energy was obtained
                         if xhi2_min is None or xhi2_current < xhi2_min:
                             DFT_params = deepcopy(params[1:3])                        
                             params[1] = 0.0
-                            E_corr = fit_bonds_angles_sc_2(*params,modes=modes,fit_modes=mode_types,penalty=False,E_0=DFT_E)
+                            E_corr = sc_fit_objective(params,sc_setup,DFT_E,penalty=False)
                             xhi2_min = xhi2_current
 
                     if 'mp2' in qc_types:
-                        fit_func = lambda x: fit_bonds_angles_sc(*x,modes=modes,E_0=MP2_E)
-                        params = minimize(fit_func,initial_guess,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
+                        mp2_setup = sc_fit_setup(modes)
+                        fit_func = lambda x: sc_fit_objective(x,mp2_setup,MP2_E)
+                        params = minimize(fit_func,initial_guess,jac=True,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
 
                 # Fall back on the least-squares guess if the fit was bad
                 if xhi2_min > 1E-7:
@@ -4810,17 +4778,18 @@ def parse_harmonic_dihedrals_sc(folders,list_of_dihedral_types,dihedral_folders,
                         initial_guess += [5.0,0.0]
 
             # Perform a 1-D optimization to find the best force constant for this mode while holding the other parameters constant
+            sc_setup = sc_fit_setup(modes,fit_modes=mode_types)
             xhi2_min = None
             for i in np.arange(lstsq_guess[0]*min_scale,lstsq_guess[0]+1.0):
                 initial_guess[1] = i
-                xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                 if xhi2_min is None or xhi2_current < xhi2_min:
                     best_guess = i
                     xhi2_min = xhi2_current
             xhi2_min = None
             for i in np.linspace(best_guess-1.0,best_guess+1.0,300):
                 initial_guess[1] = i
-                xhi2_current = fit_bonds_angles_sc_2(*initial_guess,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                xhi2_current = sc_fit_objective(initial_guess,sc_setup,DFT_E,jac=False)
                 if xhi2_min is None or xhi2_current < xhi2_min:
                     best_guess = i
                     xhi2_min = xhi2_current
@@ -4835,20 +4804,21 @@ def parse_harmonic_dihedrals_sc(folders,list_of_dihedral_types,dihedral_folders,
                 if 'dft' in qc_types:
 
                     # Perform the fit for the current initial guess
-                    fit_func = lambda x: fit_bonds_angles_sc_2(*x,modes=modes,fit_modes=mode_types,E_0=DFT_E)
-                    params = minimize(fit_func,initial_guess,method='L-BFGS-B',bounds=bounds,options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
-                    xhi2_current = fit_bonds_angles_sc_2(*params,modes=modes,fit_modes=mode_types,penalty=True,E_0=DFT_E)
+                    fit_func = lambda x: sc_fit_objective(x,sc_setup,DFT_E)
+                    params = minimize(fit_func,initial_guess,jac=True,method='L-BFGS-B',bounds=bounds,options={'gtol':0.0,'ftol':1.0E-20,'maxiter':1000000,'maxfun':1000000,'maxls':20}).x
+                    xhi2_current = sc_fit_objective(params,sc_setup,DFT_E,jac=False)
 
                     # Update the fit parameters if a lower energy was obtained
                     if xhi2_min is None or xhi2_current < xhi2_min:
                         DFT_params = deepcopy(params[1:3])                        
                         params[1] = 0.0
-                        E_corr = fit_bonds_angles_sc_2(*params,modes=modes,fit_modes=mode_types,penalty=False,E_0=DFT_E)
+                        E_corr = sc_fit_objective(params,sc_setup,DFT_E,penalty=False)
                         xhi2_min = xhi2_current
 
                 if 'mp2' in qc_types:
-                    fit_func = lambda x: fit_bonds_angles_sc(*x,modes=modes,E_0=MP2_E)
-                    params = minimize(fit_func,initial_guess,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
+                    mp2_setup = sc_fit_setup(modes)
+                    fit_func = lambda x: sc_fit_objective(x,mp2_setup,MP2_E)
+                    params = minimize(fit_func,initial_guess,jac=True,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
 
             # Fall back on the least-squares guess if the fit was bad
             fallback_flag = 0
@@ -5158,29 +5128,9 @@ def fit_bonds_angles_sc(norm = 0.0, k_0  = None,r_0  = None,k_1  = None,r_1  = N
         print("ERROR in fit_bonds_angles_sc: the function expects the len(modes) and number of non-zero k*_* and r*_* variables to be equal. Exiting...")
         quit()
 
-    # Initialize a list of bond and angle harmonic parameters indexed to the modes
-    # The if/else controls whether the coefficients are assigned to the input fit parameters or
-    # taken from FF_dict (dihedrals not being fit on this scan)
-    params = []
-    for count_i,i in enumerate(modes[0]):
-        params += [ (k_vals[count_i],r_vals[count_i]) ]
-
-    # Initialize E_tot for each configuration
-    E_tot = np.ones(len(modes))*norm
-
-    # Cumulatively add up the bond and angle energies (fit type should be defined as a global variable outside the function)
-    for count_i,i in enumerate(modes):
-
-        # modes holds a list of tuples with bonds and angles of each coincident type being fit
-        for count_j,j in enumerate(i):
-            E_tot[count_i] += params[count_j][0]*(j[1]-params[count_j][1])**(2.0)
-        
-    # Return the penalty function
-    if penalty is True:
-        #      potential fit                       boltzman weighting                  harmonic constraint on parameter magnitudes                                        hyperbolic constraint on parameter magnitudes
-        return w_pot*np.mean((E_tot - E_0)**(2.0)*(1-w_exp+w_exp*np.exp(-E_0/(kb*T)))) + w_harm * np.mean(np.array([ j for i in params for j in i ])**(2.0)) + w_hyper * np.mean( (np.array([ j for i in params for j in i ])**(2.0) + b_hyper**(2.0) )**(0.5) - b_hyper )
-    else:
-        return E_tot
+    # Evaluate the objective with the parameter-vector form (see sc_fit_objective)
+    x = np.concatenate(([norm],np.column_stack((k_vals,r_vals)).flatten()))
+    return sc_fit_objective(x,sc_fit_setup(modes),E_0,w_pot=w_pot,w_hyper=w_hyper,b_hyper=b_hyper,w_exp=w_exp,w_harm=w_harm,T=T,kb=kb,penalty=penalty,jac=False)
 
 
 # # Fit function used for self-consistently fitting bonds and angles with respect to other modes that are shifting
@@ -5383,42 +5333,9 @@ def fit_bonds_angles_sc_2(norm = 0.0, k_0  = None,r_0  = None,k_1  = None,r_1  =
         print("ERROR in fit_bonds_angles_sc: the function expects the len(modes) and number of non-zero k*_* and r*_* variables to be equal. Exiting...")
         quit()
 
-    # Initialize a list of bond and angle harmonic parameters indexed to the modes
-    # The if/else controls whether the coefficients are assigned to the input fit parameters or
-    # taken from FF_dict (dihedrals not being fit on this scan)
-    params = []
-    for count_i,i in enumerate(modes[0]):
-        
-        # harmonic dihedrals are handled specially
-        if len(i[0]) == 4:
-            params += [ (k_vals[fit_modes.index(i[0])],-1.0,2.0) ]
-
-        # Use the same force constant for all like modes but use unique equilibrium positions
-        else:
-            params += [ (k_vals[fit_modes.index(i[0])],r_vals[count_i]) ]
-
-    # Initialize E_tot for each configuration
-    E_tot = np.ones(len(modes))*norm
-
-    # Cumulatively add up the bond and angle energies (fit type should be defined as a global variable outside the function)
-    for count_i,i in enumerate(modes):
-
-        # modes holds a list of tuples with bonds and angles of each coincident type being fit
-        for count_j,j in enumerate(i):
-
-            # harmonic dihedrals are handled specially with a k(1-np.cos(2*x)) function  
-            if len(j[0]) == 4:
-                E_tot[count_i] += params[count_j][0]*(1.0+params[count_j][1]*np.cos(params[count_j][2]*j[1]))
-            # bonds and angles are fit to harmonics
-            else:                
-                E_tot[count_i] += params[count_j][0]*(j[1]-params[count_j][1])**(2.0)
-
-    # Return the penalty function
-    #          potential fit                       boltzman weighting                  harmonic constraint on parameter magnitudes                                        hyperbolic constraint on parameter magnitudes
-    if penalty is True:
-        return w_pot*np.mean((E_tot - E_0)**(2.0)*(1-w_exp+w_exp*np.exp(-E_0/(kb*T)))) + w_harm * np.mean(np.array([ j for i in params for j in i ])**(2.0)) + w_hyper * np.mean( (np.array([ j for i in params for j in i ])**(2.0) + b_hyper**(2.0) )**(0.5) - b_hyper )
-    else:
-        return E_tot
+    # Evaluate the objective with the parameter-vector form (see sc_fit_objective)
+    x = np.concatenate(([norm],np.column_stack((k_vals,r_vals)).flatten()))
+    return sc_fit_objective(x,sc_fit_setup(modes,fit_modes),E_0,w_pot=w_pot,w_hyper=w_hyper,b_hyper=b_hyper,w_exp=w_exp,w_harm=w_harm,T=T,kb=kb,penalty=penalty,jac=False)
 
 
 
@@ -5465,43 +5382,106 @@ def fit_bonds_angles_sc_single(params = None,                          k_1  = No
         print("ERROR in fit_bonds_angles_sc: the function expects the len(modes) and number of non-zero k*_* and r*_* variables to be equal. Exiting...")
         quit()
 
-    # Initialize a list of bond and angle harmonic parameters indexed to the modes
-    # The if/else controls whether the coefficients are assigned to the input fit parameters or
-    # taken from FF_dict (dihedrals not being fit on this scan)
-    params = []
-    for count_i,i in enumerate(modes[0]):
-        
-        # harmonic dihedrals are handled specially
-        if len(i[0]) == 4:
-            params += [ (k_vals[fit_modes.index(i[0])],-1.0,2.0) ]
+    # Evaluate the objective with the parameter-vector form (see sc_fit_objective)
+    x = np.concatenate(([norm],np.column_stack((k_vals,r_vals)).flatten()))
+    return sc_fit_objective(x,sc_fit_setup(modes,fit_modes),E_0,w_pot=w_pot,w_hyper=w_hyper,b_hyper=b_hyper,w_exp=w_exp,w_harm=w_harm,T=T,kb=kb,penalty=penalty,jac=False)
 
-        # Use the same force constant for all like modes but use unique equilibrium positions
+# Description: Packs the mode values and the parameter layout used by the fit_bonds_angles_sc* objectives so that
+#              sc_fit_objective can evaluate the objective and its analytic gradient with vectorized operations.
+#              The parameter vector has the same layout as the positional arguments of the legacy functions,
+#              x = [ norm, k_0, r_0, k_1, r_1, ... ].
+#
+# Inputs:      modes:     list (one entry per configuration) of lists of (mode_type,value) tuples
+#              fit_modes: optional, list of the mode types. If supplied, like modes share the force constant of their
+#                         type (k_vals[fit_modes.index(type)]) and harmonic dihedrals are evaluated as k*(1-cos(2*x)) 
+#                         (fit_bonds_angles_sc_2 behavior). If None, every mode has its own k and r (fit_bonds_angles_sc).
+#
+# Returns:     setup:     dictionary consumed by sc_fit_objective
+def sc_fit_setup(modes,fit_modes=None):
+
+    N_modes = len(modes[0])
+    X = np.array([ [ j[1] for j in i ] for i in modes ],dtype=float).reshape(len(modes),N_modes)
+    r_ind = 2+2*np.arange(N_modes)
+    if fit_modes is None:
+        k_ind    = 1+2*np.arange(N_modes)
+        dihedral = np.zeros(N_modes,dtype=bool)
+    else:
+        k_ind    = np.array([ 1+2*fit_modes.index(i[0]) for i in modes[0] ],dtype=int)
+        dihedral = np.array([ len(i[0]) == 4 for i in modes[0] ],dtype=bool)
+
+    # Entries of the flattened parameter list used by the regularization terms. Harmonic dihedrals contribute 
+    # (k,-1.0,2.0), everything else (k,r). p_ind holds the index in x of each entry (-1 for the constants)
+    p_ind   = []
+    p_const = []
+    for count_i,i in enumerate(dihedral):
+        if i:
+            p_ind   += [k_ind[count_i],-1,-1]
+            p_const += [0.0,-1.0,2.0]
         else:
-            params += [ (k_vals[fit_modes.index(i[0])],r_vals[count_i]) ]
+            p_ind   += [k_ind[count_i],r_ind[count_i]]
+            p_const += [0.0,0.0]
 
-    # Initialize E_tot for each configuration
-    E_tot = np.ones(len(modes))*norm
+    return { "X":X, "k_ind":k_ind, "r_ind":r_ind, "dihedral":dihedral, "p_ind":np.array(p_ind,dtype=int), "p_const":np.array(p_const,dtype=float) }
 
-    # Cumulatively add up the bond and angle energies (fit type should be defined as a global variable outside the function)
-    for count_i,i in enumerate(modes):
+# Description: Returns the value and gradient of the L2 (w_harm) and hyperbolic (w_hyper) regularization terms shared by
+#              the self-consistent bond/angle and OPLS fit objectives. p_ind/p_const describe the flattened parameter 
+#              list (see sc_fit_setup); the gradient is accumulated into an array of len(x).
+def fit_regularization(x,p_ind,p_const,w_harm=0.0,w_hyper=0.0,b_hyper=0.1):
 
-        # modes holds a list of tuples with bonds and angles of each coincident type being fit
-        for count_j,j in enumerate(i):
-
-            # harmonic dihedrals are handled specially with a k(1-np.cos(2*x)) function  
-            if len(j[0]) == 4:
-                E_tot[count_i] += params[count_j][0]*(1.0+params[count_j][1]*np.cos(params[count_j][2]*j[1]))
-            # bonds and angles are fit to harmonics
-            else:                
-                E_tot[count_i] += params[count_j][0]*(j[1]-params[count_j][1])**(2.0)
+    var = p_ind >= 0
+    P = p_const.copy()
+    P[var] = x[p_ind[var]]
+    root = ( P**(2.0) + b_hyper**(2.0) )**(0.5)
+    value = w_harm * np.mean(P**(2.0)) + w_hyper * np.mean( root - b_hyper )
+    g_P = ( w_harm*2.0*P + w_hyper*P/root ) / len(P)
+    return value,np.bincount(p_ind[var],weights=g_P[var],minlength=len(x))
 
-    # Return the penalty function
-    #          potential fit                       boltzman weighting                  harmonic constraint on parameter magnitudes                                        hyperbolic constraint on parameter magnitudes
-    if penalty is True:
-        return w_pot*np.mean((E_tot - E_0)**(2.0)*(1-w_exp+w_exp*np.exp(-E_0/(kb*T)))) + w_harm * np.mean(np.array([ j for i in params for j in i ])**(2.0)) + w_hyper * np.mean( (np.array([ j for i in params for j in i ])**(2.0) + b_hyper**(2.0) )**(0.5) - b_hyper )
-    else:
+# Description: Parameter-vector form of the fit_bonds_angles_sc* objectives with its analytic gradient. 
+#
+# Inputs:      x:       parameter vector [ norm, k_0, r_0, k_1, r_1, ... ]
+#              setup:   dictionary returned by sc_fit_setup
+#              E_0:     target energies of the configurations
+#              fixed:   optional, trailing parameters that are held fixed. The objective is evaluated at
+#                       concatenate(x,fixed) and only the gradient with respect to x is returned (fit_bonds_angles_sc_single).
+#              penalty: if False the fit energies are returned instead of the penalty function
+#              jac:     if True the gradient is returned as well (for minimize(...,jac=True))
+#
+# Returns:     xhi2, (xhi2,gradient) if jac is True, or E_tot if penalty is False
+def sc_fit_objective(x,setup,E_0,w_pot=1.0,w_hyper=0.0,b_hyper=0.1,w_exp=0.0,w_harm=0.0,T=298.0,kb=0.0019872041,fixed=None,penalty=True,jac=True):
+
+    N_free = len(x)
+    if fixed is not None:
+        x = np.concatenate((x,fixed))
+    x = np.asarray(x,dtype=float)
+    X,k_ind,r_ind,dihedral = setup["X"],setup["k_ind"],setup["r_ind"],setup["dihedral"]
+
+    # dE/dk for each configuration and mode: (x-r)^2 for bonds and angles and 1-cos(2x) for harmonic dihedrals
+    k = x[k_ind]
+    r = np.where(dihedral,0.0,x[np.minimum(r_ind,len(x)-1)])
+    dk = np.where(dihedral,1.0-np.cos(2.0*X),(X-r)**(2.0))
+    E_tot = x[0] + dk.dot(k)
+    if penalty is False:
         return E_tot
 
+    # Potential fit (with optional boltzmann weighting) and regularization
+    E_0 = np.asarray(E_0,dtype=float)
+    weights = w_pot*(1-w_exp+w_exp*np.exp(-E_0/(kb*T))) / len(E_0)
+    resid = E_tot - E_0
+    reg,g_reg = fit_regularization(x,setup["p_ind"],setup["p_const"],w_harm=w_harm,w_hyper=w_hyper,b_hyper=b_hyper)
+    xhi2 = np.sum(weights*resid**(2.0)) + reg
+    if jac is False:
+        return xhi2
+
+    # Gradient (dE/dnorm = 1, dE/dk = dk, dE/dr = -2k(x-r))
+    g_E = 2.0*weights*resid
+    grad = g_reg
+    grad[0] += np.sum(g_E)
+    grad += np.bincount(k_ind,weights=g_E.dot(dk),minlength=len(x))
+    harm = ~dihedral
+    grad += np.bincount(r_ind[harm],weights=g_E.dot(-2.0*k*(X-r))[harm],minlength=len(x))
+
+    return xhi2,grad[:N_free]
+
 # Description: write function for generating a geometry optimization for an unconverged scan
 #
 # Inputs:     template: string holding the filename of the input file for the job that failed to converge.
@@ -7103,41 +7083,75 @@ def OPLS_OPLS_Fit_MIN(V0_0  = None,V1_0  = None,V2_0  = None,V3_0  = None,V4_0
         print("ERROR in OPLS_OPLS_Fit_MIN: the function expects the len(unique_fit_dihedral_types) and number of non-zero V*_* variables to be equal. Exiting...")
         quit()
 
-    # Initialize a list of fourier coefficients that are properly indexed to dihedral types
-    # The if/else controls whether the coefficients are assigned to the input fit parameters or
-    # taken from FF_dict (dihedrals not being fit on this scan)
-    params = []
+    # Evaluate the objective with the parameter-vector form (see opls_fit_objective)
+    x = np.column_stack((V0_vals,V1_vals,V2_vals,V3_vals,V4_vals)).flatten()
+    setup = opls_fit_setup(unique_fit_dihedral_types,angles,dihedral_types,QC_dihedral,FF_dict)
+    return opls_fit_objective(x,setup,E_0,w_pot=w_pot,w_hyper=w_hyper,b_hyper=b_hyper,w_exp=w_exp,w_harm=w_harm,T=T,kb=kb,jac=False)
+
+# Description: Packs the OPLS fit of coincident dihedrals (OPLS_OPLS_Fit_MIN) into a linear model so that opls_fit_objective
+#              can evaluate the objective and its analytic gradient with matrix-vector products. The parameter vector has 
+#              the same layout as the positional arguments of OPLS_OPLS_Fit_MIN, x = [ V0_0, V1_0, V2_0, V3_0, V4_0, V0_1, ... ].
+#              As in OPLS_OPLS_Fit_MIN, the V0 term of every fit type is taken from V0_0.
+#
+# Inputs:      unique_fit_dihedral_types, angles, dihedral_types, QC_dihedral, FF_dict: see OPLS_OPLS_Fit_MIN
+#
+# Returns:     setup: dictionary consumed by opls_fit_objective
+def opls_fit_setup(unique_fit_dihedral_types,angles,dihedral_types,QC_dihedral,FF_dict):
+
+    # Fourier basis of each dihedral in each configuration
+    theta = np.array(angles,dtype=float).reshape(len(angles),len(dihedral_types))*np.pi/180.0
+    basis = np.stack((np.ones(theta.shape),0.5*(1+np.cos(theta)),0.5*(1-np.cos(2.0*theta)),0.5*(1+np.cos(3.0*theta)),0.5*(1-np.cos(4.0*theta))),axis=2)
+
+    # Dihedrals being fit add their basis to the design matrix, the others add a constant contribution
+    N_params = 5*len(unique_fit_dihedral_types)
+    M       = np.zeros([len(angles),N_params])
+    E_const = np.zeros(len(angles))
+    p_ind   = []
+    p_const = []
     for count_i,i in enumerate(dihedral_types):
         if i in unique_fit_dihedral_types:
-            idx = unique_fit_dihedral_types.index(i)
-            params += [ (V0_0,V1_vals[idx],V2_vals[idx],V3_vals[idx],V4_vals[idx]) ]
-        elif i in list(FF_dict["dihedrals"].keys()):
-            if len(FF_dict["dihedrals"][i][QC_dihedral]) == 5:
-                params += [tuple([0.0] + FF_dict["dihedrals"][i][QC_dihedral][1:])]
-            elif len(FF_dict["dihedrals"][i][QC_dihedral]) == 6:
-                params += [tuple(FF_dict["dihedrals"][i][QC_dihedral][1:])]
+            idx = 5*unique_fit_dihedral_types.index(i)
+            cols = [0,idx+1,idx+2,idx+3,idx+4]
+            M[:,cols] += basis[:,count_i,:]
+            p_ind   += cols
+            p_const += [0.0]*5
         else:
-            params += [(0.0,0.0,0.0,0.0,0.0)]
-
-    # Initialize E_OPLS for the current configuration
-    E_OPLS = np.zeros(len(angles))
-
-    # Cumulatively add up the OPLS energy (fit type should be defined as a global variable outside the function)
-    for count_i,i in enumerate(angles):
-
-        # In OPLS_OPLS_Fit, angles holds a list of tuples with the angle of each coincident type being fit
-        for count_j,j in enumerate(i):
+            params = [0.0]*5
+            if i in FF_dict["dihedrals"]:
+                if len(FF_dict["dihedrals"][i][QC_dihedral]) == 5:
+                    params = [0.0] + list(FF_dict["dihedrals"][i][QC_dihedral][1:])
+                elif len(FF_dict["dihedrals"][i][QC_dihedral]) == 6:
+                    params = list(FF_dict["dihedrals"][i][QC_dihedral][1:])
+            E_const += basis[:,count_i,:].dot(params)
+            p_ind   += [-1]*5
+            p_const += params
+
+    return { "M":M, "E_const":E_const, "p_ind":np.array(p_ind,dtype=int), "p_const":np.array(p_const,dtype=float) }
+
+# Description: Parameter-vector form of OPLS_OPLS_Fit_MIN with its analytic gradient. The OPLS energy is linear in the
+#              fourier coefficients, so the gradient of the potential term is M^T applied to the weighted residuals.
+#
+# Inputs:      x:     parameter vector (see opls_fit_setup)
+#              setup: dictionary returned by opls_fit_setup
+#              E_0:   target energies of the configurations
+#              jac:   if True the gradient is returned as well (for minimize(...,jac=True))
+#
+# Returns:     xhi2, or (xhi2,gradient) if jac is True
+def opls_fit_objective(x,setup,E_0,w_pot=1.0,w_hyper=0.01,b_hyper=0.1,w_exp=0.0,w_harm=0.0,T=298.0,kb=0.0019872041,jac=True):
 
-            # Unpack params
-            V0,V1,V2,V3,V4 = params[count_j]
+    x = np.asarray(x,dtype=float)
+    E_0 = np.asarray(E_0,dtype=float)
+    E_OPLS = setup["M"].dot(x) + setup["E_const"]
 
-            # Calculate the dihedral energy for this configuration
-            E_OPLS[count_i] += V0 + 0.5*V1*(1+np.cos(j*np.pi/180.0)) + 0.5*V2*(1-np.cos(2.0*j*np.pi/180.0)) + 0.5*V3*(1+np.cos(3.0*j*np.pi/180.0)) + 0.5*V4*(1-np.cos(4.0*j*np.pi/180.0))
+    # Potential fit (with optional boltzmann weighting) and regularization
+    weights = w_pot*(1-w_exp+w_exp*np.exp(-E_0/(kb*T))) / len(E_0)
+    resid = E_OPLS - E_0
+    reg,g_reg = fit_regularization(x,setup["p_ind"],setup["p_const"],w_harm=w_harm,w_hyper=w_hyper,b_hyper=b_hyper)
+    xhi2 = np.sum(weights*resid**(2.0)) + reg
+    if jac is False:
+        return xhi2
 
-    # Return the penalty function
-    #          potential fit                       boltzman weighting                  harmonic constraint on parameter magnitudes (L2 regularization)                       hyperbolic constraint on parameter magnitudes
-    return w_pot*np.mean((E_OPLS - E_0)**(2.0)*(1-w_exp+w_exp*np.exp(-E_0/(kb*T)))) + w_harm * np.mean(np.array([ j for i in params for j in i ])**(2.0)) + w_hyper * np.mean( (np.array([ j for i in params for j in i ])**(2.0) + b_hyper**(2.0) )**(0.5) - b_hyper )
-#    return w_pot*np.mean((E_OPLS - E_0)**(2.0)*(1-w_exp+w_exp*np.exp(-E_0/(kb*T)))) + w_hyper * np.mean( (np.array([ j for i in params for j in i ])**(2.0) + b_hyper**(2.0) )**(0.5) - b_hyper )
+    return xhi2,setup["M"].T.dot(2.0*weights*resid) + g_reg
 
 # Description: This function drives the fit of the harmonic dihedrals parameters. It accepts
 #              various arguments that modify the convergence criteria and optimization
@@ -10048,10 +10062,11 @@ def parse_dihedrals_qcmatch(Folder,geo_folders,dihedral_folders_frag,list_of_dih
 
                     # All coincident dihedrals are self-consistently fit at once, the registration between the input arguments in 
                     # OPLS_OPLS_Fit_MIN and the individual dihedral types is acheived using the unique_fit_dihedral_tOAypes list
-                    fit_func = lambda x: OPLS_OPLS_Fit_MIN(*x,unique_fit_dihedral_types=unique_fit_dihedral_types,angles=angle_tuples,E_0=res_potential,V_range=V_range,\
-                                                              dihedral_types=dihedral_types,QC_dihedral=QC_dihedral,FF_dict=FF_dict,w_pot=w_pot,w_hyper=w_hyper,b_hyper=b_hyper,w_exp=w_exp,w_harm=w_harm)                        
+                    # (opls_fit_objective is the parameter-vector form of OPLS_OPLS_Fit_MIN and also returns the analytic gradient)
+                    opls_setup = opls_fit_setup(unique_fit_dihedral_types,angle_tuples,dihedral_types,QC_dihedral,FF_dict)
+                    fit_func = lambda x: opls_fit_objective(x,opls_setup,res_potential,w_pot=w_pot,w_hyper=w_hyper,b_hyper=b_hyper,w_exp=w_exp,w_harm=w_harm)
 
-                    params = minimize(fit_func,initial_guess,bounds=bounds,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
+                    params = minimize(fit_func,initial_guess,jac=True,bounds=bounds,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':1E-20}).x
 
                     # Perform a weighted update of the force-field dictionary 
                     for count_f,f in enumerate(unique_fit_dihedral_types):
@@ -15,11 +15,15 @@ from numpy.linalg import norm
 from numpy.linalg import matrix_rank
 #from pylab import *
 from copy import deepcopy
-import random,time
+import random,time,math,warnings
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 ### in this .py file we also have 'axis_rot' and 'type_adjmat' that are also defined in adjacency lib
 ### they're probably the same, should find sometime to resolve this kind of issue for all .py file
 from adjacency import Table_generator
+from param_store import load_store
+from type_registry import registry,type_ids,atomic_numbers
+from orca_parser import parse_orca
+from ingest_pool import pool_map
 from matplotlib import pyplot as plt
 # Powerpoint generation dependencies
 from pptx import Presentation
@@ -124,10 +128,14 @@ def main(argv):
                         help = 'Determines the method for calculating the UA values. '+\
                                '"radius" uses the volume of the sphere that encompasses all UA atoms in the group, scaled by a factor determined by the -UA_vol_scale variable. '+\
                                '"volume" uses the monte-carlo calculated volume of the UA group, with overlaps naturally subtracted. '+\
+                               '"analytic" is the same as "volume" but uses the exact (closed-form) group volume. '+\
                                'Both, radius and volume methods base the UA eps values upon scaled AA-eps values in order to reproduce the intermolecular '+\
                                'LJ interaction energy. "fit" performs an iterative fit of the eps and sigma values to reproduce the DFT data, independent of the AA '+\
                                'parameters. radius and volume are meant for use fitting self interactions (where A and B molecules are identical), the fit method is meant '+\
                                'for fitting heteromolecular interactions (e.g., ion polymer or solute solvent) (default: radius)')
+    parser.add_argument('-procs', dest='procs', default=1,
+                        help = 'Number of processes used to parse the configurations (0 uses all cores). (default: 1)')
+
     parser.add_argument('-fun', dest='functional', default='B3LYP',
                         help = 'functional for get_data to identify job_type. (default: B3LYP; other typical options are wB97X-D3, and M062X)')
 
@@ -165,6 +173,7 @@ def main(argv):
     args.L2_s = float(args.L2_s)
     args.L2_e = float(args.L2_e)
     args.gens = int(args.gens)
+    args.procs = int(args.procs)
     if args.DFT_db != []:
         args.DFT_db = args.DFT_db.split()
     if args.MP2_db != []:
@@ -172,7 +181,7 @@ def main(argv):
 
     # Consistency checks
     if args.fit not in [ 'lj', 'buck', 'born' ]: print("ERROR: an unrecognized fit type was requested by the user. Exiting..."); quit()
-    if args.UA_method not in [ 'radius', 'volume', 'AA_fit', 'fit' ]: print("ERROR: an unrecognized -UA_method was requested by the user. Exiting..."); quit()
+    if args.UA_method not in [ 'radius', 'volume', 'analytic', 'AA_fit', 'fit' ]: print("ERROR: an unrecognized -UA_method was requested by the user. Exiting..."); quit()
     if args.mixing_rule not in ['none','lb','wh']: print("ERROR: an unrecognized -mixing_rule was requested by the user. Exiting..."); quit()
     if args.min_cycles > args.max_cycles: print("ERROR: min_cycles must be less than or equal to max_cycles. Exiting..."); quit()
     if args.L2_s < 0.0: print("ERROR: -L2_sigma must be set to a float greater than 0. Exiting..."); quit()
@@ -238,7 +247,7 @@ def main(argv):
     # to subdictionaries. See the get_data function for more info on the keys that are populated.
     # NOTE: this is function parses both DFT and MP2 data. The subsequent fit function only makes use
     #       of a subset of the data depending on whether the MP2 or DFT information is being used. 
-    Data, job_type = get_data(Names,args.functional,args.extract_charges,args.DFT_db,q_a=args.q_a,q_b=args.q_b)
+    Data, job_type = get_data(Names,args.functional,args.extract_charges,args.DFT_db,q_a=args.q_a,q_b=args.q_b,procs=args.procs)
     ########################
     # PARSE DFT PARAMETERS #
     ########################
@@ -626,7 +635,7 @@ def add_9(slide,names,h_pad=0.0,v_pad=0.0):
 #             "e_MP2_fit" : array holding the counterpoise-corrected MP2 interaction energies less the electrostatic contribution for each configuration
 #             "r_dist"    : array holding the pair-separations for each configurations (rows are indexed to the atoms in geo_a and columns to the atoms in geo_b).
 #
-def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
+def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None,procs=1):
 
     # Initialize dictionary for all configurations
     global Data
@@ -637,10 +646,13 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
     if db_files != []:
         FF_charges = grab_db_charges(db_files)
 
-    if parse_charges == 1:
+    # Determine job type (i.e. 'dft' 'mp2' or combined 'dft' 'mp2')
+    job_type = find_jobtype(Names[0],functional)
+
+    # Parse the geometries, types, charges, adjacency matrices and energies of each configuration (distributed over procs processes)
+    configs = dict(zip(Names,pool_map(parse_config,[ (i,parse_charges,job_type) for i in Names ],procs=procs)))
 
-        # Initialize a list of unique atom types
-        unique_types = []
+    if parse_charges == 1:
 
         # Iterate over all input files and parse atom types and charges for each molecule
         for count_i,i in enumerate(Names):
@@ -649,18 +661,9 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
             Data[i] = { 'geo_a': np.array([]), 'geo_b': np.array([]), 'types_a': [], 'types_b': [], 'charges_a':np.array([]), 'charges_b':np.array([]), 'e_dft':0.0, 'e_mp2':0.0, 
                         'e_dft_fit_AA':0.0, 'e_mp2_fit_AA':0.0, 'e_dft_fit_UA':0.0, 'e_mp2_fit_UA':0.0, 'charges_a_UA':np.array([]), 'charges_b_UA':np.array([]) }
 
-            # Grab geometry and datatypes from xyz file
-            XYZ_file = '.'.join([ j for j in i.split('.')[:-1] ])+'.xyz'
-            Data[i]['elem_a'],Data[i]['elem_b'],Data[i]['geo_a'],Data[i]['geo_b'],Data[i]['types_a'],Data[i]['types_b'] = scrape_xyz(XYZ_file,parse_charges=0)
-
-            # Add atom types to unique list
-            for j in Data[i]['types_a']:
-                if j not in unique_types: unique_types += [j]
-            for j in Data[i]['types_b']:
-                if j not in unique_types: unique_types += [j]
-                    
-            # Get charges from output files
-            Data[i]['charges_a'],Data[i]['charges_b'] = scrape_charges(i,Data[i]['types_a'],Data[i]['types_b'])
+            # Geometry and datatypes from the xyz file and charges from the output file
+            for j in ['elem_a','elem_b','geo_a','geo_b','types_a','types_b','charges_a','charges_b']:
+                Data[i][j] = configs[i][j]
 
 #             # Overwrite values for molecules already in the FF_charges dictionary
 #             if False not in [ j in FF_charges.keys() for j in Data[i]['types_a'] ]:
@@ -679,32 +682,18 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
 #             for count_j,j in enumerate(Data[i]['types_b']):
 #                 Data[i]['charges_b'][count_j] -= residual/float(len(Data[i]['types_b']))
     
-        # Calculate average of each charge type over all configurations
-        charges = np.zeros(len(unique_types))
-        counts  = np.zeros(len(unique_types))
-        for count_i,i in enumerate(unique_types):
-            for count_j,j in enumerate(Names):
-                for count_k,k in enumerate(Data[j]["types_a"]):
-                    if i == k:
-                        charges[count_i] += Data[j]["charges_a"][count_k]
-                        counts[count_i]  += 1
-                for count_k,k in enumerate(Data[j]["types_b"]):
-                    if i == k:
-                        charges[count_i] += Data[j]["charges_b"][count_k]
-                        counts[count_i]  += 1
-                        
+        # Calculate average of each charge type over all configurations (accumulated by interned type id)
+        ids     = np.concatenate([ type_ids(Data[j][k]) for j in Names for k in ["types_a","types_b"] ]).astype(int)
+        charges = np.bincount(ids,weights=np.concatenate([ Data[j][k] for j in Names for k in ["charges_a","charges_b"] ]),minlength=len(registry))
+        counts  = np.bincount(ids,minlength=len(registry))
+
         # Perform average 
-        charges = charges/counts
-        
+        charges[counts > 0] = charges[counts > 0]/counts[counts > 0]
+
         # Assign charges to each sub-dictionary
-        for count_i,i in enumerate(unique_types):
-            for count_j,j in enumerate(Names):
-                for count_k,k in enumerate(Data[j]["types_a"]):
-                    if i == k:
-                        Data[j]["charges_a"][count_k] = charges[count_i]
-                for count_k,k in enumerate(Data[j]["types_b"]):
-                    if i == k:
-                        Data[j]["charges_b"][count_k] = charges[count_i]
+        for j in Names:
+            Data[j]["charges_a"][:] = charges[type_ids(Data[j]["types_a"])]
+            Data[j]["charges_b"][:] = charges[type_ids(Data[j]["types_b"])]
                 
     # Parse configurational energies
     flag_a_AA_charges = 0
@@ -720,19 +709,24 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
             Data[i] = { 'geo_a': np.array([]), 'geo_b': np.array([]), 'types_a': [], 'types_b': [], 'e_dft':0.0, 'e_mp2':0.0, 
                         'e_dft_fit_AA':0.0, 'e_mp2_fit_AA':0.0, 'e_dft_fit_UA':0.0, 'e_mp2_fit_UA':0.0, 'charges_a_UA':np.array([]), 'charges_b_UA':np.array([]) }
 
-        # Grab geometry and datatypes from xyz file
-        XYZ_file = '.'.join([ j for j in i.split('.')[:-1] ])+'.xyz'
-        if parse_charges == 1:
-            Data[i]['elem_a'],Data[i]['elem_b'],Data[i]['geo_a'],Data[i]['geo_b'],Data[i]['types_a'],Data[i]['types_b'] = scrape_xyz(XYZ_file,parse_charges=0)
-        else:
-            Data[i]['elem_a'],Data[i]['elem_b'],Data[i]['geo_a'],Data[i]['geo_b'],Data[i]['types_a'],Data[i]['types_b'],Data[i]['charges_a'],Data[i]['charges_b'] = scrape_xyz(XYZ_file,parse_charges=1)
+        # Geometry and datatypes from xyz file (and charges when they aren't parsed from the output)
+        for j in ['elem_a','elem_b','geo_a','geo_b','types_a','types_b']:
+            Data[i][j] = configs[i][j]
+        if parse_charges == 0:
+            Data[i]['charges_a'],Data[i]['charges_b'] = configs[i]['charges_a'],configs[i]['charges_b']
+
+        # Interned type ids and atomic numbers of each molecule
+        ids_a = type_ids(Data[i]['types_a'])
+        ids_b = type_ids(Data[i]['types_b'])
+        Z_a   = registry.atomic_number[ids_a]
+        Z_b   = registry.atomic_number[ids_b]
 
         # Overwrite values for molecules already in the FF_charges dictionary (the charges are only assigned if all of the charges in the molecule are present)
-        if False not in [ j in list(FF_charges.keys()) for j in Data[i]['types_a'] ]:
+        if False not in [ j in FF_charges for j in Data[i]['types_a'] ]:
             flag_a_AA_charges = 1
             for count_j,j in enumerate(Data[i]['types_a']):
                 Data[i]['charges_a'][count_j] = FF_charges[j]
-        if False not in [ j in list(FF_charges.keys()) for j in Data[i]['types_b'] ]:
+        if False not in [ j in FF_charges for j in Data[i]['types_b'] ]:
             flag_b_AA_charges = 1
             for count_j,j in enumerate(Data[i]['types_b']):
                 Data[i]['charges_b'][count_j] = FF_charges[j]
@@ -742,15 +736,15 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
         # NOTE: values are first initialized from a copy of the charges* arrays
         Data[i]["charges_a_UA"] = np.copy(Data[i]["charges_a"])
         Data[i]["charges_b_UA"] = np.copy(Data[i]["charges_b"])
-        if False not in [ j+'-UA' in list(FF_charges.keys()) for j in Data[i]['types_a'] if int(j.split('[')[1].split(']')[0]) != 1 ]:
+        if False not in [ j+'-UA' in FF_charges for count_j,j in enumerate(Data[i]['types_a']) if Z_a[count_j] != 1 ]:
             flag_a_UA_charges = 1
             for count_j,j in enumerate(Data[i]['types_a']):
-                if int(j.split('[')[1].split(']')[0]) == 1: continue
+                if Z_a[count_j] == 1: continue
                 Data[i]['charges_a_UA'][count_j] = FF_charges[j+'-UA']
-        if False not in [ j+'-UA' in list(FF_charges.keys()) for j in Data[i]['types_b'] if int(j.split('[')[1].split(']')[0]) != 1 ]:
+        if False not in [ j+'-UA' in FF_charges for count_j,j in enumerate(Data[i]['types_b']) if Z_b[count_j] != 1 ]:
             flag_b_UA_charges = 1
             for count_j,j in enumerate(Data[i]['types_b']):
-                if int(j.split('[')[1].split(']')[0]) == 1: continue
+                if Z_b[count_j] == 1: continue
                 Data[i]['charges_b_UA'][count_j] = FF_charges[j+'-UA']
 
         # Assign the total charge on molecule a
@@ -789,22 +783,22 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
             Data[i]['charges_b'][count_j] -= residual/float(len(Data[i]['types_b']))
 
         # Calculate UA charges
-        Data[i]['adj_mat_a'] = Table_generator(Data[i]['elem_a'],Data[i]['geo_a'])            
-        Data[i]['adj_mat_b'] = Table_generator(Data[i]['elem_b'],Data[i]['geo_b'])            
+        Data[i]['adj_mat_a'] = configs[i]['adj_mat_a']
+        Data[i]['adj_mat_b'] = configs[i]['adj_mat_b']
 
         # Add hydrogen charges to bonded carbons - for molecule a
         Data[i]["charges_a_UA"] = np.copy(Data[i]["charges_a"])
         for count_j,j in enumerate(Data[i]['adj_mat_a']):
-            if int(Data[i]["types_a"][count_j].split('[')[1].split(']')[0]) != 6: continue
-            H_ind = [ count_k for count_k,k in enumerate(j) if k == 1 and int(Data[i]['types_a'][count_k].split('[')[1].split(']')[0]) == 1 ]
+            if Z_a[count_j] != 6: continue
+            H_ind = np.where((j == 1) & (Z_a == 1))[0]
             Data[i]["charges_a_UA"][count_j] += sum([ Data[i]["charges_a"][k] for k in H_ind ])
             Data[i]["charges_a_UA"][H_ind] = 0.0
 
         # Add hydrogen charges to bonded carbons - for molecule b
         Data[i]["charges_b_UA"] = np.copy(Data[i]["charges_b"])
         for count_j,j in enumerate(Data[i]['adj_mat_b']):
-            if int(Data[i]["types_b"][count_j].split('[')[1].split(']')[0]) != 6: continue
-            H_ind = [ count_k for count_k,k in enumerate(j) if k == 1 and int(Data[i]['types_b'][count_k].split('[')[1].split(']')[0]) == 1 ]
+            if Z_b[count_j] != 6: continue
+            H_ind = np.where((j == 1) & (Z_b == 1))[0]
             Data[i]["charges_b_UA"][count_j] += sum([ Data[i]["charges_b"][k] for k in H_ind ])
             Data[i]["charges_b_UA"][H_ind] = 0.0
         
@@ -815,55 +809,8 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
 #         for count_j,j in enumerate(Data[i]['types_b']):
 #             if j+'-UA' in FF_charges.keys(): Data[i]['charges_b_UA'][count_j] = FF_charges[j+'-UA']
 
-        # Determine job type (i.e. 'dft' 'mp2' or combined 'dft' 'mp2')
-        if count_i == 0:
-            job_type = find_jobtype(i,functional)
-
-        # Parse the orca output files 
-        flag = 0
-        DFT_energy_count = 0
-        MP2_energy_count = 0
-        DFT_AB = 0.0
-        DFT_A  = 0.0
-        DFT_B  = 0.0
-        MP2_AB = 0.0
-        MP2_A  = 0.0
-        MP2_B  = 0.0
-        with open(i,'r') as output:
-            for lines in output:
-                fields = lines.split()
-
-                # The ordering of jobs for 'dft mp2': 1=dimer_DFT, 2=dimer_MP2, 3=A_DFT, 4=A_MP2, 5=B_DFT, 6=B_MP2
-                # The ordering of jobs for 'dft':     1=dimer_DFT, 2=A_DFT, 3=B_DFT
-                # The ordering of jobs for 'dft mp2': 1=dimer_MP2, 2=A_MP2, 3=B_MP2
-                if len(fields) == 5 and fields[0] == "FINAL" and fields[1] == "SINGLE" and fields[2] == "POINT" and fields[3] == "ENERGY":
-                    DFT_energy_count += 1
-                    # If mp2 jobs are interspersed then the HF jobs will also print "FINAL SINGLE POINT ENERGY"
-                    if "dft" in job_type and "mp2" in job_type:
-                        if DFT_energy_count == 1:
-                            DFT_AB = float(fields[4])
-                        elif DFT_energy_count == 3:
-                            DFT_A  = float(fields[4])
-                        elif DFT_energy_count == 5:
-                            DFT_B  = float(fields[4])
-                    # If only dft jobs are run then each FINAL SINGLE POINT ENERGY corresponds to one of the DFT jobs
-                    elif "dft" in job_type:
-                        if DFT_energy_count == 1:
-                            DFT_AB = float(fields[4])
-                        elif DFT_energy_count == 2:
-                            DFT_A  = float(fields[4])
-                        elif DFT_energy_count == 3:
-                            DFT_B  = float(fields[4])
-
-                if len(fields) == 5 and fields[0] == "MP2" and fields[1] == "TOTAL" and fields[2] == "ENERGY:":
-                    MP2_energy_count += 1
-                    if MP2_energy_count == 1:
-                        MP2_AB = float(fields[3])
-                    elif MP2_energy_count == 2:
-                        MP2_A  = float(fields[3])
-                    elif MP2_energy_count == 3:
-                        MP2_B  = float(fields[3])
-                        break
+        # Energies of the dimer and monomer jobs
+        DFT_AB,DFT_A,DFT_B,MP2_AB,MP2_A,MP2_B,DFT_energy_count,MP2_energy_count = configs[i]['energies']
 
         if "dft" in job_type and "mp2" in job_type:
             if DFT_energy_count < 5:
@@ -885,19 +832,17 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
         if "mp2" in job_type:
             Data[i]["e_mp2"]        = (MP2_AB-MP2_A-MP2_B)*Htokcalmol          # BSSE-corrected MP2 interaction energy
 
-        # Calculate r_dist matrix, holding the pair-wise separations between atoms on molecule a and b
-        Data[i]["r_dist"] = cdist(Data[i]['geo_a'],Data[i]['geo_b'])
+        # r_dist matrix, holding the pair-wise separations between atoms on molecule a and b
+        Data[i]["r_dist"] = configs[i]['r_dist']
 
-        # Calculate pairs lists, holding the pair-wise separations for all instances of each pair-type in this configuration
-        Data[i]["pairs"] = {}
-        for count_j,j in enumerate(Data[i]["types_a"]):
-            for count_k,k in enumerate(Data[i]["types_b"]):
-                if (j,k) not in list(Data[i]["pairs"].keys()): Data[i]["pairs"][(j,k)]=[]
-                Data[i]["pairs"][(j,k)]+=[Data[i]["r_dist"][count_j,count_k]]
-
-        # Convert lists to arrays
-        for j in list(Data[i]["pairs"].keys()):
-            Data[i]["pairs"][j] = np.array(Data[i]["pairs"][j])
+        # Calculate pairs lists, holding the pair-wise separations for all instances of each pair-type in this configuration.
+        # The separations are grouped by the integer code of their (type_a,type_b) id pair; the keys are in order of first
+        # appearance and each array is in row-major order of r_dist
+        codes = registry.pair_codes(ids_a[:,None],ids_b[None,:]).ravel()
+        unique_codes,first,inverse = np.unique(codes,return_index=True,return_inverse=True)
+        seps  = np.split(Data[i]["r_dist"].ravel()[np.argsort(inverse,kind='stable')],np.cumsum(np.bincount(inverse))[:-1])
+        pairs = registry.names(registry.pair_ids(unique_codes))
+        Data[i]["pairs"] = { pairs[j]:seps[j] for j in np.argsort(first) }
 
         # Calculate arrays for vectorized calculation of pairwise interactions
         # "pair_vector" holds the sum of 1/r elements for each pair type indexed to 
@@ -907,14 +852,14 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
         Data[i]["pair_vector-6"] = []
         Data[i]["pair_vector-12"] = []
         Data[i]["pair_type_vector"] = []
-        added_types = []
+        added_types = set([])
         for j in list(Data[i]["pairs"].keys()):
             if j in added_types:
                 continue
             if j[0]==j[1]:
                 Data[i]["pair_vector-6"]  += [sum(1.0/Data[i]["pairs"][j]**6.0)]
                 Data[i]["pair_vector-12"] += [sum(1.0/Data[i]["pairs"][j]**12.0)]
-            elif (j[1],j[0]) in list(Data[i]["pairs"].keys()):
+            elif (j[1],j[0]) in Data[i]["pairs"]:
                 Data[i]["pair_vector-6"]  += [sum(1.0/Data[i]["pairs"][j]**6.0)  + sum(1.0/Data[i]["pairs"][(j[1],j[0])]**6.0)]
                 Data[i]["pair_vector-12"] += [sum(1.0/Data[i]["pairs"][j]**12.0) + sum(1.0/Data[i]["pairs"][(j[1],j[0])]**12.0)]                
             else:
@@ -924,10 +869,15 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
                 Data[i]["pair_type_vector"]+=[j]
             else:
                 Data[i]["pair_type_vector"]+=[(j[1],j[0])]
-            added_types += [j,(j[1],j[0])]
+            added_types.update([j,(j[1],j[0])])
         Data[i]["pair_vector-6"]  = np.array(Data[i]["pair_vector-6"])
         Data[i]["pair_vector-12"] = np.array(Data[i]["pair_vector-12"])
 
+        # Flattened separations and the index of their type in "pair_type_vector" (used for the vectorized buckingham evaluations)
+        type_index = { j:count_j for count_j,j in enumerate(Data[i]["pair_type_vector"]) }
+        Data[i]["pair_seps"] = np.concatenate([ Data[i]["pairs"][j] for j in Data[i]["pairs"] ])
+        Data[i]["pair_seps_type"] = np.concatenate([ np.full(len(Data[i]["pairs"][j]),type_index[j] if j in type_index else type_index[(j[1],j[0])],dtype=int) for j in Data[i]["pairs"] ])
+
     # Print relevant diagnostics
     if residual_flag_a != 0 or residual_flag_b != 0 or flag_a_AA_charges == 1 or flag_b_AA_charges == 1 or flag_a_UA_charges == 1 or flag_b_UA_charges == 1:
         print(" ")
@@ -951,14 +901,10 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
     if flag_a_UA_charges == 0 and flag_b_UA_charges == 0:
 
         # Calculate total intermolecular AA-electrostatic energy
-        E_C_Tot_AA = 0.0
-        for i in Names:
-            E_C_Tot_AA += E_C_Tot(i,'AA')
+        E_C_Tot_AA = sum(coul_vector(Names,'AA'))
 
         # Calculate total intermolecular UA-electrostatic energy (uncorrected)
-        E_C_Tot_UA = 0.0
-        for i in Names:
-            E_C_Tot_UA += E_C_Tot(i,'UA')
+        E_C_Tot_UA = sum(coul_vector(Names,'UA'))
 
         # calculate scale factor (the scale factor is the sqrt of the ratio because coulomb evaluations involve the product of charges)
         scale_factor = (E_C_Tot_AA/E_C_Tot_UA)**(0.5)
@@ -979,13 +925,15 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
 #         print "{:40} {:< 12.6f} (kcal/mol)".format("Rescaled United-atom EC_tot:",E_C_Tot_UA)
 
     # Calculate interaction energies with the coulombic contribution subtracted out
-    for i in Names:
+    E_C_AA = coul_vector(Names,'AA')
+    E_C_UA = coul_vector(Names,'UA')
+    for count_i,i in enumerate(Names):
         if "dft" in job_type:
-            Data[i]["e_dft_fit_AA"] = Data[i]["e_dft"] - E_C_Tot(i,'AA')       # DFT fit potential (subtracted electrostatic component)
-            Data[i]["e_dft_fit_UA"] = Data[i]["e_dft"] - E_C_Tot(i,'UA')       # DFT fit potential (subtracted electrostatic component)
+            Data[i]["e_dft_fit_AA"] = Data[i]["e_dft"] - E_C_AA[count_i]       # DFT fit potential (subtracted electrostatic component)
+            Data[i]["e_dft_fit_UA"] = Data[i]["e_dft"] - E_C_UA[count_i]       # DFT fit potential (subtracted electrostatic component)
         if "mp2" in job_type:
-            Data[i]["e_mp2_fit_AA"] = Data[i]["e_mp2"] - E_C_Tot(i,'AA')       # MP2 fit potential (subtracted electrostatic component)
-            Data[i]["e_mp2_fit_UA"] = Data[i]["e_mp2"] - E_C_Tot(i,'UA')       # MP2 fit potential (subtracted electrostatic component)
+            Data[i]["e_mp2_fit_AA"] = Data[i]["e_mp2"] - E_C_AA[count_i]       # MP2 fit potential (subtracted electrostatic component)
+            Data[i]["e_mp2_fit_UA"] = Data[i]["e_mp2"] - E_C_UA[count_i]       # MP2 fit potential (subtracted electrostatic component)
 
 #         # Print data:
 #         print "Data[{}]['e_dft']  = {}".format(i,Data[i]["e_dft"])
@@ -996,6 +944,77 @@ def get_data(Names,functional,parse_charges=1,db_files=[],q_a=None,q_b=None):
 
     return Data,job_type
 
+# Description: Parses the single point energies (hartree) of the dimer (AB) and monomer (A,B) jobs of a configuration and the
+#              number of DFT and MP2 energies that were found. The job ordering depends on job_type (see find_jobtype).
+def scrape_energies(name,job_type):
+
+    # Parse the orca output files 
+    flag = 0
+    DFT_energy_count = 0
+    MP2_energy_count = 0
+    DFT_AB = 0.0
+    DFT_A  = 0.0
+    DFT_B  = 0.0
+    MP2_AB = 0.0
+    MP2_A  = 0.0
+    MP2_B  = 0.0
+    with open(name,'r') as output:
+        for lines in output:
+            fields = lines.split()
+
+            # The ordering of jobs for 'dft mp2': 1=dimer_DFT, 2=dimer_MP2, 3=A_DFT, 4=A_MP2, 5=B_DFT, 6=B_MP2
+            # The ordering of jobs for 'dft':     1=dimer_DFT, 2=A_DFT, 3=B_DFT
+            # The ordering of jobs for 'dft mp2': 1=dimer_MP2, 2=A_MP2, 3=B_MP2
+            if len(fields) == 5 and fields[0] == "FINAL" and fields[1] == "SINGLE" and fields[2] == "POINT" and fields[3] == "ENERGY":
+                DFT_energy_count += 1
+                # If mp2 jobs are interspersed then the HF jobs will also print "FINAL SINGLE POINT ENERGY"
+                if "dft" in job_type and "mp2" in job_type:
+                    if DFT_energy_count == 1:
+                        DFT_AB = float(fields[4])
+                    elif DFT_energy_count == 3:
+                        DFT_A  = float(fields[4])
+                    elif DFT_energy_count == 5:
+                        DFT_B  = float(fields[4])
+                # If only dft jobs are run then each FINAL SINGLE POINT ENERGY corresponds to one of the DFT jobs
+                elif "dft" in job_type:
+                    if DFT_energy_count == 1:
+                        DFT_AB = float(fields[4])
+                    elif DFT_energy_count == 2:
+                        DFT_A  = float(fields[4])
+                    elif DFT_energy_count == 3:
+                        DFT_B  = float(fields[4])
+
+            if len(fields) == 5 and fields[0] == "MP2" and fields[1] == "TOTAL" and fields[2] == "ENERGY:":
+                MP2_energy_count += 1
+                if MP2_energy_count == 1:
+                    MP2_AB = float(fields[3])
+                elif MP2_energy_count == 2:
+                    MP2_A  = float(fields[3])
+                elif MP2_energy_count == 3:
+                    MP2_B  = float(fields[3])
+                    break
+
+    return DFT_AB,DFT_A,DFT_B,MP2_AB,MP2_A,MP2_B,DFT_energy_count,MP2_energy_count
+
+# Description: Parses one configuration of the vdw fit: the elements, geometries and types of each molecule (xyz file), their
+#              charges (first CHELPG block of the output if parse_charges is 1, else the xyz file), the adjacency matrices,
+#              the pair-separation matrix (r_dist) and the energies of the output (see scrape_energies). Worker of the
+#              -procs parse in get_data; the charge averaging/balancing and the type bookkeeping are done by the caller.
+def parse_config(name,parse_charges,job_type):
+
+    config = {}
+    XYZ_file = '.'.join([ j for j in name.split('.')[:-1] ])+'.xyz'
+    if parse_charges == 1:
+        config['elem_a'],config['elem_b'],config['geo_a'],config['geo_b'],config['types_a'],config['types_b'] = scrape_xyz(XYZ_file,parse_charges=0)
+        config['charges_a'],config['charges_b'] = scrape_charges(name,config['types_a'],config['types_b'])
+    else:
+        config['elem_a'],config['elem_b'],config['geo_a'],config['geo_b'],config['types_a'],config['types_b'],config['charges_a'],config['charges_b'] = scrape_xyz(XYZ_file,parse_charges=1)
+    config['adj_mat_a'] = Table_generator(config['elem_a'],config['geo_a'])
+    config['adj_mat_b'] = Table_generator(config['elem_b'],config['geo_b'])
+    config['r_dist']    = cdist(config['geo_a'],config['geo_b'])
+    config['energies']  = scrape_energies(name,job_type)
+    return config
+
 # Description: scrape charges from the supplied db file. Any charges read from the file are used regardless of the
 #              charge parsing option.
 def grab_db_charges(db_files):
@@ -1014,46 +1033,16 @@ def grab_db_charges(db_files):
 #              of the QC calculation. 
 def scrape_charges(filename,atomtypes_a,atomtypes_b):
 
-    # Read in the charges
-    charges_flag  = 0
-    break_flag    = 0
-    charges_count = 0
+    # Read in the charges of the first CHELPG block (molecule a, then molecule b). Charges missing from the
+    # output (no CHELPG block, or a truncated one) are left at zero.
     charges_a = np.zeros(len(atomtypes_a))
     charges_b = np.zeros(len(atomtypes_b))
-    with open(filename,'r') as f:
-        for count,lines in enumerate(f):
-            fields = lines.split()
-
-            # Break after all charges have been read
-            if break_flag == 1:
-                break
-
-            # Find the start of the first CHELPG calculation
-            if len(fields) == 2 and fields[0] == "CHELPG" and fields[1] == "Charges":
-                charges_flag = 1
-                continue
-
-            # Necessary because of a "------" filler line in the Orca CHELPG output
-            if charges_flag == 1:
-                charges_flag = 2
-                continue
-
-            # Start parsing charges in molecule b
-            if charges_flag == 3:
-                charges_b[charges_count-len(charges_a)] = float(fields[3])
-                charges_count += 1
-
-                # Once all charges have been read reset the count and flag.
-                if charges_count == len(charges_a)+len(charges_b):
-                    break_flag = 1
-
-            # Start parsing charges in molecule a
-            if charges_flag == 2:
-                charges_a[charges_count] = float(fields[3])
-                charges_count += 1
-                if charges_count == len(charges_a):
-                    charges_flag += 1
-    
+    chelpg    = parse_orca(filename)["chelpg"]
+    if len(chelpg) > 0:
+        charges = chelpg[0][:len(atomtypes_a)+len(atomtypes_b)]
+        N_a     = min(len(charges),len(atomtypes_a))
+        charges_a[:N_a] = charges[:N_a]
+        charges_b[:len(charges)-N_a] = charges[N_a:]
 
     # Average over like types of molecule a
     for i in sorted(set(atomtypes_a)):
@@ -1517,22 +1506,54 @@ def Fit_pairs(Folder,Data,fit,weight,delta_xhi2_thresh,min_cycles,max_cycles,FF_
 # outputs the coulomb contribution to the interaction energy of a pair of molecules
 def E_C_Tot(ind,type):
 
-    # Initialize the energy
-    E_C = 0.0
-
     # Calculate the atoms_A atom_B separations
     r_dist = cdist(Data[str(ind)]['geo_a'],Data[str(ind)]['geo_b'])
 
-    # Cumulatively add up the electrostatic energy
-    for count_i,i in enumerate(r_dist):
-        for count_j,j in enumerate(i):
-            if type == 'AA':
-                E_C += ( Data[str(ind)]["charges_a"][count_i]*Data[str(ind)]["charges_b"][count_j] / j )*Ecoul_Const
-            elif type == 'UA':
-                E_C += ( Data[str(ind)]["charges_a_UA"][count_i]*Data[str(ind)]["charges_b_UA"][count_j] / j )*Ecoul_Const
-
-    return E_C
+    # Sum the electrostatic energy over all A-B pairs at once
+    if type == 'AA':
+        return np.sum(np.outer(Data[str(ind)]["charges_a"],Data[str(ind)]["charges_b"]) / r_dist)*Ecoul_Const
+    elif type == 'UA':
+        return np.sum(np.outer(Data[str(ind)]["charges_a_UA"],Data[str(ind)]["charges_b_UA"]) / r_dist)*Ecoul_Const
+    return 0.0
+
+# Returns an array holding the coulomb contribution (see E_C_Tot) for each configuration in ind
+def coul_vector(ind,type):
+    return np.array([ E_C_Tot(i,type) for i in ind ])
+
+# Description: Packs the per-configuration pair moments (the "pair_vector-6" and "pair_vector-12" arrays generated by get_data)
+#              into dense matrices so that the LJ energies of all configurations are evaluated with matrix-vector products.
+#              The columns are the union of the "pair_type_vector" entries of the configurations (in order of first appearance),
+#              so this also works when the configurations don't share the same set of pair types.
+#
+# Inputs:      ind:  list of keys in Data for the configurations
+#              data: optional, the configuration dictionary (defaults to the global Data)
+#
+# Returns:     pair_types: list of the pair types indexing the columns
+#              R6:         (len(ind),len(pair_types)) array holding the sum of r^-6 for each configuration and pair type 
+#              R12:        (len(ind),len(pair_types)) array holding the sum of r^-12 for each configuration and pair type
+def pack_pair_moments(ind,data=None):
+
+    if data is None:
+        data = Data
+
+    # Assign a column to each pair type
+    pair_types = []
+    type_index = {}
+    for d in ind:
+        for j in data[d]["pair_type_vector"]:
+            if j not in type_index:
+                type_index[j] = len(pair_types)
+                pair_types += [j]
+
+    # Fill in the moment matrices
+    R6  = np.zeros([len(ind),len(pair_types)])
+    R12 = np.zeros([len(ind),len(pair_types)])
+    for count_d,d in enumerate(ind):
+        cols = [ type_index[j] for j in data[d]["pair_type_vector"] ]
+        R6[count_d,cols]  = data[d]["pair_vector-6"]
+        R12[count_d,cols] = data[d]["pair_vector-12"]
 
+    return pair_types,R6,R12
 
 # This function expects data to be a globally defined dictionary. The function
 # outputs the LJ contribution to the interaction energy of a pair of molecules
@@ -1540,14 +1561,10 @@ def E_LJ_Tot(ind):
 
     global Data,VDW_dict
 
-    # Initialize the energy
-    E_LJ = 0
-    
-    # Iterate over list of pair-seps for each pair-type (Data[d]["pairs"] is a dictionary with keys for each pair type linked to arrays of the instances of pair separations for that type)
-    for i in list(Data[ind]["pairs"].keys()):
-        E_LJ += sum( ( 4.0*VDW_dict[i][0]*VDW_dict[i][1]**(12.0)*Data[ind]["pairs"][i]**(-12.0) - 4.0*VDW_dict[i][0]*VDW_dict[i][1]**(6.0)*Data[ind]["pairs"][i]**(-6.0) ) )
-
-    return E_LJ
+    # The pair moments are stored per pair type (see get_data), so the energy is a dot product
+    eps_array   = np.array([ VDW_dict[i][0] for i in Data[ind]["pair_type_vector"] ])
+    sigma_array = np.array([ VDW_dict[i][1] for i in Data[ind]["pair_type_vector"] ])
+    return np.sum( 4.0*eps_array*sigma_array**(12.0)*Data[ind]["pair_vector-12"] - 4.0*eps_array*sigma_array**(6.0)*Data[ind]["pair_vector-6"] )
 
 # This function expects data to be a globally defined dictionary. The function
 # outputs the Buckingham contribution to the interaction energy of a pair of molecules
@@ -1555,14 +1572,11 @@ def E_BUCK_Tot(ind):
 
     global Data,VDW_dict
 
-    # Initialize the energy
-    E_BUCK = 0
-    
-    # Iterate over list of pair-seps for each pair-type (Data[d]["pairs"] is a dictionary with keys for each pair type linked to arrays of the instances of pair separations for that type)
-    for i in list(Data[ind]["pairs"].keys()):
-        E_BUCK += sum( ( VDW_dict[i][0]*exp(-Data[ind]["pairs"][i]/VDW_dict[i][1]) - VDW_dict[i][2]*Data[ind]["pairs"][i]**(-6.0) ) )
-
-    return E_BUCK
+    # "pair_seps" holds every A-B separation and "pair_seps_type" the index of its type in "pair_type_vector"
+    A,B,C = np.array([ VDW_dict[i][:3] for i in Data[ind]["pair_type_vector"] ]).reshape(-1,3).T
+    r = Data[ind]["pair_seps"]
+    t = Data[ind]["pair_seps_type"]
+    return np.sum( A[t]*np.exp(-r/B[t]) - C[t]*r**(-6.0) )
 
 # def E_LJ_Type_test(type,VDW_new):
 
@@ -1750,7 +1764,7 @@ def E_LJ_Type(type):
 
 # Returns the LJ energy for each configuration (as an array) using the parameters currently defined in VDW_dict
 # and the supplied parameters for the type being fit (fit_type is globally defined outside of the function). 
-def E_LJ_Fit(ind,eps_fit,sigma_fit):
+def E_LJ_Fit(ind,eps_fit,sigma_fit,moments=None):
 
     # In python you need to expand the scope of global variables at every level
     global VDW_dict,fit_type,Pair_min_dict
@@ -1759,24 +1773,17 @@ def E_LJ_Fit(ind,eps_fit,sigma_fit):
     # NOTE: the restriction on sigma_min is to stop the minimum of the fit potential from lieing outside of the sampled configuration space
     if fit_type in list(Pair_min_dict.keys()) and ( eps_fit < 0.001 or eps_fit > 30.0 or sigma_fit > 10.0 or sigma_fit < Pair_min_dict[fit_type]*2.**(-1./6.) ): return np.ones(len(ind))*1.E20        
 
-    # Initialize E_LJ for the current configuration 
-    E_LJ = np.zeros(len(ind))
-
-    # Initialize eps and sigma arrays for the vectorized calculations
-    eps_array = np.array([ VDW_dict[i][0] for i in Data[ind[0]]["pair_type_vector"] ])
-    sigma_array = np.array([ VDW_dict[i][1] for i in Data[ind[0]]["pair_type_vector"] ])
+    # Initialize eps and sigma arrays for the vectorized calculations (the moments are packed once per fit)
+    pair_types,R6,R12 = cached_pair_moments(ind,Data,moments)
+    eps_array = np.array([ VDW_dict[i][0] for i in pair_types ])
+    sigma_array = np.array([ VDW_dict[i][1] for i in pair_types ])
 
-    for i in [ count_j for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j == fit_type or (j[1],j[0]) == fit_type ) ]:        
+    for i in [ count_j for count_j,j in enumerate(pair_types) if ( j == fit_type or (j[1],j[0]) == fit_type ) ]:        
         eps_array[i]   = eps_fit
         sigma_array[i] = sigma_fit
 
-    # Iterate over the configuration index
-    for count_d,d in enumerate(ind):
-
-        # Iterate over list of pair-seps for each pair-type (Data[d]["pairs"] is a dictionary with keys for each pair type linked to arrays of the instances of pair separations for that type)
-        E_LJ[count_d] = sum( ( 4.0*eps_array*sigma_array**(12.0)*Data[d]["pair_vector-12"] - 4.0*eps_array*sigma_array**(6.0)*Data[d]["pair_vector-6"] ) )
-
-    return E_LJ
+    # Calculate the LJ energy of all configurations at once
+    return R12.dot(4.0*eps_array*sigma_array**(12.0)) - R6.dot(4.0*eps_array*sigma_array**(6.0))
 
 # Returns the BUCK energy for each configuration (as an array) using the parameters currently defined in VDW_dict
 # and the supplied parameters for the type being fit (fit_type is globally defined outside of the function). 
@@ -2460,9 +2467,12 @@ def lstsq_fit(x_vals,y_vals,Pairs,fit):
     # In python you need to expand the scope of global variables at every level
     global VDW_dict,fit_type,Pair_min_dict
 
+    # Pack the pair moments of the configurations once for the E_LJ_Fit* evaluations of the fit
+    moments = cached_pair_moments(x_vals,Data) if fit.lower() == 'lj' else None
+
     # Calculate the Fit xhi2 using UFF parameters (Here E_LJ_Fit is just a function for calculating the fit energies of all configurations)
     fit_type = 0 # dummy value so that all pair-potentials are taken from VDW_dict (see E_LJ_Fit for more details)
-    fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0) ] 
+    fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0,moments=moments) ] 
     xhi2_UFF = np.mean((y_vals-fit_vals[0])**2) 
 
     b = y_vals                       # The binding energy of each configuration is used as the fit vector
@@ -2496,7 +2506,7 @@ def lstsq_fit(x_vals,y_vals,Pairs,fit):
 
     # Calculate the Fit xhi2 using the lstsq parameters (Here E_LJ_Fit is just a function for calculating the fit energies of all configurations)
     fit_type = 0 # dummy value so that all pair-potentials are taken from VDW_dict (see E_LJ_Fit for more details)
-    fit_vals += [ E_LJ_Fit(x_vals,0.0,0.0) ] 
+    fit_vals += [ E_LJ_Fit(x_vals,0.0,0.0,moments=moments) ] 
     xhi2_lstsq = np.mean((y_vals-fit_vals[1])**2) 
     
     # Print diagnostic
@@ -2525,6 +2535,9 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
     # In python you need to expand the scope of global variables at every level
     global VDW_dict,fit_type,Pair_min_dict,Data
 
+    # Pack the pair moments of the configurations once for the E_LJ_Fit* evaluations of the fit
+    moments = cached_pair_moments(x_vals,Data) if fit.lower() == 'lj' else None
+
     # BOTH OF THE SELF TERMS NEED TO BE DEFINED FOR MIXING RULES TO BE SENSIBLY APPLIED
     if mixing_rule in ['wh','lb']:
         # Pairs = [ (k,k) for k in set([ j for i in Pairs for j in i ]) ] # OLD
@@ -2538,7 +2551,7 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
     cycle_count = 0
 
     if fit == 'lj':
-        fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0) ] * (max_cycles+5)
+        fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0,moments=moments) ] * (max_cycles+5)
     elif fit == 'buck':
         fit_vals = [ E_BUCK_Fit(x_vals,0.0,0.0,0.0) ] * (max_cycles+5)
     else:
@@ -2549,30 +2562,23 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
     # If no pairs are being fit (as happens if only UA types are being fit and AA are being read from file) just return the fit_vals
     if len(Pairs) == 0: print(" "); return fit_vals[:cycle_count+1]
 
-    # Check the rank of the fit data by assembling the lstsq fit matrix
-    if fit in ['lj','buck'] :
-        A = np.zeros([len(x_vals),len(Pairs)*2]) # For the lj fit there are 2 linearly parameters per pair type (A,B). The rank of the LJ matrix is used in place of the buck 
-                                              # A matrix owing to the non-linearity of the buckingham potential
-    # Build up A matrix
-    for count_i,i in enumerate(x_vals):
-        for count_j,j in enumerate(Pairs):
+    # Resolve the parameter layout once. The r^-6 and r^-12 moments (packed above) are used for the rank check and are
+    # passed to the objective function so that each evaluation is a pair of matrix-vector products. Both are kept by
+    # cached_lj_fit_setup for the global_fit_LJ* evaluations and later fits of these configurations.
+    moments,setup = cached_lj_fit_setup(x_vals,Data,Pairs,VDW_dict,mixing_rule=mixing_rule,moments=moments)
+    pair_types,R6,R12 = moments
+    type_index = { j:count_j for count_j,j in enumerate(pair_types) }
 
-            if fit in ['lj','buck']:
-                # Pairs only contains I J or J I combinations whereas Data[i]["pairs"] has both combinations
-                # To be consistent the contributions from both I J and J I configurations need to be added to 
-                # the elements of A
-                tmp_6 = 0.0
-                tmp_12 = 0.0
-
-                if (j[0],j[1]) in list(Data[i]["pairs"].keys()):
-                    tmp_6  += sum(Data[i]["pairs"][(j[0],j[1])]**(-6.0))
-                    tmp_12 += sum(Data[i]["pairs"][(j[0],j[1])]**(-12.0))
-                if j[0] != j[1] and (j[1],j[0]) in list(Data[i]["pairs"].keys()):
-                    tmp_6  += sum(Data[i]["pairs"][(j[1],j[0])]**(-6.0))
-                    tmp_12 += sum(Data[i]["pairs"][(j[1],j[0])]**(-12.0))
-
-                A[count_i,(count_j*2)+0] += tmp_12
-                A[count_i,(count_j*2)+1] -= tmp_6
+    # Check the rank of the fit data by assembling the lstsq fit matrix
+    # For the lj fit there are 2 linearly parameters per pair type (A,B). The rank of the LJ matrix is used in place of the buck 
+    # A matrix owing to the non-linearity of the buckingham potential
+    # (pair_type_vector already holds the I J and J I contributions for each pair type)
+    A = np.zeros([len(x_vals),len(Pairs)*2])
+    for count_j,j in enumerate(Pairs):
+        col = type_index.get(j,type_index.get((j[1],j[0])))
+        if col is not None:
+            A[:,(count_j*2)+0] += R12[:,col]
+            A[:,(count_j*2)+1] -= R6[:,col]
 
     # Calculate the rank of the fit matrix
     rank = matrix_rank(A)
@@ -2591,22 +2597,14 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
     if VDW_0 is None:
         VDW_0 = deepcopy(VDW_dict)
 
+    # The fit functions return the objective and its analytic gradient (fit_func works with eps and sigma directly,
+    # fit_func_pos with their square roots)
+    outlier = []
     if outlier_option:
         Mi,outlier = detect_outlier(y_vals)   
         print("Number of outliers removed: {}".format(len([out for out in outlier if out])))
-        fit_func = lambda x: global_fit_LJ(*x,ind=x_vals,outlier=outlier,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,\
-                                      Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_sigma=L2_s,L2_eps=L2_e,VDW_0=VDW_0)
-        fit_func_pos = lambda x,**kw: global_fit_LJ_pos(*x,ind=x_vals,outlier=outlier,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,\
-                                      Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_sigma=L2_s,L2_eps=L2_e,VDW_0=VDW_0,**kw)
-
-    else:
-        # Initialize anonymous fit function
-        fit_func = lambda x: global_fit_LJ(*x,ind=x_vals,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,\
-                                         Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_sigma=L2_s,L2_eps=L2_e,VDW_0=VDW_0)
-        # positive fitting function(fit sqrt(eps) and sqrt(sigma))
-        fit_func_pos = lambda x,**kw: global_fit_LJ_pos(*x,ind=x_vals,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,\
-                                         Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_sigma=L2_s,L2_eps=L2_e,VDW_0=VDW_0,**kw)
-#    fit_func = lambda x: global_fit_LJ(*x,ind=x_vals,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_weight=L2_weight)
+    fit_func = lambda x: lj_fit_objective(x,setup,y_vals,outlier=outlier,L2_sigma=L2_s,L2_eps=L2_e,VDW_0=VDW_0)
+    fit_func_pos = lambda x: lj_fit_objective(x,setup,y_vals,outlier=outlier,L2_sigma=L2_s,L2_eps=L2_e,VDW_0=VDW_0,sqrt_params=True)
 
     # Initialize guesses and parameter bounds
     initial_guess = []
@@ -2627,7 +2625,7 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
     if fit.lower() == "lj":
         #results = minimize(fit_func,initial_guess,bounds=bounds,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':delta_xhi2_thresh})
         #new_params = results.x
-        results = minimize(fit_func_pos,initial_guess_sqrt,bounds=bounds_sqrt,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':delta_xhi2_thresh})
+        results = minimize(fit_func_pos,initial_guess_sqrt,jac=True,bounds=bounds_sqrt,method='L-BFGS-B',options={'maxiter':1000000,'maxfun':1000000,'ftol':delta_xhi2_thresh})
         new_params = results.x**2.0
 
     # Print diagnostics
@@ -2635,10 +2633,8 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
         print("\t{:<30s} {:<12s}".format("Fit termination condition:","Converged"))
     else:
         print("\t{:<30s} {:<12s}".format("Fit termination condition:","Unconverged"))
-    print("\t{:<30s} {:<12.6f}".format("Initial xhi^2 (kcal/mol):",global_fit_LJ(*initial_guess,ind=x_vals,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,\
-                                                                                 Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_sigma=0.0,L2_eps=0.0)))
-    print("\t{:<30s} {:<12.6f}".format("Final xhi^2 (kcal/mol):",global_fit_LJ(*new_params,ind=x_vals,E_config=y_vals,VDW_dict=VDW_dict,Data=Data,Fit_Pairs=Pairs,\
-                                                                               Pair_min_dict=Pair_min_dict,penalty=0.0,mixing_rule=mixing_rule,L2_sigma=0.0,L2_eps=0.0)))
+    print("\t{:<30s} {:<12.6f}".format("Initial xhi^2 (kcal/mol):",lj_fit_objective(initial_guess,setup,y_vals,jac=False)))
+    print("\t{:<30s} {:<12.6f}".format("Final xhi^2 (kcal/mol):",lj_fit_objective(new_params,setup,y_vals,jac=False)))
     print("\t{:<30s} {:<12.6f}".format("Time for completion (s):",time.time()-t0))
 
     # Update the VDW_dict    
@@ -2673,9 +2669,227 @@ def global_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_cycl
 
     # Calculate fit values and xhi2 with final fit parameters
     if fit.lower() == "lj":
-        fit_vals[1] = E_LJ_Fit(x_vals,0.0,0.0)
+        fit_vals[1] = E_LJ_Fit(x_vals,0.0,0.0,moments=moments)
     return fit_vals[:2]  # only return the result of using final fit params and UFF 
 
+# Description: Resolves the parameter layout of the global LJ fit once, so that lj_fit_objective can evaluate the
+#              objective and its analytic gradient with a few vectorized operations. The fit parameters are held in a 
+#              flat vector x = [ e_0, s_0, e_1, s_1, ... ] indexed to Fit_Pairs (the same order as the e_*/s_* arguments
+#              of global_fit_LJ). For each pair-type column of moments, the setup records which fit parameters determine
+#              its eps and sigma, and the VDW_dict self-terms used for the types that are held fixed by the mixing rule.
+#
+# Inputs:      Fit_Pairs:   list of the pair types being fit
+#              VDW_dict:    dictionary holding the current (eps,sigma) tuple of each pair type
+#              moments:     the (pair_types,R6,R12) tuple returned by pack_pair_moments
+#              mixing_rule: "none", "lb", or "wh"
+#
+# Returns:     setup:       dictionary consumed by lj_fit_objective
+def lj_fit_setup(Fit_Pairs,VDW_dict,moments,mixing_rule="none"):
+
+    pair_types,R6,R12 = moments
+    setup = { "R6":R6, "R12":R12, "N_fit":len(Fit_Pairs), "mixing_rule":mixing_rule,\
+              "eps":np.array([ VDW_dict[i][0] for i in pair_types ],dtype=float), "sigma":np.array([ VDW_dict[i][1] for i in pair_types ],dtype=float) }
+    
+    # Without mixing, each column of a fit pair (in either order) takes that pair's parameters 
+    if mixing_rule == "none":
+        fit_cols = {}
+        for count_c,c in enumerate(Fit_Pairs):
+            for count_j,j in enumerate(pair_types):
+                if j == c or (j[1],j[0]) == c:
+                    fit_cols[count_j] = count_c
+        setup["cols"] = np.array(list(fit_cols.keys()),dtype=int)
+        setup["ind"]  = np.array(list(fit_cols.values()),dtype=int)
+
+    # With mixing, every column involving a fit type is generated from the self-terms. ind_a/ind_b hold the index of 
+    # the fit type on each side of the pair (-1 if that side is held at its VDW_dict self-term, stored in eps_*/sigma_*)
+    elif mixing_rule in ["wh","lb"]:
+        fit_types = { i[0]:count_i for count_i,i in enumerate(Fit_Pairs) }
+        cols  = [ count_j for count_j,j in enumerate(pair_types) if ( j[0] in fit_types or j[1] in fit_types ) ]
+        ind_a = np.array([ fit_types.get(pair_types[j][0],-1) for j in cols ],dtype=int)
+        ind_b = np.array([ fit_types.get(pair_types[j][1],-1) for j in cols ],dtype=int)
+
+        # As in the original lb loop, the fit values only enter when the first type of the pair is being fit
+        if mixing_rule == "lb":
+            ind_b[ind_a < 0] = -1
+
+        setup["cols"]    = np.array(cols,dtype=int)
+        setup["ind_a"]   = ind_a
+        setup["ind_b"]   = ind_b
+        setup["eps_a"]   = np.array([ VDW_dict[(pair_types[j][0],pair_types[j][0])][0] if ind_a[count_j] < 0 else 1.0 for count_j,j in enumerate(cols) ],dtype=float)
+        setup["sigma_a"] = np.array([ VDW_dict[(pair_types[j][0],pair_types[j][0])][1] if ind_a[count_j] < 0 else 1.0 for count_j,j in enumerate(cols) ],dtype=float)
+        setup["eps_b"]   = np.array([ VDW_dict[(pair_types[j][1],pair_types[j][1])][0] if ind_b[count_j] < 0 else 1.0 for count_j,j in enumerate(cols) ],dtype=float)
+        setup["sigma_b"] = np.array([ VDW_dict[(pair_types[j][1],pair_types[j][1])][1] if ind_b[count_j] < 0 else 1.0 for count_j,j in enumerate(cols) ],dtype=float)
+
+    else:
+        print("ERROR in lj_fit_setup: {} is not an implemented mixing rule. Exiting...".format(mixing_rule))
+        quit()
+
+    # Self pairs being fit (used by the L2 regularization against VDW_0)
+    setup["self"] = np.array([ count_i for count_i,i in enumerate(Fit_Pairs) if i[0] == i[1] ],dtype=int)
+    setup["self_pairs"] = [ i for i in Fit_Pairs if i[0] == i[1] ]
+
+    return setup
+
+# Description: Returns the (pair_types,R6,R12) moments of a configuration set (see pack_pair_moments). The last set is
+#              cached on the function (keyed on ind and Data), so the fits and their E_LJ_Fit*/global_fit_LJ* objective
+#              evaluations pack the moments once. Moments that are passed in are returned as they are.
+def cached_pair_moments(ind,Data,moments=None):
+
+    if moments is not None:
+        return moments
+    if not hasattr(cached_pair_moments,"cache"):
+        cached_pair_moments.cache = None
+    cache = cached_pair_moments.cache
+    if cache is None or cache["Data"] is not Data or cache["ind"] != list(ind):
+        cache = { "ind":list(ind), "Data":Data, "moments":pack_pair_moments(ind,Data) }
+        cached_pair_moments.cache = cache
+    return cache["moments"]
+
+# Description: Returns the (moments,setup) of the global_fit_LJ/global_fit_LJ_pos objective for a configuration set. The
+#              last setup is cached on the function, so the objective evaluations of a fit (and of the self-consistency
+#              cycles that follow, as long as the parameters held by VDW_dict don't change) skip lj_fit_setup. The
+#              moments come from cached_pair_moments; the setup is keyed on them, the fit pairs, the mixing rule and the
+#              VDW_dict values it was resolved from.
+def cached_lj_fit_setup(ind,Data,Fit_Pairs,VDW_dict,mixing_rule="none",moments=None):
+
+    if not hasattr(cached_lj_fit_setup,"cache"):
+        cached_lj_fit_setup.cache = None
+    cache   = cached_lj_fit_setup.cache
+    moments = cached_pair_moments(ind,Data,moments)
+    if cache is None or cache["moments"] is not moments:
+        cache = { "moments":moments }
+
+    # The setup reads the VDW_dict values of the packed pair types and of the self-terms of their types
+    if "vdw_keys" not in cache:
+        types = sorted(set([ j for i in moments[0] for j in i ]))
+        cache["vdw_keys"] = list(moments[0]) + [ (i,i) for i in types ]
+    key = (tuple(Fit_Pairs),mixing_rule,tuple([ tuple(VDW_dict[i]) if i in VDW_dict else None for i in cache["vdw_keys"] ]))
+    if cache.get("key") != key:
+        cache["setup"] = lj_fit_setup(Fit_Pairs,VDW_dict,moments,mixing_rule=mixing_rule)
+        cache["key"]   = key
+    cached_lj_fit_setup.cache = cache
+    return moments,cache["setup"]
+
+# Description: Parameter-vector form of the global_fit_LJ/global_fit_LJ_pos objective with its analytic gradient. 
+#              The objective is the mean squared deviation between the LJ and QC interaction energies plus the L2 terms,
+#              and the gradient is obtained by propagating the residuals back through the packed moments and the mixing 
+#              rules, so a call costs about as much as two objective evaluations regardless of the number of parameters.
+#
+# Inputs:      x:           parameter vector [ e_0, s_0, e_1, s_1, ... ] (see lj_fit_setup)
+#              setup:       dictionary returned by lj_fit_setup
+#              E_config:    QC interaction energies of the configurations (indexed to the rows of the moments)
+#              outlier:     optional boolean list, configurations flagged True are excluded from the average
+#              random_ind:  optional list of configuration indices (mini-batch); when supplied only these are averaged
+#              L2_sigma:    weight of the sigma L2 term
+#              L2_eps:      weight of the eps L2 term
+#              VDW_0:       reference VDW dictionary for the L2 terms. If None the L2 terms penalize the magnitudes instead.
+#              sqrt_params: if True x holds the square roots of eps and sigma (as in global_fit_LJ_pos)
+#              jac:         if True the gradient is returned as well (for minimize(...,jac=True))
+#
+# Returns:     xhi2, or (xhi2,gradient) if jac is True
+def lj_fit_objective(x,setup,E_config,outlier=[],random_ind=[],L2_sigma=0.0,L2_eps=0.0,VDW_0=None,sqrt_params=False,jac=True):
+
+    # Unpack the fit eps and sigma values
+    x = np.asarray(x,dtype=float)
+    if sqrt_params is True:
+        e_vals,s_vals = x[0::2]**(2.0),x[1::2]**(2.0)
+    else:
+        e_vals,s_vals = x[0::2],x[1::2]
+
+    # Assign eps and sigma to each pair-type column
+    eps_array   = setup["eps"].copy()
+    sigma_array = setup["sigma"].copy()
+    cols = setup["cols"]
+    if setup["mixing_rule"] == "none":
+        eps_array[cols]   = e_vals[setup["ind"]]
+        sigma_array[cols] = s_vals[setup["ind"]]
+    else:
+        ind_a,ind_b = setup["ind_a"],setup["ind_b"]
+        e_a = np.where(ind_a >= 0,e_vals[ind_a],setup["eps_a"])
+        s_a = np.where(ind_a >= 0,s_vals[ind_a],setup["sigma_a"])
+        e_b = np.where(ind_b >= 0,e_vals[ind_b],setup["eps_b"])
+        s_b = np.where(ind_b >= 0,s_vals[ind_b],setup["sigma_b"])
+
+        # Waldman-Hagler: sigma^6 is the mean of the sigma^6 values and eps*sigma^6 is the geometric mean
+        if setup["mixing_rule"] == "wh":
+            sig6 = ( s_a**(6.0) + s_b**(6.0) ) / 2.0
+            sigma_array[cols] = sig6**(1.0/6.0)
+            eps_array[cols]   = ( e_a*s_a**(6.0) * e_b*s_b**(6.0) )**(0.5) / sig6
+            de_a  = eps_array[cols] / ( 2.0*e_a )
+            de_b  = eps_array[cols] / ( 2.0*e_b )
+            des_a = eps_array[cols] * ( 3.0/s_a - 3.0*s_a**(5.0)/sig6 )
+            des_b = eps_array[cols] * ( 3.0/s_b - 3.0*s_b**(5.0)/sig6 )
+            ds_a  = 0.5*s_a**(5.0) / sigma_array[cols]**(5.0)
+            ds_b  = 0.5*s_b**(5.0) / sigma_array[cols]**(5.0)
+
+        # Lorentz-Berthelot: arithmetic mean of sigma and geometric mean of eps
+        else:
+            sigma_array[cols] = ( s_a + s_b ) / 2.0
+            eps_array[cols]   = ( e_a * e_b )**(0.5)
+            de_a  = eps_array[cols] / ( 2.0*e_a )
+            de_b  = eps_array[cols] / ( 2.0*e_b )
+            des_a = des_b = np.zeros(len(cols))
+            ds_a  = ds_b  = np.ones(len(cols))*0.5
+
+    # LJ energy of every configuration (one matrix-vector product per moment)
+    R6,R12 = setup["R6"],setup["R12"]
+    A = 4.0*eps_array*sigma_array**(12.0)
+    B = 4.0*eps_array*sigma_array**(6.0)
+    E_LJ = R12.dot(A) - R6.dot(B)
+
+    # Weights of each configuration in the average
+    if len(random_ind) == 0:
+        weights = np.ones(len(E_LJ)) if len(outlier) == 0 else (~np.asarray(outlier,dtype=bool)).astype(float)
+        weights /= np.sum(weights)
+    else:
+        weights = np.bincount(np.asarray(random_ind,dtype=int),minlength=len(E_LJ)) / float(len(random_ind))
+    resid = E_LJ - np.asarray(E_config,dtype=float)
+    xhi2  = np.sum(weights*resid**(2.0))
+
+    # L2 regularization
+    if VDW_0 is not None:
+        self_ind = setup["self"]
+        e_0 = np.array([ VDW_0[i][0] for i in setup["self_pairs"] ])
+        s_0 = np.array([ VDW_0[i][1] for i in setup["self_pairs"] ])
+        L2_e = np.mean((e_vals[self_ind]-e_0)**(2.0)) if len(self_ind) > 0 else 0.0
+        L2_s = np.mean((s_vals[self_ind]-s_0)**(2.0)) if len(self_ind) > 0 else 0.0
+    else:
+        L2_e = np.mean(eps_array**(2.0))
+        L2_s = np.mean(sigma_array**(2.0))
+    if jac is False:
+        return xhi2 + L2_sigma*L2_s + L2_eps*L2_e
+
+    # Gradient with respect to the eps and sigma of each column
+    g_E = 2.0*weights*resid
+    g12 = R12.T.dot(g_E)
+    g6  = R6.T.dot(g_E)
+    g_eps   = 4.0*sigma_array**(12.0)*g12 - 4.0*sigma_array**(6.0)*g6
+    g_sigma = 48.0*eps_array*sigma_array**(11.0)*g12 - 24.0*eps_array*sigma_array**(5.0)*g6
+    if VDW_0 is None:
+        g_eps   += L2_eps*2.0*eps_array/len(eps_array)
+        g_sigma += L2_sigma*2.0*sigma_array/len(sigma_array)
+
+    # Chain rule back to the fit parameters 
+    N_fit = setup["N_fit"]
+    if setup["mixing_rule"] == "none":
+        g_e = np.bincount(setup["ind"],weights=g_eps[cols],minlength=N_fit)
+        g_s = np.bincount(setup["ind"],weights=g_sigma[cols],minlength=N_fit)
+    else:
+        g_e = np.zeros(N_fit)
+        g_s = np.zeros(N_fit)
+        for ind,de,des,ds in [ (ind_a,de_a,des_a,ds_a),(ind_b,de_b,des_b,ds_b) ]:
+            m = ind >= 0
+            g_e += np.bincount(ind[m],weights=(g_eps[cols]*de)[m],minlength=N_fit)
+            g_s += np.bincount(ind[m],weights=(g_eps[cols]*des+g_sigma[cols]*ds)[m],minlength=N_fit)
+    if VDW_0 is not None and len(self_ind) > 0:
+        g_e[self_ind] += L2_eps*2.0*(e_vals[self_ind]-e_0)/len(self_ind)
+        g_s[self_ind] += L2_sigma*2.0*(s_vals[self_ind]-s_0)/len(self_ind)
+    if sqrt_params is True:
+        g_e *= 2.0*x[0::2]
+        g_s *= 2.0*x[1::2]
+
+    return xhi2 + L2_sigma*L2_s + L2_eps*L2_e, np.column_stack((g_e,g_s)).flatten()
+
 def global_fit_LJ_pos(e_0=0, s_0=0, e_1=0,  s_1=0,  e_2=0,  s_2=0,  e_3=0,  s_3=0,  e_4=0,  s_4=0,  e_5=0,  s_5=0,  e_6=0,  s_6=0,  e_7=0,  s_7=0,  e_8=0,  s_8=0,  e_9=0,  s_9=0,  e_10=0, s_10=0,\
                                 e_11=0, s_11=0, e_12=0, s_12=0, e_13=0, s_13=0, e_14=0, s_14=0, e_15=0, s_15=0, e_16=0, s_16=0, e_17=0, s_17=0, e_18=0, s_18=0, e_19=0, s_19=0, e_20=0, s_20=0,\
                                 e_21=0, s_21=0, e_22=0, s_22=0, e_23=0, s_23=0, e_24=0, s_24=0, e_25=0, s_25=0, e_26=0, s_26=0, e_27=0, s_27=0, e_28=0, s_28=0, e_29=0, s_29=0, e_30=0, s_30=0,\
@@ -2696,7 +2910,7 @@ def global_fit_LJ_pos(e_0=0, s_0=0, e_1=0,  s_1=0,  e_2=0,  s_2=0,  e_3=0,  s_3=
                                 e_171=0,s_171=0,e_172=0,s_172=0,e_173=0,s_173=0,e_174=0,s_174=0,e_175=0,s_175=0,e_176=0,s_176=0,e_177=0,s_177=0,e_178=0,s_178=0,e_179=0,s_179=0,e_180=0,s_180=0,\
                                 e_181=0,s_181=0,e_182=0,s_182=0,e_183=0,s_183=0,e_184=0,s_184=0,e_185=0,s_185=0,e_186=0,s_186=0,e_187=0,s_187=0,e_188=0,s_188=0,e_189=0,s_189=0,e_190=0,s_190=0,\
                                 e_191=0,s_191=0,e_192=0,s_192=0,e_193=0,s_193=0,e_194=0,s_194=0,e_195=0,s_195=0,e_196=0,s_196=0,e_197=0,s_197=0,e_198=0,s_198=0,e_199=0,s_199=0,e_200=0,s_200=0,\
-                                ind=[],outlier=[],E_config=[],VDW_dict=[],Data=[],Fit_Pairs=[],Pair_min_dict=[],penalty=100.0,mixing_rule="none",L2_sigma=0.0,L2_eps=0.0,VDW_0=None,random_ind=[]):
+                                ind=[],outlier=[],E_config=[],VDW_dict=[],Data=[],Fit_Pairs=[],Pair_min_dict=[],penalty=100.0,mixing_rule="none",L2_sigma=0.0,L2_eps=0.0,VDW_0=None,moments=None,random_ind=[]):
 
     # Initialize local variable dictionary (used for determining what has been defined)
     local_vars = locals()
@@ -2709,112 +2923,14 @@ def global_fit_LJ_pos(e_0=0, s_0=0, e_1=0,  s_1=0,  e_2=0,  s_2=0,  e_3=0,  s_3=
     if len(e_vals) != len(Fit_Pairs):
         print("ERROR in global_fit_LJ: the function expects the len(Fit_Pairs) and number of non-zero e_* variable to be equal. Exiting...")
         quit()
+    if len(random_ind) != 0 and len(outlier) != 0:
+        print("WARNING: remove outlier function is not supported for mini batch")
 
-    # Initialize eps and sigma arrays for the vectorized calculations
-    eps_array = np.array([ VDW_dict[i][0] for i in Data[ind[0]]["pair_type_vector"] ])
-    sigma_array = np.array([ VDW_dict[i][1] for i in Data[ind[0]]["pair_type_vector"] ])
-
-    # Update the elements being fit with the corresponding e_vals and s_vals
-    for count_c,c in enumerate(Fit_Pairs):        
-        for i in [ count_j for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j == c or (j[1],j[0]) == c ) ]:        
-            eps_array[i]   = e_vals[count_c]**2.0
-            sigma_array[i] = s_vals[count_c]**2.0
-
-    # Apply mixing rules
-    # If/else conditions handle cases where one or both of the involved types is in the fit set 
-    if mixing_rule == "wh":
-        fit_types = { i[0]:count_i for count_i,i in enumerate(Fit_Pairs) }
-        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] in fit_types or j[1] in fit_types )]:            
-            #print "\ntarget: {}".format(i)
-            if i[0] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),e_vals[fit_types[i[0]]],s_vals[fit_types[i[0]]])
-                if i[1] in fit_types:
-                    #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-                    sigma_array[count_i] = (( s_vals[fit_types[i[0]]]**(12.0) + s_vals[fit_types[i[1]]]**(12.0) ) / 2.0 )**(1.0/6.0)
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]]**(2.0)*s_vals[fit_types[i[0]]]**(12.0) * e_vals[fit_types[i[1]]]**(2.0)*s_vals[fit_types[i[1]]]**(12.0) )**(0.5) / sigma_array[count_i]**(6.0)
-                else:
-                    #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])
-                    sigma_array[count_i] = (( s_vals[fit_types[i[0]]]**(12.0) + VDW_dict[(i[1],i[1])][1]**(6.0) ) / 2.0 )**(1.0/6.0)
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]]**(2.0)*s_vals[fit_types[i[0]]]**(12.0) * VDW_dict[(i[1],i[1])][0]*VDW_dict[(i[1],i[1])][1]**(6.0) )**(0.5) / sigma_array[count_i]**(6.0)
-            elif i[1] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])                
-                #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-
-                sigma_array[count_i] = (( s_vals[fit_types[i[1]]]**(12.0) + VDW_dict[(i[0],i[0])][1]**(6.0) ) / 2.0 )**(1.0/6.0)
-                eps_array[count_i]   = (e_vals[fit_types[i[1]]]**(2.0)*s_vals[fit_types[i[1]]]**(12.0) * VDW_dict[(i[0],i[0])][0]*VDW_dict[(i[0],i[0])][1]**(6.0) )**(0.5) / sigma_array[count_i]**(6.0)
-            #print "result: {},{}".format(eps_array[count_i],sigma_array[count_i])
-#        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] not in fit_types and j[1] not in fit_types )]:            
-            #print "\ntarget (2): {}".format(i)
-            #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])    
-            #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])            
-            #print "result: {},{}".format(VDW_dict[i][0],VDW_dict[i][1])
-
-    elif mixing_rule == "lb":
-        fit_types = { i[0]:count_i for count_i,i in enumerate(Fit_Pairs) }
-
-        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] in fit_types or j[1] in fit_types )]:            
-            #print "\ntarget: {}".format(i)
-            if i[0] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),e_vals[fit_types[i[0]]],s_vals[fit_types[i[0]]])
-                if i[1] in fit_types:
-                    #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-                    sigma_array[count_i] = (s_vals[fit_types[i[0]]]**2 + s_vals[fit_types[i[1]]]**2 ) / 2.0 
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]]**2 * e_vals[fit_types[i[1]]]**2 )**(0.5)
-                else:
-                    #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])
-                    sigma_array[count_i] = (s_vals[fit_types[i[0]]]**2 + VDW_dict[(i[1],i[1])][1] ) / 2.0 
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]]**2 * VDW_dict[(i[1],i[1])][0] )**(0.5)
-            elif i[1] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])                
-                #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-                sigma_array[count_i] = (VDW_dict[(i[0],i[0])][1] + VDW_dict[(i[1],i[1])][1] ) / 2.0 
-                eps_array[count_i]   = (VDW_dict[(i[0],i[0])][0] * VDW_dict[(i[1],i[1])][0] )**(0.5)
-            #print "result: {},{}".format(eps_array[count_i],sigma_array[count_i])
-#        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] not in fit_types and j[1] not in fit_types )]:            
-            #print "\ntarget (2): {}".format(i)
-            #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])    
-            #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])            
-            #print "result: {},{}".format(VDW_dict[i][0],VDW_dict[i][1])
-
-
-    # Initialize L2 regularization sums
-    if VDW_0 is not None:
-
-        # only loop over the values in the sigma and eps arrays (they are the only ones that affect the fit!)
-        L2_e = np.mean([ (e_vals[count_i]**2.0-VDW_0[i][0])**(2.0) for count_i,i in enumerate(Fit_Pairs) if i[0] == i[1] ]) 
-        L2_s = np.mean([ (s_vals[count_i]**2.0-VDW_0[i][1])**(2.0) for count_i,i in enumerate(Fit_Pairs) if i[0] == i[1] ]) 
-
-    else:
-        L2_e = np.mean(eps_array**(2.0))
-        L2_s = np.mean(sigma_array**(2.0))
-        
-    # Initialize E_LJ for the current configuration
-    xhi2 = 0
-
-    #print(sigma_array)
-
-    if len(random_ind) == 0:
-       data_count = 0
-       # Iterate over the configuration index
-       for count_d,d in enumerate(ind):
-            
-           if len(outlier) != 0:
-               if outlier[count_d]: continue
-           data_count += 1
-           # Iterate over list of pair-seps for each pair-type (Data[d]["pairs"] is a dictionary with keys for each pair type linked to arrays of the instances of pair separations for that type)
-           xhi2 += ( sum( ( 4.0*eps_array*sigma_array**(12.0)*Data[d]["pair_vector-12"] - 4.0*eps_array*sigma_array**(6.0)*Data[d]["pair_vector-6"] ) ) - E_config[count_d] )**(2.0)
-
-       xhi2 /= float(data_count)
+    # Evaluate the objective with the parameter-vector form (the e_* and s_* values are the square roots of eps and sigma)
+    moments,setup = cached_lj_fit_setup(ind,Data,Fit_Pairs,VDW_dict,mixing_rule=mixing_rule,moments=moments)
+    x = np.column_stack((e_vals,s_vals)).flatten()
+    return lj_fit_objective(x,setup,E_config,outlier=outlier,random_ind=random_ind,L2_sigma=L2_sigma,L2_eps=L2_eps,VDW_0=VDW_0,sqrt_params=True,jac=False)
 
-    else:
-       if outlier != []:
-           print("WARNING: remove outlier function is not supported for mini batch")
-       for i in random_ind:
-           xhi2 += ( sum( ( 4.0*eps_array*sigma_array**(12.0)*Data[ind[i]]["pair_vector-12"] - 4.0*eps_array*sigma_array**(6.0)*Data[ind[i]]["pair_vector-6"] ) ) - E_config[i] )**(2.0)
-       xhi2 = xhi2/len(random_ind)
-
-    
-    return xhi2 + L2_sigma*L2_s + L2_eps*L2_e
 # fit_type is a globally defined tuple
 def global_fit_LJ(e_0=0, s_0=0, e_1=0,  s_1=0,  e_2=0,  s_2=0,  e_3=0,  s_3=0,  e_4=0,  s_4=0,  e_5=0,  s_5=0,  e_6=0,  s_6=0,  e_7=0,  s_7=0,  e_8=0,  s_8=0,  e_9=0,  s_9=0,  e_10=0, s_10=0,\
                                 e_11=0, s_11=0, e_12=0, s_12=0, e_13=0, s_13=0, e_14=0, s_14=0, e_15=0, s_15=0, e_16=0, s_16=0, e_17=0, s_17=0, e_18=0, s_18=0, e_19=0, s_19=0, e_20=0, s_20=0,\
@@ -2836,7 +2952,7 @@ def global_fit_LJ(e_0=0, s_0=0, e_1=0,  s_1=0,  e_2=0,  s_2=0,  e_3=0,  s_3=0,
                                 e_171=0,s_171=0,e_172=0,s_172=0,e_173=0,s_173=0,e_174=0,s_174=0,e_175=0,s_175=0,e_176=0,s_176=0,e_177=0,s_177=0,e_178=0,s_178=0,e_179=0,s_179=0,e_180=0,s_180=0,\
                                 e_181=0,s_181=0,e_182=0,s_182=0,e_183=0,s_183=0,e_184=0,s_184=0,e_185=0,s_185=0,e_186=0,s_186=0,e_187=0,s_187=0,e_188=0,s_188=0,e_189=0,s_189=0,e_190=0,s_190=0,\
                                 e_191=0,s_191=0,e_192=0,s_192=0,e_193=0,s_193=0,e_194=0,s_194=0,e_195=0,s_195=0,e_196=0,s_196=0,e_197=0,s_197=0,e_198=0,s_198=0,e_199=0,s_199=0,e_200=0,s_200=0,\
-                                ind=[],outlier=[],E_config=[],VDW_dict=[],Data=[],Fit_Pairs=[],Pair_min_dict=[],penalty=100.0,mixing_rule="none",L2_sigma=0.0,L2_eps=0.0,VDW_0=None):
+                                ind=[],outlier=[],E_config=[],VDW_dict=[],Data=[],Fit_Pairs=[],Pair_min_dict=[],penalty=100.0,mixing_rule="none",L2_sigma=0.0,L2_eps=0.0,VDW_0=None,moments=None):
 
     # Initialize local variable dictionary (used for determining what has been defined)
     local_vars = locals()
@@ -2850,97 +2966,10 @@ def global_fit_LJ(e_0=0, s_0=0, e_1=0,  s_1=0,  e_2=0,  s_2=0,  e_3=0,  s_3=0,
         print("ERROR in global_fit_LJ: the function expects the len(Fit_Pairs) and number of non-zero e_* variable to be equal. Exiting...")
         quit()
 
-    # Initialize eps and sigma arrays for the vectorized calculations
-    eps_array = np.array([ VDW_dict[i][0] for i in Data[ind[0]]["pair_type_vector"] ])
-    sigma_array = np.array([ VDW_dict[i][1] for i in Data[ind[0]]["pair_type_vector"] ])
-
-    # Update the elements being fit with the corresponding e_vals and s_vals
-    for count_c,c in enumerate(Fit_Pairs):        
-        for i in [ count_j for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j == c or (j[1],j[0]) == c ) ]:        
-            eps_array[i]   = e_vals[count_c]
-            sigma_array[i] = s_vals[count_c]
-
-    # Apply mixing rules
-    # If/else conditions handle cases where one or both of the involved types is in the fit set 
-    if mixing_rule == "wh":
-        fit_types = { i[0]:count_i for count_i,i in enumerate(Fit_Pairs) }
-        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] in fit_types or j[1] in fit_types )]:            
-            #print "\ntarget: {}".format(i)
-            if i[0] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),e_vals[fit_types[i[0]]],s_vals[fit_types[i[0]]])
-                if i[1] in fit_types:
-                    #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-                    sigma_array[count_i] = (( s_vals[fit_types[i[0]]]**(6.0) + s_vals[fit_types[i[1]]]**(6.0) ) / 2.0 )**(1.0/6.0)
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]]*s_vals[fit_types[i[0]]]**(6.0) * e_vals[fit_types[i[1]]]*s_vals[fit_types[i[1]]]**(6.0) )**(0.5) / sigma_array[count_i]**(6.0)
-                else:
-                    #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])
-                    sigma_array[count_i] = (( s_vals[fit_types[i[0]]]**(6.0) + VDW_dict[(i[1],i[1])][1]**(6.0) ) / 2.0 )**(1.0/6.0)
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]]*s_vals[fit_types[i[0]]]**(6.0) * VDW_dict[(i[1],i[1])][0]*VDW_dict[(i[1],i[1])][1]**(6.0) )**(0.5) / sigma_array[count_i]**(6.0)
-            elif i[1] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])                
-                #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-
-                sigma_array[count_i] = (( s_vals[fit_types[i[1]]]**(6.0) + VDW_dict[(i[0],i[0])][1]**(6.0) ) / 2.0 )**(1.0/6.0)
-                eps_array[count_i]   = (e_vals[fit_types[i[1]]]*s_vals[fit_types[i[1]]]**(6.0) * VDW_dict[(i[0],i[0])][0]*VDW_dict[(i[0],i[0])][1]**(6.0) )**(0.5) / sigma_array[count_i]**(6.0)
-            #print "result: {},{}".format(eps_array[count_i],sigma_array[count_i])
-#        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] not in fit_types and j[1] not in fit_types )]:            
-            #print "\ntarget (2): {}".format(i)
-            #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])    
-            #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])            
-            #print "result: {},{}".format(VDW_dict[i][0],VDW_dict[i][1])
-
-    elif mixing_rule == "lb":
-        fit_types = { i[0]:count_i for count_i,i in enumerate(Fit_Pairs) }
-
-        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] in fit_types or j[1] in fit_types )]:            
-            #print "\ntarget: {}".format(i)
-            if i[0] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),e_vals[fit_types[i[0]]],s_vals[fit_types[i[0]]])
-                if i[1] in fit_types:
-                    #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-                    sigma_array[count_i] = (s_vals[fit_types[i[0]]] + s_vals[fit_types[i[1]]] ) / 2.0 
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]] * e_vals[fit_types[i[1]]] )**(0.5)
-                else:
-                    #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])
-                    sigma_array[count_i] = (s_vals[fit_types[i[0]]] + VDW_dict[(i[1],i[1])][1] ) / 2.0 
-                    eps_array[count_i]   = (e_vals[fit_types[i[0]]] * VDW_dict[(i[1],i[1])][0] )**(0.5)
-            elif i[1] in fit_types:
-                #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])                
-                #print "{}: {},{}".format((i[1],i[1]),e_vals[fit_types[i[1]]],s_vals[fit_types[i[1]]])
-                sigma_array[count_i] = (VDW_dict[(i[0],i[0])][1] + VDW_dict[(i[1],i[1])][1] ) / 2.0 
-                eps_array[count_i]   = (VDW_dict[(i[0],i[0])][0] * VDW_dict[(i[1],i[1])][0] )**(0.5)
-            #print "result: {},{}".format(eps_array[count_i],sigma_array[count_i])
-#        for count_i,i in [ (count_j,j) for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j[0] not in fit_types and j[1] not in fit_types )]:            
-            #print "\ntarget (2): {}".format(i)
-            #print "{}: {},{}".format((i[0],i[0]),VDW_dict[(i[0],i[0])][0],VDW_dict[(i[0],i[0])][1])    
-            #print "{}: {},{}".format((i[1],i[1]),VDW_dict[(i[1],i[1])][0],VDW_dict[(i[1],i[1])][1])            
-            #print "result: {},{}".format(VDW_dict[i][0],VDW_dict[i][1])
-
-    # Initialize L2 regularization sums
-    if VDW_0 is not None:
-
-        # only loop over the values in the sigma and eps arrays (they are the only ones that affect the fit!)
-        L2_e = np.mean([ (e_vals[count_i]-VDW_0[i][0])**(2.0) for count_i,i in enumerate(Fit_Pairs) if i[0] == i[1] ]) 
-        L2_s = np.mean([ (s_vals[count_i]-VDW_0[i][1])**(2.0) for count_i,i in enumerate(Fit_Pairs) if i[0] == i[1] ]) 
-
-    else:
-        L2_e = np.mean(eps_array**(2.0))
-        L2_s = np.mean(sigma_array**(2.0))
-        
-    # Initialize E_LJ for the current configuration
-    xhi2 = 0
-
-    # Iterate over the configuration index
-    data_count = 0
-    for count_d,d in enumerate(ind):
-       
-        if len(outlier) != 0: 
-            if outlier[count_d]: continue
-        data_count += 1
-        # Iterate over list of pair-seps for each pair-type (Data[d]["pairs"] is a dictionary with keys for each pair type linked to arrays of the instances of pair separations for that type)
-        xhi2 += ( sum( ( 4.0*eps_array*sigma_array**(12.0)*Data[d]["pair_vector-12"] - 4.0*eps_array*sigma_array**(6.0)*Data[d]["pair_vector-6"] ) ) - E_config[count_d] )**(2.0)
-
-    return xhi2/float(data_count) + L2_sigma*L2_s + L2_eps*L2_e
+    # Evaluate the objective with the parameter-vector form
+    moments,setup = cached_lj_fit_setup(ind,Data,Fit_Pairs,VDW_dict,mixing_rule=mixing_rule,moments=moments)
+    x = np.column_stack((e_vals,s_vals)).flatten()
+    return lj_fit_objective(x,setup,E_config,outlier=outlier,L2_sigma=L2_sigma,L2_eps=L2_eps,VDW_0=VDW_0,jac=False)
 
 
 # Description: This function drives the pair-wise fit of the VDW parameters. It accepts
@@ -2962,12 +2991,15 @@ def iterative_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_c
     # In python you need to expand the scope of global variables at every level
     global VDW_dict,fit_type,Pair_min_dict
 
+    # Pack the pair moments of the configurations once for the E_LJ_Fit* evaluations of the fit
+    moments = cached_pair_moments(x_vals,Data) if fit.lower() == 'lj' else None
+
     # Intialize cycle count and array of fit values
     fit_type = 0 # dummy value so that all pair-potentials are taken from VDW_dict (see E_LJ_Fit for more details)
     cycle_count = 0
 
     if fit == 'lj':
-        fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0) ] * (max_cycles+5)
+        fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0,moments=moments) ] * (max_cycles+5)
     elif fit == 'buck':
         fit_vals = [ E_BUCK_Fit(x_vals,0.0,0.0,0.0) ] * (max_cycles+5)
     xhi2_previous = np.mean((y_vals-fit_vals[cycle_count])**2) 
@@ -2975,30 +3007,21 @@ def iterative_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_c
     # If no pairs are being fit (as happens if only UA types are being fit and AA are being read from file) just return the fit_vals
     if len(Pairs) == 0: print(" "); return fit_vals[:cycle_count+1]
 
-    # Check the rank of the fit data by assembling the lstsq fit matrix
-    if fit in ['lj','buck'] :
-        A = np.zeros([len(x_vals),len(Pairs)*2]) # For the lj fit there are 2 linearly parameters per pair type (A,B). The rank of the LJ matrix is used in place of the buck 
-                                              # A matrix owing to the non-linearity of the buckingham potential
-    # Build up A matrix
-    for count_i,i in enumerate(x_vals):
-        for count_j,j in enumerate(Pairs):
-
-            if fit in ['lj','buck']:
-                # Pairs only contains I J or J I combinations whereas Data[i]["pairs"] has both combinations
-                # To be consistent the contributions from both I J and J I configurations need to be added to 
-                # the elements of A
-                tmp_6 = 0.0
-                tmp_12 = 0.0
-
-                if (j[0],j[1]) in list(Data[i]["pairs"].keys()):
-                    tmp_6  += sum(Data[i]["pairs"][(j[0],j[1])]**(-6.0))
-                    tmp_12 += sum(Data[i]["pairs"][(j[0],j[1])]**(-12.0))
-                if j[0] != j[1] and (j[1],j[0]) in list(Data[i]["pairs"].keys()):
-                    tmp_6  += sum(Data[i]["pairs"][(j[1],j[0])]**(-6.0))
-                    tmp_12 += sum(Data[i]["pairs"][(j[1],j[0])]**(-12.0))
+    # The r^-6 and r^-12 moments of every configuration (packed once above) are used for the rank check
+    moments = cached_pair_moments(x_vals,Data,moments)
+    pair_types,R6,R12 = moments
+    type_index = { j:count_j for count_j,j in enumerate(pair_types) }
 
-                A[count_i,(count_j*2)+0] += tmp_12
-                A[count_i,(count_j*2)+1] -= tmp_6
+    # Check the rank of the fit data by assembling the lstsq fit matrix
+    # For the lj fit there are 2 linearly parameters per pair type (A,B). The rank of the LJ matrix is used in place of the buck 
+    # A matrix owing to the non-linearity of the buckingham potential
+    # (pair_type_vector already holds the I J and J I contributions for each pair type)
+    A = np.zeros([len(x_vals),len(Pairs)*2])
+    for count_j,j in enumerate(Pairs):
+        col = type_index.get(j,type_index.get((j[1],j[0])))
+        if col is not None:
+            A[:,(count_j*2)+0] += R12[:,col]
+            A[:,(count_j*2)+1] -= R6[:,col]
 
     # Calculate the rank of the fit matrix
     rank = matrix_rank(A)
@@ -3077,7 +3100,7 @@ def iterative_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_c
         # Update the fit data array
         fit_type = 0   # dummy value so that all pair-potentials are taken from VDW_dict (see E_LJ_Fit for more details)
         if fit.lower() == 'lj':
-            fit_vals[cycle_count] = E_LJ_Fit(x_vals,0.0,0.0)
+            fit_vals[cycle_count] = E_LJ_Fit(x_vals,0.0,0.0,moments=moments)
         elif fit.lower() == 'buck':
             fit_vals[cycle_count] = E_BUCK_Fit(x_vals,0.0,0.0,0.0)
 
@@ -3114,7 +3137,7 @@ def iterative_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_c
     # Prepare initial guess parameters, initial fit energies, and initial xhi2 value
     initial_guess = [ j for i in Current_Fit_Pairs for j in VDW_dict[i] ]
     if fit == 'lj':
-        xhi2_previous = np.mean((y_vals-E_LJ_Fit_all(x_vals,*initial_guess))**2)
+        xhi2_previous = np.mean((y_vals-E_LJ_Fit_all(x_vals,*initial_guess,moments=moments))**2)
     elif fit == 'buck':
         xhi2_previous = np.mean((y_vals-E_BUCK_Fit_all(x_vals,*initial_guess))**2)
 
@@ -3128,10 +3151,10 @@ def iterative_fit(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,min_c
 
         # Perform LJ fit
         if fit == 'lj':
-            params,err = curve_fit(E_LJ_Fit_all,x_vals,y_vals,p0=initial_guess,maxfev=10000)
+            params,err = curve_fit(lambda x,*p: E_LJ_Fit_all(x,*p,moments=moments),x_vals,y_vals,p0=initial_guess,maxfev=10000)
 
             # Calculate fit values and xhi2 with final fit parameters
-            fit_vals[cycle_count] = E_LJ_Fit_all(x_vals,*params)
+            fit_vals[cycle_count] = E_LJ_Fit_all(x_vals,*params,moments=moments)
             xhi2 = np.mean((y_vals-fit_vals[cycle_count])**2)        
             delta_xhi2 = xhi2_previous - xhi2 
 
@@ -3198,11 +3221,14 @@ def iterative_fit_UA(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,mi
     # In python you need to expand the scope of global variables at every level
     global VDW_dict,fit_type,Pair_min_dict
 
+    # Pack the pair moments of the configurations once for the E_LJ_Fit* evaluations of the fit
+    moments = cached_pair_moments(x_vals,Data) if fit.lower() == 'lj' else None
+
     # Intialize cycle count and array of fit values
     cycle_count = 0
     fit_type = 0 # dummy value so that all pair-potentials are taken from VDW_dict (see E_LJ_Fit for more details)
     if fit == 'lj':
-        fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0) ] * (max_cycles+5)
+        fit_vals = [ E_LJ_Fit(x_vals,0.0,0.0,moments=moments) ] * (max_cycles+5)
     elif fit == 'buck':
         fit_vals = [ E_BUCK_Fit(x_vals,0.0,0.0,0.0) ] * (max_cycles+5)
     xhi2_previous = np.mean((y_vals-fit_vals[cycle_count])**2) 
@@ -3316,7 +3342,7 @@ def iterative_fit_UA(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,mi
         # Update the fit data array
         fit_type = 0   # dummy value so that all pair-potentials are taken from VDW_dict (see E_LJ_Fit for more details)
         if fit == 'lj':
-            fit_vals[cycle_count] = E_LJ_Fit(x_vals,0.0,0.0)
+            fit_vals[cycle_count] = E_LJ_Fit(x_vals,0.0,0.0,moments=moments)
         elif fit == 'buck':
             fit_vals[cycle_count] = E_BUCK_Fit(x_vals,0.0,0.0,0.0)
 
@@ -3352,7 +3378,7 @@ def iterative_fit_UA(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,mi
     if fit == 'lj':
         initial_guess = [ VDW_dict[i][0] for i in Current_Fit_Pairs ]
 #        xhi2_previous = np.mean((y_vals-E_LJ_Fit_all_UA(x_vals,*initial_guess))**2)
-        xhi2_previous = np.mean((y_vals-E_LJ_Fit_all(x_vals,*initial_guess))**2)
+        xhi2_previous = np.mean((y_vals-E_LJ_Fit_all(x_vals,*initial_guess,moments=moments))**2)
         print("\nInitializing simultaneous fit of all LJ parameters:\n")
     elif fit == 'buck':
         initial_guess = [ j for i in Current_Fit_Pairs for j in VDW_dict[i] ]
@@ -3373,11 +3399,11 @@ def iterative_fit_UA(x_vals,y_vals,Pairs,weight,fit,delta_xhi2_thresh=0.00001,mi
         if fit == 'lj':
 #            params,err = curve_fit(E_LJ_Fit_all_UA,x_vals,y_vals,p0=initial_guess,maxfev=10000)
 #            params,err = curve_fit(E_LJ_Fit_all_UA,x_vals,y_vals,p0=initial_guess,maxfev=10000,sigma=fit_weights)
-            params,err = curve_fit(E_LJ_Fit_all,x_vals,y_vals,p0=initial_guess,maxfev=10000,sigma=fit_weights)
+            params,err = curve_fit(lambda x,*p: E_LJ_Fit_all(x,*p,moments=moments),x_vals,y_vals,p0=initial_guess,maxfev=10000,sigma=fit_weights)
 
             # Calculate fit values and xhi2 with final fit parameters
 #            fit_vals[cycle_count] = E_LJ_Fit_all_UA(x_vals,*params)
-            fit_vals[cycle_count] = E_LJ_Fit_all(x_vals,*params)
+            fit_vals[cycle_count] = E_LJ_Fit_all(x_vals,*params,moments=moments)
             xhi2 = np.mean(((y_vals-fit_vals[cycle_count])/fit_weights)**2)        
             delta_xhi2 = xhi2_previous - xhi2 
 
@@ -3554,9 +3580,9 @@ def plot_convergence(folder,Data,fit_vals,plot_num=5,type='DFT-AA'):
     
     # Create all-atom/united-atom coulombic array
     if type == 'DFT-AA' or type == 'MP2-AA':
-        coul_array = np.array([ E_C_Tot(i,'AA') for i in x_vals ])
+        coul_array = coul_vector(x_vals,'AA')
     if type == 'DFT-UA' or type == 'MP2-UA':
-        coul_array = np.array([ E_C_Tot(i,'UA') for i in x_vals ])
+        coul_array = coul_vector(x_vals,'UA')
 
     # Add coulombic contribution to the fit values
     for i in range(len(fit_vals)):
@@ -4160,23 +4186,19 @@ def get_FF_data(db_files,keep_types=[ "atom", "vdw", "bond", "angle", "torsion",
     
     # Read in Atom data
     for i in db_files:
-        with open(i,'r') as f:
-            for lines in f:
-                fields = lines.split()
-
-                if len(fields) == 0: continue
-                if fields[0] == "atom" and "atom" in keep_types:
-                    Data["atoms"][fields[1]] = fields[1:]
-                if fields[0] == "vdw" and "vdw" in keep_types:
-                    Data["vdws"][(fields[1],fields[2],fields[3])] = fields[1:]
-                if fields[0] == "bond" and "bond" in keep_types:
-                    Data["bonds"][(fields[1],fields[2],fields[3])] = fields[1:]
-                if fields[0] == "angle" and "angle" in keep_types:
-                    Data["angles"][(fields[1],fields[2],fields[3],fields[4])] = fields[1:]
-                if fields[0] == "diehdral" or fields[0] == "torsion" and ( "diehdral" in keep_types or "torsion" in keep_types ):
-                    Data["dihedrals"][(fields[1],fields[2],fields[3],fields[4],fields[5])] = fields[1:]
-                if fields[0] == "charge" and "charge" in keep_types:
-                    Data["charges"][fields[1]] = fields[1:]
+        for fields in load_store(i).lines():
+            if fields[0] == "atom" and "atom" in keep_types:
+                Data["atoms"][fields[1]] = fields[1:]
+            if fields[0] == "vdw" and "vdw" in keep_types:
+                Data["vdws"][(fields[1],fields[2],fields[3])] = fields[1:]
+            if fields[0] == "bond" and "bond" in keep_types:
+                Data["bonds"][(fields[1],fields[2],fields[3])] = fields[1:]
+            if fields[0] == "angle" and "angle" in keep_types:
+                Data["angles"][(fields[1],fields[2],fields[3],fields[4])] = fields[1:]
+            if fields[0] == "diehdral" or fields[0] == "torsion" and ( "diehdral" in keep_types or "torsion" in keep_types ):
+                Data["dihedrals"][(fields[1],fields[2],fields[3],fields[4],fields[5])] = fields[1:]
+            if fields[0] == "charge" and "charge" in keep_types:
+                Data["charges"][fields[1]] = fields[1:]
   
     # Generate the cross terms via the mixing rule if specified
     if mixing_rule == "lb":
@@ -4244,13 +4266,16 @@ def fit_all(x_vals,y_vals,Fit_Pairs,fit,delta_xhi2_thresh):
     
     global VDW_dict,fit_type,Pair_min_dict,Current_Fit_Pairs
 
+    # Pack the pair moments of the configurations once for the E_LJ_Fit* evaluations of the fit
+    moments = cached_pair_moments(x_vals,Data)
+
     # Copy the supplied Fit_Pairs to the local/global variable Current_Fit_Pairs
     # This is performed because the pairs being fit need to be flexibly defined locally
     Current_Fit_Pairs = Fit_Pairs
 
     # Prepare initial guess parameters, initial fit energies, and initial xhi2 value
     initial_guess = [ j for i in Current_Fit_Pairs for j in VDW_dict[i] ]
-    fit_vals = [ E_LJ_Fit_all(x_vals,*initial_guess) ]
+    fit_vals = [ E_LJ_Fit_all(x_vals,*initial_guess,moments=moments) ]
     xhi2_previous = np.mean((y_vals-fit_vals[0])**2)
 
     # Print diagnostics
@@ -4264,10 +4289,10 @@ def fit_all(x_vals,y_vals,Fit_Pairs,fit,delta_xhi2_thresh):
     while 1:
 
         # Perform fit
-        params,err = curve_fit(E_LJ_Fit_all,x_vals,y_vals,p0=initial_guess,maxfev=10000)
+        params,err = curve_fit(lambda x,*p: E_LJ_Fit_all(x,*p,moments=moments),x_vals,y_vals,p0=initial_guess,maxfev=10000)
 
         # Calculate fit values and xhi2 with final fit parameters
-        fit_vals += [E_LJ_Fit_all(x_vals,*params)]
+        fit_vals += [E_LJ_Fit_all(x_vals,*params,moments=moments)]
         xhi2 = np.mean((y_vals-fit_vals[cycle])**2)        
         delta_xhi2 = xhi2_previous - xhi2 
 
@@ -4372,7 +4397,7 @@ def E_LJ_Fit_all(ind,e_0=0, s_0=0, e_1=0, s_1=0, e_2=0, s_2=0, e_3=0, s_3=0, e_4
                          e_61=0,s_61=0,e_62=0,s_62=0,e_63=0,s_63=0,e_64=0,s_64=0,e_65=0,s_65=0,e_66=0,s_66=0,e_67=0,s_67=0,e_68=0,s_68=0,e_69=0,s_69=0,e_70=0,s_70=0,\
                          e_71=0,s_71=0,e_72=0,s_72=0,e_73=0,s_73=0,e_74=0,s_74=0,e_75=0,s_75=0,e_76=0,s_76=0,e_77=0,s_77=0,e_78=0,s_78=0,e_79=0,s_79=0,e_80=0,s_80=0,\
                          e_81=0,s_81=0,e_82=0,s_82=0,e_83=0,s_83=0,e_84=0,s_84=0,e_85=0,s_85=0,e_86=0,s_86=0,e_87=0,s_87=0,e_88=0,s_88=0,e_89=0,s_89=0,e_90=0,s_90=0,\
-                         e_91=0,s_91=0,e_92=0,s_92=0,e_93=0,s_93=0,e_94=0,s_94=0,e_95=0,s_95=0,e_96=0,s_96=0,e_97=0,s_97=0,e_98=0,s_98=0,e_99=0,s_99=0,e_100=0,s_100=0):
+                         e_91=0,s_91=0,e_92=0,s_92=0,e_93=0,s_93=0,e_94=0,s_94=0,e_95=0,s_95=0,e_96=0,s_96=0,e_97=0,s_97=0,e_98=0,s_98=0,e_99=0,s_99=0,e_100=0,s_100=0,moments=None):
 
     # In python you need to expand the scope of global variables at every level
     global VDW_dict,Current_Fit_Pairs,Data
@@ -4394,24 +4419,17 @@ def E_LJ_Fit_all(ind,e_0=0, s_0=0, e_1=0, s_1=0, e_2=0, s_2=0, e_3=0, s_3=0, e_4
     for count_i,i in enumerate(s_vars):
         if s_vals[count_i] > 10.0 or s_vals[count_i] < Pair_min_dict[Current_Fit_Pairs[count_i]]*2.**(-1./6.): return np.ones(len(ind))*1.E20
 
-    # Initialize eps and sigma arrays for the vectorized calculations
-    eps_array = np.array([ VDW_dict[i][0] for i in Data[ind[0]]["pair_type_vector"] ])
-    sigma_array = np.array([ VDW_dict[i][1] for i in Data[ind[0]]["pair_type_vector"] ])
+    # Initialize eps and sigma arrays for the vectorized calculations (the moments are packed once per fit)
+    pair_types,R6,R12 = cached_pair_moments(ind,Data,moments)
+    eps_array = np.array([ VDW_dict[i][0] for i in pair_types ])
+    sigma_array = np.array([ VDW_dict[i][1] for i in pair_types ])
     for count_c,c in enumerate(Current_Fit_Pairs):
-        for i in [ count_j for count_j,j in enumerate(Data[ind[0]]["pair_type_vector"]) if ( j == c or (j[1],j[0]) == c ) ]:        
+        for i in [ count_j for count_j,j in enumerate(pair_types) if ( j == c or (j[1],j[0]) == c ) ]:        
             eps_array[i]   = e_vals[count_c]
             sigma_array[i] = s_vals[count_c]
 
-    # Initialize E_LJ for the current configuration
-    E_LJ = np.zeros(len(ind))
-
-    # Iterate over the configuration index
-    for count_d,d in enumerate(ind):
-
-        # Iterate over list of pair-seps for each pair-type (Data[d]["pairs"] is a dictionary with keys for each pair type linked to arrays of the instances of pair separations for that type)
-        E_LJ[count_d] = sum( ( 4.0*eps_array*sigma_array**(12.0)*Data[d]["pair_vector-12"] - 4.0*eps_array*sigma_array**(6.0)*Data[d]["pair_vector-6"] ) )
-
-    return E_LJ
+    # Calculate the LJ energy of all configurations at once
+    return R12.dot(4.0*eps_array*sigma_array**(12.0)) - R6.dot(4.0*eps_array*sigma_array**(6.0))
 
 # fit_type is a globally defined tuple
 def E_BUCK_Fit_all(ind,a_0=0, b_0=0, c_0=0, a_1=0, b_1=0, c_1=0, a_2=0, b_2=0, c_2=0, a_3=0, b_3=0, c_3=0, a_4=0, b_4=0, c_4=0, a_5=0, b_5=0, c_5=0, a_6=0, b_6=0, c_6=0, a_7=0, b_7=0, c_7=0,\
@@ -5064,13 +5082,22 @@ def calc_UA_parameters(VDW_dict,DB_Pairs,Data,vol_scale,vol_method):
 
     # VOLUME BASED SIGMA VALUES
     # Loop over the VDW dictionary and update UA sigma values based on membership in UA_types
-    if vol_method == 'volume':
+    # ('analytic' uses the exact group volume instead of the monte-carlo estimate)
+    if vol_method in [ 'volume', 'analytic' ]:
 
         # Print diagnostic
-        print("\nCalculating LJ parameters based on the (MC-calculated) group volume and the total configurational LJ interaction energy:\n")
+        if vol_method == 'volume':
+            print("\nCalculating LJ parameters based on the (MC-calculated) group volume and the total configurational LJ interaction energy:\n")
+        else:
+            print("\nCalculating LJ parameters based on the (analytic) group volume and the total configurational LJ interaction energy:\n")
 
         # Initialize sobol quasi-random value list (used in the calc_eff_vol_MC for monte-carlo volume calculations)
-        sobol_list = i4_sobol_generate( 3, 1000000, 10 )
+        if vol_method == 'volume':
+            sobol_list = sobol_samples(1000000,3,10)
+            vol_mode = 'mc'
+        else:
+            sobol_list = None
+            vol_mode = 'analytic'
 
         # Loop over the VDW dictionary and update UA sigma values based on membership in UA_types    
         for i in list(VDW_dict.keys()):
@@ -5106,7 +5133,7 @@ def calc_UA_parameters(VDW_dict,DB_Pairs,Data,vol_scale,vol_method):
 
                 # Calculate the effective volume of the C with its joined atoms (w.r.t. the i[0] atom type)
                 # V_eff += calc_eff_vol(seps,*sigmas) # old sphere based method
-                V_eff += calc_eff_vol_MC(sobol_list,seps,*sigmas)
+                V_eff += calc_eff_vol_MC(sobol_list,seps,*sigmas,mode=vol_mode)
 
             # Calculate the effective volume for type_2
             if i[1] in list(UA_types.keys()):
@@ -5131,7 +5158,7 @@ def calc_UA_parameters(VDW_dict,DB_Pairs,Data,vol_scale,vol_method):
 
                 # Calculate the effective volume of the C with its joined atoms (w.r.t. the i[0] atom type)
                 # V_eff += calc_eff_vol(seps,*sigmas) # old sphere based method
-                V_eff += calc_eff_vol_MC(sobol_list,seps,*sigmas)
+                V_eff += calc_eff_vol_MC(sobol_list,seps,*sigmas,mode=vol_mode)
 
             # If both types are UA then subtract off the C-C interation because its volume contribution was double counted
             if i[0] in list(UA_types.keys()) and i[1] in list(UA_types.keys()):
@@ -5277,14 +5304,15 @@ def calc_UA_parameters(VDW_dict,DB_Pairs,Data,vol_scale,vol_method):
 
 # Calculate the effective sigma value for united atoms based on the volume of the 
 # bonded atoms (sum of invidivual hard sphere volumes minus their overlap)
-def calc_eff_vol_MC(sobol_list,seps,sigma_1=0,sigma_2=0,sigma_3=0,sigma_4=0,sigma_5=0,sigma_6=0,sigma_7=0,sigma_8=0,sigma_9=0,sigma_10=0):
+# mode is passed on to calc_pair_volume ('mc' samples sobol_list, 'analytic' uses the exact volume)
+def calc_eff_vol_MC(sobol_list,seps,sigma_1=0,sigma_2=0,sigma_3=0,sigma_4=0,sigma_5=0,sigma_6=0,sigma_7=0,sigma_8=0,sigma_9=0,sigma_10=0,mode='mc'):
 
     # Initialize local variable dictionary (used for determining what has been defined)
     local_vars = locals()
     
     # Find defined sigmas
     sigma_vars = natural_sort([ i for i in local_vars if 'sigma_' in i and "__" not in i and local_vars[i] != 0 ])
-    sigma_vals = [ locals()[i] for i in sigma_vars ]
+    sigma_vals = [ local_vars[i] for i in sigma_vars ]
 
     V_eff = 0.0
 
@@ -5299,7 +5327,7 @@ def calc_eff_vol_MC(sobol_list,seps,sigma_1=0,sigma_2=0,sigma_3=0,sigma_4=0,sigm
             if count_i != 0 or count_j == 0: continue
 
             # Add bond volume (central-atom + hydrogen + cylinder the size of hydrogen connecting the two)
-            V_eff += calc_pair_volume(i,j,seps[count_i,count_j],sobol_list)
+            V_eff += calc_pair_volume(i,j,seps[count_i,count_j],sobol_list,mode=mode)
 
             # Subtract off the central-atom volume because it was already included in V_eff
             V_eff -= 4.0/3.0*np.pi*sigma_vals[0]**(3.0)
@@ -5307,36 +5335,90 @@ def calc_eff_vol_MC(sobol_list,seps,sigma_1=0,sigma_2=0,sigma_3=0,sigma_4=0,sigm
     return V_eff
 
 # Monte-carlo volume calculator for two spheres connected by a cylinder with the radius of the smaller sphere.
-# r_1 and r_2 are the sphere radii, length is their separation, and sobol_list is a preinitialized list of 
-# quasi-random triples for sampling the enclosing volume.
-def calc_pair_volume(r_1,r_2,length,sobol_list):
+# r_1 and r_2 are the sphere radii, length is their separation, and sobol_list is a preinitialized (3,N) array of 
+# quasi-random triples for sampling the enclosing volume (see sobol_samples). All samples are tested at once.
+# mode='analytic' returns the exact volume instead (see pair_volume_analytic) and doesn't use sobol_list.
+# Volumes are cached on (r_1,r_2,length) rounded to tol, so repeated UA groups are only evaluated once.
+def calc_pair_volume(r_1,r_2,length,sobol_list,mode='mc',tol=1.0E-4):
+
+    # Check the cache
+    if not hasattr(calc_pair_volume,"cache"):
+        calc_pair_volume.cache = {}
+    key = (mode,0 if mode == 'analytic' else len(sobol_list[0]),int(round(r_1/tol)),int(round(r_2/tol)),int(round(length/tol)))
+    if key in calc_pair_volume.cache:
+        return calc_pair_volume.cache[key]
 
     # Find larger r
     if r_1 >= r_2: r_big = r_1; r_small = r_2
     else: r_big = r_2; r_small = r_1
 
     # If one sphere completely contains the other then return the volume of the larger sphere
-    if length < abs(r_1-r_2): return 4.0/3.0*np.pi*r_big**(3.0)
-    
-    V_box = (r_1+r_2+length) * (2.0*r_big) * (2.0*r_big)
-    counts = 0
-
-    # Scale the samples to fill the box (only one quadrant is sampled since the object is 4-fold symmetric)
-    samples = np.array([ [sobol_list[0][i],sobol_list[1][i],sobol_list[2][i]] for i in range(len(sobol_list[0])) ])*np.array([r_1+length+r_2,r_big,r_big]) 
+    if length < abs(r_1-r_2): 
+        V = 4.0/3.0*np.pi*r_big**(3.0)
 
-    # Monte-carlo sample the volume
-    for count_p,p in enumerate(samples):
+    elif mode == 'analytic':
+        V = pair_volume_analytic(r_1,r_2,length)
 
-        # sphere one is located at r_1,r_big,r_big
-        if (p[0]-r_1)**2.0 + (p[1]-r_big)**2.0 + (p[2]-r_big)**2.0 < r_1**2.0: counts += 1; continue
+    else:
+        V_box = (r_1+r_2+length) * (2.0*r_big) * (2.0*r_big)
+
+        # Scale the samples to fill the box (only one quadrant is sampled since the object is 4-fold symmetric)
+        x  = sobol_list[0]*(r_1+length+r_2)
+        yz = (sobol_list[1]*r_big-r_big)**2.0 + (sobol_list[2]*r_big-r_big)**2.0
+
+        # sphere one is located at r_1,r_big,r_big, sphere two at r_1+length,r_big,r_big, and the connecting cylinder 
+        # is oriented along the x-axis from r_1 to r_1+length, centered at r_big,r_big in y and z, with a radius of r_small
+        inside  = (x-r_1)**2.0 + yz < r_1**2.0
+        inside |= (x-(r_1+length))**2.0 + yz < r_2**2.0
+        inside |= (x >= r_1) & (x < (r_1+length)) & (yz < r_small**2.0)
+        V = V_box * float(np.count_nonzero(inside))/float(len(x))
+
+    calc_pair_volume.cache[key] = V
+    return V
+
+# Exact volume of the object sampled by calc_pair_volume. All three solids share the x-axis, so the cross section at x is 
+# a disk whose squared radius is the largest of the three profiles. The profile crossings split the axis into intervals 
+# on which a single solid is outermost, and each interval is integrated in closed form.
+def pair_volume_analytic(r_1,r_2,length):
+
+    r_small = min(r_1,r_2)
+    if length < abs(r_1-r_2): return 4.0/3.0*np.pi*max(r_1,r_2)**(3.0)
+
+    # Interval boundaries: solid extents, sphere-cylinder crossings, and the sphere-sphere crossing
+    pts = [ -r_1, r_1, length-r_2, length+r_2, 0.0, length, (r_1**2.0-r_small**2.0)**(0.5), length-(r_2**2.0-r_small**2.0)**(0.5) ]
+    if length > 0.0:
+        pts += [ (r_1**2.0-r_2**2.0+length**2.0)/(2.0*length) ]
+    pts = sorted(set([ i for i in pts if -r_1 <= i <= length+r_2 ]))
+
+    # Integrate pi*rho(x)^2 over each interval using the solid that is outermost at its midpoint
+    V = 0.0
+    for a,b in zip(pts[:-1],pts[1:]):
+        m = (a+b)/2.0
+        profiles = [ (r_1**2.0-m**2.0,0.0,r_1), (r_2**2.0-(m-length)**2.0,length,r_2) ]
+        if 0.0 <= m < length:
+            profiles += [ (r_small**2.0,None,r_small) ]
+        rho2,c,r = max(profiles)
+        if rho2 <= 0.0: continue
+        if c is None:
+            V += np.pi*r**2.0*(b-a)
+        else:
+            V += np.pi*( r**2.0*(b-a) - ((b-c)**3.0-(a-c)**3.0)/3.0 )
 
-        # sphere two is located at r_1+length,r_big,r_big
-        if (p[0]-(r_1+length))**2.0 + (p[1]-r_big)**2.0 + (p[2]-r_big)**2.0 < r_2**2.0: counts += 1; continue
+    return V
 
-        # the connecting cylinder is oriented along the x-axis from r_1 to r_1+length, centered at r_big,r_big in y and z, with a radius of r_small
-        if (p[0] >= r_1 and p[0] < (r_1+length) ) and (p[1]-r_big)**2.0 + (p[2]-r_big)**2.0 < r_small**2.0: counts += 1; continue
+# Returns an (m,n) array of sobol quasi-random points (same layout as i4_sobol_generate) using the
+# scipy.stats.qmc engine, skipping the first skip points. Falls back on i4_sobol_generate when qmc is unavailable.
+def sobol_samples(n,m=3,skip=10):
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        return i4_sobol_generate(m,n,skip)
 
-    return V_box * float(counts)/float(len(samples))
+    engine = qmc.Sobol(d=m,scramble=False)
+    engine.fast_forward(skip)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # qmc warns when n isn't a power of 2
+        return engine.random(n).T
 
 def i4_bit_hi1 ( n ):
 
@@ -5586,47 +5668,47 @@ def i4_sobol ( dim_num, seed ):
 #	Initialize (part of) V.
 #
 		v = np.zeros((dim_max,log_max))
-		v[0:40,0] = transpose([ \
+		v[0:40,0] = np.transpose([ \
 			1, 1, 1, 1, 1, 1, 1, 1, 1, 1, \
 			1, 1, 1, 1, 1, 1, 1, 1, 1, 1, \
 			1, 1, 1, 1, 1, 1, 1, 1, 1, 1, \
 			1, 1, 1, 1, 1, 1, 1, 1, 1, 1 ])
 
-		v[2:40,1] = transpose([ \
+		v[2:40,1] = np.transpose([ \
 			1, 3, 1, 3, 1, 3, 3, 1, \
 			3, 1, 3, 1, 3, 1, 1, 3, 1, 3, \
 			1, 3, 1, 3, 3, 1, 3, 1, 3, 1, \
 			3, 1, 1, 3, 1, 3, 1, 3, 1, 3 ])
 
-		v[3:40,2] = transpose([ \
+		v[3:40,2] = np.transpose([ \
 			7, 5, 1, 3, 3, 7, 5, \
 			5, 7, 7, 1, 3, 3, 7, 5, 1, 1, \
 			5, 3, 3, 1, 7, 5, 1, 3, 3, 7, \
 			5, 1, 1, 5, 7, 7, 5, 1, 3, 3 ])
 
-		v[5:40,3] = transpose([ \
+		v[5:40,3] = np.transpose([ \
 			1, 7, 9,13,11, \
 			1, 3, 7, 9, 5,13,13,11, 3,15, \
 			5, 3,15, 7, 9,13, 9, 1,11, 7, \
 			5,15, 1,15,11, 5, 3, 1, 7, 9 ])
 	
-		v[7:40,4] = transpose([ \
+		v[7:40,4] = np.transpose([ \
 			9, 3,27, \
 			15,29,21,23,19,11,25, 7,13,17, \
 			1,25,29, 3,31,11, 5,23,27,19, \
 			21, 5, 1,17,13, 7,15, 9,31, 9 ])
 
-		v[13:40,5] = transpose([ \
+		v[13:40,5] = np.transpose([ \
 							37,33, 7, 5,11,39,63, \
 		 27,17,15,23,29, 3,21,13,31,25, \
 			9,49,33,19,29,11,19,27,15,25 ])
 
-		v[19:40,6] = transpose([ \
+		v[19:40,6] = np.transpose([ \
 			13, \
 			33,115, 41, 79, 17, 29,119, 75, 73,105, \
 			7, 59, 65, 21,	3,113, 61, 89, 45,107 ])
 
-		v[37:40,7] = transpose([ \
+		v[37:40,7] = np.transpose([ \
 			7, 23, 39 ])
 #
 #	Set POLY.
@@ -5697,7 +5779,7 @@ def i4_sobol ( dim_num, seed ):
 				for k in range(1, m+1):
 					l = 2 * l
 					if ( includ[k-1] ):
-						newv = bitwise_xor ( int(newv), int(l * v[i-1,j-k-1]) )
+						newv = np.bitwise_xor ( int(newv), int(l * v[i-1,j-k-1]) )
 				v[i-1,j-1] = newv
 #
 #	Multiply columns of V by appropriate power of 2.
@@ -5736,7 +5818,7 @@ def i4_sobol ( dim_num, seed ):
 		for seed_temp in range( int(seed_save), int(seed)):
 			l = i4_bit_lo0 ( seed_temp )
 			for i in range(1 , dim_num+1):
-				lastq[i-1] = bitwise_xor ( int(lastq[i-1]), int(v[i-1,l-1]) )
+				lastq[i-1] = np.bitwise_xor ( int(lastq[i-1]), int(v[i-1,l-1]) )
 
 		l = i4_bit_lo0 ( seed )
 
@@ -5745,7 +5827,7 @@ def i4_sobol ( dim_num, seed ):
 		for seed_temp in range( int(seed_save + 1), int(seed) ):
 			l = i4_bit_lo0 ( seed_temp )
 			for i in range(1, dim_num+1):
-				lastq[i-1] = bitwise_xor ( int(lastq[i-1]), int(v[i-1,l-1]) )
+				lastq[i-1] = np.bitwise_xor ( int(lastq[i-1]), int(v[i-1,l-1]) )
 
 		l = i4_bit_lo0 ( seed )
 #
@@ -5763,7 +5845,7 @@ def i4_sobol ( dim_num, seed ):
 	quasi=np.zeros(dim_num)
 	for i in range( 1, dim_num+1):
 		quasi[i-1] = lastq[i-1] * recipd
-		lastq[i-1] = bitwise_xor ( int(lastq[i-1]), int(v[i-1,l-1]) )
+		lastq[i-1] = np.bitwise_xor ( int(lastq[i-1]), int(v[i-1,l-1]) )
 
 	seed_save = seed
 	seed = seed + 1
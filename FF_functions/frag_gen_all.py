@@ -724,7 +724,8 @@ def mode_frag(M,Geometry,Adj_mat,Bond_mat,Elements,Atom_types,gens,q_tot=0,fc=[]
 
     # Canonicalize by sorting the elements based on hashing (NOTE: range(len(N_atom_types)) is used here rather than "atoms" as in the keep_terminal is True option. 
     Masses = [ mode_frag.mass_dict[N_Elements[i]] for i in range(len(N_Atom_types)) ]
-    hash_list,atoms = [ list(j) for j in zip(*sorted([ (atom_hash(count_i,N_Adj_mat,Masses),i) for count_i,i in enumerate(range(len(N_Atom_types))) ],reverse=True)) ]
+    hashes = atom_hashes(N_Adj_mat,Masses)
+    hash_list,atoms = [ list(j) for j in zip(*sorted([ (hashes[count_i],i) for count_i,i in enumerate(range(len(N_Atom_types))) ],reverse=True)) ]
 
     # Update lists/arrays based on the sorted atoms
     N_M          = tuple([ atoms.index(i) for i in N_M ])
@@ -9,6 +9,10 @@ from scipy.spatial.distance import cdist
 from shutil import move,copyfile
 from copy import deepcopy
 
+# Add TAFFI Lib to path
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from lammps_traj import Trajectory
+
 def main(argv):
     
     parser = argparse.ArgumentParser(description='Molecular configurations from a LAMMPS trajectory and generates an input for an orca single-point energy calculations.')
@@ -144,8 +148,9 @@ def main(argv):
     print("* {:^100s} *".format("Parsing configurations from LAMMPS trajectory "))
     print("{}\n".format("*"*104))
 
-    # Get the number of frames in each trajectory
-    num_frames = get_num_frames(args.traj_file)
+    # Index the trajectory (single pass, reused from the <traj>.idx.npz sidecar when present)
+    traj = Trajectory(args.traj_file)
+    num_frames = len(traj)
 
     # Appropriately set the termination frame for each trajectory
     if args.frame_end == 0 or num_frames-1 < args.frame_end: # option for parsing all frames in all trajectories, or if less frames than the requested are present parse what's there. 
@@ -155,14 +160,11 @@ def main(argv):
     config_count = 0
     complete_flag = 0
     print("{:45} Configurations_Drawn".format(''))
-    for frame in range(args.frame_start,args.frame_end+1,args.every):
+    for frame,(ids,types,geo,mol,box) in traj.iter_frames(range(args.frame_start,args.frame_end+1,args.every)):
 
         # Print diagnostic
         print("parsing configurations from frame {:<10}: {}".format(frame,config_count))
 
-        # Grab frame data (num_atoms allows more efficient initialization of the parser arrays)
-        ids,types,geo,mol,box = get_frame(frame,args.traj_file,num_atoms)
-
         # Unwrap molecules
         geo = unwrap(geo,adj_mat,mol,box)
         
@@ -397,50 +399,10 @@ def gen_orca(Save_Folder,config_count,Elements,Types,functional,D3_option,Geomet
     return
 
 # Parses the box,id#s,atom_types,mol#s, and geometry from the requested frame in the supplied trajectory
-def get_frame(frame,traj,num_atoms):
-
-    ids = [0]*num_atoms
-    types = ["X"]*num_atoms
-    geo = zeros([num_atoms,3])
-    mol = ["X"]*num_atoms
-    box = array([0.0,0.0,0.0,0.0,0.0,0.0])
-    
-    # Check for atom dump type
-    with open(traj,'r') as f:
-        timestep_flag = -1        # zero indexing
-        parse_flag    = 0         # toggles the geometry parse
-        box_flag      = 0
-        atom_counter  = 0         # keeps track of the number of placed atoms
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-            if len(fields) > 0 and fields[0] == "ITEM:" and fields[1] == "TIMESTEP":
-                timestep_flag += 1
-            if len(fields) > 0 and fields[0] == "ITEM:" and fields[1] == "TIMESTEP" and parse_flag == 1:
-                break
-
-            # Geo parse statements
-            if timestep_flag == frame and len(fields) >= 8 and fields[0] == "ITEM:" and fields[1] == "ATOMS" and "mol" in fields:
-                mol_ind = fields.index("mol") - 2
-                parse_flag = 1
-                continue
-            if parse_flag == 1:
-                ids[atom_counter]   = int(fields[0])
-                types[atom_counter] = fields[1]
-                geo[atom_counter,:] = array([float(fields[2]),float(fields[3]),float(fields[4])])
-                mol[atom_counter]   = fields[mol_ind]
-                atom_counter += 1
-
-            # Box parse statements
-            if timestep_flag == frame and len(fields) >= 2 and fields[0] == "ITEM:" and fields[1] == "BOX":
-                box_flag = 1
-                continue
-            if box_flag > 0 and box_flag <= 5:
-                box[box_flag-1] = float(fields[0])
-                box[box_flag]   = float(fields[1])
-                box_flag += 2
-
-
-    return ids,types,geo,mol,box
+# NOTE: thin wrapper around lammps_traj.Trajectory (the frame index is cached in a sidecar). Use 
+#       Trajectory.iter_frames() directly when looping over many frames.
+def get_frame(frame,traj,num_atoms=None):
+    return Trajectory(traj).get_frame(frame)
 
 # Function checks the formatting of the LAMMPS dump file
 def check_dump_format(Name):
@@ -600,16 +562,7 @@ def Generate_Map(traj_file,map_file):
 
 # Returns the total number of frames in the trajectory
 def get_num_frames(Name):
-
-    # Parse number of frames    
-    with open(Name,'r') as f:
-        frame_count = 0
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-            if len(fields) > 0 and fields[0] == "ITEM:" and fields[1] == "TIMESTEP":
-                frame_count += 1
-
-    return frame_count
+    return len(Trajectory(Name))
 
 # XXX Replace this function with the corresponding Lib function 
 def gen_xyz(Save_Folder,config_count,Elements,Geometry,Charges,Types):
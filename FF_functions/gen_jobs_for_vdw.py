@@ -6,9 +6,14 @@ from pylab import *
 from numpy import *
 from numpy.linalg import norm
 from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 from shutil import move,copyfile
 from copy import deepcopy
 
+# Add TAFFI Lib to path
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from lammps_traj import Trajectory
+
 def main(argv):
     
     parser = argparse.ArgumentParser(description='Extracts pair-wise configurations from a LAMMPS trajectory and generates an input for an orca binding energy calculation.')
@@ -355,27 +360,28 @@ def main(argv):
         print("* {:^100s} *".format("Parsing configurations from LAMMPS trajectory "))
         print("{}\n".format("*"*104))
 
-        # Get the number of frames in each trajectory
-        num_frames = get_num_frames(t)
+        # Index the trajectory (single pass, reused from the <traj>.idx.npz sidecar when present)
+        traj = Trajectory(t)
+        num_frames = len(traj)
 
         # Appropriately set the termination frame for each trajectory
         if args.frame_end == 0 or num_frames-1 < args.frame_end: # option for parsing all frames in all trajectories, or if less frames than the requested are present parse what's there. 
                 args.frame_end = num_frames-1                    # set last frame to the total number of frames (-1 for zero indexing)
 
+        # Integer-indexed lookups for the frame screening (lammps type -> type index, type index pair -> pair_list index, r_thresh by pair index)
+        pair_list,type_index,pair_id_mat,r_thresh = Generate_Pair_Arrays(data2map_dict,pair_dict)
+
         # Parse configurations
         config_count = 0
         complete_flag = 0
         print("{:45} Configurations_Drawn".format('Frame_diagnostic'))
         print(range(args.frame_start,args.frame_end+1,args.every))
-        for frame in range(args.frame_start,args.frame_end+1,args.every):
+        for frame,(ids,types,geo,mol,box) in traj.iter_frames(range(args.frame_start,args.frame_end+1,args.every)):
 
             # Print diagnostic
             #print("parsing configurations from frame {:<10}: {}".format(frame,config_count))
             print("start parsing configurations from frame {:<10}".format(frame))
 
-            # Grab frame data (num_atoms allows more efficient initialization of the parser arrays)
-            ids,types,geo,mol,box = get_frame(frame,t,num_atoms)
-
             # Unwrap molecules
             geo = unwrap(geo,adj_mat,mol,box)
 
@@ -386,80 +392,59 @@ def main(argv):
                     for count_i,i in enumerate(geo):
                         f.write(" {:20s} {:< 20.6f} {:< 20.6f} {:< 20.6f}\n".format(data2elem_dict[types[count_i]],i[0],i[1],i[2]))
 
-            # Grab relevant pairs and 
-            red_list = []
-            tmp_count = 0
-            for count_i,i in enumerate(args.A_list):
-                for count_j,j in enumerate(args.B_list):
+            # Screen the whole frame for molecule pairs holding at least one atom pair within r_thresh. The pairs are
+            # returned in the same (A_list,B_list) order that the configurations were historically drawn in.
+            for A_mol,B_mol,A_inds,B_inds,hit_ids,hit_counts in screen_pairs(geo,types,mol,args.A_list,args.B_list,type_index,pair_id_mat,r_thresh):
 
-                    # avoid the same molecule interacting with itself, or duplicate pairs
-                    if i == j or (i,j) in red_list:
-                        continue
-                    if False not in [ pair_dict[k]["configurations"] >= args.N_configs for k in list(pair_dict.keys()) ]:
-                    # We stop when enough "atom type" pairs configurations are extracted which means mol pairs is gonna be less or more than the threshold configurations we set for atom pairs
-                        break
-
-                    # add the current pair to the red_list to avoid future duplicate configurations
-                    red_list += [(i,j),(j,i)]
-
-                    # Intialize subgeometries for each molecule
-                    A_inds     = [ count_k for count_k,k in enumerate(mol) if k == i ] # atoms of mol i in A_list
-                    B_inds     = [ count_k for count_k,k in enumerate(mol) if k == j ] # atoms of mol j in B_list
-                    A_geo      = geo[A_inds,:]
-                    B_geo      = geo[B_inds,:]
-                    seps       = cdist(A_geo,B_geo) # all the atom pairs distance for mol pair (i,j)
-
-                    # Check if any of the pairs are close enough to include the configuration
-                    # A molecular pair was retained if at least one pair of atoms
-                    # from each molecule resided within r_thresh
-                    keep_flag = 0
-                    for count_k,k in enumerate(seps):
-                        for count_m,m in enumerate(k):
-
-                            # Grab pair type
-                            A_type = data2map_dict[types[A_inds[count_k]]]
-                            B_type = data2map_dict[types[B_inds[count_m]]]
-
-                            if A_type >= B_type:
-                                pair = (A_type,B_type)
-                            else:
-                                pair = (B_type,A_type)
-
-                            if pair in list(pair_dict.keys()) and m <= pair_dict[pair]["r_thresh"] and pair_dict[pair]["configurations"] < args.N_configs:
-                                keep_flag = 1
-                                pair_dict[pair]["configurations"] += 1  
-
-                    # if the keep flag is set, generate orca input files and *.xyz files
-                    if keep_flag == 1:
-
-                        # Generate element lists
-                        A_elem = [ data2elem_dict[types[m]] for m in A_inds ]
-                        B_elem = [ data2elem_dict[types[m]] for m in B_inds ]
-
-                        # Generate type lists
-                        A_types = [ data2map_dict[types[m]] for m in A_inds ]
-                        B_types = [ data2map_dict[types[m]] for m in B_inds ]
-                        
+                # We stop when enough "atom type" pairs configurations are extracted which means mol pairs is gonna be less or more than the threshold configurations we set for atom pairs
+                if False not in [ pair_dict[k]["configurations"] >= args.N_configs for k in pair_list ]:
+                    break
+
+                # A molecular pair was retained if at least one pair of atoms from each molecule resided within r_thresh
+                # and the pair type still needs configurations. Each qualifying atom pair counts towards its pair type.
+                keep_flag = 0
+                for count_k,k in enumerate(hit_ids):
+                    pair = pair_list[k]
+                    accepted = min(hit_counts[count_k],args.N_configs-pair_dict[pair]["configurations"])
+                    if accepted > 0:
+                        keep_flag = 1
+                        pair_dict[pair]["configurations"] += int(accepted)
+
+                # Intialize subgeometries for each molecule
+                A_geo      = geo[A_inds,:]
+                B_geo      = geo[B_inds,:]
+
+                # if the keep flag is set, generate orca input files and *.xyz files
+                if keep_flag == 1:
+
+                    # Generate element lists
+                    A_elem = [ data2elem_dict[types[m]] for m in A_inds ]
+                    B_elem = [ data2elem_dict[types[m]] for m in B_inds ]
+
+                    # Generate type lists
+                    A_types = [ data2map_dict[types[m]] for m in A_inds ]
+                    B_types = [ data2map_dict[types[m]] for m in B_inds ]
+                    
+                    
+                    # Generate charge lists
+                    A_charges = [ data2charge_dict[types[m]] for m in A_inds ] 
+                    B_charges = [ data2charge_dict[types[m]] for m in B_inds ] 
+
+                    # Generate xyz with geometry, types, mol_ids, and charges
+                    gen_xyz(args.filename+'/configs/{}-{}/'.format(str(label_list[count_t]),str(config_count)),'{}-{}'.format(str(label_list[count_t]),str(config_count)),A_elem,B_elem,A_geo,B_geo,A_charges,B_charges,A_types,B_types)
+
+                    if args.o_mode == 1:
+                        # Generate SAPT input file
+                        gen_SAPT(args.filename+'/configs/{}-{}/'.format(str(label_list[count_t]),str(config_count)),'{}-{}'.format(str(label_list[count_t]),str(config_count)),A_elem,A_types,A_geo,B_elem,B_types,B_geo,args.q_A,\
+                             args.m_A,args.q_B,args.m_B,args.SAPT_method,args.SAPT_name)
                         
-                        # Generate charge lists
-                        A_charges = [ data2charge_dict[types[m]] for m in A_inds ] 
-                        B_charges = [ data2charge_dict[types[m]] for m in B_inds ] 
-
-                        # Generate xyz with geometry, types, mol_ids, and charges
-                        gen_xyz(args.filename+'/configs/{}-{}/'.format(str(label_list[count_t]),str(config_count)),'{}-{}'.format(str(label_list[count_t]),str(config_count)),A_elem,B_elem,A_geo,B_geo,A_charges,B_charges,A_types,B_types)
-
-                        if args.o_mode == 1:
-                            # Generate SAPT input file
-                            gen_SAPT(args.filename+'/configs/{}-{}/'.format(str(label_list[count_t]),str(config_count)),'{}-{}'.format(str(label_list[count_t]),str(config_count)),A_elem,A_types,A_geo,B_elem,B_types,B_geo,args.q_A,\
-                                 args.m_A,args.q_B,args.m_B,args.SAPT_method,args.SAPT_name)
-                            
-                        else:
-                            # Generate orca input file
-                            gen_orca(args.filename+'/configs/{}-{}/'.format(str(label_list[count_t]),str(config_count)),'{}-{}'.format(str(label_list[count_t]),str(config_count)),A_elem,A_types,A_geo,B_elem,B_types,B_geo,args.functional,args.D3_option,args.q_A,\
-                                 args.m_A,args.q_B,args.m_B,args.procs,args.QC_types)
-
-                        # Iterate configuration counter
-                        config_count += 1
+                    else:
+                        # Generate orca input file
+                        gen_orca(args.filename+'/configs/{}-{}/'.format(str(label_list[count_t]),str(config_count)),'{}-{}'.format(str(label_list[count_t]),str(config_count)),A_elem,A_types,A_geo,B_elem,B_types,B_geo,args.functional,args.D3_option,args.q_A,\
+                             args.m_A,args.q_B,args.m_B,args.procs,args.QC_types)
+
+                    # Iterate configuration counter
+                    config_count += 1
             # Print diagnostic
             print("parsing configurations from frame {:<10}: {}".format(frame,config_count))
 
@@ -888,50 +873,10 @@ def gen_SAPT(Save_Folder,Name,A_Elements,A_Types,A_Geometry,B_Elements,B_Types,B
 
 
 # Parses the box,id#s,atom_types,mol#s, and geometry from the requested frame in the supplied trajectory
-def get_frame(frame,traj,num_atoms):
-
-    ids = [0]*num_atoms
-    types = ["X"]*num_atoms
-    geo = zeros([num_atoms,3])
-    mol = ["X"]*num_atoms
-    box = array([0.0,0.0,0.0,0.0,0.0,0.0])
-
-    # Check for atom dump type
-    with open(traj,'r') as f:
-        timestep_flag = -1        # zero indexing
-        parse_flag    = 0         # toggles the geometry parse
-        box_flag      = 0
-        atom_counter  = 0         # keeps track of the number of placed atoms
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-            if len(fields) > 0 and fields[0] == "ITEM:" and fields[1] == "TIMESTEP":
-                timestep_flag += 1
-            if len(fields) > 0 and fields[0] == "ITEM:" and fields[1] == "TIMESTEP" and parse_flag == 1:
-                break
-
-            # Geo parse statements
-            if timestep_flag == frame and len(fields) >= 8 and fields[0] == "ITEM:" and fields[1] == "ATOMS" and "mol" in fields:
-                mol_ind = fields.index("mol") - 2
-                parse_flag = 1
-                continue
-            if parse_flag == 1:
-                ids[atom_counter]   = int(fields[0])
-                types[atom_counter] = fields[1]
-                geo[atom_counter,:] = array([float(fields[2]),float(fields[3]),float(fields[4])])
-                mol[atom_counter]   = fields[mol_ind]
-                atom_counter += 1
-
-            # Box parse statements
-            if timestep_flag == frame and len(fields) >= 2 and fields[0] == "ITEM:" and fields[1] == "BOX":
-                box_flag = 1
-                continue
-            if box_flag > 0 and box_flag <= 5:
-                box[box_flag-1] = float(fields[0])
-                box[box_flag]   = float(fields[1])
-                box_flag += 2
-
-
-    return ids,types,geo,mol,box
+# NOTE: thin wrapper around lammps_traj.Trajectory (the frame index is cached in a sidecar). Use 
+#       Trajectory.iter_frames() directly when looping over many frames.
+def get_frame(frame,traj,num_atoms=None):
+    return Trajectory(traj).get_frame(frame)
 
 # Check dump formatting and scrap lammps atom types and mol ids
 def check_dump_format(Name):
@@ -1087,16 +1032,7 @@ def Generate_Map(traj_file,map_file):
 
 # Returns the total number of frames in the trajectory
 def get_num_frames(Name):
-
-    # Parse number of frames    
-    with open(Name,'r') as f:
-        frame_count = 0
-        for lc,lines in enumerate(f):
-            fields = lines.split()
-            if len(fields) > 0 and fields[0] == "ITEM:" and fields[1] == "TIMESTEP":
-                frame_count += 1
-
-    return frame_count
+    return len(Trajectory(Name))
 
 def gen_xyz(Save_Folder,Name,A_Elements,B_Elements,A_Geometry,B_Geometry,A_Charges,B_Charges,A_Types,B_Types):
 
@@ -1208,6 +1144,112 @@ def Generate_Pair_Info(traj_file,A_list,B_list,data2map_dict,initial_params,r_mi
 
     return pair_dict,initial_guess_dict
 
+# Description: Packs the pair information into integer-indexed arrays for screen_pairs(). 
+#
+# Returns:     pair_list:   list of the pair types in pair_dict (the pair index used below)
+#              type_index:  dictionary mapping each lammps atom type onto an integer type index
+#              pair_id_mat: TxT array holding the pair index for each combination of type indices (-1 if the pair isn't sampled)
+#              r_thresh:    array holding the r_thresh of each pair index
+def Generate_Pair_Arrays(data2map_dict,pair_dict):
+
+    pair_list   = list(pair_dict.keys())
+    pair_ind    = { i:count_i for count_i,i in enumerate(pair_list) }
+    type_index  = { i:count_i for count_i,i in enumerate(sorted(data2map_dict.keys())) }
+    pair_id_mat = -ones([len(type_index),len(type_index)],dtype=int)
+    for i in type_index:
+        for j in type_index:
+            A_type = data2map_dict[i]
+            B_type = data2map_dict[j]
+            if A_type >= B_type:
+                pair = (A_type,B_type)
+            else:
+                pair = (B_type,A_type)
+            if pair in pair_ind:
+                pair_id_mat[type_index[i],type_index[j]] = pair_ind[pair]
+    r_thresh = array([ pair_dict[i]["r_thresh"] for i in pair_list ],dtype=float)
+
+    return pair_list,type_index,pair_id_mat,r_thresh
+
+# Description: Screens a whole frame for molecule pairs (one molecule from A_list and one from B_list) that hold at least one 
+#              atom pair within the r_thresh of its pair type. All atom pairs within the largest r_thresh are collected with a 
+#              single KD-tree query and then filtered against the per-pair-type thresholds using the integer type indices. 
+#              No periodic images are considered (the frame is expected to be unwrapped, consistent with the per-pair cdist 
+#              this replaces).
+#
+# Inputs:      geo:         Nx3 array of (unwrapped) coordinates
+#              types:       N lammps atom types
+#              mol:         N mol ids
+#              A_list:      list of mol ids that can occupy the A position of a pair
+#              B_list:      list of mol ids that can occupy the B position of a pair
+#              type_index,pair_id_mat,r_thresh: see Generate_Pair_Arrays()
+#
+# Returns:     list of (A_mol,B_mol,A_inds,B_inds,hit_ids,hit_counts) tuples ordered as they would be visited by looping over A_list and 
+#              then B_list (skipping self pairs and pairs already visited in the opposite order). hit_ids holds the pair indices
+#              that were found within r_thresh and hit_counts the number of atom pairs found for each.
+def screen_pairs(geo,types,mol,A_list,B_list,type_index,pair_id_mat,r_thresh):
+
+    if len(r_thresh) == 0:
+        return []
+
+    # Integer molecule and type indices for each atom
+    mol_ids,mol_idx = unique(mol,return_inverse=True)
+    type_ids,type_idx = unique(types,return_inverse=True)
+    type_idx = array([ type_index[i] for i in type_ids ],dtype=int)[type_idx]
+
+    # Position of each molecule in A_list and B_list (-1 for molecules not in the list)
+    A_pos = {}
+    B_pos = {}
+    for count_i,i in enumerate(A_list):
+        A_pos.setdefault(str(i),count_i)
+    for count_i,i in enumerate(B_list):
+        B_pos.setdefault(str(i),count_i)
+    pos_A = array([ A_pos.get(str(i),-1) for i in mol_ids ],dtype=int)
+    pos_B = array([ B_pos.get(str(i),-1) for i in mol_ids ],dtype=int)
+
+    # All atom pairs within the largest threshold, then per-pair-type threshold filtering
+    hits = cKDTree(geo).query_pairs(r=max(r_thresh),output_type='ndarray')
+    if len(hits) == 0:
+        return []
+    m_1 = mol_idx[hits[:,0]]
+    m_2 = mol_idx[hits[:,1]]
+    pair_ids = pair_id_mat[type_idx[hits[:,0]],type_idx[hits[:,1]]]
+    mask = ( m_1 != m_2 ) * ( pair_ids >= 0 ) 
+    hits,m_1,m_2,pair_ids = hits[mask],m_1[mask],m_2[mask],pair_ids[mask]
+    d = norm(geo[hits[:,0]]-geo[hits[:,1]],axis=1)
+    mask = d <= r_thresh[pair_ids]
+    m_1,m_2,pair_ids = m_1[mask],m_2[mask],pair_ids[mask]
+
+    # Orient each molecule pair by its first appearance in the A_list/B_list loop 
+    N_B = len(B_list)
+    big = (len(A_list)+1)*(N_B+1)
+    key_12 = where( (pos_A[m_1] >= 0) * (pos_B[m_2] >= 0), pos_A[m_1]*N_B+pos_B[m_2], big )
+    key_21 = where( (pos_A[m_2] >= 0) * (pos_B[m_1] >= 0), pos_A[m_2]*N_B+pos_B[m_1], big )
+    keys   = minimum(key_12,key_21)
+    mask   = keys < big
+    keys,pair_ids = keys[mask],pair_ids[mask]
+    if len(keys) == 0:
+        return []
+
+    # Count the atom pairs of each pair type found for each molecule pair (sorted by visiting order)
+    combined,counts = unique(array([keys,pair_ids]).T,axis=0,return_counts=True)
+
+    # Atom indices of each molecule (in ascending order, as the original list comprehension over mol)
+    order = argsort(mol_idx,kind='stable')
+    mol_inds = split(order,cumsum(bincount(mol_idx,minlength=len(mol_ids)))[:-1])
+    mol_lookup = { str(i):count_i for count_i,i in enumerate(mol_ids) }
+
+    # Assemble the molecule pairs. The visiting key encodes the A_list and B_list positions of the pair.
+    pairs = []
+    bounds = concatenate([[0],where(diff(combined[:,0]) != 0)[0]+1,[len(combined)]])
+    for count_i in range(len(bounds)-1):
+        key   = combined[bounds[count_i],0]
+        A_mol = A_list[key // N_B]
+        B_mol = B_list[key % N_B]
+        pairs += [(A_mol,B_mol,mol_inds[mol_lookup[str(A_mol)]],mol_inds[mol_lookup[str(B_mol)]],\
+                   combined[bounds[count_i]:bounds[count_i+1],1],counts[bounds[count_i]:bounds[count_i+1]])]
+
+    return pairs
+
 # Description: Reads in the FF parameters
 def get_FF_data(FF_files,keep_types=[ "atom", "vdw", "bond", "angle", "torsion", "dihedral", "charge" ]):
 
@@ -136,15 +136,11 @@ def grid_gen(elements,geo,size_factor,density_scale):
     #elements = [c['element'] for c in conf]
     # array of points for each scale of molecular surface
     #try different density, 6 is a good number
-    points = []
     
     # Size factors (multiplication constants) multiplied by the VDW radii of corresponding atoms
     # sizefactor and density scale are set to be the same as 2005 Anisimov et al.
     # doi:10.1021/ct049930p
-    for atom in atoms:
-        points.extend(atom.radius_points(density=float(args.density)*density_scale, scale=size_factor/10, check_against=atoms))
-
-    points = np.array(points) 
+    points = GRC.surface_points(atoms, scale=size_factor/10, density=float(args.density)*density_scale)
     rows = points.shape[0]
     print("Total of {} grid pts generated for Radii scale at {}".format(rows,float(size_factor/10)))
 
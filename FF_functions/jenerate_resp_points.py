@@ -7,6 +7,7 @@ import sys,argparse
 import itertools
 import math
 import numpy as np
+from scipy.spatial import cKDTree
 
 import matplotlib.pyplot as plt
 
@@ -64,16 +65,10 @@ def main(argv):
        #for scale in range(14, 21, 2): #generate points 1.4, 1.6, 1.8, 2.0 times the VDW radius
        for count_i,scale in enumerate(sizefactor):
            colors.append(scale)
-           pointses.append([])
-           for atom in atoms:
-               #pointses[-1].extend(atom.radius_points(density=int(args.density), scale=scale/10, check_against=atoms))
-               pointses[-1].extend(atom.radius_points(density=float(args.density)*density_scale[count_i], scale=scale/10, check_against=atoms))
+           pointses.append(surface_points(atoms, scale=scale/10, density=float(args.density)*density_scale[count_i]))
        
        grand_colors = list(itertools.chain.from_iterable([color] * len(points) for color, points in zip(colors, pointses)))
        
-       # make numpy arrays from pointses
-       pointses = [np.array(points) for points in pointses]
-       
        # go through all pointses, saving points to a file and plotting
        for color, points in zip(colors, pointses):
            rows = points.shape[0]
@@ -226,66 +221,117 @@ class Atom:
 
             if dist_sq(self.xyz, other.xyz) < sum_r_sq:
                 to_check.append((other, (other.radius * scale)**2))
-        # get number of points based on density and surface area
-        # but this will be for each eight of the sphere
-        num_points = math.pi * r * r * density / 2
-        # inclination radius is always sphere's r
-        # azimuth radius varies from 0 to sphere r
-        # in fact, it's r * sin(theta), where theta is the inclination angle
-        # the average of this is 2 / PI * r
-        # so the average radii are r and 2 / PI * r
-        # so the circumferences are 2 PI r and 2 PI (2 / PI r)
-        # but the half-circumference of incl is PI r and the azimuthal circumference is still 2 PI (2 / PI r)
-        # hence the surface area is 4 PI r^2, which is the textbook definition
-        # but if we want to get number of points in each direction, we need to consider
-        # x = PI r, and SA = x * (4 / PI) x
-        # so x = sqrt(SA * PI / 4)
-        # if instead of SA, we want to divide number of points, we can just substitute that, as below
-        
-        # partition number of points by inclination and azimuth d.o.f.
-        inc_points = math.sqrt(num_points * math.pi / 4)
-
-        # round up for both
-        inc_points, azi_points_0 = math.ceil(inc_points), inc_points * 2 / math.pi
-        avg_r = 2 / math.pi * r
-
         points = []
-        counter = 0
-        # pre-calculate some things
-        theta_factor = math.pi / 2 / inc_points
-        z_factorses = [(1, -1)] * inc_points + [(1, )]
-        xy_factorses = [(1, )] + [(1, -1)] * inc_points
-        # iterate over inclination points
-        # + 1 to make sure we get top and bottom
-        for inc, z_factors, xy_factors in zip(range(inc_points + 1), z_factorses, xy_factorses):
-            theta = inc * theta_factor
-            z_0 = r * math.cos(theta)
-            inc_r = r * math.sin(theta)
-            # get number of azimuthal points at this inclination
-            azi_points = math.ceil(azi_points_0 * (inc_r + 0.001) / avg_r)
-            for z in (z_0 * z_factor for z_factor in z_factors):
-                counter += azi_points
-                #print(azi_points)
-                phi_factor = math.pi / 2 / azi_points
-
-                for azi in range(azi_points):
-                    phi = azi * phi_factor
-                    x = inc_r * math.cos(phi)
-                    y = inc_r * math.sin(phi)
-                    for xy_rot in range(4 if x or y else 1):
-                        final_offset = (x, y, z)
-                        loc = tuple(a + b for a, b in zip(self.xyz, final_offset))
-                        #print(math.sin(phi), inc_r)
-                        #tuple(r_sin_theta * i for i in azi) + (z, )
-                        for other, other_r_sq in to_check:
-                            if other != self and dist_sq(loc, other.xyz) < other_r_sq:
-                                break
-                        else:
-                            points.append(loc)
-                        x, y = -y, x
-        assert counter > num_points
+        for final_offset in shell_offsets(r, density):
+            loc = tuple(a + b for a, b in zip(self.xyz, final_offset))
+            for other, other_r_sq in to_check:
+                if other != self and dist_sq(loc, other.xyz) < other_r_sq:
+                    break
+            else:
+                points.append(loc)
         return points
 
+def shell_offsets(r, density):
+    """return the offsets from the atom center of the points on a sphere of
+       radius r with a density on the surface of density (points / square
+       angstrom), in the order radius_points visits them. The offsets only
+       depend on r and density, so they are cached
+    """
+    if not hasattr(shell_offsets, "cache"):
+        shell_offsets.cache = {}
+    if (r, density) in shell_offsets.cache:
+        return shell_offsets.cache[(r, density)]
+
+    # get number of points based on density and surface area
+    # but this will be for each eight of the sphere
+    num_points = math.pi * r * r * density / 2
+    # inclination radius is always sphere's r
+    # azimuth radius varies from 0 to sphere r
+    # in fact, it's r * sin(theta), where theta is the inclination angle
+    # the average of this is 2 / PI * r
+    # so the average radii are r and 2 / PI * r
+    # so the circumferences are 2 PI r and 2 PI (2 / PI r)
+    # but the half-circumference of incl is PI r and the azimuthal circumference is still 2 PI (2 / PI r)
+    # hence the surface area is 4 PI r^2, which is the textbook definition
+    # but if we want to get number of points in each direction, we need to consider
+    # x = PI r, and SA = x * (4 / PI) x
+    # so x = sqrt(SA * PI / 4)
+    # if instead of SA, we want to divide number of points, we can just substitute that, as below
+    
+    # partition number of points by inclination and azimuth d.o.f.
+    inc_points = math.sqrt(num_points * math.pi / 4)
+
+    # round up for both
+    inc_points, azi_points_0 = math.ceil(inc_points), inc_points * 2 / math.pi
+    avg_r = 2 / math.pi * r
+
+    points = []
+    counter = 0
+    # pre-calculate some things
+    theta_factor = math.pi / 2 / inc_points
+    z_factorses = [(1, -1)] * inc_points + [(1, )]
+    xy_factorses = [(1, )] + [(1, -1)] * inc_points
+    # iterate over inclination points
+    # + 1 to make sure we get top and bottom
+    for inc, z_factors, xy_factors in zip(range(inc_points + 1), z_factorses, xy_factorses):
+        theta = inc * theta_factor
+        z_0 = r * math.cos(theta)
+        inc_r = r * math.sin(theta)
+        # get number of azimuthal points at this inclination
+        azi_points = math.ceil(azi_points_0 * (inc_r + 0.001) / avg_r)
+        for z in (z_0 * z_factor for z_factor in z_factors):
+            counter += azi_points
+            #print(azi_points)
+            phi_factor = math.pi / 2 / azi_points
+
+            for azi in range(azi_points):
+                phi = azi * phi_factor
+                x = inc_r * math.cos(phi)
+                y = inc_r * math.sin(phi)
+                for xy_rot in range(4 if x or y else 1):
+                    points.append((x, y, z))
+                    x, y = -y, x
+    assert counter > num_points
+    shell_offsets.cache[(r, density)] = points
+    return points
+
+def surface_points(atoms, scale=1, density=1):
+    """return the points of a molecular surface layer as an Nx3 array, the
+       same points (and order) as concatenating atom.radius_points(scale,
+       density, check_against=atoms) over atoms. The shells of all atoms are
+       built from shell_offsets with array operations and the buried points
+       are removed with KD-tree queries for the whole layer (one per distinct
+       atomic radius)
+    """
+    xyz = np.array([atom.xyz for atom in atoms], dtype=float).reshape(-1, 3)
+    r = [atom.radius * scale for atom in atoms]
+    r_sq = np.array([(atom.radius * scale)**2 for atom in atoms])
+
+    # shell points of every atom (owner holds the index of the atom each point belongs to)
+    shells = [xyz[i] + np.array(shell_offsets(r[i], density)).reshape(-1, 3) for i in range(len(atoms))]
+    owner = np.concatenate([np.full(len(shell), i) for i, shell in enumerate(shells)] + [np.zeros(0, dtype=int)])
+    points = np.vstack(shells + [np.zeros([0, 3])])
+    if len(points) == 0:
+        return points
+
+    # a point is buried if it is inside the scaled radius of another atom that overlaps its own atom (the same
+    # tests and arithmetic as radius_points). The atoms are grouped by radius so that only the nearest atoms of
+    # each group have to be checked: if any atom of a group other than the owner contains the point, so does the
+    # nearest one (the query radius is padded so that no candidate is lost to round-off).
+    buried = np.zeros(len(points), dtype=bool)
+    for radius in sorted(set(r)):
+        members = np.array([i for i in range(len(atoms)) if r[i] == radius])
+        nbrs = cKDTree(xyz[members]).query(points, k=min(3, len(members)), distance_upper_bound=radius * (1.0 + 1.0E-8))[1]
+        for nbr in nbrs.reshape(len(points), -1).T:
+            p_ind = np.where(nbr < len(members))[0]
+            a_ind = members[nbr[p_ind]]
+            d = xyz[owner[p_ind]] - xyz[a_ind]
+            overlap = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2] < (np.array(r)[a_ind] + np.array(r)[owner[p_ind]])**2
+            d = points[p_ind] - xyz[a_ind]
+            inside = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2] < r_sq[a_ind]
+            buried[p_ind[(a_ind != owner[p_ind]) & overlap & inside]] = True
+    return points[~buried]
+
 
 if __name__ == "__main__":
    main(sys.argv[1:])
@@ -9,6 +9,8 @@ from scipy.spatial.distance import *
 from numpy.linalg import *
 import shutil
 import random
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from param_store import ParamStore,load_store,write_db
 
 def main(argv):
 
@@ -118,71 +120,36 @@ def fun(option):
         if os.path.isfile(master_path+'/.bkp'+str(num_bkp-i)+'.'+master.split('/')[-1]) != True:
             shutil.copyfile(master,master_path+'/.bkp'+str(num_bkp-i)+'.'+master.split('/')[-1])            
 
-    # Read in the master list data
-    Master_Data = get_data(master,keep_types = [ "atom", "vdw", "bond", "angle", "torsion", "dihedral", "charge" ],no_ct=no_ct)
-    New_Data = get_data(new_params,keep_types=types,no_ct=no_ct)
-    
-    # Merge new parameters with master    
-    added_elements = 0
-    updated_elements = 0
-    for i in list(New_Data.keys()):
-        for j in list(New_Data[i].keys()):
-
-            # Add new parameters that don't exist in current master database.
-            if j not in list(Master_Data[i].keys()):
-                
-                # Add new parameter and append mol_id to the info
-                Master_Data[i][j] = New_Data[i][j]
-                added_elements += 1
-
-            # Update parameters that exist in current master database (if -R is toggled in command line call).
-            elif j in list(Master_Data[i].keys()) and replace == 1:
-
-                # Add new parameter and append mol_id to the info
-                Master_Data[i][j] = New_Data[i][j]
-                updated_elements += 1
-                
-    # Write updated master FF 
-    if added_elements > 0 or updated_elements > 0:
-        if added_elements > 0:
-            print("Updating {} with {} new parameters from {}...".format(master,added_elements,new_params))
-        if updated_elements > 0:
-            print("Updating {} with {} updated parameters from {}...".format(master,updated_elements,new_params))
-        write_updated(Master_Data,master,num_bkp)
-    else:
-        print("No new parameters discovered in {}. Exiting without modifying {}...".format(new_params,master))
+    # Read in the master list data (cached store) and the new parameters
+    Master_Store = load_store(master)
+    New_Store = ParamStore().import_db(new_params)
+
+    # Merge new parameters with master (only the new/updated entries are touched). The merge is only committed
+    # once the text file has been written, so the cached store never reports itself current for a file it doesn't match.
+    added_elements,updated_elements = Master_Store.merge(New_Store,keep_types=types,replace=(replace == 1),no_ct=no_ct,commit=False)
+    try:
+
+        # Write updated master FF 
+        if added_elements > 0 or updated_elements > 0:
+            if added_elements > 0:
+                print("Updating {} with {} new parameters from {}...".format(master,added_elements,new_params))
+            if updated_elements > 0:
+                print("Updating {} with {} updated parameters from {}...".format(master,updated_elements,new_params))
+            write_updated(Master_Store,master,num_bkp)
+        else:
+            print("No new parameters discovered in {}. Exiting without modifying {}...".format(new_params,master))
+        Master_Store.conn.execute("COMMIT")
+    except:
+        Master_Store.conn.execute("ROLLBACK")
+        raise
 
     return
     
 # Description: Reads in the FF
 def get_data(master_file,keep_types=[ "atom", "vdw", "bond", "angle", "torsion", "dihedral", "charge" ],no_ct=False):
+    return load_store(master_file).get_data(keep_types=keep_types,no_ct=no_ct)
 
-    Data = {"atoms":{},"bonds":{},"angles":{},"dihedrals":{},"vdws":{},"charges":{}}
-
-    # Read in Atom data
-    with open(master_file,'r') as f:
-        for lines in f:
-            fields = lines.split()
-
-            if len(fields) == 0: continue
-            if fields[0] == "atom" and "atom" in keep_types:
-                Data["atoms"][fields[1]] = fields[1:]
-            if fields[0] == "vdw" and "vdw" in keep_types:
-                if no_ct is True and fields[1] == fields[2]:
-                    Data["vdws"][(fields[1],fields[2],fields[3])] = fields[1:]
-                elif no_ct is False:
-                    Data["vdws"][(fields[1],fields[2],fields[3])] = fields[1:]
-            if fields[0] == "bond" and "bond" in keep_types:
-                Data["bonds"][(fields[1],fields[2],fields[3])] = fields[1:]
-            if fields[0] == "angle" and "angle" in keep_types:
-                Data["angles"][(fields[1],fields[2],fields[3],fields[4])] = fields[1:]
-            if fields[0] == "dihedral" or fields[0] == "torsion" and ( "dihedral" in keep_types or "torsion" in keep_types ):
-                Data["dihedrals"][(fields[1],fields[2],fields[3],fields[4],fields[5])] = fields[1:]
-            if fields[0] == "charge" and "charge" in keep_types:
-                Data["charges"][fields[1]] = fields[1:]
-    
-    return Data
-
+# Description: Writes the updated FF (a ParamStore or a get_data dictionary) to master_FF, keeping num_bkp backups
 def write_updated(Data,master_FF,num_bkp):
 
     # generate master_path and *.molecules.db name
@@ -194,63 +161,18 @@ def write_updated(Data,master_FF,num_bkp):
     #######################
 
     # Copy header    
+    header = ""
     with open(master_FF,'r') as f:
-        with open(master_FF+'.tmp', 'w') as h:
-            for i in f:
-                if i[0] != "#": break
-                else: h.write(i)
+        for i in f:
+            if i[0] != "#": break
+            else: header += i
 
     # The formatting of this database file is compatible 
     # with the input for the polygen.py program.
-    with open(master_FF+'.tmp', 'a') as f:
-
-        # Write atom type definitions
-        f.write("\n\n# Atom type definitions\n#\n{:<10s} {:<60s} {:<59s} {:<20s} {:<6s}\n"\
-                .format("#","Atom_type","Label","Mass", "Mol_ID"))        
-        for i in sorted(Data["atoms"].keys()):
-            if len(Data["atoms"][i]) > 3:
-                f.write("{:<10s} {:<60s} {:<59s} {:<20s} {:<s}\n"\
-                        .format("atom",Data["atoms"][i][0],Data["atoms"][i][1],Data["atoms"][i][2],Data["atoms"][i][3]))
-            elif len(Data["atoms"][i]) == 3:
-                f.write("{:<10s} {:<60s} {:<59s} {:<20s}\n"\
-                        .format("atom",Data["atoms"][i][0],Data["atoms"][i][1],Data["atoms"][i][2]))                
-
-        # Write VDW definitions
-        f.write("\n# VDW definitions\n#\n{:<10s} {:<60s} {:<60s} {:<15s} {:<41s} {:<6s}\n"\
-                .format("#","Atom_type","Atom_type","Potential","params (style determines #args)","Mol_ID"))
-        for i in sorted(Data["vdws"].keys()):
-            f.write("{:<10s} {:<60s} {:<60s} {:<15s} {} {:<s}\n"\
-                    .format("vdw",Data["vdws"][i][0],Data["vdws"][i][1],Data["vdws"][i][2]," ".join([ "{:<20s}".format(j) for j in Data["vdws"][i][3:-1] ]),Data["vdws"][i][-1])) 
-
-        # Write bond definitions
-        f.write("\n# Bond type definitions\n#\n{:<10s} {:<40s} {:<40s} {:<15s} {:<41s} {:<6s}\n".format("#","Atom_type","Atom_type","style","params (style determines #args)","Mol_ID"))
-        for i in sorted(Data["bonds"].keys()):
-            f.write("{:<10s} {:<40s} {:<40s} {:<15s} {} {:<s}\n"\
-                    .format("bond",Data["bonds"][i][0],Data["bonds"][i][1],Data["bonds"][i][2]," ".join([ "{:<20s}".format(j) for j in Data["bonds"][i][3:-1] ]),Data["bonds"][i][-1]))
-
-        # Write angle definitions
-        f.write("\n# Angle type definitions\n#\n{:<10s} {:<40s} {:<40s} {:<40s} {:<15s} {:<41s} {:<6s}\n"\
-                .format("#","Atom_type","Atom_type","Atom_type","style","params (style determines #args)","Mol_ID"))
-        for i in sorted(Data["angles"].keys()):
-            f.write("{:<10s} {:<40s} {:<40s} {:<40s} {:<15s} {} {:<s}\n"\
-                    .format("angle",Data["angles"][i][0],Data["angles"][i][1],Data["angles"][i][2],Data["angles"][i][3],\
-                            " ".join([ "{:<20s}".format(j) for j in Data["angles"][i][4:-1] ]),Data["angles"][i][-1]))
-
-        # Write dihedral definitions
-        f.write("\n# Dihedral/Torsional type definitions\n#\n{:<10s} {:<40s} {:<40s} {:<40s} {:<40s} {:<15s} {:<83s} {:<6s}\n"\
-                .format("#","Atom_type","Atom_type","Atom_type","Atom_type","style","params (style determines #args)","Mol_ID"))
-        for i in sorted(Data["dihedrals"].keys()):
-            f.write("{:<10s} {:<40s} {:<40s} {:<40s} {:<40s} {:<15s} {} {:<s}\n"\
-                    .format("torsion",Data["dihedrals"][i][0],Data["dihedrals"][i][1],Data["dihedrals"][i][2],Data["dihedrals"][i][3],Data["dihedrals"][i][4],\
-                            " ".join([ "{:<20s}".format(j) for j in Data["dihedrals"][i][5:-1] ]),Data["dihedrals"][i][-1]))
-
-        # Write charge definitions
-        f.write("\n# Charge definitions\n#\n{:<10s} {:<61s} {:<6s}\n".format("#","Atom_type","Charge","Mol_ID"))
-        for i in sorted(Data["charges"].keys()):
-            if len(Data["charges"][i]) > 2:
-                f.write("{:<10s} {:<60s} {:<20s} {:<20s}\n".format("charge",Data["charges"][i][0],Data["charges"][i][1],Data["charges"][i][2]))
-            elif len(Data["charges"][i]) == 2:
-                f.write("{:<10s} {:<60s} {:<20s}\n".format("charge",Data["charges"][i][0],Data["charges"][i][1]))
+    if isinstance(Data,ParamStore):
+        Data.export_db(master_FF+'.tmp',header=header)
+    else:
+        write_db(Data,master_FF+'.tmp',header=header)
 
     # copy backups
     # NOTE: convoluted "/".join call is to properly parse the path and ".".join call to
@@ -271,6 +193,10 @@ def write_updated(Data,master_FF,num_bkp):
 
     # remove .tmp files
     os.remove(master_FF+'.tmp')
+
+    # The store already holds the update, so it is marked as current for the new file
+    if isinstance(Data,ParamStore) and Data.path != ":memory:":
+        Data.set_source(master_FF)
     return
 
 
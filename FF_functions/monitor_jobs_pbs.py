@@ -1,6 +1,8 @@
 #!/bin/env python                                                                                                                                                             
 import sys,os,subprocess,argparse,time
 from subprocess import PIPE
+sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
+from job_tracker import JobTracker,PBSBackend
 
 class monitor_jobs() :
       
@@ -57,18 +59,17 @@ class monitor_jobs() :
 
         return jobs
 
+   # Blocks until the jobs leave the queue (one scheduler query per interval, backing off while nothing changes)
    def main(self):
-      current_jobs = self.qstat()
       print("waiting for jobs {} to complete....".format(self.jobids))
-      while True in [ i in current_jobs for i in self.jobids ]:
-        time.sleep(60)
-        current_jobs = self.qstat()  
+      self.tracker.wait(self.jobids)
       return
 
    def __init__(self,jobids,user):
       self.dict = {}
       self.jobids = jobids
       self.user = user
+      self.tracker = JobTracker(PBSBackend(user))
       self.main()
 
 
@@ -18,6 +18,7 @@ sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 from transify import *
 from adjacency import *
 from file_parsers import *
+from param_store import load_store
 from id_types import *
 
 def main(argv):
@@ -510,8 +511,9 @@ def frag_mode_gen(gens,charge,multiplicity,procs,theory,constraints,local_relaxa
         cyclic_dihedral_types = []
         cyclic_atomtypes = []
         del_list = []
+        G = as_graph(Adj_mat)
         for count_i,i in enumerate(All_Dihedrals):
-            if i[3] in return_connected(Adj_mat,start=i[0],avoid=[i[1]]) and i[0] in return_connected(Adj_mat,start=i[3],avoid=[i[2]]):
+            if i[3] in return_connected(G,start=i[0],avoid=[i[1]]) and i[0] in return_connected(G,start=i[3],avoid=[i[2]]):
                 cyclic_dihedrals += [i]
                 cyclic_dihedral_types += [tuple(All_Dihedral_types[count_i])] # Original mode
                 cyclic_dihedral_types += [(Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[i[3]])] # Mode in model compound                
@@ -1386,8 +1388,9 @@ def gen_bond_files(Name,gens,Adj_mat,B,Elements,Geometry,Atom_types,bond_step=0.
 
     # Check if the symmetric elongation protocol can be used (i.e. if the bond separates the molecule into
     # two halves then each halve can move as a whole during the elongation/contraction generation.
-    set_0 = return_connected(Adj_mat,start=B[0],avoid=[B[1]])
-    set_1 = return_connected(Adj_mat,start=B[1],avoid=[B[0]])
+    G = as_graph(Adj_mat)
+    set_0 = return_connected(G,start=B[0],avoid=[B[1]])
+    set_1 = return_connected(G,start=B[1],avoid=[B[0]])
     if set_0.isdisjoint(set_1):
         use_sym = True
     else:
@@ -3530,23 +3533,19 @@ def get_FF_data(avoid_files,gens=2,no_harmonic_db=0,keep_types=[ "atom", "vdw",
         else:
 
             # Read in parameters from FF file
-            with open(avoid,'r') as f:
-                for lines in f:
-                    fields = lines.split()
-
-                    if len(fields) == 0: continue
-                    if fields[0] == "atom" and "atom" in keep_types:
-                        Data["atoms"][fields[1]] = fields[1:]
-                    if fields[0] == "vdw" and "vdw" in keep_types:
-                        Data["vdws"][(fields[1],fields[2],fields[3])] = fields[1:]
-                    if fields[0] == "bond" and "bond" in keep_types:
-                        Data["bonds"][(fields[1],fields[2],fields[3])] = fields[1:]
-                    if fields[0] == "angle" and "angle" in keep_types:
-                        Data["angles"][(fields[1],fields[2],fields[3],fields[4])] = fields[1:]
-                    if fields[0] == "dihedral" or fields[0] == "torsion" and ( "dihedral" in keep_types or "torsion" in keep_types ):
-                        Data["dihedrals"][(fields[1],fields[2],fields[3],fields[4],fields[5])] = fields[1:]
-                    if fields[0] == "charge" and "charge" in keep_types:
-                        Data["charges"][fields[1]] = fields[1:]
+            for fields in load_store(avoid).lines():
+                if fields[0] == "atom" and "atom" in keep_types:
+                    Data["atoms"][fields[1]] = fields[1:]
+                if fields[0] == "vdw" and "vdw" in keep_types:
+                    Data["vdws"][(fields[1],fields[2],fields[3])] = fields[1:]
+                if fields[0] == "bond" and "bond" in keep_types:
+                    Data["bonds"][(fields[1],fields[2],fields[3])] = fields[1:]
+                if fields[0] == "angle" and "angle" in keep_types:
+                    Data["angles"][(fields[1],fields[2],fields[3],fields[4])] = fields[1:]
+                if fields[0] == "dihedral" or fields[0] == "torsion" and ( "dihedral" in keep_types or "torsion" in keep_types ):
+                    Data["dihedrals"][(fields[1],fields[2],fields[3],fields[4],fields[5])] = fields[1:]
+                if fields[0] == "charge" and "charge" in keep_types:
+                    Data["charges"][fields[1]] = fields[1:]
         
     return Data
 
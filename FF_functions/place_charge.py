@@ -2,14 +2,14 @@
 
 import sys,argparse,subprocess,os,math
 from subprocess import PIPE
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 import numpy as np
 import jenerate_resp_points as GRC # Generate Resp Charge 
 # Add TAFFI Lib to path
 sys.path.append('/'.join(os.path.abspath(__file__).split('/')[:-2])+'/Lib')
 from file_parsers import xyz_parse
 from adjacency import Table_generator,find_lewis,Find_modes_baonly
-from id_types import Hybridization_finder
+from id_types import Hybridization_finder,id_types
 
 
 def main(argv):
@@ -96,15 +96,11 @@ def grid_gen(elements,geo,density,size_factor,density_scale):
     #elements = [c['element'] for c in conf]
     # array of points for each scale of molecular surface
     #try different density, 6 is a good number
-    points = []
     
     # Size factors (multiplication constants) multiplied by the VDW radii of corresponding atoms
     # sizefactor and density scale are set to be the same as 2005 Anisimov et al.
     # doi:10.1021/ct049930p
-    for atom in atoms:
-        points.extend(atom.radius_points(density=float(density)*density_scale, scale=size_factor/10, check_against=atoms))
-
-    points = np.array(points) 
+    points = GRC.surface_points(atoms, scale=size_factor/10, density=float(density)*density_scale)
     rows = points.shape[0]
     print("Total of {} grid pts generated for Radii scale at {}".format(rows,float(size_factor/10)))
 
@@ -159,8 +155,8 @@ def place_all(criteria,points,geo,bonds,hybridizations,element,density,size_fact
 
 def place_bonds(criteria,points,geo,bonds,element):
 
-
     # Get bonds vectors
+    points = np.asarray(points,dtype=float).reshape(-1,3)
     intersec = []
     for pair in bonds:
          # Get bonds vector and bond central coordinate
@@ -170,14 +166,13 @@ def place_bonds(criteria,points,geo,bonds,element):
             v[i] = geo[pair[0]][i] - geo[pair[1]][i] 
             bc[i] = (geo[pair[0]][i] + geo[pair[1]][i]) / 2.0 
          # Get the intersection of bondvector and connolly surface
+         # (the angles of the candidates from the vectorized test are recomputed point by point so that the
+         # selection is identical to testing every point with angle_between)
          intersec_tmp = {}
-         for p in points: 
-            v2 = np.zeros(3)
-            for i in range(3):
-               v2[i] = p[i] - bc [i]
-            angle = angle_between(v,v2)
+         for count_p in np.where(angles_between(v,points-bc) < criteria + angle_tol)[0]:
+            angle = angle_between(v,points[count_p]-bc)
             if angle < criteria :
-               intersec_tmp[angle] = p
+               intersec_tmp[angle] = points[count_p]
          # if more than 2 grid points fits the criteria for one bond, delete the one that's off most
          if len(intersec_tmp) > 2:
             del intersec_tmp[max(intersec_tmp.keys())] 
@@ -188,21 +183,14 @@ def place_bonds(criteria,points,geo,bonds,element):
          for key in intersec_tmp:
             intersec.append(intersec_tmp[key])
     # if distance between two pts <1.5 A then remove one
-    shape = np.array(intersec).shape
-    if len(shape) == 1 and shape[0] == 0 :
+    if len(intersec) == 0:
       return intersec 
-    elif len(shape) == 1 and shape[0] != 0:
-      intersec = np.array(intersec).reshape(-1,1)
-    Dist_Mat = np.triu(cdist(intersec,intersec))
-    rm_ind,y_ind = np.where( (Dist_Mat < 1.5) & (Dist_Mat > 0.0))
-    # remove pts that are repeatedly chosen ( because it sneak through Dist_Mat > 0.0)
-    tmp_x,tmp_y = np.where( (Dist_Mat == 0.0) )
-    for i in range(0,len(tmp_x)):
-      if tmp_y[i] > tmp_x[i]:
-         rm_ind = np.append(rm_ind,tmp_y[i])
-         
-    rm_ind = list(dict.fromkeys(rm_ind))
-    intersec = [ i for count_i,i in enumerate(intersec) if count_i not in rm_ind] 
+    pairs,dist = close_pairs(np.array(intersec))
+    # remove pts that are repeatedly chosen ( because it sneak through dist > 0.0)
+    rm_ind = np.concatenate((pairs[(dist < 1.5) & (dist > 0.0),0],pairs[dist == 0.0,1]))
+    keep = np.ones(len(intersec),dtype=bool)
+    keep[rm_ind] = False
+    intersec = [ i for count_i,i in enumerate(intersec) if keep[count_i] ] 
       
     print("Placing {} charges along {} bonds....".format(len(intersec),len(bonds)))  
 
@@ -212,30 +200,21 @@ def place_bonds(criteria,points,geo,bonds,element):
 def place_lone_pair(criteria,points,geo,bonds,hybridizations,element):
 
     # Get bonds vectors
+    points = np.asarray(points,dtype=float).reshape(-1,3)
     intersec = []
 
+    # bonded atoms of each atom (in the order of bonds)
+    links = {}
+    for pair in bonds:
+         links.setdefault(pair[0],[]).append(pair[1])
+         if pair[1] != pair[0]:
+            links.setdefault(pair[1],[]).append(pair[0])
+
     # atoms that have special contraints (sp3 O and sp2 N)
     special = {}
     for count_i,hybrid in enumerate(hybridizations): 
-         if hybrid == 'sp3' and element[count_i] == 'O':
-            link = []
-            for pair in bonds:
-               if pair[0] == count_i:
-                  link.append(pair[1])
-               elif pair[1] == count_i:
-                  link.append(pair[0])
-            if len(link) == 2:
-               special[count_i] = {}
-               special[count_i]['element'] = 'N'
-               special[count_i]['atom_num'] = count_i 
-               special[count_i]['link'] = link
-         elif hybrid == 'sp2' and element[count_i] == 'N':
-            link = []
-            for pair in bonds:
-               if pair[0] == count_i:
-                  link.append(pair[1])
-               elif pair[1] == count_i:
-                  link.append(pair[0])
+         if (hybrid == 'sp3' and element[count_i] == 'O') or (hybrid == 'sp2' and element[count_i] == 'N'):
+            link = links.get(count_i,[])
             if len(link) == 2:
                special[count_i] = {}
                special[count_i]['element'] = 'N'
@@ -269,14 +248,15 @@ def place_lone_pair(criteria,points,geo,bonds,hybridizations,element):
          intersec_tmp_a  = []
          intersec_tmp_p = []
          count = [0] * 5
-         for p in points: 
-            v3 = p - geo[atom]
-            for i in range(0,5):
-               angle = angle_between_normal(P_d[i],v3,normal=True)
-               if angle < criteria :
-                  intersec_tmp_a.append(angle)
-                  intersec_tmp_p.append(p)
-                  count[i] += int(1)
+         # candidates (point,direction) in the order of the points are recomputed with angle_between (see place_bonds)
+         v3 = points - geo[atom]
+         angles = np.array([ angles_between(P_d[i],v3,normal=True) for i in range(0,5) ]).T
+         for count_p,i in np.argwhere(angles < criteria + angle_tol):
+            angle = angle_between(P_d[i],v3[count_p],normal=True)
+            if angle < criteria :
+               intersec_tmp_a.append(angle)
+               intersec_tmp_p.append(points[count_p])
+               count[i] += int(1)
 
          intersec = []
          # if more than 1 grid points fits the criteria for line pair, only keep one that has min angle
@@ -322,16 +302,31 @@ def remove_contact(grid_points,intersec):
       grid_points = np.array(grid_points).reshape(-1,1)
     if len(shape2) == 1 and shape2[0] != 0:
       intersec = np.array(intersec).reshape(-1,1)
-    Dist_Mat = np.triu(cdist(grid_points,intersec))
-    rm_ind,y_ind = np.where( (Dist_Mat < 1.5) & (Dist_Mat > 0.0))
-    rm_ind = list(dict.fromkeys(rm_ind))
+    # only the pairs (i,j) with j >= i are tested (upper triangle of the grid_points x intersec distance matrix)
+    pairs,dist = close_pairs(np.array(grid_points,dtype=float),np.array(intersec,dtype=float))
+    rm_ind = np.unique(pairs[(pairs[:,1] >= pairs[:,0]) & (dist < 1.5) & (dist > 0.0),0])
     
     print("{} charges removed due to close contact w/ already placed charge".format(len(rm_ind)))
-    grid_points = [ i for count_i,i in enumerate(grid_points) if count_i not in rm_ind]
+    keep = np.ones(len(grid_points),dtype=bool)
+    keep[rm_ind] = False
+    grid_points = [ i for count_i,i in enumerate(grid_points) if keep[count_i] ]
 
 
     return grid_points
 
+# Returns the index pairs (i,j) of the points in x and y that are within r of each other (i < j when y is None) and their
+# distances. The pairs are found with a KD-tree and the distances are recomputed as in cdist, so a comparison against
+# r gives the same result as on the full distance matrix.
+def close_pairs(x,y=None,r=1.5):
+    if y is None:
+      pairs = cKDTree(x).query_pairs(r*(1.0+1.0E-8),output_type='ndarray').reshape(-1,2)
+      y = x
+    else:
+      pairs = cKDTree(x).sparse_distance_matrix(cKDTree(y),r*(1.0+1.0E-8),output_type='ndarray')
+      pairs = np.array([pairs['i'],pairs['j']],dtype=int).T.reshape(-1,2)
+    d = x[pairs[:,0]] - y[pairs[:,1]]
+    dist = np.sqrt(d[:,0]*d[:,0] + d[:,1]*d[:,1] + d[:,2]*d[:,2])
+    return pairs,dist
 
 def angle_between(v1, v2,normal=False):
 # Return acute angle
@@ -344,6 +339,17 @@ def angle_between(v1, v2,normal=False):
          angle = 180.0 - angle
     return angle
 
+# Vectorized angle_between for the rows of v2s (equal to angle_between up to round-off, see angle_tol)
+def angles_between(v1,v2s,normal=False):
+    with np.errstate(divide='ignore',invalid='ignore'):
+       angle = np.arccos(np.clip(np.dot(v2s,unit_vector(v1))/np.linalg.norm(v2s,axis=1),-1.0,1.0))/math.pi*180.0
+    if not normal:
+       angle = np.where(angle > 90.0,180.0 - angle,angle)
+    return angle
+
+# Margin (degrees) on the criteria of the vectorized angle test, the candidates are then tested with angle_between
+angle_tol = 1.0E-6
+
 def unit_vector(vector):
     """ Returns the unit vector of the vector.  """
     return vector / np.linalg.norm(vector)
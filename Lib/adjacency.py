@@ -1,17 +1,29 @@
 import os
 import numpy as np #from numpy import *
 from scipy.spatial.distance import cdist
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import shortest_path,connected_components
+from collections import OrderedDict
+import hashlib
 from itertools import combinations,permutations
 from copy import deepcopy
 import random
 import codecs,json
 import re
+from mol_graph import MolGraph,as_graph,as_adj_mat
+from type_registry import atomic_numbers
 
 # Generates the adjacency matrix based on UFF bond radii
 # Inputs:       Elements: N-element List strings for each atom type
 #               Geometry: Nx3 np.array holding the geometry of the molecule
 #               File:  Optional. If Table_generator encounters a problem then it is often useful to have the name of the file the geometry came from printed. 
-def Table_generator(Elements,Geometry,File=None,Radii_dict=False):
+#               box:   Optional. Periodic box as [xlo,xhi,ylo,yhi,zlo,zhi] or [Lx,Ly,Lz] (orthorhombic). When supplied, bonds are found using the minimum image convention.
+#               sparse: Optional. When True a scipy.sparse csr_matrix is returned instead of the dense N x N np.array (useful for large packed boxes).
+#
+# NOTE: Candidate bonds are found with a KD-tree neighbor search out to the largest possible bond length for the elements present and are then 
+#       checked against the pair-specific (R_i+R_j)*scale_factor threshold, so neither the cost nor the memory grows quadratically with the number of atoms. 
+def Table_generator(Elements,Geometry,File=None,Radii_dict=False,box=None,sparse=False):
     module_path =  '/'.join(os.path.abspath(__file__).split('/')[:-1])
     # Initialize UFF bond radii (Rappe et al. JACS 1992)
     # NOTE: Units of angstroms 
@@ -58,40 +70,55 @@ def Table_generator(Elements,Geometry,File=None,Radii_dict=False):
                   " dictionary before proceeding. Exiting...")
             quit()
 
-    # Generate distance matrix holding atom-atom separations (only save upper right)
-    Dist_Mat = np.triu(cdist(Geometry,Geometry))
-    
-    # Find plausible connections
-    x_ind,y_ind = np.where( (Dist_Mat > 0.0) & (Dist_Mat < max([ Radii[i]**2.0 for i in Radii.keys() ])) )
-
-    # Initialize Adjacency Matrix
-    Adj_mat = np.zeros([len(Geometry),len(Geometry)])
-
-    # Iterate over plausible connections and determine actual connections
-    for count,i in enumerate(x_ind):
-        
-        # Assign connection if the ij separation is less than the UFF-sigma value times the scaling factor
-        if Dist_Mat[i,y_ind[count]] < (Radii[Elements[i]]+Radii[Elements[y_ind[count]]])*scale_factor:            
-            Adj_mat[i,y_ind[count]]=1
-    
-    # Hermitize Adj_mat
-    Adj_mat=Adj_mat + Adj_mat.transpose()
+    # Find plausible connections from a neighbor list (the max Radii**2 condition is retained from the original dense implementation)
+    Geometry = np.asarray(Geometry,dtype=float).reshape(-1,3)
+    N_atoms  = len(Geometry)
+    R        = np.array([ Radii[i] for i in Elements ],dtype=float)
+    if N_atoms > 0:
+        r_cut = min(2.0*R.max()*scale_factor,max([ Radii[i]**2.0 for i in Radii.keys() ]))
+        bonds,seps = bond_neighbors(Geometry,r_cut,box=box)
+    else:
+        r_cut,bonds,seps = 0.0,np.zeros([0,2],dtype=int),np.zeros(0)
+
+    # Assign connection if the ij separation is less than the UFF-sigma value times the scaling factor
+    keep  = (seps > 0.0) & (seps < r_cut) & (seps < (R[bonds[:,0]]+R[bonds[:,1]])*scale_factor)
+    bonds = bonds[keep]
+    seps  = seps[keep]
+
+    # Neighbor sets and bond lengths (only needed for the max bond correction)
+    degree = np.bincount(bonds.flatten(),minlength=N_atoms)
+    over   = [ count_i for count_i,i in enumerate(Elements) if Max_Bonds[i] is not None and degree[count_i] > Max_Bonds[i] ]
+    if len(over) > 0:
+        bond_seps = { (i[0],i[1]):seps[count_i] for count_i,i in enumerate(bonds.tolist()) }
+        nbrs = [ set() for i in range(N_atoms) ]
+        for i,j in bonds.tolist():
+            nbrs[i].add(j)
+            nbrs[j].add(i)
 
     # Perform some simple checks on bonding to catch errors
+    # NOTE: degrees can only decrease during the correction, so only atoms that start with too many bonds need to be checked (in index order)
     problem_dict = { i:0 for i in Radii.keys() }
     conditions = { "H":1, "C":4, "F":1, "Cl":1, "Br":1, "I":1, "O":2, "N":4, "B":4 }
-    for count_i,i in enumerate(Adj_mat):
+    for count_i in over:
 
-        if Max_Bonds[Elements[count_i]] is not None and sum(i) > Max_Bonds[Elements[count_i]]:
+        if len(nbrs[count_i]) > Max_Bonds[Elements[count_i]]:
             problem_dict[Elements[count_i]] += 1
-            cons = sorted([ (Dist_Mat[count_i,count_j],count_j) if count_j > count_i else (Dist_Mat[count_j,count_i],count_j) for count_j,j in enumerate(i) if j == 1 ])[::-1]
-            while sum(Adj_mat[count_i]) > Max_Bonds[Elements[count_i]]:
+            cons = sorted([ (bond_seps[(min(count_i,count_j),max(count_i,count_j))],count_j) for count_j in nbrs[count_i] ])[::-1]
+            while len(nbrs[count_i]) > Max_Bonds[Elements[count_i]]:
                 sep,idx = cons.pop(0)
-                Adj_mat[count_i,idx] = 0
-                Adj_mat[idx,count_i] = 0
+                nbrs[count_i].discard(idx)
+                nbrs[idx].discard(count_i)
+                bond_seps.pop((min(count_i,idx),max(count_i,idx)))
 #        if Elements[count_i] in conditions.keys():
 #            if sum(i) > conditions[Elements[count_i]]:
 
+    if len(over) > 0:
+        bonds = np.array(sorted(bond_seps.keys()),dtype=int).reshape(-1,2)
+
+    # Hermitize Adj_mat
+    rows = np.concatenate([bonds[:,0],bonds[:,1]])
+    cols = np.concatenate([bonds[:,1],bonds[:,0]])
+    Adj_mat = csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(N_atoms,N_atoms))
 
     # Print warning messages for obviously suspicious bonding motifs.
     if sum( [ problem_dict[i] for i in problem_dict.keys() ] ) > 0:
@@ -122,7 +149,35 @@ def Table_generator(Elements,Geometry,File=None,Radii_dict=False):
                     if i == "B": print( "WARNING in Table_generator: parsing {}, {} bromine(s) have more than four bonds.".format(File,problem_dict[i]))
         print( "")
 
-    return Adj_mat
+    if sparse:
+        return Adj_mat
+    else:
+        return Adj_mat.toarray()
+
+# Returns the atom pairs (i<j) separated by less than r_cut and their separations 
+# Inputs:       Geometry: Nx3 np.array
+#               r_cut:    neighbor cutoff (angstroms)
+#               box:      Optional. Periodic box as [xlo,xhi,ylo,yhi,zlo,zhi] or [Lx,Ly,Lz]; pairs are found with the minimum image convention.
+def bond_neighbors(Geometry,r_cut,box=None):
+
+    Geometry = np.asarray(Geometry,dtype=float)
+    if box is None:
+        pairs = cKDTree(Geometry).query_pairs(r=r_cut,output_type='ndarray')
+        delta = Geometry[pairs[:,0]]-Geometry[pairs[:,1]]
+    else:
+        box = np.asarray(box,dtype=float)
+        if len(box) == 6:
+            lo,L = box[0::2],box[1::2]-box[0::2]
+        else:
+            lo,L = np.zeros(3),box
+        wrapped = np.mod(Geometry-lo,L)
+        wrapped[wrapped >= L] = 0.0    # guard against round-off in the modulo
+        pairs = cKDTree(wrapped,boxsize=L).query_pairs(r=r_cut,output_type='ndarray')
+        delta = Geometry[pairs[:,0]]-Geometry[pairs[:,1]]
+        delta -= L*np.round(delta/L)
+
+    pairs = pairs.reshape(-1,2)
+    return pairs,np.sqrt(np.sum(delta.reshape(-1,3)**2.0,axis=1))
 
 # Canonicalizes the ordering of atoms in a geometry based on a hash function. Atoms that hash to equivalent values retain their relative order from the input geometry.
 def canon_geo(elements,geo,adj_mat,atom_types):
@@ -139,7 +194,8 @@ def canon_geo(elements,geo,adj_mat,atom_types):
 
     # Canonicalize by sorting the elements based on hashing
     masses = [ mass_dict[i] for i in elements ]
-    hash_list,atoms = [ list(j) for j in zip(*sorted([ (atom_hash(i,adj_mat,masses),i) for i in range(len(geo)) ],reverse=True)) ]
+    hashes = atom_hashes(adj_mat,masses)
+    hash_list,atoms = [ list(j) for j in zip(*sorted([ (hashes[i],i) for i in range(len(geo)) ],reverse=True)) ]
 
     # Update lists/np.arrays based on atoms
     geo   = geo[atoms]
@@ -161,19 +217,41 @@ def atom_hash(ind,A,M,alpha=100.0,beta=0.1,gens=10):
     else:
         return alpha * sum(A[ind]) + rec_sum(ind,A,M,beta,gens)
 
-# recursive function for summing up the masses at each generation of connections. 
+# function for summing up the masses at each generation of connections (each simple path of up to gens bonds contributes the 
+# mass of its last atom scaled by beta*0.1**(path length)). 
 def rec_sum(ind,A,M,beta,gens,avoid_list=[]):
-    if gens != 0:
-        tmp = M[ind]*beta
-        new = [ count_j for count_j,j in enumerate(A[ind]) if j == 1 and count_j not in avoid_list ]
-        if len(new) > 0:
-            for i in new:
-                tmp += rec_sum(i,A,M,beta*0.1,gens-1,avoid_list=avoid_list+[ind])
-            return tmp
-        else:
-            return tmp
+    return path_sum(ind,[ [ count_j for count_j,j in enumerate(i) if j == 1 ] for i in A ],M,beta,gens,avoid_list)
+
+# hashes all atoms in one go, returning the same values as [ atom_hash(i,A,M,alpha,beta,gens) for i in range(len(A)) ]. 
+# The neighbor lists are built once and the result is cached for each distinct graph/mass/parameter combination.
+def atom_hashes(A,M,alpha=100.0,beta=0.1,gens=10,max_cache=256):
+
+    # On first call initialize the cache
+    if not hasattr(atom_hashes, "cache"):
+        atom_hashes.cache = OrderedDict()
+
+    # The cache is keyed on the canonical form of the graph with the masses as labels (renumbered copies share an entry,
+    # the hashes are stored in canonical order)
+    A = np.asarray(A)
+    graph_key,pos = canonical_graph(A,M)
+    if graph_key is None:
+        graph_key,pos = (graph_hash(A),tuple(M)),np.arange(len(A))
+    key = (graph_key,alpha,beta,gens)
+    if key in atom_hashes.cache:
+        atom_hashes.cache.move_to_end(key)
+        return [ atom_hashes.cache[key][i] for i in pos ]
+
+    if gens <= 0:
+        hashes = [ M[i]*beta for i in range(len(A)) ]
     else:
-        return M[ind]*beta
+        nbrs   = [ list(np.where(A[i] == 1)[0]) for i in range(len(A)) ]
+        hashes = [ alpha * sum(A[i]) + path_sum(i,nbrs,M,beta,gens) for i in range(len(A)) ]
+
+    atom_hashes.cache[key] = [ hashes[i] for i in np.argsort(pos) ]
+    while len(atom_hashes.cache) > max_cache:
+        atom_hashes.cache.popitem(last=False)
+
+    return list(hashes)
 
 # hashing function for canonicalizing geometries on the basis of their adjacency lists and elements
 # ind  : index of the atom being hashed
@@ -186,20 +264,109 @@ def atom_hash_list(ind,A,M,alpha=100.0,beta=0.1,gens=10):
     else:
         return alpha * len(A[ind]) + rec_sum_list(ind,A,M,beta,gens)
 
-# recursive function for summing up the masses at each generation of connections. 
+# function for summing up the masses at each generation of connections (adjacency list version of rec_sum). 
 def rec_sum_list(ind,A,M,beta,gens,avoid_list=[]):
-    if gens != 0:
-        tmp = M[ind]*beta
-        new = [ j for j in A[ind] if j not in avoid_list ]
-        if len(new) > 0:
-            for i in new:
-                tmp += rec_sum_list(i,A,M,beta*0.1,gens-1,avoid_list=avoid_list+[ind])
-            return tmp
-        else:
-            return tmp
-    else:
+    return path_sum(ind,A,M,beta,gens,avoid_list)
+
+# Iterative depth-first evaluation of the rec_sum/rec_sum_list recursion
+# ind   : index of the starting atom
+# nbrs  : adjacency list
+# avoid : atoms that can't be visited (in addition to the atoms already on the current path)
+# NOTE: the summation order of the recursive version is preserved, so the hashes are bit-identical to it.
+def path_sum(ind,nbrs,M,beta,gens,avoid=[]):
+    if gens == 0:
         return M[ind]*beta
 
+    # Each stack entry holds [atom, beta, generations left, running sum, remaining children]
+    on_path = set(avoid)
+    stack = [[ind,beta,gens,M[ind]*beta,[ j for j in nbrs[ind] if j not in on_path ][::-1]]]
+    while True:
+        frame = stack[-1]
+
+        # Descend into the next child
+        if len(frame[4]) > 0:
+            child = frame[4].pop()
+            b = frame[1]*0.1
+            if frame[2]-1 == 0:
+                frame[3] += M[child]*b
+            else:
+                on_path.add(frame[0])
+                stack += [[child,b,frame[2]-1,M[child]*b,[ j for j in nbrs[child] if j not in on_path ][::-1]]]
+            continue
+
+        # All children have been summed, pass the result up to the parent
+        stack.pop()
+        if len(stack) == 0:
+            return frame[3]
+        on_path.discard(stack[-1][0])
+        stack[-1][3] += frame[3]
+
+# Returns a hash of an adjacency matrix (or list) that is used for keying cached results on the molecular graph
+def graph_hash(A):
+    if isinstance(A,np.ndarray):
+        return (A.shape,str(A.dtype),hashlib.sha1(np.ascontiguousarray(A).tobytes()).hexdigest())
+    else:
+        return hashlib.sha1(repr([ list(i) for i in A ]).encode()).hexdigest()
+
+# Returns a permutation-invariant key of a graph (square adjacency matrix, bonds are the entries equal to 1) with per-atom labels
+# (elements, masses, ...) and the canonical position of each atom, or (None,None) for other inputs and graphs larger than
+# max_atoms. Renumbered copies of the same labeled graph get the same key, so results cached in canonical order (result[order]
+# with order = np.argsort(pos)) are mapped back to another numbering by indexing with its pos. The atoms are ordered by colour
+# refinement (Weisfeiler-Lehman) of the labels, with ties broken by individualizing the lowest index atom of the first
+# non-singleton class and refining again. The key hashes the labels and bonds in that order, so graphs that refinement can't
+# tell apart (e.g., decalin and bicyclopentyl) still get different keys; a tie broken between atoms that aren't symmetry
+# equivalent only costs a cache miss.
+def canonical_graph(A,labels=None,max_atoms=1000):
+    if isinstance(A,np.ndarray) is False or A.ndim != 2 or A.shape[0] != A.shape[1] or A.shape[0] > max_atoms:
+        return None,None
+    N = A.shape[0]
+    if labels is None:
+        labels = [0]*N
+    rows,cols = np.nonzero(A == 1)
+
+    # Initial colours rank the labels
+    names = [ repr(i) for i in labels ]
+    ranks = { j:count_j for count_j,j in enumerate(sorted(set(names))) }
+    color = np.array([ ranks[i] for i in names ],dtype=np.int64)
+    n_colors = len(ranks)
+    while True:
+
+        # Refine until the number of classes is stable. The new colour of an atom ranks its colour and a hash of the
+        # multiset of its neighbors' colours.
+        while True:
+            h = np.zeros(N,dtype=np.uint64)
+            np.add.at(h,rows,mix64(color[cols].astype(np.uint64)))
+            order = np.lexsort((h,color))
+            new   = np.zeros(N,dtype=np.int64)
+            new[order[1:]] = np.cumsum((color[order[1:]] != color[order[:-1]]) | (h[order[1:]] != h[order[:-1]]))
+            color = new
+            if color.max()+1 == n_colors:
+                break
+            n_colors = color.max()+1
+        if n_colors == N:
+            break
+
+        # Individualize the lowest index atom of the first non-singleton class
+        count = np.bincount(color)
+        a     = np.where(color == np.where(count > 1)[0][0])[0][0]
+        color = 2*color
+        color[a] -= 1
+        n_colors += 1
+
+    # Hash the labels and the bonds in the canonical order
+    order = np.argsort(color)
+    bonds = np.column_stack((color[rows],color[cols]))
+    bonds = bonds[np.lexsort((bonds[:,1],bonds[:,0]))]
+    key   = hashlib.sha1((repr([ names[i] for i in order ])+str(N)).encode()+bonds.astype(np.int64).tobytes()).hexdigest()
+    return key,color
+
+# Returns a 64 bit mix (splitmix64 finalizer) of the entries of a uint64 array (used as neighbor colour hashes in canonical_graph)
+def mix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
 # Description: returns a canonicallized TAFFI bond. TAFFI bonds are written so that the lesser *atom_type* between 1 and 2 is first. 
 # 
 # inputs:      types: a list of taffi atom types defining the bond
@@ -377,6 +544,106 @@ def remove_duplicate_modes(types,modes):
     ind = [ a.index(_) for _ in set(a) ]
     return [ types[_] for _ in ind ],[ modes[_] for _ in ind ]
 
+# Description: Enumerates the bonds, angles, dihedrals, 1-5s and impropers of a graph directly from its
+#              neighbor lists. Each mode is generated exactly once (no deduplication pass is needed) and the
+#              cost scales with the number of modes rather than with N.
+#
+# Inputs:      adj_mat:   dense adjacency matrix or MolGraph
+#
+# Returns:     bonds:     (Nb,2) int array, i < j
+#              angles:    (Na,3) int array, i-j-k paths with i < k
+#              dihedrals: (Nd,4) int array, i-j-k-l paths with j < k
+#              one_fives: (N5,5) int array, i-j-k-l-m paths with i < m
+#              impropers: (Ni,4) int array, one (center,n0,n1,n2) per atom with three or more bonds using its
+#                         three lowest-index neighbors (the instance that the legacy improper dedup kept)
+#
+# NOTE:        the modes are not ordered by atom type. Use canon_modes() with integer type ids (see type_ids())
+#              to obtain the canonical TAFFI ordering.
+def enumerate_modes(adj_mat):
+
+    G = as_graph(adj_mat)
+    indptr,indices = G.indptr,G.indices
+    deg = G.degree
+
+    # Directed edges and all directed 3-paths
+    edges = np.column_stack((np.repeat(np.arange(len(G)),deg),indices))
+    paths_3 = _extend_paths(edges,indptr,indices)
+
+    # Unique modes: bonds/angles are oriented by their terminal indices, dihedrals by their central bond
+    bonds     = edges[edges[:,0] < edges[:,1]]
+    angles    = paths_3[paths_3[:,0] < paths_3[:,2]]
+    dihedrals = _extend_paths(paths_3[paths_3[:,1] < paths_3[:,2]],indptr,indices)
+    paths_5   = _extend_paths(np.vstack((dihedrals,dihedrals[:,::-1])),indptr,indices)
+    one_fives = paths_5[paths_5[:,0] < paths_5[:,4]]
+
+    # Impropers
+    centers   = np.where(deg >= 3)[0]
+    impropers = np.column_stack((centers,indices[indptr[centers]],indices[indptr[centers]+1],indices[indptr[centers]+2]))
+
+    return bonds,angles,dihedrals,one_fives,impropers.reshape(-1,4)
+
+# Helper function for enumerate_modes that appends every neighbor of the last atom of each path that isn't
+# already in the path. paths is an (M,k) int array, the (M',k+1) extended paths are returned.
+def _extend_paths(paths,indptr,indices):
+    last   = paths[:,-1]
+    counts = indptr[last+1]-indptr[last]
+    rep    = np.repeat(np.arange(len(paths)),counts)
+    offs   = np.arange(len(rep)) - np.repeat(np.cumsum(counts)-counts,counts)
+    new    = indices[indptr[last[rep]]+offs]
+    keep   = np.ones(len(rep),dtype=bool)
+    for i in range(paths.shape[1]):
+        keep &= new != paths[rep,i]
+    return np.column_stack((paths[rep[keep]],new[keep])).astype(int)
+
+# Description: Maps lists of atom type labels onto integer ids. The ids index into the sorted list of unique
+#              labels, so comparing ids reproduces the string comparisons used by canon_bond, canon_angle,
+#              canon_dihedral and canon_improper. All lists share the same label table.
+#
+# Inputs:      *type_lists: one or more lists of atom type labels
+#
+# Returns:     labels: sorted list of the unique labels
+#              ids:    list of int arrays (one per supplied list)
+def type_ids(*type_lists):
+    labels = sorted(set([ j for i in type_lists for j in i ]))
+    lookup = { j:count_j for count_j,j in enumerate(labels) }
+    return labels,[ np.array([ lookup[j] for j in i ],dtype=int) for i in type_lists ]
+
+# Description: Vectorized canonicalization of an array of modes using integer type ids. Follows the same
+#              conventions as canon_bond (k=2), canon_angle (k=3), canon_dihedral (k=4) and canon_improper
+#              (improper=True).
+#
+# Inputs:      modes:    (M,k) int array of atom indices
+#              mode_ids: (M,k) int array holding the type id of each atom in each mode
+#
+# Returns:     modes,mode_ids: canonically ordered copies of the inputs
+def canon_modes(modes,mode_ids,improper=False):
+
+    modes    = np.array(modes,dtype=int)
+    mode_ids = np.array(mode_ids,dtype=int).reshape(modes.shape)
+    if len(modes) == 0:
+        return modes,mode_ids
+
+    # Impropers: the peripheral atoms are sorted by type, then index
+    if improper:
+        order = np.lexsort((modes[:,1:],mode_ids[:,1:]),axis=1)+1
+        modes[:,1:]    = np.take_along_axis(modes,order,axis=1)
+        mode_ids[:,1:] = np.take_along_axis(mode_ids,order,axis=1)
+        return modes,mode_ids
+
+    # Bonds, angles, and dihedrals are reversed when the last type is lesser than the first
+    # (dihedrals with equivalent termini are decided by the central types)
+    if modes.shape[1] == 4:
+        flip = ( mode_ids[:,0] > mode_ids[:,3] ) | ( ( mode_ids[:,0] == mode_ids[:,3] ) & ( mode_ids[:,1] > mode_ids[:,2] ) )
+    else:
+        flip = mode_ids[:,0] > mode_ids[:,-1]
+    modes[flip]    = modes[flip,::-1]
+    mode_ids[flip] = mode_ids[flip,::-1]
+    return modes,mode_ids
+
+# Helper function that converts mode/type-id arrays into the lists of index tuples and type tuples used by the md writers
+def mode_lists(modes,mode_ids,labels):
+    return [ tuple(i) for i in modes.tolist() ],[ tuple( labels[j] for j in i ) for i in mode_ids.tolist() ]
+
 # A wrapper for the commands to parse the dihedrals from the adjacency matrix and geometry.
 #           Atom_types isn't necessary here, this section of code just hasn't been cleaned up.
 # Returns:  list of (dihedral_type,angle) tuples. 
@@ -391,14 +658,6 @@ def Find_modes(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
     # (e.g., bonds between atoms 1 and 13 and 17 and 5 would be stored as [(1,13),(17,5)] 
     # Similarly, types are stored as tuples of atom types.
     Atom_types = [ next( j for j in i.split('link-') if j != '' ) for i in Atom_types ]    #  split('-link') call is necessary for handling fragment atoms
-    Bonds = []
-    Bond_types = []
-    Angles = []
-    Angle_types = []
-    Dihedrals = []
-    Dihedral_types = []
-    One_fives = []
-    VDW_types = []
 
     # Gen = 1 types are generated for angle and dihedral terms
     if d1_opt:
@@ -406,58 +665,43 @@ def Find_modes(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
         for i in Atom_types:
             a,t = type_adjmat(i)
             g1_types += [id_types(t,a,gens=1)[0]]
-
-    # Find bonds #
-    for count_i,i in enumerate(Adj_mat):        
-        Bonds += [ canon_bond((Atom_types[count_i],Atom_types[count_j]),(count_i,count_j)) for count_j,j in enumerate(i) if j == 1 and count_j > count_i ]
-    Bond_types,Bonds = map(list,zip(*Bonds))
-
-    # Remove -UA tag from Bond_types (united-atom has no meaning for bonds)
-    Bond_types = [ (i[0].split('-UA')[0],i[1].split('-UA')[0]) for i in Bond_types ]
-
-    # Find angles #
-    # When d1_opt is supplied, the 1 and 3 atoms are typed based on depth=1 types
-    for i in Bonds:        
-        if d1_opt:
-            Angles += [ canon_angle((g1_types[count_j],Atom_types[i[0]],g1_types[i[1]]),(count_j,i[0],i[1])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j != i[1] ]
-            Angles += [ canon_angle((g1_types[i[0]],Atom_types[i[1]],g1_types[count_j]),(i[0],i[1],count_j)) for count_j,j in enumerate(Adj_mat[i[1]]) if j == 1 and count_j != i[0] ]
-        else:
-            Angles += [ canon_angle((Atom_types[count_j],Atom_types[i[0]],Atom_types[i[1]]),(count_j,i[0],i[1])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j != i[1] ]
-            Angles += [ canon_angle((Atom_types[i[0]],Atom_types[i[1]],Atom_types[count_j]),(i[0],i[1],count_j)) for count_j,j in enumerate(Adj_mat[i[1]]) if j == 1 and count_j != i[0] ]
-
-    Angle_types,Angles = remove_duplicate_modes(*map(list,zip(*Angles)))
-    
-    # Remove -UA tag from Angle_types (united-atom has no meaning for angles)
-    Angle_types = [ (i[0].split('-UA')[0],i[1].split('-UA')[0],i[2].split('-UA')[0]) for i in Angle_types ]
-        
-    # Find dihedrals #
-    # When d1_opt is supplied, the 1 and 4 atoms are typed based on depth=1 types
-    for i in Angles:
-        if d1_opt:
-            Dihedrals += [ canon_dihedral((g1_types[count_j],Atom_types[i[0]],Atom_types[i[1]],g1_types[i[2]]),(count_j,i[0],i[1],i[2])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in [i[1],i[2]] ]
-            Dihedrals += [ canon_dihedral((g1_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],g1_types[count_j]),(i[0],i[1],i[2],count_j)) for count_j,j in enumerate(Adj_mat[i[2]]) if j == 1 and count_j not in [i[0],i[1]] ]
-        else:
-            Dihedrals += [ canon_dihedral((Atom_types[count_j],Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]]),(count_j,i[0],i[1],i[2])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in [i[1],i[2]] ]
-            Dihedrals += [ canon_dihedral((Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[count_j]),(i[0],i[1],i[2],count_j)) for count_j,j in enumerate(Adj_mat[i[2]]) if j == 1 and count_j not in [i[0],i[1]] ]
-    if len(Dihedrals) != 0:
-      Dihedral_types,Dihedrals = remove_duplicate_modes(*map(list,zip(*Dihedrals)))
+    else:
+        g1_types = Atom_types
+
+    # Enumerate the modes from the neighbor lists (each mode is generated once) and canonicalize them
+    # using integer type ids. When d1_opt is supplied, the terminal atoms of angles and dihedrals are typed based on depth=1 types
+    labels,(t,t1) = type_ids(Atom_types,g1_types)
+    bonds,angles,dihedrals,_,_ = enumerate_modes(Adj_mat)
+    bonds,b_ids     = canon_modes(bonds,t[bonds])
+    angles,a_ids    = canon_modes(angles,np.column_stack((t1[angles[:,0]],t[angles[:,1]],t1[angles[:,2]])))
+    dihedrals,d_ids = canon_modes(dihedrals,np.column_stack((t1[dihedrals[:,0]],t[dihedrals[:,1]],t[dihedrals[:,2]],t1[dihedrals[:,3]])))
+
+    # Remove -UA tag from Bond_types and Angle_types (united-atom has no meaning for bonds and angles)
+    ua = [ i.split('-UA')[0] for i in labels ]
+    Bonds = [ tuple(i) for i in bonds.tolist() ]
+    Bond_types = [ tuple( ua[j] for j in i ) for i in b_ids.tolist() ]
+    Angles = [ tuple(i) for i in angles.tolist() ]
+    Angle_types = [ tuple( ua[j] for j in i ) for i in a_ids.tolist() ]
+    Dihedrals = [ tuple(i) for i in dihedrals.tolist() ]
 
     # Add Dihedral_type to dihedrals
-    for count_i,i in enumerate(Dihedrals):
-        if 2 in [ j[i[1],i[2]] for j in Bond_mats ]:
-            Dihedral_types[count_i] = tuple(list(Dihedral_types[count_i]) + ["harmonic"])
-        else:
-            Dihedral_types[count_i] = tuple(list(Dihedral_types[count_i]) + ["opls"])                
+    harmonic = np.zeros(len(dihedrals),dtype=bool)
+    for j in Bond_mats:
+        harmonic |= np.asarray(j)[dihedrals[:,1],dihedrals[:,2]] == 2
+    Dihedral_types = [ tuple([ labels[j] for j in i ]+[ "harmonic" if harmonic[count_i] else "opls" ]) for count_i,i in enumerate(d_ids.tolist()) ]
 
     # Find 1-5s
     # NOTE: no effort is made to sort based on types because these are only used for coul and lj corrections
+    # NOTE: like the legacy loop, each 1-5 is listed once from each of its two dihedrals
+    nbrs = as_graph(Adj_mat).to_adj_list()
+    One_fives = []
     for i in Dihedrals:
         
         # Find atoms attached to first atom of each dihedral
-        One_fives += [ (count_j,i[0],i[1],i[2],i[3]) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in [i[1],i[2],i[3]] ]
+        One_fives += [ (count_j,i[0],i[1],i[2],i[3]) for count_j in nbrs[i[0]] if count_j not in [i[1],i[2],i[3]] ]
 
         # Find atoms attached to the fourth atom of each dihedral
-        One_fives += [ (i[0],i[1],i[2],i[3],count_j) for count_j,j in enumerate(Adj_mat[i[3]]) if j == 1 and count_j not in [i[0],i[1],i[2]] ]
+        One_fives += [ (i[0],i[1],i[2],i[3],count_j) for count_j in nbrs[i[3]] if count_j not in [i[0],i[1],i[2]] ]
 
     One_five_types = [ (Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[i[3]],Atom_types[i[4]]) for i in One_fives ]
 
@@ -491,6 +735,9 @@ def Find_modes_baonly(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
     One_fives = []
     VDW_types = []
 
+    # Neighbor lists are used for all connectivity lookups (O(degree) rather than O(N) row scans)
+    nbrs = as_graph(Adj_mat).to_adj_list()
+
     # Gen = 1 types are generated for angle and dihedral terms
     if d1_opt:
         g1_types = [] 
@@ -499,8 +746,8 @@ def Find_modes_baonly(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
             g1_types += [id_types(t,a,gens=1)[0]]
 
     # Find bonds #
-    for count_i,i in enumerate(Adj_mat):        
-        Bonds += [ canon_bond((Atom_types[count_i],Atom_types[count_j]),(count_i,count_j)) for count_j,j in enumerate(i) if j == 1 and count_j > count_i ]
+    for count_i,i in enumerate(nbrs):        
+        Bonds += [ canon_bond((Atom_types[count_i],Atom_types[count_j]),(count_i,count_j)) for count_j in i if count_j > count_i ]
     Bond_types,Bonds = map(list,zip(*Bonds))
 
     # Remove -UA tag from Bond_types (united-atom has no meaning for bonds)
@@ -510,11 +757,11 @@ def Find_modes_baonly(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
     # When d1_opt is supplied, the 1 and 3 atoms are typed based on depth=1 types
     for i in Bonds:        
         if d1_opt:
-            Angles += [ canon_angle((g1_types[count_j],Atom_types[i[0]],g1_types[i[1]]),(count_j,i[0],i[1])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j != i[1] ]
-            Angles += [ canon_angle((g1_types[i[0]],Atom_types[i[1]],g1_types[count_j]),(i[0],i[1],count_j)) for count_j,j in enumerate(Adj_mat[i[1]]) if j == 1 and count_j != i[0] ]
+            Angles += [ canon_angle((g1_types[count_j],Atom_types[i[0]],g1_types[i[1]]),(count_j,i[0],i[1])) for count_j in nbrs[i[0]] if count_j != i[1] ]
+            Angles += [ canon_angle((g1_types[i[0]],Atom_types[i[1]],g1_types[count_j]),(i[0],i[1],count_j)) for count_j in nbrs[i[1]] if count_j != i[0] ]
         else:
-            Angles += [ canon_angle((Atom_types[count_j],Atom_types[i[0]],Atom_types[i[1]]),(count_j,i[0],i[1])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j != i[1] ]
-            Angles += [ canon_angle((Atom_types[i[0]],Atom_types[i[1]],Atom_types[count_j]),(i[0],i[1],count_j)) for count_j,j in enumerate(Adj_mat[i[1]]) if j == 1 and count_j != i[0] ]
+            Angles += [ canon_angle((Atom_types[count_j],Atom_types[i[0]],Atom_types[i[1]]),(count_j,i[0],i[1])) for count_j in nbrs[i[0]] if count_j != i[1] ]
+            Angles += [ canon_angle((Atom_types[i[0]],Atom_types[i[1]],Atom_types[count_j]),(i[0],i[1],count_j)) for count_j in nbrs[i[1]] if count_j != i[0] ]
 
     Angle_types,Angles = remove_duplicate_modes(*map(list,zip(*Angles)))
     
@@ -525,11 +772,11 @@ def Find_modes_baonly(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
     # When d1_opt is supplied, the 1 and 4 atoms are typed based on depth=1 types
     for i in Angles:
         if d1_opt:
-            Dihedrals += [ canon_dihedral((g1_types[count_j],Atom_types[i[0]],Atom_types[i[1]],g1_types[i[2]]),(count_j,i[0],i[1],i[2])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in [i[1],i[2]] ]
-            Dihedrals += [ canon_dihedral((g1_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],g1_types[count_j]),(i[0],i[1],i[2],count_j)) for count_j,j in enumerate(Adj_mat[i[2]]) if j == 1 and count_j not in [i[0],i[1]] ]
+            Dihedrals += [ canon_dihedral((g1_types[count_j],Atom_types[i[0]],Atom_types[i[1]],g1_types[i[2]]),(count_j,i[0],i[1],i[2])) for count_j in nbrs[i[0]] if count_j not in [i[1],i[2]] ]
+            Dihedrals += [ canon_dihedral((g1_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],g1_types[count_j]),(i[0],i[1],i[2],count_j)) for count_j in nbrs[i[2]] if count_j not in [i[0],i[1]] ]
         else:
-            Dihedrals += [ canon_dihedral((Atom_types[count_j],Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]]),(count_j,i[0],i[1],i[2])) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in [i[1],i[2]] ]
-            Dihedrals += [ canon_dihedral((Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[count_j]),(i[0],i[1],i[2],count_j)) for count_j,j in enumerate(Adj_mat[i[2]]) if j == 1 and count_j not in [i[0],i[1]] ]
+            Dihedrals += [ canon_dihedral((Atom_types[count_j],Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]]),(count_j,i[0],i[1],i[2])) for count_j in nbrs[i[0]] if count_j not in [i[1],i[2]] ]
+            Dihedrals += [ canon_dihedral((Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[count_j]),(i[0],i[1],i[2],count_j)) for count_j in nbrs[i[2]] if count_j not in [i[0],i[1]] ]
     #Dihedral_types,Dihedrals = remove_duplicate_modes(*map(list,zip(*Dihedrals)))
 
     # Add Dihedral_type to dihedrals
@@ -544,10 +791,10 @@ def Find_modes_baonly(Adj_mat,Atom_types,Bond_mats,return_all=0,d1_opt=False):
     #for i in Dihedrals:
     #    
         # Find atoms attached to first atom of each dihedral
-    #    One_fives += [ (count_j,i[0],i[1],i[2],i[3]) for count_j,j in enumerate(Adj_mat[i[0]]) if j == 1 and count_j not in [i[1],i[2],i[3]] ]
+    #    One_fives += [ (count_j,i[0],i[1],i[2],i[3]) for count_j in nbrs[i[0]] if count_j not in [i[1],i[2],i[3]] ]
 
         # Find atoms attached to the fourth atom of each dihedral
-    #    One_fives += [ (i[0],i[1],i[2],i[3],count_j) for count_j,j in enumerate(Adj_mat[i[3]]) if j == 1 and count_j not in [i[0],i[1],i[2]] ]
+    #    One_fives += [ (i[0],i[1],i[2],i[3],count_j) for count_j in nbrs[i[3]] if count_j not in [i[0],i[1],i[2]] ]
 
     #One_five_types = [ (Atom_types[i[0]],Atom_types[i[1]],Atom_types[i[2]],Atom_types[i[3]],Atom_types[i[4]]) for i in One_fives ]
     if return_all == 1: return Bonds,Angles,Bond_types,Angle_types
@@ -622,21 +869,24 @@ def Dijkstra(Adj_mat,start=0,end=-1):
     return Shortest_path
 
 # Return true if idx is a ring atom
+# adj_mat can be a dense adjacency matrix or a MolGraph; only the component containing idx is searched.
 def ring_atom(adj_mat,idx):
 
     # Find the atoms connected to atom idx
-    connections = [ count_i for count_i,i in enumerate(adj_mat[idx]) if i == 1 ]
+    G = as_graph(adj_mat)
+    connections = G.neighbors(idx).tolist()
 
     # If there isn't at least two connections then there is no possibility that this is a ring atom
     if len(connections) < 2:
         return False
 
-    # Loop through all unique pairs of atom indices connected to idx
-    for i in combinations(connections,2):
-
-        # If two atoms connected to atom idx have identical sets of connections then idx is a ring atom
-        if return_connected(adj_mat,start=i[0],avoid=[idx]) == return_connected(adj_mat,start=i[1],avoid=[idx]):
+    # idx is a ring atom if two of its neighbors are still connected after removing idx
+    # (each neighbor's network is only searched if it wasn't reached from an earlier one)
+    reached = set([])
+    for i in connections:
+        if i in reached:
             return True
+        reached.update(return_connected(G,start=i,avoid=[idx]))
 
     # If the fuction gets to this point then idx is not a ring atom
     return False
@@ -645,13 +895,14 @@ def ring_atom(adj_mat,idx):
 def return_ring(idx,adj_mat,atomtypes=None):
 
     # Only keep elements of idx that are ring atoms
-    ring_idx = [ i for i in idx if ring_atom(adj_mat,i) is True ]
+    G = as_graph(adj_mat)
+    ring_idx = [ i for i in idx if ring_atom(G,i) is True ]
 
     # Iterate over the ring_idx list and append connected ring atoms to the list without backtracking
     for i in ring_idx:
 
         # Find the atoms connected to atom i
-        ring_idx += [ count_j for count_j,j in enumerate(adj_mat[i]) if j == 1 and ring_atom(adj_mat,count_j) is True and count_j not in ring_idx  ]
+        ring_idx += [ j for j in G.neighbors(i).tolist() if ring_atom(G,j) is True and j not in ring_idx  ]
 
     return ring_idx
 
@@ -1074,8 +1325,8 @@ def check_lewis(atomtypes,adj_mat,q_tot=0,bonding_pref=[],fixed_bonds=[],return_
     #                            58,38,19,57,89,2,10,18,63,65,67,72,88]
 
     # Initalize elementa and atomic_number lists for use by the function
-    elements = [ check_lewis.atomic_to_element[int(i.split("[")[1].split("]")[0])] for i in atomtypes ]
-    atomic_number = [ int(i.split("[")[1].split("]")[0]) for i in atomtypes ]
+    atomic_number = atomic_numbers(atomtypes).tolist()
+    elements = [ check_lewis.atomic_to_element[i] for i in atomic_number ]
     
     # Initially assign all valence electrons as lone electrons
     lone_electrons    = np.zeros(len(atomtypes),dtype="int")    
@@ -1086,7 +1337,7 @@ def check_lewis(atomtypes,adj_mat,q_tot=0,bonding_pref=[],fixed_bonds=[],return_
     for count_i,i in enumerate(atomtypes):
 
         # Grab the total number of (expected) electrons from the atomic number
-        N_tot = int(i.split('[')[1].split(']')[0])
+        N_tot = atomic_number[count_i]
 
         # Determine the number of core/valence electrons based on row in the periodic table
         if N_tot > 54:
@@ -1114,7 +1365,7 @@ def check_lewis(atomtypes,adj_mat,q_tot=0,bonding_pref=[],fixed_bonds=[],return_
         if count_i in [ j[0] for j in bonding_pref ]:
             bonding_target[count_i] = next( j[1] for j in bonding_pref if j[0] == count_i )
         else:
-            bonding_target[count_i] = N_tot - check_lewis.lone_e[check_lewis.atomic_to_element[int(i.split('[')[1].split(']')[0])]]
+            bonding_target[count_i] = N_tot - check_lewis.lone_e[elements[count_i]]
 
     # Loop over the adjmat and assign initial bonded electrons assuming single bonds (and adjust lone electrons accordingly)
     for count_i,i in enumerate(adj_mat):
@@ -1466,6 +1717,7 @@ def find_lewis(elements,adj_mat_0,bonding_pref=[],q_tot=0,fixed_bonds=[],fc_0=No
 
     # Initalize elementa and atomic_number lists for use by the function
     atomic_number = [ find_lewis.periodic[i.lower()] for i in elements ]
+    adj_mat_0 = as_adj_mat(adj_mat_0)    # MolGraph inputs are expanded once, the bond matrix algebra below is dense
     adj_mat = deepcopy(adj_mat_0)
 
     # Initially assign all valence electrons as lone electrons
@@ -2138,6 +2390,7 @@ def frag_find_lewis(elements,adj_mat_0,bonding_pref=[],fixed_bonds=[],q_tot=0,fc
 
     # Initalize elementa and atomic_number lists for use by the function
     atomic_number = [ frag_find_lewis.periodic[i.lower()] for i in elements ]
+    adj_mat_0 = as_adj_mat(adj_mat_0)    # MolGraph inputs are expanded once, the bond matrix algebra below is dense
     adj_mat = deepcopy(adj_mat_0)
 
     # Initially assign all valence electrons as lone electrons
@@ -2654,7 +2907,7 @@ def frag_find_lewis(elements,adj_mat_0,bonding_pref=[],fixed_bonds=[],q_tot=0,fc
                  'Cs':132.90545,'Ba':137.327,'La':138.9055,'Hf':178.49,'Ta':180.9479,'W':183.84,'Re':186.207,'Os':190.23,'Ir':192.217,'Pt':195.078,'Au':196.96655,'Hg':200.59,\
                  'Tl':204.3833,'Pb':207.2,'Bi':208.98038,'Po':209.0,'At':210.0,'Rn':222.0}
     masses    = [ mass_dict[i] for i in elements ]
-    hash_list = [  atom_hash(ind,adj_mat_0,masses) for ind in range(len(elements)) ]
+    hash_list = atom_hashes(adj_mat_0,masses)
 
     # Find identical atoms
     same_atoms= [(i,[ count_j for count_j,j in enumerate(hash_list) if j == i ]  ) for i in set(hash_list) if hash_list.count(i) > 1]
@@ -3459,34 +3712,68 @@ def reorder_list(loop_list,atomic_number):
     return [ loop_list[i] for i in c_types+others ]
 
 # Returns a matrix of graphical separations for all nodes in a graph defined by the inputted adjacency matrix 
-def graph_seps(adj_mat_0):
+# NOTE: the separations are found by breadth-first searches on a sparse copy of the graph (any element > 0 is treated 
+#       as a bond) and are returned as an integer array with -1 for disconnected pairs and 0 on the diagonal. Results are 
+#       memoized on the canonical form of the bond pattern (see canonical_graph), so repeated calls with the same adjacency
+#       matrix (e.g., inside per-atom loops) or a renumbered copy of it only pay for a copy. 
+def graph_seps(adj_mat_0,max_cache=64):
+
+    # On first call initialize the cache
+    if not hasattr(graph_seps, "cache"):
+        graph_seps.cache = OrderedDict()
+
+    # Hash the bond pattern (canonical form, renumbered copies share an entry and the separations are stored in canonical order)
+    adj = np.asarray(adj_mat_0) > 0
+    key,pos = canonical_graph(adj)
+    if key is None:
+        key,pos = graph_hash(adj),np.arange(len(adj))
+    if key in graph_seps.cache:
+        graph_seps.cache.move_to_end(key)
+        return graph_seps.cache[key][pos][:,pos]
+
+    # Unweighted shortest paths (BFS from every node)
+    seps = shortest_path(csr_matrix(adj),method='D',directed=True,unweighted=True)
+    seps[np.isinf(seps)] = -1
+    seps = seps.astype(int)
+
+    # Update the cache (least recently used entries are discarded first)
+    order = np.argsort(pos)
+    graph_seps.cache[key] = seps[order][:,order]
+    while len(graph_seps.cache) > max_cache:
+        graph_seps.cache.popitem(last=False)
+
+    return seps.copy()
 
-    # Create a new name for the object holding A**(N), initialized with A**(1)
-    adj_mat = deepcopy(adj_mat_0)
+# # Returns a matrix of graphical separations for all nodes in a graph defined by the inputted adjacency matrix 
+# # DENSE MATRIX-POWER VERSION, REPLACED BY THE BFS VERSION ABOVE
+# def graph_seps(adj_mat_0):
+
+#     # Create a new name for the object holding A**(N), initialized with A**(1)
+#     adj_mat = deepcopy(adj_mat_0)
     
-    # Initialize an np.array to hold the graphical separations with -1 for all unassigned elements and 0 for the diagonal.
-    seps = np.ones([len(adj_mat),len(adj_mat)])*-1
-    np.fill_diagonal(seps,0)
+#     # Initialize an np.array to hold the graphical separations with -1 for all unassigned elements and 0 for the diagonal.
+#     seps = np.ones([len(adj_mat),len(adj_mat)])*-1
+#     np.fill_diagonal(seps,0)
 
-    # Perform searches out to len(adj_mat) bonds (maximum distance for a graph with len(adj_mat) nodes
-    for i in np.arange(len(adj_mat)):        
+#     # Perform searches out to len(adj_mat) bonds (maximum distance for a graph with len(adj_mat) nodes
+#     for i in np.arange(len(adj_mat)):        
 
-        # All perform assignments to unassigned elements (seps==-1) 
-        # and all perform an assignment if the value in the adj_mat is > 0        
-        seps[np.where((seps==-1)&(adj_mat>0))] = i+1
+#         # All perform assignments to unassigned elements (seps==-1) 
+#         # and all perform an assignment if the value in the adj_mat is > 0        
+#         seps[np.where((seps==-1)&(adj_mat>0))] = i+1
 
-        # Since we only care about the leading edge of the search and not the actual number of paths at higher orders, we can 
-        # set the larger than 1 values to 1. This ensures numerical stability for larger adjacency matrices.
-        adj_mat[np.where(adj_mat>1)] = 1
+#         # Since we only care about the leading edge of the search and not the actual number of paths at higher orders, we can 
+#         # set the larger than 1 values to 1. This ensures numerical stability for larger adjacency matrices.
+#         adj_mat[np.where(adj_mat>1)] = 1
         
-        # Break once all of the elements have been assigned
-        if -1 not in seps:
-            break
+#         # Break once all of the elements have been assigned
+#         if -1 not in seps:
+#             break
 
-        # Take the inner product of the A**(i+1) with A**(1)
-        adj_mat = np.dot(adj_mat,adj_mat_0)
+#         # Take the inner product of the A**(i+1) with A**(1)
+#         adj_mat = np.dot(adj_mat,adj_mat_0)
 
-    return seps
+#     return seps
 
 # # Returns a matrix of graphical separations for all nodes in a graph defined by the inputted adjacency matrix 
 # # OLD FUNCTION HAD PROBLEMS WITH LARGE ADJACENCY MATRICES
@@ -3517,8 +3804,14 @@ def graph_seps(adj_mat_0):
 #     return seps
 
 # Returns the set of connected nodes to the start node, while avoiding any connections through nodes in the avoid list. 
+# adj_mat can be a dense adjacency matrix or a MolGraph. A dense matrix is converted on every call (O(N^2)), so callers
+# that search the same molecule repeatedly (e.g., once per bond or dihedral) should pass as_graph(adj_mat) instead.
 def return_connected(adj_mat,start=0,avoid=[]):
 
+    # Neighbor lookups go through the CSR arrays
+    G = as_graph(adj_mat)
+    indptr,indices = G.indptr,G.indices
+
     # Initialize the avoid list with the starting index
     avoid = set(avoid+[start])
 
@@ -3531,7 +3824,7 @@ def return_connected(adj_mat,start=0,avoid=[]):
     while len(new_0) > 0:        
 
         # reinitialize new_0 with new connections
-        new_0 = [ count_j for i in new_0 for count_j,j in enumerate(adj_mat[i]) if j == 1 and count_j not in avoid ]
+        new_0 = [ j for i in new_0 for j in indices[indptr[i]:indptr[i+1]].tolist() if j not in avoid ]
 
         # update the new_1 set and avoid list with the most recently encountered new nodes
         new_1.update(new_0)
@@ -3543,7 +3836,10 @@ def return_connected(adj_mat,start=0,avoid=[]):
 # Returns the list of terminal centers, where a terminal center is an atom with only one 
 # bond to a non-terminal atom.
 def terminal_centers(adj_mat):    
-    return [ count_i for count_i,i in enumerate(adj_mat) if sum(i) > 1 and len([ j for count_j,j in enumerate(i) if j == 1 and sum(adj_mat[count_j]) > 1 ]) == 1 ]
+    G = as_graph(adj_mat)
+    deg = G.degree
+    n_nonterm = G.to_csr().dot((deg > 1).astype(float))    # number of non-terminal neighbors of each atom
+    return np.where((deg > 1) & (n_nonterm == 1))[0].tolist()
 
 # This function generates a local adjacency matrix from an atomtype label
 def type_adjmat(label):
@@ -3645,34 +3941,12 @@ def axis_rot(Point,v1,v2,theta,mode='angle'):
 #
 # Returns:     mol_count: scalar, the number of molecules in the adj_mat
 def mol_count(adj_mat):
-    
-    # Initialize list of atoms assigned to molecules and a counter for molecules
-    placed_idx = []    
-    mol_count = 0
 
-    # Continue the search until all the atoms have been assigned to molecules
-    while len(placed_idx)<len(adj_mat):
-
-        # Use sequential elements of the adj_mat as seeds for the spanning network search
-        for count_i,i in enumerate(adj_mat):
-
-            # Only proceed with search if the current atom hasn't been placed in a molecule
-            if count_i not in placed_idx:
-
-                # Increment mol_count for every new seed and add the seed to the list of placed atoms
-                mol_count += 1               
-                placed_idx += [count_i]
-                
-                # Find connections
-                idx = [ count_j for count_j,j in enumerate(i) if j==1 and count_j not in placed_idx ]
-                
-                # Continue until no new atoms are found
-                while len(idx) > 0:
-                    current = idx.pop(0)
-                    if current not in placed_idx:
-                        placed_idx += [current]
-                        idx += [ count_k for count_k,k in enumerate(adj_mat[current]) if k == 1 and count_k not in placed_idx ]
-    return mol_count
+    # Each connected component of the bond graph is a molecule
+    G = as_graph(adj_mat)
+    if len(G) == 0:
+        return 0
+    return int(connected_components(G.to_csr(),directed=False)[0])
 
 # Description: finds the distance from a terminus for each node in the adjacency matrix
 #
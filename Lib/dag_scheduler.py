@@ -0,0 +1,148 @@
+#!/bin/env python
+
+from job_tracker import JobTracker,LocalBackend,MixedBackend,detect_backend
+
+# Description: A unit of work in a DAGScheduler. run(task) launches the work and returns the jobids
+#              that it submitted (an empty list if the work finished synchronously). Once all of the
+#              jobids complete, check(task) (optional) is called; it returns more jobids to wait on
+#              (e.g., resubmissions or the next step of a multi-step task) or an empty list when the
+#              task is done. stage, attempts and data are free for run/check to keep their progress in.
+class Task(object):
+
+    def __init__(self,name,run,deps=[],resource=None,check=None):
+        self.name     = name
+        self.run      = run
+        self.deps     = list(deps)
+        self.resource = resource
+        self.check    = check
+        self.state    = "waiting"        # waiting, running or done
+        self.jobs     = set([])
+        self.stage    = None
+        self.attempts = 0
+        self.data     = {}
+
+    def __repr__(self):
+        return "Task({}, {})".format(self.name,self.state)
+
+# Description: Runs a dependency graph of tasks. A task is launched as soon as all of its
+#              dependencies are done, subject to a cap on the number of simultaneously running tasks
+#              for each resource class (limits, e.g. {"param":4,"vdw":2}; None or missing is
+#              unlimited). Ready tasks are launched in the order they were added. The jobs of all
+#              running tasks are followed by a single JobTracker, so each task advances as soon as
+#              its own jobs finish rather than waiting on the slowest job of the batch. Local
+#              subprocesses can be tracked alongside batch jobs with register().
+#
+# Usage:       dag = DAGScheduler(limits={"param":4},user=c["user"],on_done=save_progress)
+#              dag.add("geoopt:KEY",run=submit_fn,check=check_fn,resource="param")
+#              dag.add("modescan:KEY",run=...,deps=["geoopt:KEY"],resource="param")
+#              dag.mark_done(previously_completed_names)
+#              dag.run()
+class DAGScheduler(object):
+
+    def __init__(self,tracker=None,limits=None,user=None,on_done=None):
+        self.local   = LocalBackend()
+        self.tracker = tracker if tracker is not None else JobTracker(MixedBackend(detect_backend(user),self.local))
+        self.limits  = {} if limits is None else limits
+        self.on_done = on_done
+        self.tasks   = {}
+        self.order   = []
+        self.owner   = {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self,name):
+        return self.tasks[name]
+
+    # Adds a task and returns it
+    def add(self,name,run,deps=[],resource=None,check=None):
+        if name in self.tasks:
+            print("ERROR in DAGScheduler.add: task {} was added twice.".format(name))
+            quit()
+        self.tasks[name] = Task(name,run,deps=deps,resource=resource,check=check)
+        self.order += [name]
+        return self.tasks[name]
+
+    # Marks tasks as done without running them (e.g., completed in a previous run)
+    def mark_done(self,names):
+        for i in names:
+            if i in self.tasks:
+                self.tasks[i].state = "done"
+
+    # Registers a running subprocess.Popen object so that a task can return its jobid
+    def register(self,proc,jobid=None):
+        return self.local.register(proc,jobid=jobid)
+
+    # Returns the waiting tasks whose dependencies are done (in the order they were added)
+    def ready(self):
+        return [ self.tasks[i] for i in self.order if self.tasks[i].state == "waiting" and\
+                 False not in [ self.tasks[j].state == "done" for j in self.tasks[i].deps ] ]
+
+    # Returns the number of running tasks in the resource class
+    def running(self,resource=None):
+        return len([ i for i in self.order if self.tasks[i].state == "running" and (resource is None or self.tasks[i].resource == resource) ])
+
+    # Launches ready tasks until none are left or the resource caps are reached
+    def launch(self):
+        started = True
+        while started is True:
+            started = False
+            for i in self.ready():
+                if self.limits.get(i.resource) is not None and self.running(i.resource) >= int(self.limits[i.resource]):
+                    continue
+                i.state = "running"
+                self.submit(i,i.run(i))
+                started = True
+                break
+
+    # Tracks the jobs returned by run or check (finishing the task if there are none)
+    def submit(self,task,jobids):
+        jobids = [ str(i).strip() for i in (jobids if jobids is not None else []) if str(i).strip() != "" ]
+        if len(jobids) == 0:
+            self.finish(task)
+            return
+        task.jobs = set(jobids)
+        for i in jobids:
+            self.owner[i] = task
+            self.tracker.add(i,callback=self.job_done)
+
+    # Tracker callback: finishes the owning task once its last job completes
+    def job_done(self,jobid):
+        task = self.owner.pop(jobid,None)
+        if task is None:
+            return
+        task.jobs.discard(jobid)
+        if len(task.jobs) == 0:
+            self.finish(task)
+
+    # Runs the task's check (which can return more jobs) and marks it done
+    def finish(self,task):
+        if task.check is not None:
+            jobids = task.check(task)
+            if jobids is not None and len(jobids) > 0:
+                self.submit(task,jobids)
+                return
+        task.state = "done"
+        if self.on_done is not None:
+            self.on_done(task)
+
+    # Runs the graph until every task is done
+    def run(self):
+
+        # Check for missing dependencies
+        for i in self.order:
+            missing = [ j for j in self.tasks[i].deps if j not in self.tasks ]
+            if len(missing) > 0:
+                print("ERROR in DAGScheduler.run: task {} depends on undefined task(s) {}.".format(i," ".join(missing)))
+                quit()
+
+        self.launch()
+        while "waiting" in [ self.tasks[i].state for i in self.order ] or self.running() > 0:
+            if self.running() == 0:
+                print("ERROR in DAGScheduler.run: no task can be launched, the remaining tasks have circular dependencies ({}).".format(\
+                      " ".join([ i for i in self.order if self.tasks[i].state == "waiting" ])))
+                quit()
+            if len(self.tracker.poll()) == 0:
+                self.tracker.sleep()
+            self.launch()
+        return
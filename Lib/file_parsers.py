@@ -3,39 +3,37 @@
 import numpy as np 
 import fnmatch
 import os
+from param_store import load_store
 
 
-# Description: Parses taffi.db files and returns a dictionary with the parameters and modes
+# Description: Parses taffi.db files and returns a dictionary with the parameters and modes (the files are read through their cached ParamStore)
 def parse_FF_params(FF_files,FF_dict={"masses":{},"charges":{},"bonds":{},"angles":{},"dihedrals":{},"dihedrals_harmonic":{},"vdw":{}}):
                    
     modes_from_FF = []
     for i in FF_files:
-        with open(i,'r') as f:
-            for lines in f:
-                fields = lines.split()
-                if len(fields) == 0: continue
-                if fields[0].lower() == "atom":   FF_dict["masses"][fields[1]] = float(fields[3])
-                if fields[0].lower() == "charge": FF_dict["charges"][fields[1]] = float(fields[2])
-                if fields[0].lower() == "bond":   
-                    modes_from_FF += [(fields[1],fields[2])]
-                    modes_from_FF += [(fields[2],fields[1])]
-                    FF_dict["bonds"][(fields[1],fields[2])] = [fields[3],float(fields[4]),float(fields[5])]
-                if fields[0].lower() == "angle":
-                    modes_from_FF += [(fields[1],fields[2],fields[3])]
-                    modes_from_FF += [(fields[3],fields[2],fields[1])]
-                    FF_dict["angles"][(fields[1],fields[2],fields[3])] = [fields[4],float(fields[5]),float(fields[6])]
-                if fields[0].lower() in ["dihedral","torsion"]: 
-                    modes_from_FF += [(fields[1],fields[2],fields[3],fields[4])]
-                    modes_from_FF += [(fields[4],fields[3],fields[2],fields[1])]
-                    if fields[5] == "opls":       
-                        FF_dict["dihedrals"][(fields[1],fields[2],fields[3],fields[4])] = [fields[5]] + [ float(i) for i in fields[6:10] ]
-                    elif fields[5] == "harmonic":
-                        FF_dict["dihedrals_harmonic"][(fields[1],fields[2],fields[3],fields[4])] = [fields[5]] + [ float(fields[6]),int(float(fields[7])),int(float(fields[8])) ] 
-                    elif fields[5] == "quadratic":
-                        FF_dict["dihedrals_harmonic"][(fields[1],fields[2],fields[3],fields[4])] = [fields[5]] + [ float(fields[6]),float(fields[7]) ]
-                if fields[0].lower() == "vdw":    
-                    FF_dict["vdw"][(fields[1],fields[2])] = [fields[3],float(fields[4]),float(fields[5])]
-                    FF_dict["vdw"][(fields[2],fields[1])] = [fields[3],float(fields[4]),float(fields[5])]
+        for fields in load_store(i).lines():
+            if fields[0].lower() == "atom":   FF_dict["masses"][fields[1]] = float(fields[3])
+            if fields[0].lower() == "charge": FF_dict["charges"][fields[1]] = float(fields[2])
+            if fields[0].lower() == "bond":   
+                modes_from_FF += [(fields[1],fields[2])]
+                modes_from_FF += [(fields[2],fields[1])]
+                FF_dict["bonds"][(fields[1],fields[2])] = [fields[3],float(fields[4]),float(fields[5])]
+            if fields[0].lower() == "angle":
+                modes_from_FF += [(fields[1],fields[2],fields[3])]
+                modes_from_FF += [(fields[3],fields[2],fields[1])]
+                FF_dict["angles"][(fields[1],fields[2],fields[3])] = [fields[4],float(fields[5]),float(fields[6])]
+            if fields[0].lower() in ["dihedral","torsion"]: 
+                modes_from_FF += [(fields[1],fields[2],fields[3],fields[4])]
+                modes_from_FF += [(fields[4],fields[3],fields[2],fields[1])]
+                if fields[5] == "opls":       
+                    FF_dict["dihedrals"][(fields[1],fields[2],fields[3],fields[4])] = [fields[5]] + [ float(i) for i in fields[6:10] ]
+                elif fields[5] == "harmonic":
+                    FF_dict["dihedrals_harmonic"][(fields[1],fields[2],fields[3],fields[4])] = [fields[5]] + [ float(fields[6]),int(float(fields[7])),int(float(fields[8])) ] 
+                elif fields[5] == "quadratic":
+                    FF_dict["dihedrals_harmonic"][(fields[1],fields[2],fields[3],fields[4])] = [fields[5]] + [ float(fields[6]),float(fields[7]) ]
+            if fields[0].lower() == "vdw":    
+                FF_dict["vdw"][(fields[1],fields[2])] = [fields[3],float(fields[4]),float(fields[5])]
+                FF_dict["vdw"][(fields[2],fields[1])] = [fields[3],float(fields[4]),float(fields[5])]
 
     return FF_dict,modes_from_FF
 
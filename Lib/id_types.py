@@ -4,6 +4,8 @@ import sys
 from file_parsers import *
 from adjacency import *
 import numpy as np
+from collections import OrderedDict
+from itertools import chain
 #from itertools import combinations
 #from time import time
 def main(argv):
@@ -65,6 +67,25 @@ def id_types(elements,A,gens=2,avoid=[],fc=None,keep_lone=None,return_index=Fals
                            37:'Rb',38:'Sr',39:'Y',40:'Zr',41:'Nb',42:'Mo',43:'Tc',44:'Ru',45:'Rh',46:'Pd',47:'Ag',48:'Cd',49:'In',50:'Sn',51:'Sb',52:'Te',53:'I',54:'Xe',\
                            55:'Cs',56:'Ba',57:'La',72:'Hf',73:'Ta',74:'W',75:'Re',76:'Os',77:'Ir',78:'Pt',79:'Au',80:'Hg',81:'Tl',82:'Pb',83:'Bi',84:'Po',85:'At',86:'Rn'}
 
+    # Return the cached types if this molecular graph has already been typed (repeated molecules and fragments)
+    if not hasattr(id_types, "type_cache"):
+        id_types.type_cache = OrderedDict()
+        id_types.max_cache  = 512
+    # Without formal charges the key is the canonical form of the graph (renumbered copies share an entry, the types are
+    # stored in canonical order), otherwise the per-atom fc/keep_lone lists are keyed as supplied
+    graph_key,pos = canonical_graph(A,elements) if fc is None and keep_lone is None else (None,None)
+    if graph_key is None:
+        graph_key,pos = (tuple(elements),graph_hash(A),repr(fc),repr(keep_lone)),list(range(len(elements)))
+    cache_key = (graph_key,gens,return_index,algorithm)
+    if cache_key in id_types.type_cache:
+        id_types.type_cache.move_to_end(cache_key)
+        atom_types,bond_index = deepcopy(id_types.type_cache[cache_key])
+        atom_types,bond_index = [ atom_types[i] for i in pos ],[ bond_index[i] for i in pos ]
+        if return_index:
+            return atom_types,bond_index
+        else:
+            return atom_types
+
     # If atomic numbers are supplied in place of elements
     try:
         elements = [ id_types.e_dict[int(_)] for _ in elements ]
@@ -119,8 +140,7 @@ def id_types(elements,A,gens=2,avoid=[],fc=None,keep_lone=None,return_index=Fals
         for i in range(len(elements)):
             N_masses[i] += (fc_0[i].count('+') * 100.0 + fc_0[i].count('-') * 90.0 + fc_0[i].count('*') * 80.0)
                                     
-        if algorithm == "matrix": atom_types = [ "["+taffi_type(i,elements,A,N_masses,gens,fc=fc_0)+"]" for i in range(len(elements)) ]
-        elif algorithm == "list": atom_types = [ "["+taffi_type_list(i,elements,A,N_masses,gens,fc=fc_0)+"]" for i in range(len(elements)) ]
+        atom_types = [ "["+i+"]" for i in taffi_types(elements,A,N_masses,gens,fc=fc_0,algorithm=algorithm) ]
 
     #resonance structure appear, identify special atoms and keep both formal charge information (now only support matrix input)
     else:
@@ -142,11 +162,14 @@ def id_types(elements,A,gens=2,avoid=[],fc=None,keep_lone=None,return_index=Fals
                 if fc_0[l][i] < 0    : fc_s[i] += abs(fc_0[l][i])*"-" 
             fc_0[l] = fc_s
         
+        # Graphical separations are used for determining which atoms and bonds to keep
+        gs = graph_seps(A)
+
+        # Types are generated for all atoms at once for each distinct set of formal charges (fc_types is keyed by the fc list)
+        fc_types = {}
+
         for ind in range(len(elements)):
             if ind in normal_atoms:
-                # Graphical separations are used for determining which atoms and bonds to keep
-                gs = graph_seps(A)
-                
                 # all atoms within "gens" of the ind atoms are kept
                 keep_atoms = list(set([ count_j for count_j,j in enumerate(gs[ind]) if j <= gens ]))  
                 contain_special = [N_s for N_s in keep_atoms if N_s in special_atoms]
@@ -180,17 +203,25 @@ def id_types(elements,A,gens=2,avoid=[],fc=None,keep_lone=None,return_index=Fals
                 bond_index[ind]=bond_ind
 
             # add charge to atom_type sorting
-            N_masses = deepcopy(masses)
-            for i in range(len(elements)):
-                N_masses[i] += (fc[i].count('+') * 100.0 + fc[i].count('-') * 90.0 + fc[i].count('*') * 80.0) 
+            if tuple(fc) not in fc_types:
+                N_masses = deepcopy(masses)
+                for i in range(len(elements)):
+                    N_masses[i] += (fc[i].count('+') * 100.0 + fc[i].count('-') * 90.0 + fc[i].count('*') * 80.0) 
+                fc_types[tuple(fc)] = taffi_types(elements,A,N_masses,gens,fc=fc)
                 
-            atom_types += [ "["+taffi_type(ind,elements,A,N_masses,gens,fc=fc)+"]" ]
+            atom_types += [ "["+fc_types[tuple(fc)][ind]+"]" ]
 
     # Add ring atom designation for atom types that belong are intrinsic to rings 
     # (depdends on the value of gens)
     for count_i,i in enumerate(atom_types):
         if ring_atom_new(A,count_i,ring_size=(gens+2)) == True:
             atom_types[count_i] = "R" + atom_types[count_i]            
+
+    # Update the cache (least recently used entries are discarded first)
+    order = np.argsort(pos)
+    id_types.type_cache[cache_key] = deepcopy(([ atom_types[i] for i in order ],[ bond_index[i] for i in order ]))
+    while len(id_types.type_cache) > id_types.max_cache:
+        id_types.type_cache.popitem(last=False)
  
     if return_index:
         return atom_types,bond_index
@@ -235,6 +266,57 @@ def taffi_type(ind,elements,adj_mat,masses,gens=2,avoid=[],fc=[]):
     # Calculate formal charge terms
     return "{}".format(taffi_type.periodic[elements[ind].lower()]) + fc[ind] + "".join([ "["+i+"]" for i in subs ])
 
+# Description: iterative (generation-by-generation) version of taffi_type/taffi_type_list that types every atom in one sweep.
+#              The label of each bond direction (parent -> child) is built for generation 1, 2, ..., gens-1 from the labels 
+#              of the previous generation, so no subtree is rebuilt and the neighbor ordering hashes are computed once per 
+#              generation for the whole molecule. Returns the same strings as 
+#              [ taffi_type(i,elements,A,masses,gens,fc=fc) for i in range(len(elements)) ] (or taffi_type_list for algorithm="list").
+def taffi_types(elements,A,masses,gens=2,fc=[],algorithm="matrix"):
+
+    # Check fc condition
+    if len(fc) == 0:
+        fc = ['']*len(elements)
+    if len(fc) != len(elements):
+        print("ERROR in taffi_types: fc must have the same dimensions as elements and A")
+        quit()
+
+    # On first call initialize dictionaries
+    if not hasattr(taffi_types, "periodic"):
+
+        # Initialize periodic table
+        taffi_types.periodic = { "h": 1,  "he": 2,\
+                                "li":3,  "be":4,                                                                                                      "b":5,    "c":6,    "n":7,    "o":8,    "f":9,    "ne":10,\
+                                "na":11, "mg":12,                                                                                                     "al":13,  "si":14,  "p":15,   "s":16,   "cl":17,  "ar":18,\
+                                 "k":19,  "ca":20,  "sc":21,  "ti":22,  "v":23,  "cr":24,  "mn":25,  "fe":26,  "co":27,  "ni":28,  "cu":29,  "zn":30,  "ga":31,  "ge":32,  "as":33,  "se":34,  "br":35,  "kr":36,\
+                                "rb":37, "sr":38,  "y":39,   "zr":40,  "nb":41, "mo":42,  "tc":43,  "ru":44,  "rh":45,  "pd":46,  "ag":47,  "cd":48,  "in":49,  "sn":50,  "sb":51,  "te":52,  "i":53,   "xe":54,\
+                                "cs":55, "ba":56,            "hf":72,  "ta":73, "w":74,   "re":75,  "os":76,  "ir":77,  "pt":78,  "au":79,  "hg":80,  "tl":81,  "pb":82,  "bi":83,  "po":84,  "at":85,  "rn":86}
+
+    # Generation 0 labels and neighbor lists
+    labels = [ "{}".format(taffi_types.periodic[i.lower()]) + fc[count_i] for count_i,i in enumerate(elements) ]
+    if algorithm == "matrix":
+        A = np.asarray(A)
+        nbrs = [ list(np.where(A[i] == 1)[0]) for i in range(len(elements)) ]
+    else:
+        nbrs = [ list(i) for i in A ]
+    if gens == 0:
+        return labels
+
+    # Neighbor orderings for each generation (connections are sorted by the gens-1 hash in descending order, ties by descending index)
+    order = {}
+    for g in range(1,gens+1):
+        if algorithm == "matrix":
+            h = atom_hashes(A,masses,gens=g-1)
+        else:
+            h = [ atom_hash_list(i,A,masses,gens=g-1) for i in range(len(elements)) ]
+        order[g] = [ [ j[1] for j in sorted([ (h[k],k) for k in i ])[::-1] ] for i in nbrs ]
+
+    # Directed bond labels: sub[(p,c)] holds the generation g label of atom c reached from p
+    sub = { (p,c):labels[c] for c in range(len(elements)) for p in nbrs[c] }
+    for g in range(1,gens):
+        sub = { (p,c):labels[c]+"".join([ "["+sub[(c,k)]+"]" for k in order[g][c] if k != p ]) for c in range(len(elements)) for p in nbrs[c] }
+
+    return [ labels[i]+"".join([ "["+sub[(i,k)]+"]" for k in order[gens][i] ]) for i in range(len(elements)) ]
+
 
 '''
 # identifies the taffi atom types from an adjacency matrix/list (A) and element identify. 
@@ -991,26 +1073,11 @@ def minimal_structure(atomtype,geo,elements,adj_mat=None,atomtypes=None,gens=2):
         # If the current atomtype matches the atomtype being searched for then proceed with minimal geo check
         if i == atomtype:
 
-            # Initialize lists for holding indices in the structure within "gens" bonds of the seed atom (count_i)
-            keep_list = [count_i]
-            new_list  = [count_i]
-            
-            # Carry ount a "gens" bond deep search
-            for j in range(gens):
-
-                # Id atoms in the next generation
-                tmp_new_list = []                
-                for k in new_list:
-                    tmp_new_list += [ count_m for count_m,m in enumerate(adj_mat[k]) if m == 1 and count_m not in keep_list ]
-
-                # Update lists
-                tmp_new_list = list(set(tmp_new_list))
-                if len(tmp_new_list) > 0:
-                    keep_list += tmp_new_list
-                new_list = tmp_new_list
-            
+            # Indices in the structure within "gens" bonds of the seed atom (count_i)
+            seps = graph_seps(adj_mat)[count_i]
+            keep_list = set(np.where((seps >= 0) & (seps <= gens))[0])
+
             # Check for the minimal condition
-            keep_list = set(keep_list)
             if False in [ elements[j] == "H" for j in range(len(elements)) if j not in keep_list ]:
                 minimal_flag = False
             else:
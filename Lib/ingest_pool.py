@@ -0,0 +1,31 @@
+#!/bin/env python
+
+import os,math
+from concurrent.futures import ProcessPoolExecutor
+
+# Description: Process pool for the ingestion phase of the extract_* scripts (parsing the QC outputs, xyz files and
+#              potential grids of each configuration or model compound). The work items are independent, so they are
+#              sent in chunks to a pool of worker processes and the results are returned in the order of the items,
+#              which keeps every reduction that follows identical to a serial run. The worker functions must be
+#              module-level functions that don't depend on globals set at runtime (e.g., in main). With procs=1
+#              (the default of the -procs options) everything runs in the calling process; procs=0 uses all cores.
+#
+# Usage:       results = pool_map(parse_config,[ (name,gens) for name in names ],procs=args.procs)
+def pool_map(func,items,procs=1,chunksize=None):
+    items = list(items)
+    procs = min(get_procs(procs),len(items))
+    if procs <= 1:
+        return [ func(*i) for i in items ]
+
+    # Several chunks per worker balance configurations of different size without paying the IPC cost per item
+    if chunksize is None:
+        chunksize = max(1,int(math.ceil(len(items)/float(4*procs))))
+    with ProcessPoolExecutor(max_workers=procs) as executor:
+        return list(executor.map(func,*zip(*items),chunksize=chunksize))
+
+# Returns the number of worker processes for a -procs argument (values < 1 mean all cores)
+def get_procs(procs):
+    procs = int(procs)
+    if procs < 1:
+        return os.cpu_count()
+    return procs
@@ -0,0 +1,297 @@
+#!/bin/env python
+
+import os,subprocess,shutil,time,threading
+
+# Description: Tracks the completion of batch (or local) jobs. Each polling interval the
+#              scheduler is queried once for the whole set of tracked jobs, and the interval
+#              grows geometrically (up to max_interval) while nothing changes, resetting when
+#              a job finishes. Jobs can also be given sentinel files (e.g., a status file or
+#              the final output of the run directory); a job is considered complete as soon as
+#              one of its sentinels exists, even if the scheduler hasn't dropped it yet.
+#              Sentinels are checked every sentinel_interval (a few stat calls, no subprocess).
+#              Callbacks registered with add() are called with the jobid as each job finishes.
+#
+# Usage:       tracker = JobTracker(user=c["user"])              # backend is detected (slurm/pbs)
+#              tracker.add(jobid,callback=on_done,sentinel="{}/vdw/status.txt".format(inchi))
+#              for jobid in tracker.as_completed(): ...          # react as each job finishes
+#              tracker.wait()                                   # or block until all are done
+#              thread = tracker.watch()                         # or track in a background thread
+class JobTracker(object):
+
+    def __init__(self,backend=None,user=None,interval=5.0,max_interval=60.0,backoff=1.5,sentinel_interval=1.0):
+        self.backend           = backend if backend is not None else detect_backend(user)
+        self.interval          = interval
+        self.max_interval      = max_interval
+        self.backoff           = backoff
+        self.sentinel_interval = sentinel_interval
+        self.current_interval  = interval
+        self.next_query        = 0.0
+        self.pending           = []
+        self.completed         = []
+        self.callbacks         = {}
+        self.sentinels         = {}
+        self.lock              = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    # Adds a jobid to the tracker. callback (optional) is called with the jobid when the job completes.
+    # sentinel is a path or list of paths whose existence marks the job as complete.
+    def add(self,jobid,callback=None,sentinel=None):
+        jobid = str(jobid).strip()
+        if jobid == "" or jobid in self.pending or jobid in self.completed:
+            return jobid
+        with self.lock:
+            self.pending += [jobid]
+            self.callbacks[jobid] = [] if callback is None else [callback]
+            if sentinel is None:
+                self.sentinels[jobid] = []
+            elif isinstance(sentinel,str):
+                self.sentinels[jobid] = [sentinel]
+            else:
+                self.sentinels[jobid] = list(sentinel)
+        return jobid
+
+    # Checks the sentinels and (if the interval has elapsed) queries the scheduler once. Returns
+    # the list of jobids that completed since the last call, after running their callbacks.
+    def poll(self):
+        with self.lock:
+            done = [ i for i in self.pending if True in [ os.path.exists(j) for j in self.sentinels[i] ] ]
+
+            # Query the scheduler for everything not already completed by a sentinel
+            remaining = [ i for i in self.pending if i not in done ]
+            if len(remaining) > 0 and time.time() >= self.next_query:
+                active = self.backend.active(remaining)
+
+                # A failed query (e.g., scheduler timeout) is treated as "no change"
+                if active is not None:
+                    done += [ i for i in remaining if i not in active ]
+                if len(done) > 0:
+                    self.current_interval = self.interval
+                else:
+                    self.current_interval = min(self.current_interval*self.backoff,self.max_interval)
+                self.next_query = time.time()+self.current_interval
+
+            elif len(done) > 0:
+                self.current_interval = self.interval
+
+            self.pending    = [ i for i in self.pending if i not in done ]
+            self.completed += done
+
+        for i in done:
+            for j in self.callbacks[i]:
+                j(i)
+        return done
+
+    # Generator that yields the jobids (all pending jobs by default) as they complete. If timeout
+    # (seconds) elapses first the generator returns with the unfinished jobs still pending.
+    def as_completed(self,jobids=None,timeout=None):
+        if jobids is None:
+            jobids = list(self.pending)
+        else:
+            jobids = [ self.add(i) for i in jobids ]
+        remaining = set([ i for i in jobids if i not in self.completed ])
+        start = time.time()
+        for i in [ i for i in jobids if i in self.completed ]:
+            yield i
+        while len(remaining) > 0:
+            done = [ i for i in self.poll() if i in remaining ]
+            for i in done:
+                remaining.remove(i)
+                yield i
+            if len(done) > 0:
+                continue
+            if timeout is not None and time.time()-start >= timeout:
+                return
+            self.sleep()
+
+    # Sleeps until the next sentinel check or scheduler query is due
+    def sleep(self):
+        time.sleep(max(min(self.sentinel_interval,self.next_query-time.time()),0.05))
+
+    # Blocks until the jobids (all pending jobs by default) complete. Returns the jobids that are
+    # still pending (empty unless timeout was reached).
+    def wait(self,jobids=None,timeout=None):
+        if jobids is None:
+            jobids = list(self.pending)
+        for i in self.as_completed(jobids,timeout=timeout):
+            pass
+        return [ i for i in jobids if str(i).strip() in self.pending ]
+
+    # Runs wait() in a daemon thread so that callbacks fire while the caller does other work.
+    # Returns the (started) thread; join() it to block until all jobs are done.
+    def watch(self,jobids=None,timeout=None):
+        thread = threading.Thread(target=self.wait,args=(jobids,timeout))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+# Returns the backend for the scheduler available on this machine (slurm, then pbs, else local)
+def detect_backend(user=None):
+    if shutil.which("squeue") is not None:
+        return SlurmBackend(user)
+    elif shutil.which("qstat") is not None:
+        return PBSBackend(user)
+    return LocalBackend()
+
+# Description: Queries slurm for the states of the user's jobs with a single squeue call.
+#              Jobs that are missing from the queue or in a terminal state are complete.
+class SlurmBackend(object):
+
+    terminal = ["CD","CA","F","TO","NF","PR","OOM","BF","DL","RV"]
+
+    def __init__(self,user=None):
+        self.user = user
+
+    # Returns {jobid:state} for the user's jobs in the queue (None if squeue failed)
+    def states(self):
+        command = ["squeue","-h","-o","%i %t"]
+        if self.user not in [None,""]:
+            command += ["-u",str(self.user)]
+        output = run_query(command)
+        if output is None:
+            return None
+        return dict([ (i.split()[0],i.split()[1]) for i in output.split("\n") if len(i.split()) >= 2 ])
+
+    # Returns the subset of jobids that are still active (None if squeue failed)
+    def active(self,jobids):
+        states = self.states()
+        if states is None:
+            return None
+        return set([ i for i in jobids if i in states and states[i] not in self.terminal ])
+
+    # Returns the user's jobids that are still active (None if squeue failed)
+    def queued(self):
+        states = self.states()
+        if states is None:
+            return None
+        return [ i for i in states if states[i] not in self.terminal ]
+
+# Description: Queries pbs/torque for the states of all jobs with a single qstat -f call.
+#              Jobs are matched on the numeric part of the id (qstat reports the server suffix
+#              even when the submission didn't). Missing, completed (C) or finished (F) jobs are complete.
+class PBSBackend(object):
+
+    terminal = ["C","F"]
+
+    def __init__(self,user=None):
+        self.user = user
+
+    # Returns {jobid:state} for the user's jobs in the queue (None if qstat failed)
+    def states(self):
+        output = run_query(["qstat","-f"])
+        if output is None:
+            return None
+        states = {}
+        owners = {}
+        current_key = None
+        for i in output.split("\n"):
+            fields = i.split()
+            if len(fields) == 0: continue
+            if "Job Id" in i:
+                current_key = fields[2]
+                states[current_key] = "NA"
+                owners[current_key] = "NA"
+            elif current_key is not None and fields[0] == "job_state":
+                states[current_key] = fields[2]
+            elif current_key is not None and fields[0] == "Job_Owner":
+                owners[current_key] = fields[2].split("@")[0]
+        return dict([ (i,states[i]) for i in states if self.user in [None,""] or owners[i] == self.user ])
+
+    # Returns the subset of jobids that are still active (None if qstat failed)
+    def active(self,jobids):
+        states = self.states()
+        if states is None:
+            return None
+        states = dict([ (i.split(".")[0],states[i]) for i in states ])
+        return set([ i for i in jobids if i.split(".")[0] in states and states[i.split(".")[0]] not in self.terminal ])
+
+    # Returns the user's jobids that are still active (None if qstat failed)
+    def queued(self):
+        states = self.states()
+        if states is None:
+            return None
+        return [ i for i in states if states[i] not in self.terminal ]
+
+# Description: Backend for processes running on this machine (no scheduler). Existing
+#              subprocess.Popen handles are registered with register(); submit() launches a
+#              command, holding it back until fewer than max_procs submitted commands are running.
+#              Mostly used for workflows that fan out subprocesses and for testing the tracker.
+class LocalBackend(object):
+
+    def __init__(self,max_procs=None):
+        self.max_procs = max_procs
+        self.procs     = {}
+        self.queue     = []
+        self.count     = 0
+
+    # Registers a running Popen object and returns its jobid
+    def register(self,proc,jobid=None):
+        if jobid is None:
+            jobid = "local-{}".format(proc.pid)
+        self.procs[str(jobid)] = proc
+        return str(jobid)
+
+    # Queues a command (list or shell string) for execution and returns its jobid
+    def submit(self,command,cwd=None,jobid=None,**kwargs):
+        self.count += 1
+        if jobid is None:
+            jobid = "local-job-{}".format(self.count)
+        self.queue += [(str(jobid),command,cwd,kwargs)]
+        self.launch()
+        return str(jobid)
+
+    # Starts queued commands while slots are available
+    def launch(self):
+        while len(self.queue) > 0 and (self.max_procs is None or len(self.running()) < self.max_procs):
+            jobid,command,cwd,kwargs = self.queue.pop(0)
+            self.procs[jobid] = subprocess.Popen(command,cwd=cwd,shell=isinstance(command,str),**kwargs)
+
+    # Returns the jobids of the processes that haven't exited
+    def running(self):
+        return [ i for i in self.procs if self.procs[i].poll() is None ]
+
+    # Returns the exit code of jobid (None if it is still queued or running)
+    def returncode(self,jobid):
+        if jobid not in self.procs:
+            return None
+        return self.procs[jobid].poll()
+
+    # Returns the subset of jobids that are queued or still running
+    def active(self,jobids):
+        self.launch()
+        queued = [ i[0] for i in self.queue ]
+        return set([ i for i in jobids if i in queued or (i in self.procs and self.procs[i].poll() is None) ])
+
+# Description: Combines a scheduler backend with a LocalBackend. Jobids registered with (or submitted
+#              to) the local backend are answered by it, everything else is sent to the scheduler in
+#              one query. Used when batch jobs and local subprocesses are tracked together.
+class MixedBackend(object):
+
+    def __init__(self,scheduler,local):
+        self.scheduler = scheduler
+        self.local     = local
+
+    # Returns the subset of jobids that are still active. If the scheduler query fails its jobs are
+    # reported as active so that the local results are still used.
+    def active(self,jobids):
+        queued = [ i[0] for i in self.local.queue ]
+        local  = [ i for i in jobids if i in self.local.procs or i in queued ]
+        other  = [ i for i in jobids if i not in local ]
+        active = self.local.active(local)
+        if len(other) > 0:
+            sched = self.scheduler.active(other)
+            active |= set(other) if sched is None else sched
+        return active
+
+# Runs a scheduler query and returns its stdout (None if the command failed). A missing command
+# returns an empty queue, like the legacy parsers did, so callers don't wait on a scheduler that isn't there.
+def run_query(command):
+    try:
+        p = subprocess.Popen(command,stdout=subprocess.PIPE,stderr=subprocess.PIPE,encoding='utf8')
+        output,err = p.communicate()
+    except OSError:
+        return ""
+    if p.returncode != 0:
+        return None
+    return output
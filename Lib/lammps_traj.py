@@ -0,0 +1,156 @@
+#!/bin/env python
+
+import os
+import numpy as np
+
+# Description: Indexed random-access reader for sorted LAMMPS "atom" dump files (*.lammpstrj).
+#              A single pass over the file records the byte offset of every "ITEM: TIMESTEP"
+#              block. The offsets are saved to a sidecar file (<traj>.idx.npz) together with
+#              the size and mtime of the trajectory, so later calls (and later programs) reuse
+#              the index as long as the trajectory is unchanged. Frames are served by seeking
+#              to the stored offset and parsing the whole block at once into numpy arrays.
+#
+# Usage:       traj = Trajectory("equil.lammpstrj")
+#              num_frames = len(traj)
+#              ids,types,geo,mol,box = traj.get_frame(10)
+#              for frame,(ids,types,geo,mol,box) in traj.iter_frames(range(0,len(traj),5)):
+#                  ...
+class Trajectory(object):
+
+    def __init__(self,traj,sidecar=True,chunk_size=64*1024*1024):
+        self.traj       = traj
+        self.sidecar    = traj+".idx.npz"
+        self.chunk_size = chunk_size
+        self.size       = os.path.getsize(traj)
+        self.mtime      = os.path.getmtime(traj)
+        self.offsets    = None
+
+        # Try the sidecar first, then fall back on scanning the file
+        if sidecar is True:
+            self.offsets = self.load_index()
+        if self.offsets is None:
+            self.offsets = build_frame_index(traj,chunk_size=self.chunk_size)
+            if sidecar is True:
+                self.save_index()
+
+        # Byte ranges of each frame (the last frame runs until the end of the file)
+        self.ends = np.append(self.offsets[1:],self.size)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Returns the saved offsets if the sidecar exists and matches the current trajectory, else None
+    def load_index(self):
+        if os.path.isfile(self.sidecar) is False:
+            return None
+        try:
+            with np.load(self.sidecar) as f:
+                if int(f["size"]) != self.size or float(f["mtime"]) != self.mtime:
+                    return None
+                return np.array(f["offsets"],dtype=np.int64)
+        except Exception:
+            return None
+
+    # Writes the offsets to the sidecar. Failure to write (e.g., read-only folder) is not fatal.
+    def save_index(self):
+        try:
+            with open(self.sidecar,'wb') as f:
+                np.savez(f,offsets=self.offsets,size=self.size,mtime=self.mtime)
+        except (IOError,OSError):
+            pass
+
+    # Returns ids,types,geo,mol,box for the requested frame (zero indexing). types and mol are
+    # returned as string arrays to match the lammps type and mol id labels used as dictionary keys.
+    def get_frame(self,frame):
+        with open(self.traj,'rb') as f:
+            return self._read_frame(f,frame)
+
+    # Generator over (frame,(ids,types,geo,mol,box)) for the requested frame indices. The file
+    # is opened once and each frame is reached with a single seek.
+    def iter_frames(self,frames=None):
+        if frames is None:
+            frames = range(len(self))
+        with open(self.traj,'rb') as f:
+            for frame in frames:
+                yield frame,self._read_frame(f,frame)
+
+    def _read_frame(self,f,frame):
+        if frame < 0:
+            frame += len(self)
+        if frame < 0 or frame >= len(self):
+            raise IndexError("frame {} is out of range for {} ({} frames)".format(frame,self.traj,len(self)))
+        f.seek(int(self.offsets[frame]))
+        return parse_frame(f.read(int(self.ends[frame]-self.offsets[frame])).decode())
+
+# Description: Returns the byte offsets of each "ITEM: TIMESTEP" line in a LAMMPS dump file.
+#              The file is read in large chunks and searched with bytes.find, so the cost is
+#              a single sequential pass over the file.
+def build_frame_index(traj,chunk_size=64*1024*1024):
+
+    pattern = b"ITEM: TIMESTEP"
+    offsets = []
+    with open(traj,'rb') as f:
+        buf = b""
+        pos = 0          # file offset of buf[0]
+        start = 0        # first position in buf that can still hold a new match
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf += chunk
+            while True:
+                i = buf.find(pattern,start)
+                if i == -1:
+                    break
+                if pos+i == 0 or buf[i-1:i] == b"\n":
+                    offsets += [pos+i]
+                start = i+1
+
+            # Keep enough of the tail to catch a match split across chunks (and its preceding newline)
+            # (a match starting at the first kept byte was already complete, hence start=1)
+            keep  = min(len(pattern),len(buf))
+            pos  += len(buf)-keep
+            buf   = buf[len(buf)-keep:]
+            start = 1 if keep == len(pattern) else 0
+
+    return np.array(offsets,dtype=np.int64)
+
+# Description: Parses a single frame block (text starting at "ITEM: TIMESTEP") into
+#              ids (int array), types (str array), geo (Nx3 float array), mol (str array)
+#              and box (xlo,xhi,ylo,yhi,zlo,zhi). Like the legacy per-script parsers, the
+#              coordinates are read from the 3rd-5th columns and the mol id from the "mol" column.
+def parse_frame(block):
+
+    lines = block.split("\n")
+    box = np.zeros(6)
+    num_atoms = None
+    for count_i,i in enumerate(lines):
+        if i.startswith("ITEM: NUMBER OF ATOMS"):
+            num_atoms = int(lines[count_i+1])
+        elif i.startswith("ITEM: BOX"):
+            for j in range(3):
+                fields = lines[count_i+1+j].split()
+                box[2*j]   = float(fields[0])
+                box[2*j+1] = float(fields[1])
+        elif i.startswith("ITEM: ATOMS"):
+            header = i.split()
+            atom_start = count_i+1
+            break
+    else:
+        raise ValueError("no ITEM: ATOMS section found in frame")
+
+    if num_atoms is None:
+        num_atoms = len([ j for j in lines[atom_start:] if j.strip() != "" ])
+    mol_ind = header.index("mol")-2 if "mol" in header else None
+
+    # Bulk conversion of the atom block
+    data  = np.array(" ".join(lines[atom_start:atom_start+num_atoms]).split()).reshape(num_atoms,-1)
+    ids   = data[:,0].astype(int)
+    types = data[:,1]
+    geo   = data[:,2:5].astype(float)
+    if mol_ind is not None:
+        mol = data[:,mol_ind]
+    else:
+        mol = np.array(["X"]*num_atoms)
+
+    return ids,types,geo,mol,box
@@ -0,0 +1,92 @@
+#!/bin/env python
+
+import os,subprocess,threading
+from concurrent.futures import ProcessPoolExecutor,Future,wait
+
+# Description: Runs shell commands on this machine through a concurrent.futures process pool (the "local"
+#              scheduler of orca_submit.py, lammps_submit.py and shell_submit.sh). The pool is sized to
+#              the host's cores and each command reserves the number of cores it was submitted with
+#              (the -p of the job), so a 4-core ORCA job and four 1-core jobs occupy the same slots.
+#              Queued commands are started in submission order, skipping ahead to the first one that fits
+#              when the next in line needs more cores than are currently free.
+#
+# Usage:       pool = LocalPool()                               # cores = os.cpu_count()
+#              pool.submit('orca "geoopt.in" > "geoopt.out"',cwd=folder,procs=4)
+#              returncodes = pool.wait()
+class LocalPool(object):
+
+    def __init__(self,cores=None):
+        self.cores    = cores if cores is not None else os.cpu_count()
+        self.free     = self.cores
+        self.executor = ProcessPoolExecutor(max_workers=self.cores)
+        self.queue    = []
+        self.futures  = []
+        self.lock     = threading.Lock()
+
+    def __len__(self):
+        return len(self.futures)
+
+    # Queues a shell command and returns a Future that resolves to its exit code. procs is clamped to
+    # the size of the pool so that oversized jobs still run (alone).
+    def submit(self,command,cwd=None,procs=1,output=None):
+        procs  = max(1,min(int(procs),self.cores))
+        future = Future()
+        with self.lock:
+            self.queue   += [(future,command,cwd,procs,output)]
+            self.futures += [future]
+        self.dispatch()
+        return future
+
+    # Starts queued commands while cores are free. The callbacks are added after the lock is released since
+    # add_done_callback calls release() in this thread if the command has already finished.
+    def dispatch(self):
+        started = []
+        with self.lock:
+            for i in list(self.queue):
+                if i[3] > self.free:
+                    continue
+                self.free -= i[3]
+                self.queue.remove(i)
+                started += [(self.executor.submit(run_command,i[1],i[2],i[4]),i[0],i[3])]
+        for f,future,procs in started:
+            f.add_done_callback(lambda f,future=future,procs=procs: self.release(future,procs,f))
+
+    # Returns the cores of a finished command to the pool and resolves its Future
+    def release(self,future,procs,f):
+        with self.lock:
+            self.free += procs
+        if f.exception() is not None:
+            future.set_exception(f.exception())
+        else:
+            future.set_result(f.result())
+        self.dispatch()
+
+    # Blocks until every submitted command has finished and returns their exit codes (in submission order)
+    def wait(self):
+        wait(self.futures)
+        return [ i.result() for i in self.futures ]
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+# Runs command in a shell from cwd (stdout is redirected to output if supplied) and returns the exit code
+def run_command(command,cwd=None,output=None):
+    if output is None:
+        return subprocess.call(command,cwd=cwd,shell=True)
+    with open(os.path.join(cwd,output) if cwd is not None else output,'w') as f:
+        return subprocess.call(command,cwd=cwd,shell=True,stdout=f,stderr=subprocess.STDOUT)
+
+# Runs a list of (command,cwd,procs) jobs on the local pool and blocks until they finish. Returns the exit codes.
+def run_local(jobs,cores=None):
+    pool = LocalPool(cores)
+    for command,cwd,procs in jobs:
+        pool.submit(command,cwd=cwd,procs=procs)
+    returncodes = pool.wait()
+    pool.shutdown()
+    return returncodes
+
+# Returns the extra shell_submit.sh arguments for the scheduler sched (runs the job in the foreground for "local")
+def shell_submit_args(sched):
+    if sched is not None and str(sched).lower() == "local":
+        return ["-w","local"]
+    return []
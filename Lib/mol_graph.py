@@ -0,0 +1,135 @@
+#!/bin/env python
+
+import numpy as np
+from scipy.sparse import csr_matrix,issparse
+
+# Description: Compact graph representation of a molecule (or a condensed-phase box of molecules).
+#              Connectivity is stored in CSR form: the neighbors of atom i are
+#              indices[indptr[i]:indptr[i+1]] (sorted in ascending order, matching the order that
+#              the legacy enumerate(adj_mat[i]) scans return them in). Bond orders, elements and
+#              atom types are optional per-bond/per-atom arrays. Memory and neighbor lookups scale
+#              with the number of bonds rather than N^2.
+#
+# Usage:       G = MolGraph.from_adj_mat(adj_mat,elements=elements)
+#              for j in G.neighbors(i): ...
+#              adj_mat = G.to_adj_mat()
+#
+#              The Lib functions that take an adj_mat (Find_modes, return_connected, ring_atom,
+#              terminal_centers, mol_count, find_lewis, ...) accept either a dense matrix or a
+#              MolGraph. as_graph() is used internally to convert dense inputs once at entry.
+class MolGraph(object):
+
+    __slots__ = ("N","indptr","indices","bond_orders","elements","atom_types")
+
+    def __init__(self,N,indptr,indices,bond_orders=None,elements=None,atom_types=None):
+        self.N           = int(N)
+        self.indptr      = np.asarray(indptr,dtype=np.int64)
+        self.indices     = np.asarray(indices,dtype=np.int64)
+        self.bond_orders = None if bond_orders is None else np.asarray(bond_orders,dtype=float)
+        self.elements    = None if elements is None else np.asarray(elements,dtype=object)
+        self.atom_types  = None if atom_types is None else np.asarray(atom_types,dtype=object)
+
+    def __len__(self):
+        return self.N
+
+    def __repr__(self):
+        return "MolGraph(N={}, bonds={})".format(self.N,len(self.indices)//2)
+
+    # Returns the (sorted) neighbor indices of atom i as an int array
+    def neighbors(self,i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    # Returns the bond orders of atom i's bonds (indexed like neighbors(i))
+    def neighbor_orders(self,i):
+        if self.bond_orders is None:
+            return np.ones(self.indptr[i+1]-self.indptr[i])
+        return self.bond_orders[self.indptr[i]:self.indptr[i+1]]
+
+    # Returns the number of bonds for every atom
+    @property
+    def degree(self):
+        return np.diff(self.indptr)
+
+    # Returns an (Nb,2) array of the unique bonds (i<j)
+    def bonds(self):
+        rows = np.repeat(np.arange(self.N),np.diff(self.indptr))
+        mask = rows < self.indices
+        return np.column_stack((rows[mask],self.indices[mask]))
+
+    # Returns the neighbor lists as a list of lists
+    def to_adj_list(self):
+        return [ self.indices[self.indptr[i]:self.indptr[i+1]].tolist() for i in range(self.N) ]
+
+    # Returns a scipy csr_matrix holding 1 for each bond
+    def to_csr(self):
+        return csr_matrix((np.ones(len(self.indices)),self.indices,self.indptr),shape=(self.N,self.N))
+
+    # Returns the dense NxN adjacency matrix used by the legacy functions
+    def to_adj_mat(self):
+        adj_mat = np.zeros([self.N,self.N])
+        rows = np.repeat(np.arange(self.N),np.diff(self.indptr))
+        adj_mat[rows,self.indices] = 1
+        return adj_mat
+
+    # Returns the dense NxN bond order matrix (None if bond orders weren't supplied)
+    def to_bond_mat(self):
+        if self.bond_orders is None:
+            return None
+        bond_mat = np.zeros([self.N,self.N])
+        rows = np.repeat(np.arange(self.N),np.diff(self.indptr))
+        bond_mat[rows,self.indices] = self.bond_orders
+        return bond_mat
+
+    # Build from a dense (numpy/list) or scipy sparse adjacency matrix. Like the legacy scans, only
+    # entries equal to 1 are treated as bonds. If bond_mat is supplied its entries are stored as bond orders.
+    @classmethod
+    def from_adj_mat(cls,adj_mat,bond_mat=None,elements=None,atom_types=None):
+        if issparse(adj_mat):
+            A = csr_matrix(adj_mat)
+            A.data = (A.data == 1).astype(float)
+            A.eliminate_zeros()
+            A.sort_indices()
+        else:
+            A = csr_matrix(np.asarray(adj_mat) == 1)
+            A.sort_indices()
+        bond_orders = None
+        if bond_mat is not None:
+            B = bond_mat.toarray() if issparse(bond_mat) else np.asarray(bond_mat)
+            rows = np.repeat(np.arange(A.shape[0]),np.diff(A.indptr))
+            bond_orders = B[rows,A.indices]
+        return cls(A.shape[0],A.indptr,A.indices,bond_orders=bond_orders,elements=elements,atom_types=atom_types)
+
+    # Build from a list of neighbor lists (assumed symmetric)
+    @classmethod
+    def from_adj_list(cls,adj_list,elements=None,atom_types=None):
+        indptr  = np.zeros(len(adj_list)+1,dtype=np.int64)
+        indptr[1:] = np.cumsum([ len(i) for i in adj_list ])
+        indices = np.array([ j for i in adj_list for j in sorted(i) ],dtype=np.int64)
+        return cls(len(adj_list),indptr,indices,elements=elements,atom_types=atom_types)
+
+    # Build from a list of (i,j) bonds (each bond listed once) and optional bond orders
+    @classmethod
+    def from_bonds(cls,N,bonds,bond_orders=None,elements=None,atom_types=None):
+        bonds = np.asarray(bonds,dtype=np.int64).reshape(-1,2)
+        rows  = np.concatenate((bonds[:,0],bonds[:,1]))
+        cols  = np.concatenate((bonds[:,1],bonds[:,0]))
+        if bond_orders is None:
+            data = np.ones(len(rows))
+        else:
+            data = np.concatenate((bond_orders,bond_orders)).astype(float)
+        A = csr_matrix((data,(rows,cols)),shape=(N,N))
+        A.sum_duplicates()
+        A.sort_indices()
+        return cls(N,A.indptr,A.indices,bond_orders=None if bond_orders is None else A.data,elements=elements,atom_types=atom_types)
+
+# Returns adj_mat as a MolGraph (no-op if it already is one)
+def as_graph(adj_mat):
+    if isinstance(adj_mat,MolGraph):
+        return adj_mat
+    return MolGraph.from_adj_mat(adj_mat)
+
+# Returns adj_mat as a dense numpy adjacency matrix (for functions that still need one)
+def as_adj_mat(adj_mat):
+    if isinstance(adj_mat,MolGraph):
+        return adj_mat.to_adj_mat()
+    return adj_mat
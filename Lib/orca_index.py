@@ -0,0 +1,192 @@
+#!/bin/env python
+
+import os,json,fnmatch,hashlib
+
+# Description: Persistent index of ORCA output status. Each output is read once: the bytes read so far
+#              are remembered, and when the file grows (new size/mtime) only the new part is read. For
+#              each output the index records whether ORCA terminated normally, whether a geometry
+#              optimization converged, and the number of completed optimization runs (the relaxed
+#              scan steps finished so far, counted like dihedral_restart.number_complete) along with
+#              the number of scan steps requested in the matching .in file. The manifest is a JSON
+#              file (orca_index.json in the run directory by default) keyed by path relative to root.
+#              A grown output is only treated as appended to if it is the same file (inode) and the
+#              bytes already read are unchanged (hashes of the first and last blocks before the stored
+#              offset), so a rewritten or resubmitted output that ended up larger is rescanned from 0.
+#
+# Usage:       index = OrcaIndex(c["run_dir"])
+#              index.status("KEY/Intra/geoopt/geoopt.out")["converged"]
+#              index.incomplete_scans("KEY")            # flexible dihedral scans that need a restart
+#              index.save()
+class OrcaIndex(object):
+
+    version = 2
+
+    def __init__(self,root='.',manifest=None):
+        self.root     = os.path.abspath(root)
+        self.manifest = manifest if manifest is not None else os.path.join(self.root,"orca_index.json")
+        self.records  = {}
+        self.checks   = {}
+        self.modified = False
+        self.load()
+
+    def __len__(self):
+        return len(self.records)
+
+    # Reads the manifest (a missing, unreadable or outdated manifest starts a new index)
+    def load(self):
+        if os.path.isfile(self.manifest) is False:
+            return
+        try:
+            with open(self.manifest,'r') as f:
+                data = json.load(f)
+        except (IOError,OSError,ValueError):
+            return
+        if data.get("version") != self.version:
+            return
+        self.records = data.get("records",{})
+        self.checks  = data.get("checks",{})
+
+    # Writes the manifest if anything changed. Failure to write (e.g., read-only folder) is not fatal.
+    def save(self):
+        if self.modified is False:
+            return
+        try:
+            tmp = self.manifest+".tmp"
+            with open(tmp,'w') as f:
+                json.dump({"version":self.version,"records":self.records,"checks":self.checks},f)
+            os.replace(tmp,self.manifest)
+            self.modified = False
+        except (IOError,OSError):
+            pass
+
+    # Returns the manifest key for a path
+    def key(self,path):
+        return os.path.relpath(os.path.abspath(path),self.root)
+
+    # Returns the (updated) record for an ORCA output. A missing output returns a record with exists=False.
+    def status(self,path):
+        key = self.key(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return { "exists":False, "terminated":False, "converged":False, "opt_runs":0, "scan_steps":None }
+
+        record = self.records.get(key)
+        if record is not None and record["size"] == st.st_size and record["mtime"] == st.st_mtime:
+            return record
+
+        # Start over if the file is new or was rewritten (shrank, replaced or the part already read changed), otherwise
+        # continue from the stored offset
+        if record is None or st.st_size < record["offset"] or record["inode"] != st.st_ino or record["check"] != read_check(path,record["offset"]):
+            record = { "exists":True, "offset":0, "terminated":False, "converged":False, "opt_runs":0, "scan_steps":scan_steps(path) }
+        record = dict(record)
+        scan_output(path,record)
+        record["size"]  = st.st_size
+        record["mtime"] = st.st_mtime
+        record["inode"] = st.st_ino
+        record["check"] = read_check(path,record["offset"])
+        self.records[key] = record
+        self.modified = True
+        return record
+
+    # Returns the ORCA outputs below folder matching pattern, skipping paths that contain one of the
+    # folder names in exclude
+    def outputs(self,folder,pattern="*.out",exclude=[]):
+        return sorted([ os.path.join(dp,f) for dp,dn,fn in os.walk(folder) for f in fn if fnmatch.fnmatch(f,pattern) and\
+                        True not in [ i in dp.split(os.sep) for i in exclude ] ])
+
+    # Returns the outputs below folder that haven't terminated normally
+    def incomplete(self,folder,pattern="*.out",exclude=[]):
+        return [ i for i in self.outputs(folder,pattern,exclude) if self.status(i)["terminated"] is False ]
+
+    # Returns True if every *geoopt*/geoopt.out of the model compound exists and converged, False if
+    # any didn't, and None if no *geoopt* folder was found
+    def geoopt_converged(self,inchi):
+        intra = os.path.join(inchi,"Intra")
+        folders = [ os.path.join(intra,i) for i in os.listdir(intra) if os.path.isdir(os.path.join(intra,i)) and fnmatch.fnmatch(i,"*geoopt*") ] if os.path.isdir(intra) else []
+        if len(folders) == 0:
+            return None
+        return False not in [ self.status(os.path.join(i,"geoopt.out"))["converged"] for i in folders ]
+
+    # Returns (folder,base_name) for the flexible dihedral scans (scan-forward/scan-reverse folders)
+    # below folder whose output did not terminate normally (same selection as dihedral_restart)
+    def incomplete_scans(self,folder):
+        incomplete = []
+        for dp,dn,fn in os.walk(folder):
+            for d in dn:
+                if d not in ["scan-forward","scan-reverse"]:
+                    continue
+                scan = os.path.join(dp,d)
+                out  = next( (j for j in os.listdir(scan) if j.split('.')[-1] == "out"),None )
+                if out is None:
+                    continue
+                if self.status(os.path.join(scan,out))["terminated"] is False:
+                    incomplete += [(scan,'.'.join(out.split('.')[:-1]))]
+        return sorted(incomplete)
+
+    # Returns a fingerprint of the (path,size,mtime) of the outputs. Used with check()/record_check()
+    # to skip an expensive check when none of its inputs changed.
+    def fingerprint(self,paths):
+        h = hashlib.sha1()
+        for i in sorted(paths):
+            try:
+                st = os.stat(i)
+                h.update("{} {} {}\n".format(self.key(i),st.st_size,st.st_mtime).encode())
+            except OSError:
+                h.update("{} missing\n".format(self.key(i)).encode())
+        return h.hexdigest()
+
+    # Returns the result recorded for the named check if its fingerprint matches, else None
+    def check(self,name,fingerprint):
+        if name in self.checks and self.checks[name]["fingerprint"] == fingerprint:
+            return self.checks[name]["result"]
+        return None
+
+    # Records the result of the named check for the fingerprint
+    def record_check(self,name,fingerprint,result):
+        self.checks[name] = { "fingerprint":fingerprint, "result":result }
+        self.modified = True
+
+# Reads an ORCA output from record["offset"] and updates the status fields of record in place. Only
+# complete lines are consumed so that a partially written line is reread on the next update.
+def scan_output(path,record):
+    with open(path,'rb') as f:
+        f.seek(record["offset"])
+        data = f.read()
+    end = data.rfind(b"\n")
+    if end == -1:
+        return record
+    for lines in data[:end+1].decode('utf-8','replace').split("\n"):
+        if "****ORCA TERMINATED NORMALLY****" in lines:
+            record["terminated"] = True
+        elif "THE OPTIMIZATION HAS CONVERGED" in lines:
+            record["converged"] = True
+        elif "*** OPTIMIZATION RUN DONE ***" in lines and len(lines.split()) == 5:
+            record["opt_runs"] += 1
+    record["offset"] += end+1
+    return record
+
+# Returns a hash of the first and last blocks of the first offset bytes of a file (the part of an output that has been read)
+def read_check(path,offset,block=4096):
+    h = hashlib.sha1()
+    try:
+        with open(path,'rb') as f:
+            h.update(f.read(min(block,offset)))
+            f.seek(max(0,offset-block))
+            h.update(f.read(offset-max(0,offset-block)))
+    except (IOError,OSError):
+        return None
+    return h.hexdigest()
+
+# Returns the number of relaxed scan steps requested in the .in file that matches an output (None if
+# the input is missing or isn't a scan). Parsed like dihedral_restart.pre_process.
+def scan_steps(path):
+    name = '.'.join(path.split('.')[:-1])+'.in'
+    if os.path.isfile(name) is False:
+        return None
+    with open(name,'r') as f:
+        for lines in f:
+            fields = lines.split()
+            if len(fields) == 9 and fields[0] == "D":
+                return int(fields[8].strip('.'))
+    return None
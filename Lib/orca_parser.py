@@ -0,0 +1,212 @@
+#!/bin/env python
+
+import os,pickle
+import numpy as np
+
+# Description: Single-pass parser for ORCA outputs. The output is streamed once and every quantity used by the
+#              fitting scripts is collected on the way: single point and MP2 energies, relaxed surface scan
+#              steps, cartesian geometries, CHELPG charges, dipole/quadrupole moments, isotropic
+#              polarizabilities and the termination/convergence status. Each record is tagged with the job
+#              (multi-job "$new_job" inputs) and the relaxed scan step it belongs to so that callers can pick
+#              the part of the run they need without re-reading the file. Results are returned as numpy
+#              arrays (atomic units / Angstroms, as printed by ORCA). With cache=True the parsed results are
+#              kept in .<name>.parsed next to the output and reused while the output is unchanged.
+#
+# Usage:       data = parse_orca("geoopt.out")
+#              data["terminated"]                              # ORCA terminated normally
+#              data["energies"][-1]                            # last FINAL SINGLE POINT ENERGY (Hartree)
+#              data["chelpg"][0]                               # charges of the first CHELPG block
+#              steps = relaxed_scan(data)                      # [ {"geo","elements","DFT","MP2"}, ... ]
+class OrcaParser(object):
+
+    version = 1
+
+    def __init__(self):
+        self.terminated = False
+        self.converged  = False
+        self.N_jobs     = 1
+        self.job        = 0           # number of "JOB NUMBER" banners read so far
+        self.step       = -1          # index of the current relaxed scan step (counted over the whole file)
+        self.scan_atoms = None
+        self.elements   = None
+        self.records    = { i:[] for i in ["geometries","energies","mp2","chelpg","dipole","dipole_debye","quadrupole","polarizability"] }
+        self.tags       = { i:[] for i in self.records }
+        self.step_job   = []
+        self.state      = None        # (block being read, lines left/read, buffer)
+
+    # Appends a record and its (job,step) tag
+    def add(self,name,value):
+        self.records[name] += [value]
+        self.tags[name]    += [(self.job,self.step)]
+
+    # Consumes one line of output
+    def feed(self,lines):
+
+        # Multi-line blocks
+        if self.state is not None:
+            block,count,buf = self.state
+            fields = lines.split()
+            if block == "scan":
+                try:
+                    self.scan_atoms = [ int(i) for i in lines.split("=")[0].split(">")[1].split()[1:] ]
+                except (IndexError,ValueError):
+                    pass
+                self.state = None
+            elif block == "geo":
+                if len(fields) == 1 and count == 0:
+                    self.state = (block,1,buf)
+                elif len(fields) == 4:
+                    buf += [fields]
+                else:
+                    if self.elements is None:
+                        self.elements = [ i[0] for i in buf ]
+                    self.add("geometries",np.array([ [ float(j) for j in i[1:] ] for i in buf ]))
+                    self.state = None
+            elif block == "chelpg":
+                if count == 0:
+                    self.state = (block,1,buf)
+                elif len(fields) == 4 and fields[2] == ":":
+                    buf += [float(fields[3])]
+                else:
+                    self.add("chelpg",np.array(buf))
+                    self.state = None
+            elif block == "dipole":
+                if len(fields) == 4 and fields[0] == "Magnitude" and fields[1] == "(Debye)":
+                    self.add("dipole_debye",float(fields[3]))
+                    self.state = None
+            elif block == "quadrupole":
+                if count == 5:
+                    Q = np.zeros([3,3])
+                    Q[0,:] = [float(fields[1]),float(fields[4]),float(fields[5])]
+                    Q[1,:] = [float(fields[4]),float(fields[2]),float(fields[6])]
+                    Q[2,:] = [float(fields[5]),float(fields[6]),float(fields[3])]
+                    self.add("quadrupole",Q)
+                    self.state = None
+                else:
+                    self.state = (block,count+1,buf)
+            if block != "dipole":
+                return
+
+        if "FINAL SINGLE POINT ENERGY" in lines:
+            self.add("energies",float(lines.split()[4]))
+        elif "MP2 TOTAL ENERGY" in lines:
+            self.add("mp2",float(lines.split()[3]))
+        elif "CARTESIAN COORDINATES (ANGSTROEM)" in lines:
+            self.state = ("geo",0,[])
+        elif "RELAXED SURFACE SCAN STEP" in lines:
+            self.step += 1
+            self.step_job += [self.job]
+        elif "JOB NUMBER" in lines:
+            self.job += 1
+        elif "JOBS TO BE PROCESSED THIS RUN" in lines:
+            self.N_jobs = int(lines.split()[3])
+        elif "%" in lines and "%geom scan" in lines.lower():
+            self.state = ("scan",0,None)
+        elif "****ORCA TERMINATED NORMALLY****" in lines:
+            self.terminated = True
+        elif "THE OPTIMIZATION HAS CONVERGED" in lines:
+            self.converged = True
+        else:
+            fields = lines.split()
+            if len(fields) == 2 and fields[0] == "CHELPG" and fields[1] == "Charges":
+                self.state = ("chelpg",0,[])
+            elif len(fields) == 7 and fields[0] == "Total" and fields[1] == "Dipole" and fields[2] == "Moment":
+                self.add("dipole",np.array([ float(i) for i in fields[4:7] ]))
+            elif len(fields) >= 2 and fields[0] == "DIPOLE" and fields[1] == "MOMENT":
+                self.state = ("dipole",0,None)
+            elif len(fields) == 3 and fields[0] == "QUADRUPOLE" and fields[1] == "MOMENT" and fields[2] == "(A.U.)":
+                self.state = ("quadrupole",0,None)
+            elif len(fields) >= 4 and fields[0] == "Isotropic" and fields[1] == "polarizability":
+                self.add("polarizability",float(fields[3]))
+
+    # Returns the results as a dictionary of numpy arrays. For each quantity X the arrays X_job and X_step hold the job
+    # number and relaxed scan step of each record (-1 before the first scan step).
+    def results(self):
+
+        # Flush a block that runs to the end of the file
+        if self.state is not None and self.state[0] in ["geo","chelpg"]:
+            self.feed("\n")
+
+        data = { "terminated":self.terminated, "converged":self.converged, "N_jobs":self.N_jobs, "N_job_banners":self.job,\
+                 "scan_atoms":self.scan_atoms, "elements":self.elements, "step_job":np.array(self.step_job,dtype=int) }
+        for i in self.records:
+            if i in ["geometries","chelpg"]:
+                data[i] = stack(self.records[i])
+            else:
+                data[i] = np.array(self.records[i],dtype=float)
+            tags = np.array(self.tags[i],dtype=int).reshape(-1,2)
+            data[i+"_job"]  = tags[:,0]
+            data[i+"_step"] = tags[:,1]
+        return data
+
+# Stacks a list of equally shaped arrays (a list is returned if the shapes differ, e.g., geometries of different jobs)
+def stack(arrays):
+    if len(set([ i.shape for i in arrays ])) > 1:
+        return arrays
+    return np.array(arrays,dtype=float)
+
+# Returns the parsed results of an ORCA output (see OrcaParser.results). Results are reused within a process while the
+# file is unchanged. With cache the results are also kept in .<name>.parsed next to the output (failure to read or write
+# the cache is not fatal).
+def parse_orca(output_file,cache=False):
+    if not hasattr(parse_orca,"results"):
+        parse_orca.results = {}
+    st  = os.stat(output_file)
+    key = (os.path.abspath(output_file),st.st_size,st.st_mtime)
+    if key in parse_orca.results:
+        return parse_orca.results[key]
+
+    data = None
+    name = os.path.join(os.path.dirname(key[0]),".{}.parsed".format(os.path.basename(output_file)))
+    if cache is True and os.path.isfile(name):
+        try:
+            with open(name,'rb') as f:
+                header,data = pickle.load(f)
+            if header != (OrcaParser.version,st.st_size,st.st_mtime):
+                data = None
+        except Exception:
+            data = None
+
+    if data is None:
+        parser = OrcaParser()
+        with open(output_file,'r',errors='replace') as f:
+            for lines in f:
+                parser.feed(lines)
+        data = parser.results()
+        if cache is True:
+            try:
+                with open(name+".tmp",'wb') as f:
+                    pickle.dump(((OrcaParser.version,st.st_size,st.st_mtime),data),f,protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(name+".tmp",name)
+            except (IOError,OSError):
+                pass
+
+    parse_orca.results = { i:parse_orca.results[i] for i in parse_orca.results if i[0] != key[0] }
+    parse_orca.results[key] = data
+    return data
+
+# Returns True if the output exists and ORCA terminated normally
+def terminated(output_file):
+    return os.path.isfile(output_file) and parse_orca(output_file)["terminated"]
+
+# Returns the relaxed surface scan of a parsed output as a list of dictionaries (one per step) holding the last geometry
+# ("geo"), the elements, and the last single point ("DFT") and MP2 ("MP2", if present) energies of the step in Hartree.
+# When the run has several jobs only the steps from the second job onward are returned (the first job is a preliminary
+# relaxation/scan).
+def relaxed_scan(data):
+    first_job = 0 if data["N_jobs"] == 1 else 2
+    steps = [ i for i in range(len(data["step_job"])) if data["step_job"][i] >= first_job ]
+    scan  = []
+    for i in steps:
+        step = {}
+        for name,label in [("geometries","geo"),("energies","DFT"),("mp2","MP2")]:
+            ind = np.where(data[name+"_step"] == i)[0]
+            if len(ind) > 0:
+                step[label] = np.array(data[name][ind[-1]])
+        if "geo" in step:
+            step["elements"] = list(data["elements"])
+        for i in ["DFT","MP2"]:
+            if i in step:
+                step[i] = float(step[i])
+        scan += [step]
+    return scan
@@ -0,0 +1,345 @@
+#!/bin/env python
+
+import os,sqlite3
+
+# Description: Indexed store for the parameters of a TAFFI force-field file (*.db text format). Each
+#              definition is kept in a SQLite table for its mode (atoms, charges, vdw, bonds, angles,
+#              dihedrals, impropers) keyed by interned atom type ids plus the style, so keyed lookups
+#              and merges only touch the entries involved. Lines with other keywords are kept in order
+#              so that a file can be exported again. The text files remain the format exchanged
+#              between the scripts; load_store() keeps a cached store next to each file
+#              (.<name>.sqlite, rebuilt when the file's size/mtime change) so that the text is only
+#              parsed once.
+#
+# Usage:       store = load_store(c["ff"])
+#              for fields in store.lines(): ...                  # same tokens as lines.split() on the file
+#              store.get("bonds",("[6[1]]","[1[6]]"),"harmonic")  # keyed lookup (fields after the keyword)
+#              added,updated = store.merge(load_store("new.db",cache=False),replace=True)
+#              store.export_db("TAFFI.db")
+class ParamStore(object):
+
+    version  = 1
+
+    # table: (keywords, number of atom types in the key, the key includes the style)
+    sections = { "atoms":     (["atom"],1,False),
+                 "charges":   (["charge"],1,False),
+                 "vdw":       (["vdw"],2,True),
+                 "bonds":     (["bond"],2,True),
+                 "angles":    (["angle"],3,True),
+                 "dihedrals": (["dihedral","torsion"],4,True),
+                 "impropers": (["improper"],4,True) }
+
+    # merge_FF mode names and the tables they select
+    modes = { "atom":["atoms"], "charge":["charges"], "vdw":["vdw"], "bond":["bonds"], "angle":["angles"],
+              "dihedral":["dihedrals"], "torsion":["dihedrals"], "improper":["impropers"] }
+
+    def __init__(self,path=":memory:",timeout=600.0):
+        self.path  = path
+        self.conn  = sqlite3.connect(path,timeout=timeout,isolation_level=None)
+        self.ids   = {}
+        self.names = {}
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS types (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS other (line INTEGER, keyword TEXT, params TEXT)")
+        for i in self.sections:
+            N = self.sections[i][1]
+            self.conn.execute("CREATE TABLE IF NOT EXISTS {} ({}, style TEXT, keyword TEXT, params TEXT, line INTEGER, PRIMARY KEY ({}, style))".format(\
+                              i,", ".join([ "t{} INTEGER".format(j) for j in range(N) ]),", ".join([ "t{}".format(j) for j in range(N) ])))
+        self.reload_types()
+
+    def __len__(self):
+        return sum([ self.conn.execute("SELECT COUNT(*) FROM {}".format(i)).fetchone()[0] for i in self.sections ])
+
+    # Rereads the interned types. Other handles on the same file may have added types since this one was opened,
+    # so this is called after taking the write lock and whenever a type is missing from the maps.
+    def reload_types(self):
+        self.ids   = {}
+        self.names = {}
+        for i,j in self.conn.execute("SELECT id,name FROM types"):
+            self.ids[j]   = i
+            self.names[i] = j
+
+    # Returns the interned id of an atom type (adding it if new, or reading the id added by another handle)
+    def type_id(self,name):
+        if name not in self.ids:
+            self.conn.execute("INSERT OR IGNORE INTO types (name) VALUES (?)",(name,))
+            i = self.conn.execute("SELECT id FROM types WHERE name=?",(name,)).fetchone()[0]
+            self.ids[name] = i
+            self.names[i]  = name
+        return self.ids[name]
+
+    # Returns the table that a line (list of tokens) is stored in (None for comments, "other" for anything unkeyed)
+    def classify(self,fields):
+        if len(fields) == 0 or fields[0][0] == "#":
+            return None
+        keyword = fields[0].lower()
+        for i in self.sections:
+            keywords,N,style = self.sections[i]
+            if keyword in keywords and len(fields) >= 1+N+int(style):
+                return i
+        return "other"
+
+    # Returns the value of a meta key (None if missing)
+    def meta(self,key):
+        value = self.conn.execute("SELECT value FROM meta WHERE key=?",(key,)).fetchone()
+        return None if value is None else value[0]
+
+    def set_meta(self,key,value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)",(key,str(value)))
+
+    # Reads a force-field text file into the store. Definitions are inserted in file order so that a later
+    # definition of the same key replaces an earlier one (as in the dictionary-based parsers). The
+    # leading comment block is kept as the header for export_db.
+    def import_db(self,FF_file,transaction=True):
+        if transaction is True:
+            self.conn.execute("BEGIN IMMEDIATE")
+        self.reload_types()
+        rows   = { i:[] for i in self.sections }
+        other  = []
+        header = []
+        offset = self.conn.execute("SELECT MAX(line) FROM (SELECT MAX(line) AS line FROM other UNION ALL {})".format(\
+                                   " UNION ALL ".join([ "SELECT MAX(line) FROM {}".format(i) for i in self.sections ]))).fetchone()[0]
+        offset = 0 if offset is None else offset+1
+        with open(FF_file,'r') as f:
+            for lc,lines in enumerate(f):
+                fields = lines.split()
+                if len(header) == lc and len(lines) > 0 and lines[0] == "#":
+                    header += [lines]
+                table = self.classify(fields)
+                if table is None:
+                    continue
+                elif table == "other":
+                    other += [(offset+lc,fields[0]," ".join(fields[1:]))]
+                    continue
+                N,style = self.sections[table][1:]
+                rows[table] += [tuple([ self.type_id(j) for j in fields[1:N+1] ])+\
+                               (fields[N+1] if style else "",fields[0]," ".join(fields[N+1+int(style):]),offset+lc)]
+        for i in self.sections:
+            if len(rows[i]) > 0:
+                self.conn.executemany("INSERT OR REPLACE INTO {} VALUES ({})".format(i,",".join(["?"]*len(rows[i][0]))),rows[i])
+        if len(other) > 0:
+            self.conn.executemany("INSERT INTO other VALUES (?,?,?)",other)
+        if self.meta("header") is None:
+            self.set_meta("header","".join(header))
+        if transaction is True:
+            self.conn.execute("COMMIT")
+        return self
+
+    # Removes all definitions (the interned types are kept)
+    def clear(self):
+        for i in list(self.sections.keys())+["other","meta"]:
+            self.conn.execute("DELETE FROM {}".format(i))
+
+    # Records the size/mtime of the text file that the store mirrors
+    def set_source(self,FF_file):
+        st = os.stat(FF_file)
+        self.set_meta("version",self.version)
+        self.set_meta("source","{} {}".format(st.st_size,st.st_mtime))
+
+    # Returns True if the store mirrors the current version of FF_file
+    def fresh(self,FF_file):
+        try:
+            st = os.stat(FF_file)
+        except OSError:
+            return False
+        return self.meta("version") == str(self.version) and self.meta("source") == "{} {}".format(st.st_size,st.st_mtime)
+
+    # Returns a row of a keyed table as the tokens that followed the keyword in the text file
+    def fields(self,table,row):
+        N,style = self.sections[table][1:]
+        if False in [ i in self.names for i in row[:N] ]:
+            self.reload_types()
+        return [ self.names[i] for i in row[:N] ] + ([row[N]] if style else []) + row[N+1].split()
+
+    # Returns the definitions as token lists ([keyword]+tokens, i.e., lines.split()) in file order
+    def lines(self):
+        rows = []
+        for i in self.sections:
+            N = self.sections[i][1]
+            rows += [ (j[-1],[j[N+1]]+self.fields(i,j[:N+1]+(j[N+2],))) for j in self.conn.execute("SELECT * FROM {}".format(i)) ]
+        rows += [ (j[0],[j[1]]+j[2].split()) for j in self.conn.execute("SELECT line,keyword,params FROM other") ]
+        return [ i[1] for i in sorted(rows,key=lambda x: x[0]) ]
+
+    # Keyed lookup: returns the tokens of the definition of types (and style, if the table is keyed on one)
+    # or None if it isn't defined. When style is None the first definition with any style is returned.
+    def get(self,table,types,style=None):
+        if isinstance(types,str):
+            types = [types]
+        if False in [ i in self.ids for i in types ]:
+            self.reload_types()
+        if False in [ i in self.ids for i in types ]:
+            return None
+        N = self.sections[table][1]
+        query = "SELECT {}, style, params FROM {} WHERE {}".format(", ".join([ "t{}".format(j) for j in range(N) ]),table," AND ".join([ "t{}=?".format(j) for j in range(N) ]))
+        args  = [ self.ids[i] for i in types ]
+        if style is not None:
+            query += " AND style=?"
+            args  += [style]
+        row = self.conn.execute(query+" ORDER BY line LIMIT 1",args).fetchone()
+        return None if row is None else self.fields(table,row)
+
+    # Returns the definitions in the dictionary format used by merge_FF/paramgen/extract_vdw
+    # ({"atoms":{},"bonds":{},"angles":{},"dihedrals":{},"vdws":{},"charges":{}}, values are the tokens after the keyword)
+    def get_data(self,keep_types=[ "atom", "vdw", "bond", "angle", "torsion", "dihedral", "charge" ],no_ct=False):
+        Data = {"atoms":{},"bonds":{},"angles":{},"dihedrals":{},"vdws":{},"charges":{}}
+        for table,key,N in [ ("atoms","atoms",1), ("charges","charges",1), ("vdw","vdws",3), ("bonds","bonds",3), ("angles","angles",4), ("dihedrals","dihedrals",5) ]:
+            if True not in [ table in self.modes[i] for i in keep_types if i in self.modes ]:
+                continue
+            for row in self.conn.execute("SELECT * FROM {} ORDER BY line".format(table)):
+                fields = self.fields(table,row[:self.sections[table][1]+1]+(row[-2],))
+                if table == "vdw" and no_ct is True and fields[0] != fields[1]:
+                    continue
+                Data[key][fields[0] if N == 1 else tuple(fields[:N])] = fields
+        return Data
+
+    # Merges the definitions of another store (O(number of new definitions)). New keys are added; existing
+    # keys are only replaced when replace is True. keep_types restricts the merge to merge_FF mode names.
+    # With no_ct the vdw cross terms are not merged and, if anything changed, are removed from this store
+    # (as merge_FF does). Returns the number of added and updated definitions. With commit=False the
+    # transaction is left open so that the caller can commit once the text file has been written (or roll back).
+    def merge(self,new,keep_types=None,replace=False,no_ct=False,commit=True):
+        tables = list(self.sections.keys()) if keep_types is None else\
+                 [ i for i in self.sections if True in [ i in self.modes[j] for j in keep_types if j in self.modes ] ]
+        added   = 0
+        updated = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.reload_types()
+            new.reload_types()
+            line = self.conn.execute("SELECT MAX(line) FROM (SELECT MAX(line) AS line FROM other UNION ALL {})".format(\
+                                     " UNION ALL ".join([ "SELECT MAX(line) FROM {}".format(i) for i in self.sections ]))).fetchone()[0]
+            line = 0 if line is None else line+1
+            for i in tables:
+                N   = self.sections[i][1]
+                key = " AND ".join([ "t{}=?".format(j) for j in range(N) ]+["style=?"])
+                for row in new.conn.execute("SELECT * FROM {} ORDER BY line".format(i)):
+                    names = [ new.names[j] for j in row[:N] ]
+                    if no_ct is True and i == "vdw" and names[0] != names[1]:
+                        continue
+                    values = tuple([ self.type_id(j) for j in names ])+row[N:-1]+(line,)
+                    exists = self.conn.execute("SELECT 1 FROM {} WHERE {}".format(i,key),values[:N+1]).fetchone() is not None
+                    if exists is False:
+                        added += 1
+                    elif replace is True:
+                        updated += 1
+                    else:
+                        continue
+                    self.conn.execute("INSERT OR REPLACE INTO {} VALUES ({})".format(i,",".join(["?"]*len(values))),values)
+                    line += 1
+            if no_ct is True and added+updated > 0:
+                self.conn.execute("DELETE FROM vdw WHERE t0 != t1")
+            if commit is True:
+                self.conn.execute("COMMIT")
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+        return added,updated
+
+    # Writes the store in the TAFFI text format (see write_db). Definitions with keywords outside of the
+    # standard sections (e.g., impropers) are appended after the charges.
+    def export_db(self,FF_file,header=None):
+        if header is None:
+            header = self.meta("header")
+        extra = [ i for i in self.lines() if self.classify(i) in ["impropers","other"] ]
+        write_db(self.get_data(),FF_file,header=header,extra=extra)
+
+    def close(self):
+        self.conn.close()
+
+# Returns the ParamStore of a force-field text file. With cache the store is kept in .<name>.sqlite next
+# to the file and is only rebuilt when the file changes (falls back to an in-memory store if the cache
+# can't be written). Stores are also reused within a process while the file is unchanged.
+def load_store(FF_file,cache=True):
+    if not hasattr(load_store,"stores"):
+        load_store.stores = {}
+    st  = os.stat(FF_file)
+    key = (os.path.abspath(FF_file),st.st_size,st.st_mtime)
+    if key in load_store.stores:
+        return load_store.stores[key]
+
+    store = None
+    if cache is True:
+        try:
+            store = ParamStore(os.path.join(os.path.dirname(os.path.abspath(FF_file)),".{}.sqlite".format(os.path.basename(FF_file))))
+            if store.fresh(FF_file) is False:
+                store.conn.execute("BEGIN IMMEDIATE")
+                if store.fresh(FF_file) is False:
+                    store.clear()
+                    store.import_db(FF_file,transaction=False)
+                    store.set_source(FF_file)
+                store.conn.execute("COMMIT")
+
+            # Another handle may have imported the file after this one read the types
+            store.reload_types()
+        except (sqlite3.Error,OSError):
+            store = None
+    if store is None:
+        store = ParamStore().import_db(FF_file)
+    load_store.stores = { i:load_store.stores[i] for i in load_store.stores if i[0] != key[0] }
+    load_store.stores[key] = store
+    return store
+
+# Writes a force-field dictionary (the get_data format) in the TAFFI text format: the header, followed by
+# the atom, vdw, bond, angle, dihedral and charge sections (each sorted by key) and any extra token lists.
+def write_db(Data,FF_file,header=None,extra=[]):
+
+    with open(FF_file,'w') as f:
+
+        # Copy header
+        if header is not None:
+            f.write(header)
+
+        # Write atom type definitions
+        f.write("\n\n# Atom type definitions\n#\n{:<10s} {:<60s} {:<59s} {:<20s} {:<6s}\n"\
+                .format("#","Atom_type","Label","Mass", "Mol_ID"))
+        for i in sorted(Data["atoms"].keys()):
+            if len(Data["atoms"][i]) > 3:
+                f.write("{:<10s} {:<60s} {:<59s} {:<20s} {:<s}\n"\
+                        .format("atom",Data["atoms"][i][0],Data["atoms"][i][1],Data["atoms"][i][2],Data["atoms"][i][3]))
+            elif len(Data["atoms"][i]) == 3:
+                f.write("{:<10s} {:<60s} {:<59s} {:<20s}\n"\
+                        .format("atom",Data["atoms"][i][0],Data["atoms"][i][1],Data["atoms"][i][2]))
+
+        # Write VDW definitions
+        f.write("\n# VDW definitions\n#\n{:<10s} {:<60s} {:<60s} {:<15s} {:<41s} {:<6s}\n"\
+                .format("#","Atom_type","Atom_type","Potential","params (style determines #args)","Mol_ID"))
+        for i in sorted(Data["vdws"].keys()):
+            f.write("{:<10s} {:<60s} {:<60s} {:<15s} {} {:<s}\n"\
+                    .format("vdw",Data["vdws"][i][0],Data["vdws"][i][1],Data["vdws"][i][2]," ".join([ "{:<20s}".format(j) for j in Data["vdws"][i][3:-1] ]),Data["vdws"][i][-1]))
+
+        # Write bond definitions
+        f.write("\n# Bond type definitions\n#\n{:<10s} {:<40s} {:<40s} {:<15s} {:<41s} {:<6s}\n".format("#","Atom_type","Atom_type","style","params (style determines #args)","Mol_ID"))
+        for i in sorted(Data["bonds"].keys()):
+            f.write("{:<10s} {:<40s} {:<40s} {:<15s} {} {:<s}\n"\
+                    .format("bond",Data["bonds"][i][0],Data["bonds"][i][1],Data["bonds"][i][2]," ".join([ "{:<20s}".format(j) for j in Data["bonds"][i][3:-1] ]),Data["bonds"][i][-1]))
+
+        # Write angle definitions
+        f.write("\n# Angle type definitions\n#\n{:<10s} {:<40s} {:<40s} {:<40s} {:<15s} {:<41s} {:<6s}\n"\
+                .format("#","Atom_type","Atom_type","Atom_type","style","params (style determines #args)","Mol_ID"))
+        for i in sorted(Data["angles"].keys()):
+            f.write("{:<10s} {:<40s} {:<40s} {:<40s} {:<15s} {} {:<s}\n"\
+                    .format("angle",Data["angles"][i][0],Data["angles"][i][1],Data["angles"][i][2],Data["angles"][i][3],\
+                            " ".join([ "{:<20s}".format(j) for j in Data["angles"][i][4:-1] ]),Data["angles"][i][-1]))
+
+        # Write dihedral definitions
+        f.write("\n# Dihedral/Torsional type definitions\n#\n{:<10s} {:<40s} {:<40s} {:<40s} {:<40s} {:<15s} {:<83s} {:<6s}\n"\
+                .format("#","Atom_type","Atom_type","Atom_type","Atom_type","style","params (style determines #args)","Mol_ID"))
+        for i in sorted(Data["dihedrals"].keys()):
+            f.write("{:<10s} {:<40s} {:<40s} {:<40s} {:<40s} {:<15s} {} {:<s}\n"\
+                    .format("torsion",Data["dihedrals"][i][0],Data["dihedrals"][i][1],Data["dihedrals"][i][2],Data["dihedrals"][i][3],Data["dihedrals"][i][4],\
+                            " ".join([ "{:<20s}".format(j) for j in Data["dihedrals"][i][5:-1] ]),Data["dihedrals"][i][-1]))
+
+        # Write charge definitions
+        f.write("\n# Charge definitions\n#\n{:<10s} {:<61s} {:<6s}\n".format("#","Atom_type","Charge","Mol_ID"))
+        for i in sorted(Data["charges"].keys()):
+            if len(Data["charges"][i]) > 2:
+                f.write("{:<10s} {:<60s} {:<20s} {:<20s}\n".format("charge",Data["charges"][i][0],Data["charges"][i][1],Data["charges"][i][2]))
+            elif len(Data["charges"][i]) == 2:
+                f.write("{:<10s} {:<60s} {:<20s}\n".format("charge",Data["charges"][i][0],Data["charges"][i][1]))
+
+        # Write any other definitions
+        if len(extra) > 0:
+            f.write("\n# Other definitions\n")
+            for i in extra:
+                f.write("{}\n".format(" ".join(i)))
+    return
@@ -21,11 +21,12 @@ def parse_configuration(args): #parse config.txt
                  "PARAM_GEOOPT_PROCS", "PARAM_GEOOPT_WT", "PARAM_GEOOPT_Q", "PARAM_GEOOPT_SCHED", "PARAM_GEOOPT_PPN", "PARAM_GEOOPT_SIZE",\
                  "PARAM_BA_PROCS", "PARAM_BA_WT", "PARAM_BA_Q", "PARAM_BA_SCHED", "PARAM_BA_PPN", "PARAM_BA_SIZE",\
                  "PARAM_D_PROCS", "PARAM_D_WT", "PARAM_D_Q", "PARAM_D_SCHED", "PARAM_D_PPN", "PARAM_D_SIZE",\
-                 "PARAM_FIT_WT", "PARAM_FIT_Q","PARAM_FIT_PPN",\
+                 "PARAM_FIT_WT", "PARAM_FIT_Q","PARAM_FIT_PPN","PARAM_FIT_SCHED",\
                  "CHARGES_MD_PROCS", "CHARGES_MD_WT", "CHARGES_MD_Q", "CHARGES_MD_NPP", "CHARGES_MD_SCHED", "CHARGES_MD_PPN", "CHARGES_MD_SIZE",\
                  "CHARGES_QC_PROCS", "CHARGES_QC_WT", "CHARGES_QC_Q", "CHARGES_QC_SCHED", "CHARGES_QC_PPN", "CHARGES_QC_SIZE",\
                  "VDW_MD_PROCS", "VDW_MD_WT", "VDW_MD_Q", "VDW_MD_NPP", "VDW_MD_SCHED", "VDW_MD_PPN", "VDW_MD_SIZE",\
-                 "VDW_QC_PROCS", "VDW_QC_WT", "VDW_QC_Q", "VDW_QC_SCHED", "VDW_QC_PPN", "VDW_QC_SIZE","ACCOUNT"]
+                 "VDW_QC_PROCS", "VDW_QC_WT", "VDW_QC_Q", "VDW_QC_SCHED", "VDW_QC_PPN", "VDW_QC_SIZE","ACCOUNT",\
+                 "PARAM_MAX_JOBS", "CHARGES_MAX_JOBS", "VDW_MAX_JOBS", "QC_CACHE", "CHARGES_FIT_BATCH"]
     keywords = [ _.lower() for _ in keywords ]
 
     list_delimiters = [ "," ]  # values containing any delimiters in this list will be split into lists based on the delimiter
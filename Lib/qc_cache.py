@@ -0,0 +1,297 @@
+#!/bin/env python
+
+import sys,argparse,os,fnmatch,hashlib,json,sqlite3,time,zlib
+
+# Description: Content-addressed cache of ORCA results shared between runs (QC_CACHE in the driver config).
+#              Each calculation is keyed by a hash of its input with the run-specific parts removed: the
+#              elements and coordinates (rounded to 1.0E-4 angstrom), charge, multiplicity, the "!"
+#              keywords (method, basis, job type; PALn is ignored) and the % blocks (%base, %pal and
+#              %maxcore are ignored), for every job of a multi-job ($new_job) input. Completed outputs are
+#              stored with the parsed energies, gradient and CHELPG charges, plus the companion files that
+#              the parsers read (geometries, trajectories, .vpot ESP grids, .engrad, ...) compressed with
+#              zlib. orca_submit.py -cache restores the output of any input that is already in the cache
+#              instead of submitting it, so identical calculations from other model compounds or earlier
+#              batches are never rerun.
+#
+# Usage:       cache = QCCache(c["qc_cache"])
+#              cache.restore("configs/3/3.in")          # True if 3.out (and companions) were written from the cache
+#              cache.store("configs/3/3.in")            # stores 3.out if it terminated normally
+#              cache.ingest(c["run_dir"])               # stores every completed calculation below a folder
+#              python qc_cache.py cache.db add folder   # same from the command line (also restore/stats)
+class QCCache(object):
+
+    version  = 1
+    suffixes = [".xyz",".vpot",".engrad",".dat",".hess",".property.txt"]
+
+    def __init__(self,path,timeout=600.0):
+        self.path = os.path.abspath(path)
+        self.conn = sqlite3.connect(self.path,timeout=timeout,isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version INTEGER, formula TEXT, charge INTEGER, multiplicity INTEGER,"+\
+                          " keywords TEXT, energies TEXT, gradient TEXT, charges TEXT, files BLOB, source TEXT, created REAL)")
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __contains__(self,key):
+        return self.conn.execute("SELECT 1 FROM results WHERE key=?",(key,)).fetchone() is not None
+
+    # Returns the parsed results of a key ({"energies","gradient","charges",...}) or None if it isn't cached
+    def lookup(self,key):
+        row = self.conn.execute("SELECT formula,charge,multiplicity,keywords,energies,gradient,charges,source FROM results WHERE key=?",(key,)).fetchone()
+        if row is None:
+            return None
+        return { "formula":row[0], "charge":row[1], "multiplicity":row[2], "keywords":row[3], "energies":json.loads(row[4]),\
+                 "gradient":json.loads(row[5]), "charges":json.loads(row[6]), "source":row[7] }
+
+    # Stores the output of an ORCA input (name.in -> name.out) if it terminated normally. Returns the key, or None if
+    # there was nothing to store.
+    def store(self,input_file):
+        output = os.path.splitext(input_file)[0]+'.out'
+        if os.path.isfile(output) is False:
+            return None
+        with open(output,'r',errors='replace') as f:
+            content = f.read()
+        if "****ORCA TERMINATED NORMALLY****" not in content:
+            return None
+        key,meta = input_key(input_file)
+        if key is None or key in self:
+            return key
+
+        # Companion files are stored relative to the %base names of the jobs (so they can be renamed on restore). Only
+        # files written after the input are ORCA's, the others (e.g., the typed xyz written next to the vdw inputs)
+        # belong to the run that generated the input.
+        folder = os.path.dirname(os.path.abspath(input_file))
+        files  = { "out":content }
+        bases  = sorted([ (j,count_j) for count_j,j in enumerate(meta["bases"]) ],key=lambda x: -len(x[0]))
+        t_in   = os.path.getmtime(input_file)
+        for i in sorted(os.listdir(folder)):
+            if True not in [ i.endswith(j) for j in self.suffixes ]:
+                continue
+            if os.path.getmtime(os.path.join(folder,i)) <= t_in:
+                continue
+            for j,count_j in bases:
+                if i.startswith(j):
+                    with open(os.path.join(folder,i),'r',errors='replace') as f:
+                        files["{}:{}".format(count_j,i[len(j):])] = f.read()
+                    break
+        results = parse_results(content)
+        self.conn.execute("INSERT OR IGNORE INTO results VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",(key,self.version,meta["formula"],meta["charge"],meta["multiplicity"],\
+                          meta["keywords"],json.dumps(results["energies"]),json.dumps(results["gradient"]),json.dumps(results["charges"]),\
+                          sqlite3.Binary(zlib.compress(json.dumps(files).encode(),6)),os.path.abspath(input_file),time.time()))
+        return key
+
+    # Writes the cached output (and companion files) of an input. Returns True on a cache hit. Existing files in the
+    # folder are never overwritten. The output is written last (through a temporary file) so an interrupted restore
+    # doesn't leave a complete-looking output.
+    def restore(self,input_file):
+        key,meta = input_key(input_file)
+        if key is None:
+            return False
+        row = self.conn.execute("SELECT files FROM results WHERE key=?",(key,)).fetchone()
+        if row is None:
+            return False
+        files  = json.loads(zlib.decompress(row[0]).decode())
+        folder = os.path.dirname(os.path.abspath(input_file))
+        for i in files:
+            if i == "out":
+                continue
+            ind,suffix = i.split(":",1)
+            name = os.path.join(folder,meta["bases"][int(ind)]+suffix) if int(ind) < len(meta["bases"]) else None
+            if name is not None and os.path.exists(name) is False:
+                with open(name,'w') as f:
+                    f.write(files[i])
+        output = os.path.splitext(input_file)[0]+'.out'
+        with open(output+".tmp",'w') as f:
+            f.write(files["out"])
+        os.replace(output+".tmp",output)
+        return True
+
+    # Stores every completed calculation (inputs matching pattern with a finished output) below folder. Returns the number of new entries.
+    def ingest(self,folder,pattern="*.in"):
+        N_0 = len(self)
+        for dp,dn,fn in os.walk(folder):
+            for f in fn:
+                if fnmatch.fnmatch(f,pattern):
+                    try:
+                        self.store(os.path.join(dp,f))
+                    except (IOError,OSError,ValueError):
+                        continue
+        return len(self)-N_0
+
+    def close(self):
+        self.conn.close()
+
+# Exports the cache path to the environment (read by orca_submit.py -cache) so every submission made by the calling
+# script checks the cache. Returns the absolute path (None if no cache is configured).
+def use_cache(path):
+    if path is None:
+        return None
+    os.environ["TAFFI_QC_CACHE"] = os.path.abspath(path)
+    return os.environ["TAFFI_QC_CACHE"]
+
+# Adds the completed calculations below folder to the cache at path (nothing is done if path is None)
+def store_results(path,folder):
+    if path is None:
+        return 0
+    cache = QCCache(path)
+    N = cache.ingest(folder)
+    cache.close()
+    print("Stored {} new calculations from {} in the QC cache {}".format(N,folder,path))
+    return N
+
+# Returns the cache key of an ORCA input and a dictionary with its formula, charge, multiplicity, keywords and the
+# %base name of each job (the input's name when a job has none). Returns (None,None) if the input can't be read or
+# has no geometry.
+def input_key(input_file,decimals=4):
+    try:
+        with open(input_file,'r') as f:
+            content = f.readlines()
+    except (IOError,OSError,UnicodeDecodeError):
+        return None,None
+
+    stem  = os.path.basename(os.path.splitext(input_file)[0])
+    jobs  = [ { "keywords":[], "blocks":[], "geo":[], "charge":None, "multiplicity":None } ]
+    bases = [ None ]
+    geo_flag   = 0
+    block_flag = None
+    for lines in content:
+        lines  = lines.split('#')[0]
+        fields = lines.split()
+        if len(fields) == 0:
+            continue
+        if fields[0].lower() == "$new_job":
+            jobs  += [ { "keywords":[], "blocks":[], "geo":[], "charge":None, "multiplicity":None } ]
+            bases += [ None ]
+            continue
+
+        # Geometry block
+        if geo_flag == 1:
+            if fields[0] == "*":
+                geo_flag = 0
+            elif len(fields) >= 4:
+                jobs[-1]["geo"] += [ [fields[0].capitalize()] + [ "{:.{}f}".format(float(j)+0.0,decimals).replace("-0."+"0"*decimals,"0."+"0"*decimals) for j in fields[1:4] ] ]
+            continue
+        if fields[0] == "*" and len(fields) >= 4 and fields[1].lower() in ["xyz","xyzfile"]:
+            jobs[-1]["charge"],jobs[-1]["multiplicity"] = int(fields[2]),int(fields[3])
+            if fields[1].lower() == "xyz":
+                geo_flag = 1
+            else:
+                xyz = os.path.join(os.path.dirname(os.path.abspath(input_file)),fields[4].strip('"')) if len(fields) > 4 else None
+                if xyz is None or os.path.isfile(xyz) is False:
+                    return None,None
+                with open(xyz,'r') as f:
+                    jobs[-1]["geo"] += [ [j.split()[0].capitalize()] + [ "{:.{}f}".format(float(k)+0.0,decimals).replace("-0."+"0"*decimals,"0."+"0"*decimals) for k in j.split()[1:4] ]\
+                                         for j in f.readlines()[2:] if len(j.split()) >= 4 ]
+            continue
+
+        # Keywords (order doesn't matter to ORCA)
+        if fields[0][0] == "!":
+            jobs[-1]["keywords"] += [ j.lower() for j in " ".join(fields)[1:].split() if j.lower()[:3] != "pal" ]
+            continue
+
+        # % blocks (the run name and resources don't change the results)
+        if block_flag is not None:
+            if block_flag != "skip":
+                jobs[-1]["blocks"] += [" ".join(fields).lower()]
+            if fields[-1].lower() == "end":
+                block_flag = None
+            continue
+        if fields[0][0] == "%":
+            name = fields[0][1:].lower()
+            if name == "base":
+                bases[-1] = lines.split('"')[1] if '"' in lines else fields[1]
+                continue
+            if name == "maxcore" or name == "moinp":
+                continue
+            block_flag = "skip" if name == "pal" else name
+            if block_flag != "skip":
+                jobs[-1]["blocks"] += [" ".join(fields).lower()]
+            if len(fields) > 1 and fields[-1].lower() == "end":
+                block_flag = None
+            continue
+        if block_flag is None:
+            jobs[-1]["blocks"] += [" ".join(fields).lower()]
+
+    # Jobs without a geometry inherit the previous one (as in ORCA)
+    for count_i,i in enumerate(jobs):
+        if i["charge"] is None and count_i > 0:
+            i["charge"],i["multiplicity"],i["geo"] = jobs[count_i-1]["charge"],jobs[count_i-1]["multiplicity"],jobs[count_i-1]["geo"]
+        i["keywords"] = sorted(set(i["keywords"]))
+    if True in [ len(i["geo"]) == 0 for i in jobs ]:
+        return None,None
+
+    key     = hashlib.sha1(json.dumps(jobs,sort_keys=True).encode()).hexdigest()
+    elements = [ j[0] for j in jobs[0]["geo"] ]
+    formula = "".join([ "{}{}".format(j,elements.count(j)) for j in sorted(set(elements)) ])
+    return key,{ "formula":formula, "charge":jobs[0]["charge"], "multiplicity":jobs[0]["multiplicity"],\
+                 "keywords":" | ".join([ " ".join(i["keywords"]) for i in jobs ]), "bases":[ i if i is not None else stem for i in bases ] }
+
+# Parses the final single point energies, the last cartesian gradient and the CHELPG charges (one list per CHELPG block) of an ORCA output
+def parse_results(content):
+    energies = []
+    gradient = []
+    charges  = []
+    grad_flag   = 0
+    charge_flag = 0
+    for lines in content.split("\n"):
+        fields = lines.split()
+        if len(fields) == 5 and fields[0] == "FINAL" and fields[1] == "SINGLE" and fields[2] == "POINT" and fields[3] == "ENERGY":
+            energies += [float(fields[4])]
+        elif len(fields) == 2 and fields[0] == "CARTESIAN" and fields[1] == "GRADIENT":
+            grad_flag = 1
+            gradient  = []
+        elif len(fields) == 2 and fields[0] == "CHELPG" and fields[1] == "Charges":
+            charge_flag = 1
+            charges += [[]]
+        elif grad_flag > 0:
+            if len(fields) == 6 and fields[2] == ":":
+                gradient += [ [ float(j) for j in fields[3:] ] ]
+                grad_flag = 2
+            elif grad_flag == 2 or (len(fields) > 0 and fields[0][0] != "-"):
+                grad_flag = 0
+        elif charge_flag > 0:
+            if len(fields) == 4 and fields[2] == ":":
+                charges[-1] += [float(fields[3])]
+                charge_flag = 2
+            elif charge_flag == 2 or (len(fields) > 0 and fields[0][0] != "-"):
+                charge_flag = 0
+    return { "energies":energies, "gradient":gradient, "charges":charges }
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Manages the QC result cache used by orca_submit.py -cache. add stores the completed calculations below the folders, '+\
+                                                 'restore writes the cached outputs of the inputs below the folders that don\'t have one yet, and stats prints a summary.')
+
+    #required (positional) arguments
+    parser.add_argument('cache', help = 'The cache database (created if missing).')
+
+    parser.add_argument('mode', help = 'add, restore or stats.')
+
+    parser.add_argument('folders', nargs='*', default=['.'], help = 'Folders searched for ORCA inputs (default: .)')
+
+    #optional arguments
+    parser.add_argument('-f', dest='pattern', default='*.in',
+                        help = 'Pattern of the ORCA input files (default: *.in)')
+
+    args  = parser.parse_args(argv)
+    cache = QCCache(args.cache)
+    if args.mode == "add":
+        for i in args.folders:
+            print("Stored {} new calculations from {}".format(cache.ingest(i,args.pattern),i))
+    elif args.mode == "restore":
+        for i in args.folders:
+            N = 0
+            for dp,dn,fn in os.walk(i):
+                for f in fn:
+                    if fnmatch.fnmatch(f,args.pattern) and os.path.isfile(os.path.join(dp,'.'.join(f.split('.')[:-1])+'.out')) is False:
+                        N += int(cache.restore(os.path.join(dp,f)))
+            print("Restored {} calculations below {}".format(N,i))
+    elif args.mode == "stats":
+        print("{} calculations in {} ({:.1f} MB)".format(len(cache),cache.path,os.path.getsize(cache.path)/1.0E6))
+    else:
+        print("ERROR in qc_cache: mode must be add, restore or stats. Exiting...")
+        quit()
+    cache.close()
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
@@ -76,8 +76,10 @@ def transify(geo,adj_mat,start=-1,end=-1,elements=None,opt_terminals=False,opt_f
         return geo
 
     # Initialize the list of terminal atoms and ring atoms (used in a couple places so initialized here relatively early)
+    # (G is the graph used by the repeated connectivity searches, so that adj_mat is only converted once)
+    G = as_graph(adj_mat)
     terminals = set([ count_i for count_i,i in enumerate(adj_mat) if np.sum(i) == 1 ])
-    rings = set([ count_i for count_i,i in enumerate(geo) if ring_atom(adj_mat,count_i) == True ]) 
+    rings = set([ count_i for count_i,i in enumerate(geo) if ring_atom(G,count_i) == True ]) 
 
     # Work through the backbone dihedrals and straighten them out
     for i in range(1,len(pathway)-2):
@@ -85,8 +87,8 @@ def transify(geo,adj_mat,start=-1,end=-1,elements=None,opt_terminals=False,opt_f
         if pathway[i] in rings: continue
 
         # Collect the atoms that are connected to the 2 atom of the dihedral but not to the 3 atom of the dihedral (and vice versus)
-        group_1 = return_connected(adj_mat,start=pathway[i],avoid=[pathway[i+1]])   # not used since only the forward portion of the pathway gets rotated
-        group_2 = return_connected(adj_mat,start=pathway[i+1],avoid=[pathway[i]])
+        group_1 = return_connected(G,start=pathway[i],avoid=[pathway[i+1]])   # not used since only the forward portion of the pathway gets rotated
+        group_2 = return_connected(G,start=pathway[i+1],avoid=[pathway[i]])
 
         # Skip if the two groups are equal (happens in the case of rings)
         if group_1 == group_2: continue
@@ -122,12 +124,12 @@ def transify(geo,adj_mat,start=-1,end=-1,elements=None,opt_terminals=False,opt_f
 
             # If a terminal connection exists then it is used to orient the branch by prepending it to the branch index list
             if len(conn_terminals) > 0:
-                branch_ind = [conn_terminals[0]] + list(return_connected(adj_mat,start=i,avoid=[ count_j for count_j,j in enumerate(adj_mat[i]) if j == 1 and count_j in pathway ]+conn_terminals))
+                branch_ind = [conn_terminals[0]] + list(return_connected(G,start=i,avoid=[ count_j for count_j,j in enumerate(adj_mat[i]) if j == 1 and count_j in pathway ]+conn_terminals))
                 geo[branch_ind[1:]] = transify(geo[branch_ind],adj_mat[branch_ind,:][:,branch_ind],start=0)[1:]
 
             # If no terminal connections exists then the first dihedral of the branch is not adjusted. The logic is that the sp2/sp3 alignment is better judged by the initial guess. 
             else:
-                branch_ind = list(return_connected(adj_mat,start=i,avoid=[ count_j for count_j,j in enumerate(adj_mat[i]) if j == 1 and count_j in pathway ]+conn_terminals))
+                branch_ind = list(return_connected(G,start=i,avoid=[ count_j for count_j,j in enumerate(adj_mat[i]) if j == 1 and count_j in pathway ]+conn_terminals))
                 geo[branch_ind] = transify(geo[branch_ind],adj_mat[branch_ind,:][:,branch_ind],start=next( count_j for count_j,j in enumerate(branch_ind) if j == i))
 
     # If optimize structure is set to True then the transified structure is relaxed using obminimize
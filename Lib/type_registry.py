@@ -0,0 +1,121 @@
+#!/bin/env python
+
+import numpy as np
+
+# Description: Registry of interned TAFFI atom types. Each type label (e.g., "[6[6[1][1][1]][1][1][1]]",
+#              "[6[6[1][1][1]][1][1][1]]-UA" or "link-[8[6]]") is parsed once and assigned a compact integer
+#              id. The per-type properties used in the fitting loops (atomic number, element, UA flags and
+#              the id of the canonical parent type, i.e., the label without the "-UA"/"link-" decorations)
+#              are kept in arrays indexed by id, so they are looked up by fancy indexing instead of
+#              re-splitting the label. Pair/mode keys can be built from the ids (see pair_codes) and turned
+#              back into label tuples with names().
+#
+# Usage:       ids = registry.ids(Data[i]["types_a"])            # int array
+#              registry.atomic_number[ids]                        # per-atom atomic numbers
+#              registry.UA_H[ids]                                 # hydrogens that are folded into a UA carbon
+#              registry.names(ids)                                # back to labels
+class TypeRegistry(object):
+
+    # Element symbols indexed by atomic number
+    elements = [ None,\
+                 "H", "He",\
+                 "Li","Be",                                                                                "B", "C", "N", "O", "F", "Ne",\
+                 "Na","Mg",                                                                                "Al","Si","P", "S", "Cl","Ar",\
+                 "K", "Ca","Sc","Ti","V", "Cr","Mn","Fe","Co","Ni","Cu","Zn",                              "Ga","Ge","As","Se","Br","Kr",\
+                 "Rb","Sr","Y", "Zr","Nb","Mo","Tc","Ru","Rh","Pd","Ag","Cd",                              "In","Sn","Sb","Te","I", "Xe",\
+                 "Cs","Ba","La","Ce","Pr","Nd","Pm","Sm","Eu","Gd","Tb","Dy","Ho","Er","Tm","Yb","Lu",\
+                                 "Hf","Ta","W", "Re","Os","Ir","Pt","Au","Hg",                              "Tl","Pb","Bi","Po","At","Rn" ]
+
+    def __init__(self):
+        self.labels        = []
+        self.lookup        = {}
+        self.atomic_number = np.zeros(0,dtype=int)
+        self.UA            = np.zeros(0,dtype=bool)   # label carries the "-UA" suffix
+        self.UA_H          = np.zeros(0,dtype=bool)   # hydrogen bonded to a carbon (merged into it in UA models)
+        self.UA_carbon     = np.zeros(0,dtype=bool)   # carbon bonded to at least one hydrogen
+        self.parent        = np.zeros(0,dtype=int)    # id of the undecorated type
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self,label):
+        return label in self.lookup
+
+    # Returns the id of label (interning it if new)
+    def intern(self,label):
+        if label in self.lookup:
+            return self.lookup[label]
+
+        # Parse the label: the parent is the bare type, the first bracket holds the atomic number of the
+        # central atom and the first-generation brackets hold its neighbors
+        base   = label[:-3] if label.endswith("-UA") else label
+        base   = next( i for i in base.split("link-") if i != "" ) if "link-" in base else base
+        parent = self.lookup[base] if base in self.lookup else (len(self.labels) if base == label else self.intern(base))
+        Z,nbrs = parse_type(base)
+
+        idx = len(self.labels)
+        self.labels += [label]
+        self.lookup[label] = idx
+        self.atomic_number = np.append(self.atomic_number,Z)
+        self.UA            = np.append(self.UA,label.endswith("-UA"))
+        self.UA_H          = np.append(self.UA_H,Z == 1 and 6 in nbrs)
+        self.UA_carbon     = np.append(self.UA_carbon,Z == 6 and 1 in nbrs)
+        self.parent        = np.append(self.parent,parent)
+        return idx
+
+    # Returns an int array holding the ids of a list of labels
+    def ids(self,labels):
+        return np.array([ self.lookup[i] if i in self.lookup else self.intern(i) for i in labels ],dtype=int)
+
+    def name(self,idx):
+        return self.labels[idx]
+
+    # Returns the labels of an array of ids (tuples are returned for 2D arrays, e.g., pair or mode keys)
+    def names(self,ids):
+        ids = np.asarray(ids)
+        if ids.ndim == 2:
+            return [ tuple( self.labels[j] for j in i ) for i in ids.tolist() ]
+        return [ self.labels[i] for i in ids.tolist() ]
+
+    def element(self,label):
+        idx = self.intern(label)
+        return self.elements[self.atomic_number[idx]]
+
+    # Returns integer keys for the pairs formed by two arrays of ids (stable as more types are interned). The keys
+    # of (a,b) and (b,a) differ unless symmetric is True. Use pair_ids to recover the ids.
+    def pair_codes(self,ids_a,ids_b,symmetric=False):
+        ids_a = np.asarray(ids_a,dtype=np.int64)
+        ids_b = np.asarray(ids_b,dtype=np.int64)
+        if symmetric is True:
+            ids_a,ids_b = np.maximum(ids_a,ids_b),np.minimum(ids_a,ids_b)
+        return (ids_a << 32) | ids_b
+
+    # Inverse of pair_codes: returns a (N,2) array of ids
+    def pair_ids(self,codes):
+        codes = np.asarray(codes,dtype=np.int64)
+        return np.stack([ codes >> 32, codes & 0xFFFFFFFF ],axis=-1)
+
+# Returns the atomic number of the central atom of a type label and the atomic numbers of its first-generation neighbors
+def parse_type(label):
+    Z     = int(label.split('[')[1].split(']')[0])
+    nbrs  = []
+    depth = 0
+    for count_i,i in enumerate(label):
+        if i == '[':
+            depth += 1
+            if depth == 2:
+                nbrs += [int(label[count_i+1:].split('[')[0].split(']')[0])]
+        elif i == ']':
+            depth -= 1
+    return Z,nbrs
+
+# Module-wide registry shared by the fitting scripts and md writers
+registry = TypeRegistry()
+
+# Convenience functions on the module-wide registry
+def type_ids(labels):
+    return registry.ids(labels)
+
+def atomic_numbers(labels):
+    ids = registry.ids(labels)
+    return registry.atomic_number[ids]
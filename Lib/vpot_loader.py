@@ -0,0 +1,165 @@
+#!/bin/env python
+
+import os
+import numpy as np
+from type_registry import TypeRegistry
+
+# Description: Loader for the *.vpot potential grids (CHELPG/orca_vpot format) used by the charge fits. The text file
+#              (and the xyz file holding the nuclei, if supplied) is parsed once and converted into a binary numpy
+#              sidecar, .<name>.npy next to the *.vpot file, that later loads are served from (memory-mapped, without
+#              any text parsing) while the size and mtime of the *.vpot and xyz files are unchanged. Failure to read
+#              or write the sidecar is not fatal.
+#
+#              Sidecar layout (float64, 4 columns): row 0 holds (version, number of atoms, vpot size, vpot mtime),
+#              row 1 (xyz size, xyz mtime, 0, 0) with zeros when no xyz is used, then one row per nucleus with the
+#              atomic number and coordinates, and one row per grid point with the potential and coordinates
+#              (the same order as the *.vpot file).
+#
+# Usage:       elements,geo,grid,potential = load_vpot("0_charges.vpot","0.xyz")   # geo and grid in bohr
+version = 1
+
+# Returns the elements, nuclear coordinates (bohr), grid (bohr) and potential of a *.vpot file. If an xyz file is
+# supplied the nuclei are read from it (angstroms, converted to bohr). With cache=False the sidecar isn't used.
+def load_vpot(filename,xyz_file=None,cache=True):
+    if cache is True:
+        data = read_cache(filename,xyz_file)
+        if data is not None:
+            return data
+    data = parse_vpot_text(filename,xyz_file)
+    if cache is True:
+        write_cache(filename,*data,xyz_file=xyz_file)
+    return data
+
+# Returns the sidecar filename of a *.vpot file
+def cache_name(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(filename)),".{}.npy".format(os.path.basename(filename)))
+
+# Returns the header rows that identify the files the sidecar was built from
+def cache_header(filename,xyz_file,n_atom):
+    st = os.stat(filename)
+    header = np.zeros([2,4])
+    header[0] = [version,n_atom,st.st_size,st.st_mtime]
+    if xyz_file is not None:
+        st = os.stat(xyz_file)
+        header[1,:2] = [st.st_size,st.st_mtime]
+    return header
+
+# Returns the contents of the sidecar (see load_vpot) or None if it is missing or stale
+def read_cache(filename,xyz_file=None):
+    name = cache_name(filename)
+    if os.path.isfile(name) is False:
+        return None
+    try:
+        data   = np.load(name,mmap_mode='r')
+        n_atom = int(data[0,1])
+        if np.array_equal(data[:2],cache_header(filename,xyz_file,n_atom)) is False:
+            return None
+        elements  = [ TypeRegistry.elements[int(i)] for i in data[2:2+n_atom,0] ]
+        geo       = np.array(data[2:2+n_atom,1:4])
+        grid      = np.array(data[2+n_atom:,1:4])
+        potential = np.array(data[2+n_atom:,0])
+    except Exception:
+        return None
+    return elements,geo,grid,potential
+
+# Writes the sidecar of a *.vpot file from its parsed contents (skipped if an element has no atomic number)
+def write_cache(filename,elements,geo,grid,potential,xyz_file=None):
+    if False in [ i in TypeRegistry.elements[1:] for i in elements ]:
+        return
+    name = cache_name(filename)
+    data = np.zeros([2+len(elements)+len(grid),4])
+    data[:2]                  = cache_header(filename,xyz_file,len(elements))
+    data[2:2+len(elements),0] = [ TypeRegistry.elements.index(i) for i in elements ]
+    data[2:2+len(elements),1:] = geo
+    data[2+len(elements):,0]  = potential
+    data[2+len(elements):,1:] = grid
+    try:
+        with open(name+".tmp",'wb') as f:
+            np.save(f,data)
+        os.replace(name+".tmp",name)
+    except (IOError,OSError):
+        pass
+
+# Text parser for the *.vpot file and the optional xyz file (see load_vpot)
+def parse_vpot_text(filename,xyz_file=None):
+
+    # Toggle the xyz flag
+    if xyz_file != None:
+        xyz_flag = 1
+    else:
+        xyz_flag = 0
+
+    # Loop over the lines in the file
+    with open(filename,'r') as f:
+        atom_count = 0
+        pot_count = 0
+        for lc,lines in enumerate(f):
+            fields = lines.split()
+
+            # Initialize lists/arrays
+            if lc == 0:
+                n_atom    = int(fields[0])
+                n_grid    = int(fields[1])
+                elements  = ["X"]*n_atom
+                geo       = np.zeros([n_atom,3])
+                grid      = np.zeros([n_grid,3])
+                potential = np.zeros([n_grid])
+                flag = 1
+                continue
+
+            # Parse the grid and potential
+            if flag == 2:
+                grid[pot_count] = np.array([ float(i) for i in fields[1:4] ])
+                potential[pot_count] = float(fields[0])
+                pot_count += 1
+                if pot_count == n_grid:
+                    break
+
+            # Parse the molecule
+            if flag == 1:
+                if len(fields) == 0: continue
+                # The parse is avoided if the xyz_flag is 1
+                if xyz_flag == 0:
+                    elements[atom_count] = fields[0]
+                    geo[atom_count]      = np.array([ float(i) for i in fields[1:4] ])
+                atom_count += 1
+                if atom_count == n_atom:
+                    flag = 2
+                    continue
+
+    # If an xyz file is supplied parse the nuclear centers under the assumption that the units are in angstroms
+    # Basic checks are in place for the proper number of atoms and a complete xyz file.
+    if xyz_flag == 1:
+        atom_count = 0
+        with open(xyz_file,'r') as f:
+            for lc,lines in enumerate(f):
+
+                # Initialize elements and geometry lists/arrays
+                if lc == 0:
+                    fields = lines.split()
+                    N_elements = ["X"]*int(fields[0])
+                    N_geo      = np.zeros([int(fields[0]),3])
+                    continue
+
+                # Parse the nuclei
+                # With a conversion from angstroms to bohr
+                if lc > 1:
+                    fields = lines.split()
+                    if len(fields) == 0:
+                        continue
+                    else:
+                        N_elements[atom_count] = fields[0]
+                        N_geo[atom_count] = np.array([ float(i)/0.52917721067 for i in fields[1:4] ])
+                        atom_count += 1
+
+        # Perform basic checks on the number of nuclei being parsed
+        if len(N_elements) != len(elements):
+            print("ERROR in parse_vpot: the number of atoms in the supplied xyz file does not match the number of atoms specified in the vpot file. Exiting...")
+            quit()
+        if atom_count != len(N_elements):
+            print("ERROR in parse_vpot: parsing of the xyz file terminated before finding all nuclear centers. Exiting...")
+            quit()
+        geo = N_geo
+        elements = N_elements
+
+    return elements,geo,grid,potential
@@ -0,0 +1,274 @@
+#!/bin/env python
+
+import sys,argparse,os,time,subprocess,socket,signal,sqlite3,math
+
+# Description: Shared queue of calculations that are pulled by worker pools (pull-based bundling). The
+#              queue is a SQLite database in the submission directory; claims are made inside an
+#              exclusive transaction, so any number of workers (one per allocated node) can pull from
+#              the same queue until it is empty. Each task is a shell command and the folder it runs
+#              in. Tasks are handed out in order of decreasing cost: scans before geometry
+#              optimizations before single points, then by decreasing atom count (see input_cost).
+#              NOTE: the submission directory must be on a filesystem that supports file locks.
+#
+# Usage:       queue = WorkQueue("orca_mass.queue.db")
+#              queue.add(folder,'orca "geoopt.in" > "geoopt.out"',cost=input_cost(folder+"/geoopt.in"))
+#              python work_queue.py orca_mass.queue.db -slots 20      # run by each allocated job
+class WorkQueue(object):
+
+    def __init__(self,path,timeout=600.0):
+        self.path = os.path.abspath(path)
+        self.conn = sqlite3.connect(self.path,timeout=timeout,isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, folder TEXT, command TEXT, rank INTEGER, atoms INTEGER,"+\
+                          " state TEXT, worker TEXT, started REAL, finished REAL, returncode INTEGER)")
+
+    def __len__(self):
+        return self.count("queued")
+
+    # Adds a task unless the same command is already queued or running in folder. cost is a (rank,atoms)
+    # tuple (see input_cost). Returns True if the task was added.
+    def add(self,folder,command,cost=(0,0)):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.conn.execute("SELECT id FROM tasks WHERE folder=? AND command=? AND state IN ('queued','running')",(folder,command)).fetchone() is not None:
+                return False
+            self.conn.execute("INSERT INTO tasks (folder,command,rank,atoms,state) VALUES (?,?,?,?,'queued')",(folder,command,int(cost[0]),int(cost[1])))
+            return True
+        finally:
+            self.conn.execute("COMMIT")
+
+    # Claims the most expensive queued task for worker. Returns (id,folder,command) or None if the queue is empty.
+    def claim(self,worker=None):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            task = self.conn.execute("SELECT id,folder,command FROM tasks WHERE state='queued' ORDER BY rank DESC, atoms DESC, id LIMIT 1").fetchone()
+            if task is not None:
+                self.conn.execute("UPDATE tasks SET state='running', worker=?, started=? WHERE id=?",(worker,time.time(),task[0]))
+            return task
+        finally:
+            self.conn.execute("COMMIT")
+
+    # Records the exit code of a claimed task
+    def finish(self,task_id,returncode):
+        self.conn.execute("UPDATE tasks SET state=?, finished=?, returncode=? WHERE id=?",("done" if returncode == 0 else "failed",time.time(),returncode,task_id))
+
+    # Returns the tasks claimed by worker (all workers if None) to the queue (e.g., after a worker was killed)
+    def requeue(self,worker=None):
+        if worker is None:
+            self.conn.execute("UPDATE tasks SET state='queued', worker=NULL WHERE state='running'")
+        else:
+            self.conn.execute("UPDATE tasks SET state='queued', worker=NULL WHERE state='running' AND worker=?",(worker,))
+
+    # Returns the number of tasks in state (all tasks if None)
+    def count(self,state=None):
+        if state is None:
+            return self.conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM tasks WHERE state=?",(state,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+# Runs a worker pool: keeps up to slots tasks running, claiming a new task as soon as a slot frees up,
+# and returns once the queue is empty and the last task has finished. Tasks still running when the
+# worker is interrupted (e.g., killed by the scheduler at the walltime) are returned to the queue.
+def run_worker(path,slots,worker=None,interval=1.0):
+    if worker is None:
+        worker = "{}.{}".format(socket.gethostname(),os.getpid())
+    signal.signal(signal.SIGTERM,interrupt)
+    queue   = WorkQueue(path)
+    running = {}
+    empty   = False
+    try:
+        while True:
+
+            # Record finished tasks
+            for i in list(running.keys()):
+                if running[i].poll() is not None:
+                    queue.finish(i,running.pop(i).returncode)
+
+            # Fill the free slots
+            while empty is False and len(running) < slots:
+                task = queue.claim(worker)
+                if task is None:
+                    empty = True
+                    break
+                running[task[0]] = subprocess.Popen(task[2],cwd=task[1],shell=True,start_new_session=True)
+
+            if empty is True and len(running) == 0:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+
+        # Each task runs in its own process group so that the shell and everything it started (e.g., the ORCA
+        # child processes) are killed together
+        for i in running:
+            try:
+                os.killpg(running[i].pid,signal.SIGTERM)
+            except OSError:
+                pass
+        queue.requeue(worker)
+    queue.close()
+    return
+
+# SIGTERM handler for run_worker
+def interrupt(signum,frame):
+    raise KeyboardInterrupt
+
+# Returns the (rank,atoms) cost used to order the queue. rank is 2 for relaxed scans, 1 for geometry
+# optimizations (and LAMMPS runs) and 0 for everything else; atoms is the size of the ORCA geometry block
+# or of the LAMMPS data file. Other files (e.g., the shell scripts run by bundle_submit) take the largest
+# cost of the ORCA/LAMMPS inputs in the same folder.
+def input_cost(name,search=True):
+    rank  = 0
+    atoms = 0
+    try:
+        with open(name,'r') as f:
+            content = f.readlines()
+    except (IOError,OSError,UnicodeDecodeError):
+        return (0,0)
+
+    # ORCA inputs
+    if True in [ len(i.split()) > 1 and i.split()[0] == "*" and i.split()[1] == "xyz" for i in content ]:
+        geo_flag = 0
+        for lines in content:
+            fields = lines.split()
+            if len(fields) > 1 and fields[0] == "*" and fields[1] == "xyz":
+                geo_flag = 1
+                continue
+            if geo_flag == 1:
+                if len(fields) > 0 and fields[0] == "*":
+                    geo_flag = 0
+                elif len(fields) >= 4:
+                    atoms += 1
+            elif len(fields) > 0 and fields[0].lower() == "scan":
+                rank = 2
+            elif len(fields) == 9 and fields[0] == "D" and rank < 2:
+                rank = 2
+            elif len(fields) > 0 and fields[0][0] == "!" and True in [ "opt" in i.lower() for i in fields ] and rank < 1:
+                rank = 1
+        return (rank,atoms)
+
+    # LAMMPS inputs
+    data = [ i.split()[1] for i in content if len(i.split()) > 1 and i.split()[0] == "read_data" ]
+    if len(data) > 0:
+        data = os.path.join(os.path.dirname(os.path.abspath(name)),data[0])
+        if os.path.isfile(data):
+            with open(data,'r') as f:
+                for lc,lines in enumerate(f):
+                    fields = lines.split()
+                    if len(fields) == 2 and fields[1] == "atoms":
+                        atoms = int(fields[0])
+                        break
+                    if lc > 50:
+                        break
+        return (1,atoms)
+
+    # Anything else takes the cost of its neighbors
+    if search is True:
+        folder = os.path.dirname(os.path.abspath(name))
+        costs  = [ input_cost(os.path.join(folder,i),search=False) for i in os.listdir(folder) if os.path.join(folder,i) != os.path.abspath(name) and\
+                   i.split('.')[-1] in ["in","inp","lammps"] ]
+        if len(costs) > 0:
+            return max(costs)
+    return (0,0)
+
+# Writes and submits the batch scripts for pull-based bundling: N_jobs single-node jobs that each run a
+# worker pool with ppn/procs slots on the queue. Returns the list of submission script names.
+def submit_workers(queue_path,N_jobs,args,min_flag,working_dir):
+    worker = os.path.abspath(__file__)
+    slots  = max(int(args.ppn/args.procs),1)
+    names  = []
+    for n in range(N_jobs):
+        name = "{}.worker.{}".format(args.outputname,n)
+        with open("{}.submit".format(name),'w') as f:
+
+            # Boilerplate
+            if "slurm" in args.scheduler:
+                f.write("#!/bin/bash\n\n")
+                f.write("#SBATCH --job-name {}\n".format(name))
+                f.write("#SBATCH -N 1\n")
+                f.write("#SBATCH -n {}\n".format(args.ppn))
+                if min_flag == 0:
+                    f.write("#SBATCH -t {}:00:00\n".format(args.walltime))
+                elif min_flag == 1:
+                    f.write("#SBATCH -t 00:{}:00\n".format(args.walltime))
+                if args.scheduler == "slurm-halstead":
+                    f.write("#SBATCH -A {}\n".format(args.queue))
+                else:
+                    f.write("#SBATCH --partition={}\n".format(args.queue))
+                    if getattr(args,"account",None) is not None:
+                        f.write("#SBATCH -A {}\n".format(args.account))
+                f.write("#SBATCH -o {}.out\n".format(name))
+                f.write("#SBATCH -e {}.err\n\n".format(name))
+            else:
+                f.write("#PBS -N {}\n".format(name))
+                f.write("#PBS -l nodes=1:ppn={}\n".format(args.ppn))
+                if min_flag == 0:
+                    f.write("#PBS -l walltime={}:00:00\n".format(args.walltime))
+                elif min_flag == 1:
+                    f.write("#PBS -l walltime=00:{}:00\n".format(args.walltime))
+                f.write("#PBS -q {}\n".format(args.queue))
+                if getattr(args,"account",None) is not None:
+                    f.write("#PBS -A {}\n".format(args.account))
+                f.write("#PBS -S /bin/sh\n")
+                f.write("#PBS -o {}.out\n".format(name))
+                f.write("#PBS -e {}.err\n\n".format(name))
+
+            # Set up paths
+            if args.path_to_mpi is not None:
+                f.write("#Setting OPENMPI paths and variables here:\n")
+                f.write("export PATH={}/bin:$PATH\n".format(args.path_to_mpi))
+                f.write("export LD_LIBRARY_PATH={}/lib:$LD_LIBRARY_PATH\n\n".format(args.path_to_mpi))
+
+            # Print diagnostics
+            f.write("# cd into the submission directory\n")
+            f.write("cd {}\n".format(working_dir))
+            f.write("echo Running on host `hostname`\n")
+            f.write("echo Time is `date`\n\n")
+
+            # Pull calculations from the queue until it is empty
+            f.write("# Run {} calculations at a time until the queue is empty\n".format(slots))
+            f.write("python {} {} -slots {}\n".format(worker,queue_path,slots))
+            f.write("wait\n")
+
+        subprocess.call("chmod 777 {}.submit".format(name), shell=True)
+        if "slurm" in args.scheduler:
+            subprocess.call("sbatch {}.submit".format(name), shell=True)
+        else:
+            subprocess.call("qsub {}.submit".format(name), shell=True)
+        names += [name]
+    return names
+
+# Queues the (folder,command,input_file) calculations in <outputname>.queue.db and submits the worker jobs that
+# pull from it (--pull of orca_submit.py/bundle_submit.py). As many single-node jobs are requested as the bundled
+# submission would use. Returns (N_queued,N_workers).
+def submit_pull(tasks,args,min_flag,working_dir):
+    path  = os.path.abspath("{}.queue.db".format(args.outputname))
+    queue = WorkQueue(path)
+    for folder,command,name in tasks:
+        queue.add(folder,command,cost=input_cost(folder+'/'+name))
+    N_queued = len(queue)
+    queue.close()
+    N_workers = sum([ int(math.ceil(float(min(args.size,N_queued-i)*args.procs)/float(args.ppn))) for i in range(0,N_queued,args.size) ])
+    submit_workers(path,N_workers,args,min_flag,working_dir)
+    return N_queued,N_workers
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Runs a worker pool that pulls calculations from a queue written by orca_submit.py/bundle_submit.py --pull '+\
+                                                 'and exits once the queue is empty.')
+
+    #required (positional) arguments
+    parser.add_argument('queue', help = 'The queue database (written by --pull).')
+
+    #optional arguments
+    parser.add_argument('-slots', dest='slots', default=1,
+                        help = 'The number of calculations to run at the same time (default: 1)')
+
+    parser.add_argument('-name', dest='name', default=None,
+                        help = 'Worker name recorded with each claimed calculation (default: hostname.pid)')
+
+    args = parser.parse_args(argv)
+    run_worker(args.queue,int(args.slots),worker=args.name)
+
+if __name__ == "__main__":
+   main(sys.argv[1:])